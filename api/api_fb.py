@@ -1,30 +1,69 @@
 import copy
 import time
 import random
-from fastapi import FastAPI, HTTPException, BackgroundTasks, status
+import json
+import asyncio
+import hashlib
+from fastapi import FastAPI, HTTPException, BackgroundTasks, status, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import List, Optional, Union
 from fastapi.staticfiles import StaticFiles
 import os
-import datetime
 import uuid
 import base64
 from dotenv import load_dotenv
-from typing import Any, Dict
-from supabase import create_client, Client  # type: ignore  # pylint: disable=import-error
+from typing import Any, Dict, TYPE_CHECKING
 import inspect
+import re
 import sys
+from datetime import date, datetime
 
 # プロジェクトルートをパスに追加
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from backend.modules.FeedGenerator import generate_and_store_feed_for_user, add_one_paper_to_feed
+from backend.modules.FeedGenerator import generate_and_store_feed_for_user, add_one_paper_to_feed, add_papers_to_feed, FEED_MODE_DEFAULT
+from backend.modules.GenerationWorker import enqueue_generation
+from backend.modules.VoiceVariants import switch_voice
+from backend.modules.PaperAnnIndex import get_ann_index
+from backend.modules.PaperRanker import get_ranker, BOOKMARK_WEIGHT, UNBOOKMARK_WEIGHT, SWIPE_WEIGHT
+from backend.modules.FeedEvents import feed_event_broker, feed_item_event
+from backend.modules.FeedModels import FeedCard, SimilarPaperCard, encode_json, json_response, split_authors
+from backend.modules.BookmarkCache import get_bookmark_cache, load_bookmark_ids
+from backend.modules.AudioStore import get_audio_store, encode_base64_file, is_audio_key
+from backend.modules.AudioResponse import audio_file_response
+from backend.modules.Database import get_client
+from backend.modules.Metrics import histogram, render_metrics, span
+from backend.modules.Projections import PAPER_CARD, PAPER_LATEST, FEED_ITEM, FEED_VOICE_KEY
+
+if TYPE_CHECKING:
+    # 型注釈のためだけなので実行時には読み込まない (起動を軽くする)
+    from supabase import Client  # type: ignore  # pylint: disable=import-error
 
 
 load_dotenv()
-SUPABASE_URL = os.environ["SUPABASE_URL"]
-SUPABASE_KEY = os.environ["SUPABASE_KEY"]
+
+# ストリーミング接続のハートビート間隔 (秒)。このタイミングで他プロセスが保存したアイテムもDBから拾う
+STREAM_HEARTBEAT_SECONDS = 15
+# ストリームのキャッチアップで、送った最大のfeed_idより何件下から読み直すか。
+# 生成が並行すると、小さいfeed_idを取った行が大きいfeed_idの行より後にコミットされることがある
+STREAM_CATCH_UP_WINDOW = 64
+# /api/feed/next で一度に取り出せる最大件数
+MAX_FEED_BATCH_SIZE = 20
+# フィード生成で一度に作る件数
+FEED_TARGET_SIZE = 30
+# GENERATION_QUEUE=1 ならフィード生成をAPIプロセスでは行わず、generation_job に積んで GenerationWorker に任せる
+GENERATION_QUEUE_ENABLED = os.environ.get("GENERATION_QUEUE") == "1"
+# ブックマーク一覧の1ページの件数
+DEFAULT_BOOKMARK_PAGE_SIZE = 20
+MAX_BOOKMARK_PAGE_SIZE = 100
+BOOKMARK_FIELDS = ("bookmark_id", "user_id", "paper_id", "title", "author", "url", "references_date")
+# ブックマークの列名 -> join する paper_info の列名
+BOOKMARK_PAPER_FIELDS = {"title": "title", "author": "author", "url": "arxiv_url"}
+# カーソルの references_date の秒の小数部分
+_CURSOR_FRACTION = re.compile(r'T[\d:]+\.(\d+)')
 
 
 # --- FastAPIアプリの初期化 ---
@@ -43,14 +82,38 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# --- 計測 ---
+HTTP_REQUEST_SECONDS = histogram("http_request_seconds", "API request latency by route.", ["route", "method", "status"])
+
+@app.middleware("http")
+async def record_request_latency(request: Request, call_next):
+    """リクエストの所要時間をルート (パスのテンプレート) ごとに記録する"""
+    started_at = time.perf_counter()
+    response = await call_next(request)
+    route = request.scope.get("route")
+    HTTP_REQUEST_SECONDS.observe(
+        time.perf_counter() - started_at,
+        route=getattr(route, "path", "unmatched"), method=request.method, status=response.status_code,
+    )
+    return response
+
+@app.get("/metrics")
+def get_metrics():
+    """# 呼び出し: Prometheusのスクレイプ。
+    # 役割: ステージごとの所要時間・DBの往復時間・Geminiのトークン数などのヒストグラムを返す。"""
+    return Response(content=render_metrics(), media_type="text/plain; version=0.0.4")
+
 # --- Pydanticモデル (APIのデータ構造定義) ---
+# フィード・似た論文・ブックマークのレスポンスは FeedModels で組み立ててエンコード済みのbytesで返すので、
+# 下の FeedItem などはOpenAPIのスキーマの説明にだけ使われる (レスポンスの検証は行わない)
 class FeedItem(BaseModel):
     feed_id: int
     paper_id: str
     title: str
     authors: List[str]
     summary: str
-    audio_base64: str  # audio_urlから変更
+    audio_base64: Optional[str] = None
+    audio_url: Optional[str] = None
     paper_url: str
     is_bookmarked: bool
 
@@ -58,15 +121,18 @@ class FeedResponse(BaseModel):
     items: List[FeedItem]
 
 class BookmarkItem(BaseModel):
-    bookmark_id: int
-    user_id: int
-    title: str
-    author: str
-    url: str
-    references_date: str # Supabaseのdate型に合わせて文字列で定義
+    # fieldsで列を絞った場合は指定外の列は含まれない
+    bookmark_id: Optional[int] = None
+    user_id: Optional[int] = None
+    paper_id: Optional[str] = None
+    title: Optional[str] = None
+    author: Optional[str] = None
+    url: Optional[str] = None
+    references_date: Optional[str] = None # Supabaseのdate型に合わせて文字列で定義
 
 class BookmarkResponse(BaseModel):
     items: List[BookmarkItem]
+    next_cursor: Optional[str] = None
 
 class BookmarkRequest(BaseModel):
     paper_id: str
@@ -75,9 +141,22 @@ class UserSettings(BaseModel):
     uuid: str
     voice_type: int = 3 # VOICE_TYPE_DEFAULT
 
+class UserVoiceSettings(BaseModel):
+    voice_type: int
+
 class UserSettingsUpdateRequest(BaseModel):
     character_voice: Optional[int] = None
 
+class SimilarPaperItem(BaseModel):
+    paper_id: str
+    title: str
+    authors: List[str]
+    paper_url: str
+    score: float
+
+class SimilarPapersResponse(BaseModel):
+    items: List[SimilarPaperItem]
+
 
 # 初回でのフィード取得．あとで処理をかく．feedはuser_idが必要なので，そこをなんとかする．
 @app.post("/api/feed/initial/{user_id}", response_model=FeedResponse)
@@ -88,7 +167,7 @@ def get_initial_feed(user_id: int, req: UserSettings):
     voice_type_for_db = req.voice_type
 
     try:
-        supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+        supabase = get_client()
 
         # user_info テーブルにユーザー情報を格納
         response_user_ids = supabase.table("user_info").select("user_id").eq("user_id", user_id).execute()
@@ -107,20 +186,19 @@ def get_initial_feed(user_id: int, req: UserSettings):
             print(f"user_infoテーブルに既にuser_id: {user_id} のデータが存在します。")
 
         # paper_infoテーブルから最新10件の論文を取得
-        papers_response = supabase.table("paper_info").select("*").order("published_date", desc=True).limit(10).execute()
+        papers_response = PAPER_LATEST.select(supabase).order("published_date", desc=True).limit(10).execute()
         papers = papers_response.data
         if not papers:
-            return {"items": []}
+            return json_response({"items": []})
 
         paper_ids = [p['paper_id'] for p in papers]
 
         # feedテーブルから関連データを取得
-        feed_response = supabase.table("feed").select("paper_id, feed_id, gemini_abstract").in_("paper_id", paper_ids).execute()
+        feed_response = FEED_ITEM.select(supabase).in_("paper_id", paper_ids).execute()
         feed_map = {item['paper_id']: item for item in feed_response.data}
 
-        # bookmarkテーブルからユーザーのブックマークを取得
-        bookmark_response = supabase.table("bookmark").select("paper_id").eq("user_id", user_id).in_("paper_id", paper_ids).execute()
-        bookmarked_paper_ids = {item['paper_id'] for item in bookmark_response.data}
+        # ブックマーク済みかどうかはキャッシュから判定する (未読み込みのユーザーのみDBを読む)
+        bookmarked_paper_ids = _bookmarked_among(supabase, user_id, paper_ids)
 
         initial_feed = []
         for paper in papers:
@@ -130,21 +208,11 @@ def get_initial_feed(user_id: int, req: UserSettings):
             if not feed_data:
                 continue
 
-            authors = [author.strip() for author in paper.get("author", "").split(',')]
+            initial_feed.append(feed_item_event(
+                feed_data["feed_id"], paper, feed_data.get("gemini_abstract"), str(paper_id) in bookmarked_paper_ids, voice_key=feed_data.get("voice_key"),
+            ))
 
-            feed_item = FeedItem(
-                feed_id=feed_data["feed_id"],
-                paper_id=str(paper_id),
-                title=paper["title"],
-                authors=authors,
-                summary=feed_data.get("gemini_abstract", paper.get("abstract", "")),
-                audio_url=f"http://127.0.0.1:8000/api/audio/{feed_data['feed_id']}",
-                paper_url=paper["arxiv_url"],
-                is_bookmarked=paper_id in bookmarked_paper_ids
-            )
-            initial_feed.append(feed_item)
-
-        return {"items": initial_feed}
+        return json_response({"items": initial_feed})
 
     except Exception as e:
         caller_frame = inspect.currentframe().f_back
@@ -155,59 +223,95 @@ def get_initial_feed(user_id: int, req: UserSettings):
 
 
 @app.post("/api/feed/generate/{user_id}", status_code=202)
-def start_user_feed_generation(user_id: int, background_tasks: BackgroundTasks):
+def start_user_feed_generation(user_id: int, background_tasks: BackgroundTasks, mode: str = FEED_MODE_DEFAULT):
     """# 呼び出し: アプリ初回起動時。
-    # 役割: 時間のかかるパーソナライズフィードの生成をバックグラウンドで開始させる。"""
-    print(f"API: Received request to generate feed for user {user_id}.")
-    background_tasks.add_task(generate_and_store_feed_for_user, user_id, 30)
+    # 役割: 時間のかかるパーソナライズフィードの生成をバックグラウンドで開始させる。
+    #        mode=bookmarks の場合はブックマークに似た論文でフィードを作る。"""
+    print(f"API: Received request to generate feed for user {user_id} (mode: {mode}).")
+    if GENERATION_QUEUE_ENABLED:
+        enqueue_generation(get_client(), user_id, FEED_TARGET_SIZE, mode)
+        return {"message": "Feed generation queued."}
+    background_tasks.add_task(generate_and_store_feed_for_user, user_id, FEED_TARGET_SIZE, mode)
     return {"message": "Feed generation started in background."}
 
-@app.get("/api/feed/next/{user_id}", response_model=FeedItem)
-def get_next_feed_item(user_id: int, background_tasks: BackgroundTasks):
+def _bookmarked_among(supabase: "Client", user_id: int, paper_ids: List[Any]) -> set:
+    """paper_idsのうちユーザーがブックマーク済みのものを返す (ブックマークキャッシュを使う)"""
+    return get_bookmark_cache().bookmarked_among(user_id, paper_ids, lambda: load_bookmark_ids(supabase, user_id))
+
+def _load_audio_base64(voice_key: Optional[str]) -> Optional[str]:
+    """音声ストアから音声を読み、FeedItem用にBase64にする"""
+    path = get_audio_store().local_path(voice_key) if voice_key else None
+    if path is None:
+        return None
+    # ファイルを少しずつ読んで変換する (音声全体のbytesとbase64文字列を同時に持たない)
+    with span("audio_base64_encode"):
+        return encode_base64_file(path)
+
+def _build_feed_items(supabase: "Client", user_id: int, feed_rows: List[Dict[str, Any]], include_audio: bool) -> List[FeedCard]:
+    """feedテーブルの行にpaper_infoの情報を1回のクエリで付け足し、FeedCard (FeedItemと同じキー) のリストにする"""
+    paper_ids = list({row['paper_id'] for row in feed_rows})
+    paper_info_res = PAPER_CARD.select(supabase).in_("paper_id", paper_ids).execute()
+    paper_map = {item['paper_id']: item for item in paper_info_res.data or []}
+    bookmarked_paper_ids = _bookmarked_among(supabase, user_id, paper_ids)
+
+    feed_items = []
+    for row in sorted(feed_rows, key=lambda r: r['feed_id']):
+        paper_info = paper_map.get(row['paper_id'])
+        if not paper_info:
+            # feedテーブルに孤立したデータがあった。このアイテムは返さない
+            print(f"API: Paper info not found for paper_id: {row['paper_id']} (feed_id: {row['feed_id']})")
+            continue
+        feed_items.append(feed_item_event(
+            row["feed_id"], paper_info, row["gemini_abstract"], str(row['paper_id']) in bookmarked_paper_ids,
+            audio_base64=_load_audio_base64(row.get("voice_key")) if include_audio else None, voice_key=row.get("voice_key"),
+        ))
+    return feed_items
+
+@app.get("/api/feed/next/{user_id}", response_model=Union[FeedItem, FeedResponse])
+def get_next_feed_item(user_id: int, background_tasks: BackgroundTasks, n: Optional[int] = None, peek: bool = False, include_audio: bool = True):
     """# 呼び出し: ユーザーがスワイプし、次の論文が必要になった時。
-    # 役割: feedテーブルから1件返し、裏で次の1件を補充する。"""
+    # 役割: feedテーブルから1件返し、裏で次の1件を補充する。
+    #        n を指定すると古い順にn件をまとめて取り出し (FeedResponse)、補充もn件分を1回のタスクで行う。
+    #        peek=true の場合は取り出さずに先頭n件を返す (音声はaudio_urlのみ)。クライアントが音声を先読みするために使う。
+    #        先読み済みのアイテムを取り出す時は include_audio=false で音声データの再送を省略できる。"""
+    count = min(max(n or 1, 1), MAX_FEED_BATCH_SIZE)
     try:
-        supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+        supabase = get_client()
 
-        # 1. feedテーブルから最も古いレコードを取得
-        feed_res = supabase.table("feed").select("*").eq("user_id", user_id).order("feed_id", desc=False).limit(1).single().execute()
+        if peek:
+            # 1'. 取り出さずに先頭n件を返す (音声データは読まない)
+            peek_res = FEED_ITEM.select(supabase).eq("user_id", user_id).order("feed_id", desc=False).limit(count).execute()
+            return json_response({"items": _build_feed_items(supabase, user_id, peek_res.data or [], include_audio=False)})
 
-        if not feed_res.data:
+        # 1. feedテーブルから古い順にn件を取り出す (取得と削除を1文で行うので、同時に呼ばれても重複しない)
+        dequeue_res = supabase.rpc("dequeue_feed", {"p_user_id": user_id, "p_count": count}).execute()
+        feed_rows = dequeue_res.data or []
+        if not feed_rows:
             raise HTTPException(status_code=404, detail="Personalized feed is not ready or empty.")
+        print(f"API: Dequeued feed_ids: {[row['feed_id'] for row in feed_rows]} for user_id: {user_id}")
+
+        # 2. paper_infoテーブルから不足している情報を取得してレスポンスを組み立てる
+        feed_items = _build_feed_items(supabase, user_id, feed_rows, include_audio)
+
+        # 3. バックグラウンドで閲覧履歴を嗜好ベクトルに反映し、取り出した件数分の補充タスクを1回だけ開始
+        ranker = get_ranker()
+        for row in feed_rows:
+            background_tasks.add_task(ranker.record_feedback, user_id, row['paper_id'], SWIPE_WEIGHT)
+        if GENERATION_QUEUE_ENABLED:
+            enqueue_generation(supabase, user_id, len(feed_rows))
+        elif len(feed_rows) == 1:
+            background_tasks.add_task(add_one_paper_to_feed, user_id)
+        else:
+            background_tasks.add_task(add_papers_to_feed, user_id, len(feed_rows))
 
-        feed_data = feed_res.data
-        feed_id_to_delete = feed_data['feed_id']
-        paper_id = feed_data['paper_id']
-
-        # 2. 取得したレコードをfeedテーブルから削除
-        supabase.table("feed").delete().eq("feed_id", feed_id_to_delete).execute()
-        print(f"API: Deleted feed_id: {feed_id_to_delete} for user_id: {user_id}")
-
-        # 3. paper_infoテーブルから不足している情報を取得
-        paper_info_res = supabase.table("paper_info").select("title, author, arxiv_url").eq("paper_id", paper_id).single().execute()
-        if not paper_info_res.data:
-            # この場合、feedテーブルに孤立したデータがあったことになる。エラーとして扱う。
-            raise HTTPException(status_code=404, detail=f"Paper info not found for paper_id: {paper_id}")
-
-        paper_info = paper_info_res.data
-        authors = [author.strip() for author in paper_info.get("author", "").split(',')]
-
-        # 4. バックグラウンドで補充タスクを開始
-        background_tasks.add_task(add_one_paper_to_feed, user_id)
-
-        # 5. レスポンスを組み立てて返却
-        next_item = FeedItem(
-            feed_id=feed_data["feed_id"],
-            paper_id=str(paper_id),
-            title=paper_info["title"],
-            authors=authors,
-            summary=feed_data["gemini_abstract"],
-            audio_base64=feed_data["voice"], # Base64データを直接セット
-            paper_url=paper_info["arxiv_url"],
-            is_bookmarked=False # ブックマーク情報は別APIで管理
-        )
-        return next_item
+        if n is None:
+            if not feed_items:
+                raise HTTPException(status_code=404, detail=f"Paper info not found for paper_id: {feed_rows[0]['paper_id']}")
+            return json_response(feed_items[0])
+        return json_response({"items": feed_items})
 
+    except HTTPException:
+        raise
     except Exception as e:
         caller_frame = inspect.currentframe().f_back
         caller_function_name = caller_frame.f_code.co_name if caller_frame else "Unknown"
@@ -217,97 +321,297 @@ def get_next_feed_item(user_id: int, background_tasks: BackgroundTasks):
              raise HTTPException(status_code=404, detail="Personalized feed is not ready or empty.")
         raise HTTPException(status_code=500, detail=f"An error occurred while fetching next feed: {e}")
 
+def _fetch_feed_items_after(user_id: int, last_feed_id: int) -> List[FeedCard]:
+    """feedテーブルから last_feed_id より新しいアイテムを古い順に取得する (ストリームの再開・取りこぼし対策用)"""
+    supabase = get_client()
+    feed_res = FEED_ITEM.select(supabase).eq("user_id", user_id).gt("feed_id", last_feed_id).order("feed_id", desc=False).execute()
+    if not feed_res.data:
+        return []
+    paper_ids = list({item['paper_id'] for item in feed_res.data})
+    paper_info_res = PAPER_CARD.select(supabase).in_("paper_id", paper_ids).execute()
+    paper_map = {item['paper_id']: item for item in paper_info_res.data or []}
+    bookmarked_paper_ids = _bookmarked_among(supabase, user_id, paper_ids)
+    return [
+        feed_item_event(item['feed_id'], paper_map[item['paper_id']], item['gemini_abstract'], str(item['paper_id']) in bookmarked_paper_ids, voice_key=item.get('voice_key'))
+        for item in feed_res.data if item['paper_id'] in paper_map
+    ]
+
+async def _feed_item_stream(user_id: int, last_feed_id: int):
+    """
+    新しいフィードアイテムを生成され次第返す非同期ジェネレータ。
+    ハートビートのタイミングでは None を返す (呼び出し側がプロトコルに合わせて送る)
+    """
+    queue = feed_event_broker.subscribe(user_id)
+    # クライアントが受け取り済みの範囲 (Last-Event-ID 以下) と、この接続で送ったfeed_id (窓の中の分だけ覚えておく)
+    resumed_from, high_water, sent = last_feed_id, last_feed_id, set()
+
+    def window_floor() -> int:
+        return max(resumed_from, high_water - STREAM_CATCH_UP_WINDOW)
+
+    def unsent(item: FeedCard) -> bool:
+        nonlocal high_water, sent
+        if item.feed_id <= window_floor() or item.feed_id in sent:
+            return False
+        sent.add(item.feed_id)
+        if item.feed_id > high_water:
+            high_water = item.feed_id
+            sent = {feed_id for feed_id in sent if feed_id > window_floor()}
+        return True
+    try:
+        # 1. 再開: 前回受け取った以降に保存されたアイテムをまとめて送る
+        for item in await run_in_threadpool(_fetch_feed_items_after, user_id, window_floor()):
+            if unsent(item):
+                yield item
+        # 2. 以降は生成され次第プッシュする
+        while True:
+            try:
+                event = await asyncio.wait_for(queue.get(), timeout=STREAM_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                # 他のプロセスが保存した分と、遅れてコミットされた分を窓の中から拾う
+                for item in await run_in_threadpool(_fetch_feed_items_after, user_id, window_floor()):
+                    if unsent(item):
+                        yield item
+                yield None
+                continue
+            if unsent(event):
+                yield event
+    finally:
+        feed_event_broker.unsubscribe(user_id, queue)
+
+@app.get("/api/feed/stream/{user_id}")
+async def stream_feed_items(user_id: int, request: Request, last_id: int = 0):
+    """# 呼び出し: フィード画面を開いている間 (Server-Sent Events)。
+    # 役割: 生成されたフィードアイテムを保存され次第プッシュする。Last-Event-ID (または last_id) 以降から再開できる。"""
+    last_event_id = request.headers.get("last-event-id")
+    if not last_event_id:
+        last_feed_id = last_id
+    elif last_event_id.strip().isdigit():
+        last_feed_id = int(last_event_id)
+    else:
+        raise HTTPException(status_code=400, detail=f"Invalid Last-Event-ID: {last_event_id!r}")
+
+    async def event_source():
+        async for item in _feed_item_stream(user_id, last_feed_id):
+            if await request.is_disconnected():
+                break
+            if item is None:
+                yield ": heartbeat\n\n"
+            else:
+                yield f"id: {item.feed_id}\nevent: feed_item\ndata: {encode_json(item).decode('utf-8')}\n\n"
+
+    return StreamingResponse(event_source(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.websocket("/api/feed/ws/{user_id}")
+async def feed_items_websocket(websocket: WebSocket, user_id: int, last_id: int = 0):
+    """# 呼び出し: フィード画面を開いている間 (WebSocket)。
+    # 役割: SSEと同じアイテムを {"type": "feed_item", "item": ...} の形でプッシュする。"""
+    await websocket.accept()
+    try:
+        async for item in _feed_item_stream(user_id, last_id):
+            if item is None:
+                await websocket.send_json({"type": "heartbeat"})
+            else:
+                await websocket.send_text(encode_json({"type": "feed_item", "item": item}).decode('utf-8'))
+    except WebSocketDisconnect:
+        print(f"API: Feed websocket closed for user_id: {user_id}")
+
+# 音声キーは内容から作られるので、同じURLの音声は変わらない
+AUDIO_BY_KEY_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+@app.get("/api/audio/by-key/{voice_key:path}")
+def get_audio_by_key(voice_key: str, request: Request):
+    """# 呼び出し: フィードアイテムの音声を再生する時 (audio_url)。
+    # 役割: 音声キーから音声ストアの音声を返す。feedの行を読まないので、dequeueで行が削除された後の再生やRangeリクエストにも使える。
+    #        音声はローカルのファイル (リモートのストアの場合はディスクキャッシュ) から送り、Rangeリクエストにも対応する。"""
+    if not is_audio_key(voice_key):
+        raise HTTPException(status_code=404, detail="Audio not found")
+    path = get_audio_store().local_path(voice_key)
+    if not path:
+        raise HTTPException(status_code=404, detail="Audio not found")
+    response = audio_file_response(path, request.headers.get("range"))
+    response.headers["Cache-Control"] = AUDIO_BY_KEY_CACHE_CONTROL
+    return response
+
+@app.get("/api/audio/{feed_id}")
+def get_feed_audio(feed_id: int, request: Request):
+    """# 呼び出し: 音声キーを含まない古いaudio_urlで音声を再生する時。
+    # 役割: feedテーブルの音声キーから音声ストアの音声を返す (feedの行が残っている間だけ使える)。"""
+    supabase = get_client()
+    feed_res = FEED_VOICE_KEY.select(supabase).eq("feed_id", feed_id).limit(1).execute()
+    voice_key = feed_res.data[0].get("voice_key") if feed_res.data else None
+    path = get_audio_store().local_path(voice_key) if voice_key else None
+    if not path:
+        raise HTTPException(status_code=404, detail=f"Audio not found for feed_id: {feed_id}")
+    return audio_file_response(path, request.headers.get("range"))
+
+@app.get("/api/papers/{paper_id}/similar", response_model=SimilarPapersResponse)
+def get_similar_papers(paper_id: str, k: int = 10):
+    """# 呼び出し: 論文の「似た論文」を表示する時。
+    # 役割: ANNインデックスから指定論文に近い論文をk件返す。"""
+    neighbors = get_ann_index().similar(paper_id, min(max(k, 1), 50))
+    if not neighbors:
+        return json_response({"items": []})
+    try:
+        supabase = get_client()
+        paper_info_res = PAPER_CARD.select(supabase).in_("paper_id", [p for p, _ in neighbors]).execute()
+        paper_map = {str(item['paper_id']): item for item in paper_info_res.data or []}
+
+        similar_items = []
+        for neighbor_id, score in neighbors:
+            paper = paper_map.get(neighbor_id)
+            if not paper:
+                continue
+            similar_items.append(SimilarPaperCard(neighbor_id, paper["title"], split_authors(paper.get("author")), paper["arxiv_url"], float(score)))
+        return json_response({"items": similar_items})
+
+    except Exception as e:
+        print(f"Error in get_similar_papers: {e}")
+        raise HTTPException(status_code=500, detail="An error occurred while fetching similar papers.")
+
+def _encode_bookmark_cursor(row: Dict[str, Any]) -> str:
+    """ページの最後の行の (references_date, bookmark_id) を不透明なカーソル文字列にする"""
+    raw = json.dumps([row["references_date"], row["bookmark_id"]]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+def _flatten_bookmark_row(row: Dict[str, Any], fields: List[str]) -> Dict[str, Any]:
+    """join した paper_info の列を BookmarkItem の列名 (title, author, url) に展開する"""
+    paper_info = row.get("paper_info") or {}
+    return {
+        key: paper_info.get(BOOKMARK_PAPER_FIELDS[key]) if key in BOOKMARK_PAPER_FIELDS else row.get(key)
+        for key in fields
+    }
+
+def _canonical_references_date(value: str) -> str:
+    """
+    カーソルの references_date を日時として読み直し、数字と区切り文字だけの形で書き出す (フィルタ文字列に埋め込むため)。
+    SQLiteでは文字列として比べるので、秒の小数の桁数は元の値に合わせる。日時でなければValueError
+    """
+    if len(value) == 10:
+        return date.fromisoformat(value).isoformat()
+    parsed = datetime.fromisoformat(value)
+    text = parsed.strftime('%Y-%m-%dT%H:%M:%S')
+    fraction = _CURSOR_FRACTION.search(value)
+    if fraction:
+        text += '.' + f"{parsed.microsecond:06d}"[:len(fraction.group(1))]
+    # タイムゾーンは +09:00 の形 (なければ付けない)
+    return text + parsed.isoformat(timespec='seconds')[19:]
+
+def _decode_bookmark_cursor(cursor: str):
+    """_encode_bookmark_cursor が作ったカーソルを (references_date, bookmark_id) に戻す。不正なカーソルは400"""
+    try:
+        references_date, bookmark_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return _canonical_references_date(str(references_date)), int(bookmark_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
 @app.get("/api/bookmarks/{user_id}", response_model=BookmarkResponse)
-def get_bookmarks(user_id: int):
+def get_bookmarks(user_id: int, request: Request, limit: int = DEFAULT_BOOKMARK_PAGE_SIZE, cursor: Optional[str] = None, fields: Optional[str] = None):
     """# 呼び出し: 「履歴」タブ表示時。
-    # 役割: 現在のブックマークリストを返す。"""
-    try:
-        supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
-
-        # 1. 指定されたuser_idのブックマークを取得
-        bookmark_res = supabase.table("bookmark").select("*").eq("user_id", user_id).execute()
-        if not bookmark_res.data:
-            return {"items": []} # ブックマークがない場合は空のリストを返す
-
-        bookmarked_items = []
-        for bookmark_entry in bookmark_res.data:
-            for key in ["bookmark_id", "user_id", "title", "author", "url", "references_date"]:
-                if key not in bookmark_entry:
-                    raise HTTPException(status_code=500, detail=f"Missing '{key}' in bookmark entry")
-            item = BookmarkItem(
-                bookmark_id=bookmark_entry["bookmark_id"],
-                user_id=bookmark_entry["user_id"],
-                title=bookmark_entry["title"],
-                author=bookmark_entry["author"],
-                url=bookmark_entry["url"],
-                references_date=bookmark_entry["references_date"]
-            )
-            bookmarked_items.append(item)
-        return {"items": bookmarked_items}
+    # 役割: 現在のブックマークリストを新しい順に1ページ分返す。
+    #        次のページは next_cursor を cursor に渡して取得する (references_date, bookmark_id のキーセットページング)。
+    #        fields (カンマ区切り) で返す列を絞れる。ETagが一致する場合は304を返す。"""
+    requested_fields = [f.strip() for f in fields.split(',') if f.strip()] if fields else list(BOOKMARK_FIELDS)
+    unknown_fields = [f for f in requested_fields if f not in BOOKMARK_FIELDS]
+    if unknown_fields:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown_fields)}")
+    # カーソルを作るためにキー列は必ず取得する。論文の情報は paper_info から join で取得する
+    select_fields = list(dict.fromkeys([f for f in requested_fields if f not in BOOKMARK_PAPER_FIELDS] + ["references_date", "bookmark_id"]))
+    paper_fields = [BOOKMARK_PAPER_FIELDS[f] for f in requested_fields if f in BOOKMARK_PAPER_FIELDS]
+    if paper_fields:
+        select_fields.append(f"paper_info({', '.join(paper_fields)})")
+    page_size = min(max(limit, 1), MAX_BOOKMARK_PAGE_SIZE)
 
+    try:
+        supabase = get_client()
+
+        # 1. 指定されたuser_idのブックマークを新しい順に1ページ分 (+次ページ有無の確認用に1件) 取得
+        query = supabase.table("bookmark").select(", ".join(select_fields)).eq("user_id", user_id)
+        if cursor:
+            references_date, bookmark_id = _decode_bookmark_cursor(cursor)
+            query = query.or_(f'references_date.lt."{references_date}",and(references_date.eq."{references_date}",bookmark_id.lt.{bookmark_id})')
+        bookmark_res = query.order("references_date", desc=True).order("bookmark_id", desc=True).limit(page_size + 1).execute()
+        rows = bookmark_res.data or []
+
+        page = rows[:page_size]
+        next_cursor = _encode_bookmark_cursor(page[-1]) if len(rows) > page_size else None
+        body = {
+            "items": [_flatten_bookmark_row(row, requested_fields) for row in page],
+            "next_cursor": next_cursor,
+        }
+
+        # 2. 内容が変わっていなければ本文を送らない
+        content = encode_json(body)
+        etag = '"' + hashlib.sha1(content).hexdigest() + '"'
+        if etag in [tag.strip() for tag in request.headers.get("if-none-match", "").split(',')]:
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+        return Response(content=content, media_type="application/json", headers={"ETag": etag, "Cache-Control": "private, no-cache"})
+
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error in get_bookmarks: {e}")
         raise HTTPException(status_code=500, detail="An error occurred while fetching bookmarks.")
 
 @app.post("/api/bookmarks/{user_id}", status_code=status.HTTP_201_CREATED)
-def add_bookmark(user_id: int, req: BookmarkRequest):
+def add_bookmark(user_id: int, req: BookmarkRequest, background_tasks: BackgroundTasks):
     """# 呼び出し: ブックマークボタンが押された時のAPI。
-    # 役割: リクエストで受け取った paper_id をキーに、paper_info テーブルから詳細情報を取得し、bookmark テーブルに新規レコードを追加する。"""
-    supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
-    # 1. paper_infoから論文情報を取得する
-    paper_info_res = supabase.table("paper_info").select("title, author, arxiv_url").eq("paper_id", req.paper_id).single().execute()
-    if not paper_info_res.data:
-         raise HTTPException(status_code=404, detail=f"Paper info not found for paper_id: {req.paper_id}")
-    paper_info = paper_info_res.data
-    # 2. bookmark テーブルから最大の bookmark_id を取得し、新規IDを採番する
-    bookmark_id_res = supabase.table("bookmark").select("bookmark_id").order("bookmark_id", desc=True).limit(1).execute()
-    if bookmark_id_res.data and len(bookmark_id_res.data) > 0:
-        new_bookmark_id = int(bookmark_id_res.data[0]["bookmark_id"]) + 1
-    else:
-        new_bookmark_id = 1
-    # 3. 新規レコードを組み立てる
-    new_record = {
-         "bookmark_id": new_bookmark_id,
-         "user_id": user_id,
-         "title": paper_info["title"],
-         "author": paper_info["author"],
-         "url": paper_info["arxiv_url"],
-         "references_date": datetime.datetime.now().isoformat()
-    }
-    # 4. bookmark テーブルにレコードを挿入
-    insert_res = supabase.table("bookmark").insert(new_record).execute()
-    if not insert_res.data:
-          raise HTTPException(status_code=500, detail="Failed to add bookmark")
-    return {"status": "success", "bookmark": new_record}
+    # 役割: (user_id, paper_id) を bookmark テーブルに追加する。既にブックマーク済みの場合は何もしない (冪等)。"""
+    supabase = get_client()
+    try:
+        # (user_id, paper_id) の一意索引に対する1回のupsert。事前の読み出しや採番は不要
+        supabase.table("bookmark").upsert(
+            {"user_id": user_id, "paper_id": req.paper_id},
+            on_conflict="user_id,paper_id",
+            ignore_duplicates=True
+        ).execute()
+    except Exception as e:
+        if "23503" in str(e): # foreign_key_violation: paper_infoに存在しない論文
+            raise HTTPException(status_code=404, detail=f"Paper info not found for paper_id: {req.paper_id}")
+        print(f"Error in add_bookmark: {e}")
+        raise HTTPException(status_code=500, detail="Failed to add bookmark")
+    get_bookmark_cache().add(user_id, req.paper_id)
+    # ブックマークを嗜好ベクトルに反映する
+    background_tasks.add_task(get_ranker().record_feedback, user_id, req.paper_id, BOOKMARK_WEIGHT)
+    return {"status": "success", "bookmark": {"user_id": user_id, "paper_id": req.paper_id}}
 
 @app.delete("/api/bookmarks/{user_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_bookmark(user_id: int, req: BookmarkRequest):
+def delete_bookmark(user_id: int, req: BookmarkRequest, background_tasks: BackgroundTasks):
     """# 呼び出し: ブックマーク解除時のAPI。
-    # 役割: リクエストで受け取った paper_id をキーに、paper_info テーブルから該当論文の情報（title, author）を取得し、
-    #        user_id に紐づく bookmark テーブルから、同じ title と author のレコードを削除する。
-    #        arxiv_url は削除のキーとして使用しません。"""
-    supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
-    # 1. paper_info テーブルから該当論文の情報（title, author）を取得
-    paper_info_res = supabase.table("paper_info").select("title, author").eq("paper_id", req.paper_id).single().execute()
-    if not paper_info_res.data:
-         raise HTTPException(status_code=404, detail=f"Paper info not found for paper_id: {req.paper_id}")
-    paper_info = paper_info_res.data
-    # 2. bookmark テーブルから user_id と、title および author が一致するレコードを削除
-    delete_res = supabase.table("bookmark")\
-        .delete()\
-        .eq("user_id", user_id)\
-        .eq("title", paper_info["title"])\
-        .eq("author", paper_info["author"])\
-        .execute()
+    # 役割: (user_id, paper_id) に一致するブックマークを削除する。"""
+    supabase = get_client()
+    delete_res = supabase.table("bookmark").delete().eq("user_id", user_id).eq("paper_id", req.paper_id).execute()
     if not delete_res.data:
          raise HTTPException(status_code=404, detail="Bookmark not found")
+    get_bookmark_cache().remove(user_id, req.paper_id)
+    background_tasks.add_task(get_ranker().record_feedback, user_id, req.paper_id, UNBOOKMARK_WEIGHT)
     return
 
+@app.post("/api/bookmarks/{user_id}/toggle")
+def toggle_bookmark(user_id: int, req: BookmarkRequest, background_tasks: BackgroundTasks):
+    """# 呼び出し: ブックマークボタンが押された時のAPI (状態を問わず付け外しする場合)。
+    # 役割: ブックマークされていなければ追加、されていれば削除し、操作後の状態を返す。"""
+    supabase = get_client()
+    try:
+        toggle_res = supabase.rpc("toggle_bookmark", {"p_user_id": user_id, "p_paper_id": req.paper_id}).execute()
+    except Exception as e:
+        if "23503" in str(e):
+            raise HTTPException(status_code=404, detail=f"Paper info not found for paper_id: {req.paper_id}")
+        print(f"Error in toggle_bookmark: {e}")
+        raise HTTPException(status_code=500, detail="Failed to toggle bookmark")
+    is_bookmarked = bool(toggle_res.data and toggle_res.data[0]["is_bookmarked"])
+    if is_bookmarked:
+        get_bookmark_cache().add(user_id, req.paper_id)
+    else:
+        get_bookmark_cache().remove(user_id, req.paper_id)
+    weight = BOOKMARK_WEIGHT if is_bookmarked else UNBOOKMARK_WEIGHT
+    background_tasks.add_task(get_ranker().record_feedback, user_id, req.paper_id, weight)
+    return {"paper_id": req.paper_id, "is_bookmarked": is_bookmarked}
+
 @app.get("/api/settings/{user_id}", response_model=UserVoiceSettings)
 def get_user_settings(user_id: int):
     """# 呼び出し: 「設定」画面表示時。
     # 役割: 現在のユーザー設定からvoice_typeのみをSupabaseのuser_infoテーブルから取得して返す。"""
-    supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+    supabase = get_client()
     settings_res = supabase.table("user_info").select("voice_type").eq("user_id", user_id).single().execute()
     if not settings_res.data:
         raise HTTPException(status_code=404, detail="User settings not found")
@@ -316,15 +620,20 @@ def get_user_settings(user_id: int):
 @app.post("/api/settings/{user_id}", response_model=FeedResponse)
 def update_user_settings(user_id: int, settings_update: UserSettingsUpdateRequest):
     """# 呼び出し: 設定画面で「更新」ボタンが押された時。
-    # 役割: 設定（例: character_voice）の更新を supabase を使って user_info テーブルに反映し、
-    #        feed テーブルの該当レコードを削除、フィードを再生成して、その先頭10件を返す。"""
-    supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
-    update_data = settings_update.dict(exclude_unset=True)
-    update_res = supabase.table("user_info").update(update_data).eq("user_id", user_id).execute()
-    if not update_res.data:
+    # 役割: 設定（例: character_voice）を user_info テーブルに反映し、feed テーブルの各行の音声を新しい話者のアセットへ付け替える。
+    #        新しい話者の音声がない行だけを削除し、その分だけフィードを生成して、先頭10件を返す。"""
+    supabase = get_client()
+    # character_voice は user_info の voice_type 列に保存する
+    if settings_update.character_voice is None:
+        raise HTTPException(status_code=400, detail="No settings to update")
+    # voice_type の更新と付け替えは1つのトランザクションで行う (switch_feed_voice)
+    switched = switch_voice(supabase, user_id, settings_update.character_voice)
+    if switched is None:
          raise HTTPException(status_code=404, detail="User settings not found")
-    # feed テーブルから該当 user_id の全レコードを削除する
-    supabase.table("feed").delete().eq("user_id", user_id).execute()
-    # 同期的に新しいフィードを生成する
-    new_feed = generate_and_store_feed_for_user(user_id, 30)
-    return {"items": new_feed[:10]}
+    print(f"API: Switched voice for user_id: {user_id} to {settings_update.character_voice} (repointed: {switched['repointed']}, removed: {switched['removed']})")
+    # 付け替えられなかった分 (フィードが30件に満たない分) だけを同期的に生成する (音声はaudio_urlから取得する)
+    missing = FEED_TARGET_SIZE - switched["repointed"]
+    if missing > 0:
+        generate_and_store_feed_for_user(user_id, missing)
+    feed_res = FEED_ITEM.select(supabase).eq("user_id", user_id).order("feed_id", desc=False).limit(10).execute()
+    return json_response({"items": _build_feed_items(supabase, user_id, feed_res.data or [], include_audio=False)})
@@ -14,7 +14,13 @@ from supabase import create_client, Client  # type: ignore  # pylint: disable=im
 
 
 import inspect
+import sys
 
+# プロジェクトルートをパスに追加
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from backend.modules.PaperIngestor import PaperIngestor
+from backend.modules.AudioStore import get_audio_store
 
 load_dotenv()
 SUPABASE_URL = os.environ["SUPABASE_URL"]
@@ -33,7 +39,8 @@ def save_audio_data():
         with open(file_path, "rb") as f:
             audio_data_bytes = f.read()
             print(type(audio_data_bytes))
-        audio_data_base64_string = base64.b64encode(audio_data_bytes).decode('utf-8')
+        # 音声データは音声ストアに保存し、feedにはキーだけを入れる
+        voice_key = get_audio_store().put(audio_data_bytes)
     except Exception as e:
         print("ファイルの読み込みに失敗しました:", e)
         return
@@ -79,31 +86,6 @@ def save_audio_data():
 
 
 
-        ## ブックマークデータの挿入
-        book_mark_data = {
-            "bookmark_id": 1,
-            "user_id": 1,
-            "title": "Attention Is All You Need",
-            "author": "Ashish Vaswani et al.",
-            "url": "https://arxiv.org/abs/1706.03762",
-            "references_date": "2025-07-04",
-        }
-
-        # 既存のbookmark_idを全て取得
-        response_bookmark_ids = supabase.table("bookmark").select("bookmark_id").execute()
-        existing_bookmark_ids = {item["bookmark_id"] for item in response_bookmark_ids.data}
-
-        if book_mark_data["bookmark_id"] not in existing_bookmark_ids:
-            insert_response = supabase.table("bookmark").insert(book_mark_data).execute()
-            if insert_response.data:
-                print("bookmark データ挿入成功:", insert_response.data)
-            else:
-                print("bookmark データ挿入失敗:", insert_response.error)
-        else:
-            print(f"bookmarkテーブルに既にbookmark_id: {book_mark_data['bookmark_id']} のデータが存在します。挿入をスキップします。")
-
-
-
         ## paper_infoデータの挿入
         paper_info_data = {
             "paper_id": 1,
@@ -116,26 +98,29 @@ def save_audio_data():
             "created_at": datetime.datetime.now().isoformat() + "Z"
         }
 
-        # 既存のpaper_idとarxiv_urlを全て取得
-        response_paper_ids = supabase.table("paper_info").select("paper_id").execute()
-        existing_paper_ids = {item["paper_id"] for item in response_paper_ids.data}
+        # arxiv_idをキーにupsertする (全件のpaper_id/arxiv_urlを取得して重複確認する必要はない)
+        ingest_stats = PaperIngestor(supabase).ingest([paper_info_data])
+        if ingest_stats["inserted"]:
+            print("paper_info データ挿入成功:", paper_info_data["paper_id"])
+        elif ingest_stats["updated"]:
+            print("paper_info データ更新成功 (内容変更のため関連feedを無効化):", paper_info_data["paper_id"])
+        else:
+            print(f"paper_infoテーブルに既にarxiv_url: {paper_info_data['arxiv_url']} の同一データが存在します。挿入をスキップします。")
 
-        response_arxiv_urls = supabase.table("paper_info").select("arxiv_url").execute()
-        existing_arxiv_urls = {item["arxiv_url"] for item in response_arxiv_urls.data}
 
-        if paper_info_data["paper_id"] in existing_paper_ids:
-            print(f"paper_infoテーブルに既にpaper_id: {paper_info_data['paper_id']} のデータが存在します。挿入をスキップします。")
-        elif paper_info_data["arxiv_url"] in existing_arxiv_urls:
-            print(f"paper_infoテーブルに既にarxiv_url: {paper_info_data['arxiv_url']} のデータが存在します。挿入をスキップします。")
-        else:
-            insert_response = supabase.table("paper_info").insert(paper_info_data).execute()
-            if insert_response.data:
-                print("paper_info データ挿入成功:", insert_response.data)
-            elif insert_response.error:
-                print("paper_info データ挿入失敗:", insert_response.error)
-            else:
-                print("予期せぬエラーが発生しました。")
 
+        ## ブックマークデータの挿入 (paper_infoの論文を参照するので論文の後に入れる)
+        # 論文の情報は paper_info から join するので、bookmark には (user_id, paper_id) だけを入れる。
+        # APIの add_bookmark と同じく (user_id, paper_id) の一意索引に対するupsertなので、既にあれば何もしない
+        book_mark_data = {
+            "user_id": test_user["user_id"],
+            "paper_id": paper_info_data["paper_id"],
+        }
+        insert_response = supabase.table("bookmark").upsert(book_mark_data, on_conflict="user_id,paper_id", ignore_duplicates=True).execute()
+        if insert_response.data:
+            print("bookmark データ挿入成功:", insert_response.data)
+        else:
+            print(f"bookmarkテーブルに既にpaper_id: {book_mark_data['paper_id']} のブックマークが存在します。挿入をスキップします。")
 
 
         ## feedデータの挿入
@@ -143,7 +128,7 @@ def save_audio_data():
             "feed_id": 1,
             "user_id": 1,
             "paper_id": 1,
-            "voice": audio_data_base64_string,
+            "voice_key": voice_key,
             "gemini_abstract": "this is gemini's abst"
         }
 
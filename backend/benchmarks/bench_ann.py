@@ -0,0 +1,79 @@
+"""
+backend/benchmarks/bench_ann.py
+
+Benchmarks PaperAnnIndex (IVF) against brute-force search over the same vectors.
+Reports Recall@10 and queries per second for several nprobe values on synthetic,
+clustered unit vectors shaped like the hashed abstract embeddings.
+
+Usage: python -m backend.benchmarks.bench_ann [num_papers] [num_queries]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+# プロジェクトルートをパスに追加
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from backend.modules.PaperRanker import EmbeddingStore, EMBEDDING_DIM
+from backend.modules.PaperAnnIndex import PaperAnnIndex, _top_k
+
+K = 10
+
+
+def make_vectors(n: int, dim: int, num_topics: int = 200, seed: int = 0) -> np.ndarray:
+    """トピックごとにまとまった単位ベクトルを生成する"""
+    rng = np.random.default_rng(seed)
+    topics = rng.standard_normal((num_topics, dim)).astype(np.float32)
+    vectors = topics[rng.integers(0, num_topics, size=n)] + 0.8 * rng.standard_normal((n, dim)).astype(np.float32)
+    return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+
+
+def main():
+    num_papers = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    num_queries = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+
+    directory = tempfile.mkdtemp(prefix="bench_ann_")
+    vectors = make_vectors(num_papers, EMBEDDING_DIM)
+    vectors.tofile(os.path.join(directory, "vectors.f32"))
+    with open(os.path.join(directory, "paper_ids.txt"), "w", encoding='utf-8') as f:
+        f.write("".join(f"p{i}\n" for i in range(num_papers)))
+
+    store = EmbeddingStore(directory)
+    index = PaperAnnIndex(store)
+    start = time.perf_counter()
+    index.build()
+    print(f"build: {time.perf_counter() - start:.2f} s")
+
+    # 再読み込み (memmap) にかかる時間
+    start = time.perf_counter()
+    PaperAnnIndex(EmbeddingStore(directory))
+    print(f"load: {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    rng = np.random.default_rng(1)
+    query_rows = rng.choice(num_papers, size=num_queries, replace=False)
+    queries = np.asarray(store.matrix[query_rows])
+
+    start = time.perf_counter()
+    truth = []
+    for row, query in zip(query_rows, queries):
+        top = [r for r in _top_k(store.matrix @ query, K + 1) if r != row][:K]
+        truth.append(set(int(r) for r in top))
+    brute_qps = num_queries / (time.perf_counter() - start)
+    print(f"brute force: {brute_qps:8.1f} QPS  recall@{K}=1.000")
+
+    for nprobe in (1, 4, 8, 16, 32):
+        start = time.perf_counter()
+        hits = 0
+        for row, query, expected in zip(query_rows, queries, truth):
+            found = {r for r, _ in index.search(query, K, exclude_rows={int(row)}, nprobe=nprobe)}
+            hits += len(found & expected)
+        qps = num_queries / (time.perf_counter() - start)
+        print(f"ivf nprobe={nprobe:<3} {qps:8.1f} QPS  recall@{K}={hits / (num_queries * K):.3f}  ({qps / brute_qps:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
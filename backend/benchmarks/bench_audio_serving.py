@@ -0,0 +1,116 @@
+"""
+backend/benchmarks/bench_audio_serving.py
+
+Benchmarks audio serving with many concurrent streaming clients.
+Compares the previous approach (decode base64 text into bytes and return it in one Response)
+with audio_file_response (FileResponse / mmap ranges). The server runs in a subprocess under
+uvicorn so its peak RSS can be read from /proc; clients stream every file concurrently with
+httpx, half of them with a Range header.
+
+Usage: python -m backend.benchmarks.bench_audio_serving [num_clients] [file_mb]
+"""
+
+import asyncio
+import base64
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+# プロジェクトルートをパスに追加
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from fastapi import FastAPI, Request, Response
+
+from backend.modules.AudioResponse import audio_file_response
+
+PORT = 8765
+NUM_FILES = 20
+
+
+def make_app() -> FastAPI:
+    """BENCH_MODEとBENCH_DIRの設定で、どちらかの方式で音声を返すアプリを作る"""
+    mode = os.environ["BENCH_MODE"]
+    directory = os.environ["BENCH_DIR"]
+    app = FastAPI()
+
+    @app.get("/audio/{name}")
+    def get_audio(name: str, request: Request):
+        path = os.path.join(directory, name)
+        if mode == "bytes":
+            # 従来の方式: 行に入っているbase64を読んでデコードし、全体をメモリに載せて返す
+            with open(path + ".b64", "rb") as f:
+                return Response(content=base64.b64decode(f.read()), media_type="audio/wav")
+        return audio_file_response(path, request.headers.get("range"))
+
+    return app
+
+
+def _peak_rss_mb(pid: int) -> float:
+    with open(f"/proc/{pid}/status", encoding='utf-8') as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+async def _run_clients(num_clients: int, file_size: int) -> int:
+    limits = httpx.Limits(max_connections=num_clients, max_keepalive_connections=num_clients)
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{PORT}", limits=limits, timeout=120) as client:
+        async def fetch(i: int) -> int:
+            headers = {"Range": f"bytes={file_size // 2}-"} if i % 2 else {}
+            received = 0
+            async with client.stream("GET", f"/audio/{i % NUM_FILES}.wav", headers=headers) as response:
+                async for chunk in response.aiter_raw():
+                    received += len(chunk)
+            return received
+        return sum(await asyncio.gather(*(fetch(i) for i in range(num_clients))))
+
+
+def run(mode: str, directory: str, num_clients: int, file_size: int) -> None:
+    env = dict(os.environ, BENCH_MODE=mode, BENCH_DIR=directory)
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "backend.benchmarks.bench_audio_serving:make_app", "--factory",
+         "--port", str(PORT), "--log-level", "warning", "--limit-concurrency", str(num_clients * 2)],
+        env=env, cwd=os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')),
+    )
+    try:
+        for _ in range(100):
+            try:
+                httpx.get(f"http://127.0.0.1:{PORT}/docs", timeout=1)
+                break
+            except httpx.HTTPError:
+                time.sleep(0.1)
+        baseline = _peak_rss_mb(server.pid)
+        start = time.perf_counter()
+        received = asyncio.run(_run_clients(num_clients, file_size))
+        elapsed = time.perf_counter() - start
+        print(f"{mode:>5}: {received / elapsed / 1024 ** 2:8.1f} MB/s, {elapsed:6.2f} s, "
+              f"peak RSS {_peak_rss_mb(server.pid):7.1f} MB (idle {baseline:.1f} MB)")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    num_clients = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    file_mb = float(sys.argv[2]) if len(sys.argv) > 2 else 2.0
+    file_size = int(file_mb * 1024 ** 2)
+
+    directory = tempfile.mkdtemp(prefix="bench_audio_")
+    for i in range(NUM_FILES):
+        data = os.urandom(file_size)
+        with open(os.path.join(directory, f"{i}.wav"), "wb") as f:
+            f.write(data)
+        with open(os.path.join(directory, f"{i}.wav.b64"), "wb") as f:
+            f.write(base64.b64encode(data))
+    print(f"{num_clients} clients, {NUM_FILES} files x {file_mb} MB")
+    for mode in ("bytes", "file"):
+        run(mode, directory, num_clients, file_size)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,330 @@
+"""
+backend/benchmarks/bench_e2e.py
+
+End-to-end offline benchmark of the feed API. Nothing leaves the machine: Gemini and
+VOICEVOX are replaced by the local fakes in fakes.py (with configurable latency and error
+rate), the database is the embedded SQLite backend, and audio goes to a local store, all
+under a temporary directory. The API runs under uvicorn in a subprocess so its peak RSS can
+be read from /proc, and httpx clients replay four scenarios:
+
+- cold_feed: new users open the app and wait until their personalized feed is filled
+- swipe_storm: every user swipes through the feed as fast as possible (dequeue + refill)
+- settings_change: every user switches the voice (feed rows are repointed to assets of the new
+  voice where they exist; the rest are regenerated synchronously)
+- bookmark_churn: bookmarks are toggled on and off while the bookmark list is paged
+
+Each scenario reports throughput, p50/p99 latency, errors and peak server memory; the
+report is printed as JSON (or written with --output) so runs can be compared over time.
+
+Usage: python -m backend.benchmarks.bench_e2e [--users 4] [--papers 200] [--output report.json]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+# プロジェクトルートをパスに追加
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.append(ROOT_DIR)
+
+from backend.benchmarks.fakes import FakeGeminiServer, FakeVoicevoxServer
+
+PORT = 8766
+# フィードが埋まったとみなす件数 (peekで一度に読める上限)
+READY_ITEMS = 20
+SERVER_START_TIMEOUT = 30.0
+
+
+def percentile(values: List[float], q: float) -> float:
+    """最近傍順位法でのパーセンタイル"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(q / 100 * len(ordered) + 0.5)) - 1))]
+
+
+class ScenarioResult:
+    """1つのシナリオのリクエストごとの所要時間とエラーを集める"""
+    def __init__(self, name: str):
+        self.name = name
+        self.latencies: List[float] = []
+        self.errors = 0
+        self.work = 0  # 生成された論文数など、シナリオごとのスループットの単位
+        self.started_at = time.perf_counter()
+        self.elapsed = 0.0
+        self.extra: Dict[str, Any] = {}
+
+    def record(self, seconds: float, ok: bool = True) -> None:
+        self.latencies.append(seconds)
+        if not ok:
+            self.errors += 1
+
+    def finish(self) -> None:
+        self.elapsed = time.perf_counter() - self.started_at
+
+    def to_dict(self, peak_rss_mb: float) -> Dict[str, Any]:
+        return {
+            "requests": len(self.latencies),
+            "errors": self.errors,
+            "elapsed_s": round(self.elapsed, 3),
+            "throughput_rps": round(len(self.latencies) / self.elapsed, 2) if self.elapsed else 0.0,
+            **({"work_per_s": round(self.work / self.elapsed, 2)} if self.work else {}),
+            "p50_ms": round(percentile(self.latencies, 50) * 1000, 2),
+            "p99_ms": round(percentile(self.latencies, 99) * 1000, 2),
+            "peak_rss_mb": round(peak_rss_mb, 1),
+            **self.extra,
+        }
+
+
+def _read_status_mb(pid: int, field: str) -> float:
+    with open(f"/proc/{pid}/status", encoding='utf-8') as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def _reset_peak_rss(pid: int) -> None:
+    """VmHWMをリセットしてシナリオごとのピークを測る (非対応の環境では累積のピークになる)"""
+    try:
+        with open(f"/proc/{pid}/clear_refs", "w", encoding='utf-8') as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def prepare_environment(directory: str, gemini: FakeGeminiServer, voicevox: FakeVoicevoxServer) -> Dict[str, str]:
+    """全ての保存先を一時ディレクトリにし、外部サービスを偽サーバーに向ける環境変数"""
+    return {
+        "DATABASE_BACKEND": "sqlite",
+        "SQLITE_PATH": os.path.join(directory, "app.sqlite3"),
+        "AUDIO_STORE": "local",
+        "AUDIO_STORE_DIR": os.path.join(directory, "audio"),
+        "PAPER_RANKER_DIR": os.path.join(directory, "ranker"),
+        "PAPER_INDEX_PATH": os.path.join(directory, "papers_fts.sqlite3"),
+        "AUDIO_BASE_URL": f"http://127.0.0.1:{PORT}",
+        "GOOGLE_API_KEY": "offline-benchmark",
+        "GEMINI_API_ENDPOINT": gemini.url,
+        "VOICEVOX_URL": voicevox.url,
+    }
+
+
+def seed_papers(num_papers: int, seed: int) -> None:
+    """合成した論文をpaper_infoと検索索引・埋め込みに登録する (PaperIngestorの通常の経路を使う)"""
+    from backend.modules.Database import get_client
+    from backend.modules.PaperIngestor import PaperIngestor
+    from backend.modules.PaperRanker import get_ranker
+    from backend.modules.PaperSearchIndex import get_search_index
+
+    rng = random.Random(seed)
+    topics = ["language models", "retrieval", "diffusion", "reinforcement learning", "graph networks", "speech synthesis", "robotics", "compilers"]
+    papers = []
+    for i in range(num_papers):
+        topic = topics[i % len(topics)]
+        words = " ".join(rng.choice(topics) for _ in range(40))
+        papers.append({
+            "paper_id": f"2401.{i:05d}v1",
+            "title": f"Scaling {topic} with efficient methods ({i})",
+            "author": ", ".join(f"Author {rng.randint(1, 500)}" for _ in range(4)),
+            "published_date": f"2024-01-{1 + i % 28:02d}",
+            "arxiv_url": f"http://arxiv.org/abs/2401.{i:05d}v1",
+            "arxiv_category": "cs.LG",
+            "abstract": f"We study {topic}. " + words + ". Experiments show consistent improvements over strong baselines.",
+        })
+    PaperIngestor(get_client(), indexes=[get_search_index(), get_ranker().store]).ingest(papers)
+
+
+def start_server(env: Dict[str, str], log_path: str) -> subprocess.Popen:
+    log = open(log_path, "w", encoding='utf-8')
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "api.api_fb:app", "--port", str(PORT), "--log-level", "warning"],
+        env=dict(os.environ, **env), cwd=ROOT_DIR, stdout=log, stderr=subprocess.STDOUT,
+    )
+    deadline = time.time() + SERVER_START_TIMEOUT
+    while time.time() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"APIサーバーが起動できませんでした。ログ: {log_path}")
+        try:
+            if httpx.get(f"http://127.0.0.1:{PORT}/metrics", timeout=1).status_code == 200:
+                return server
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError(f"APIサーバーが{SERVER_START_TIMEOUT}秒以内に起動しませんでした。ログ: {log_path}")
+
+
+async def _timed(result: ScenarioResult, request) -> Optional[httpx.Response]:
+    start = time.perf_counter()
+    try:
+        response = await request
+    except httpx.HTTPError:
+        result.record(time.perf_counter() - start, ok=False)
+        return None
+    result.record(time.perf_counter() - start, ok=response.status_code < 400)
+    return response
+
+
+async def cold_feed(client: httpx.AsyncClient, users: List[int], timeout: float) -> ScenarioResult:
+    """初回起動: ユーザー登録・生成開始の後、フィードが埋まるまでの時間を1件として測る"""
+    result = ScenarioResult("cold_feed")
+    first_item: List[float] = []
+
+    async def one_user(user_id: int) -> None:
+        start = time.perf_counter()
+        await client.post(f"/api/feed/initial/{user_id}", json={"uuid": f"bench-{user_id}", "voice_type": 3})
+        await client.post(f"/api/feed/generate/{user_id}")
+        ready = 0
+        while time.perf_counter() - start < timeout:
+            response = await client.get(f"/api/feed/next/{user_id}", params={"peek": "true", "n": READY_ITEMS})
+            previous, ready = ready, len(response.json().get("items", [])) if response.status_code == 200 else 0
+            if ready and not previous:
+                first_item.append(time.perf_counter() - start)
+            if ready >= READY_ITEMS:
+                break
+            await asyncio.sleep(0.1)
+        result.record(time.perf_counter() - start, ok=ready >= READY_ITEMS)
+        result.work += ready
+
+    await asyncio.gather(*(one_user(user_id) for user_id in users))
+    result.finish()
+    result.extra["first_item_p50_ms"] = round(percentile(first_item, 50) * 1000, 2)
+    return result
+
+
+async def swipe_storm(client: httpx.AsyncClient, users: List[int], swipes: int) -> ScenarioResult:
+    """全ユーザーが連続してスワイプする (取り出し + 裏での補充)"""
+    result = ScenarioResult("swipe_storm")
+
+    async def one_user(user_id: int) -> None:
+        for _ in range(swipes):
+            await _timed(result, client.get(f"/api/feed/next/{user_id}", params={"include_audio": "false"}))
+
+    await asyncio.gather(*(one_user(user_id) for user_id in users))
+    result.finish()
+    return result
+
+
+async def settings_change(client: httpx.AsyncClient, users: List[int]) -> ScenarioResult:
+    """全ユーザーが話者を切り替える (フィードを同期的に作り直して先頭10件を返す)"""
+    result = ScenarioResult("settings_change")
+
+    async def one_user(user_id: int) -> None:
+        response = await _timed(result, client.post(f"/api/settings/{user_id}", json={"character_voice": 1}))
+        if response is not None and response.status_code == 200:
+            result.work += len(response.json().get("items", []))
+
+    await asyncio.gather(*(one_user(user_id) for user_id in users))
+    result.finish()
+    return result
+
+
+async def bookmark_churn(client: httpx.AsyncClient, users: List[int], operations: int, num_papers: int, seed: int) -> ScenarioResult:
+    """ブックマークの追加・解除を繰り返しながら、5回に1回一覧を読む"""
+    result = ScenarioResult("bookmark_churn")
+    rng = random.Random(seed)
+
+    async def one_user(user_id: int) -> None:
+        for i in range(operations):
+            if i % 5 == 4:
+                await _timed(result, client.get(f"/api/bookmarks/{user_id}", params={"limit": 20}))
+            else:
+                paper_id = f"2401.{rng.randrange(min(num_papers, 50)):05d}v1"
+                await _timed(result, client.post(f"/api/bookmarks/{user_id}/toggle", json={"paper_id": paper_id}))
+
+    await asyncio.gather(*(one_user(user_id) for user_id in users))
+    result.finish()
+    return result
+
+
+def read_stage_metrics(metrics_text: str) -> Dict[str, Dict[str, float]]:
+    """/metrics の feed_stage_seconds からステージごとの合計時間と回数を読む"""
+    stages: Dict[str, Dict[str, float]] = {}
+    for line in metrics_text.splitlines():
+        for suffix, key in (("_sum", "total_s"), ("_count", "count")):
+            prefix = f'feed_stage_seconds{suffix}{{stage="'
+            if line.startswith(prefix):
+                stage, value = line[len(prefix):].split('"} ')
+                stages.setdefault(stage, {})[key] = round(float(value), 4)
+    return stages
+
+
+async def run_scenarios(args: argparse.Namespace, server: subprocess.Popen) -> Dict[str, Any]:
+    users = list(range(1, args.users + 1))
+    report: Dict[str, Any] = {}
+    limits = httpx.Limits(max_connections=args.users * 4)
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{PORT}", limits=limits, timeout=args.timeout) as client:
+        scenarios = [
+            lambda: cold_feed(client, users, args.timeout),
+            lambda: swipe_storm(client, users, args.swipes),
+            lambda: settings_change(client, users),
+            lambda: bookmark_churn(client, users, args.bookmark_ops, args.papers, args.seed),
+        ]
+        for scenario in scenarios:
+            _reset_peak_rss(server.pid)
+            result = await scenario()
+            report[result.name] = result.to_dict(_read_status_mb(server.pid, "VmHWM"))
+            print(f"BENCH: {result.name} {json.dumps(report[result.name])}", file=sys.stderr)
+        metrics_text = (await client.get("/metrics")).text
+    return {"scenarios": report, "stages": read_stage_metrics(metrics_text)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="外部サービスなしでフィードAPIの性能を測る")
+    parser.add_argument("--users", type=int, default=4, help="同時に操作するユーザー数")
+    parser.add_argument("--papers", type=int, default=200, help="paper_infoに登録する論文数")
+    parser.add_argument("--swipes", type=int, default=20, help="swipe_stormで1ユーザーがスワイプする回数")
+    parser.add_argument("--bookmark-ops", type=int, default=50, help="bookmark_churnで1ユーザーが行う操作数")
+    parser.add_argument("--gemini-latency", type=float, default=0.3, help="偽Geminiの応答時間 (秒)")
+    parser.add_argument("--gemini-error-rate", type=float, default=0.0, help="偽Geminiがエラーを返す割合")
+    parser.add_argument("--voicevox-latency", type=float, default=0.1, help="偽VOICEVOXの各APIの応答時間 (秒)")
+    parser.add_argument("--voicevox-error-rate", type=float, default=0.0, help="偽VOICEVOXがエラーを返す割合")
+    parser.add_argument("--timeout", type=float, default=120.0, help="1リクエスト・フィード生成待ちの上限 (秒)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="レポートを書き出すJSONファイル (省略時は標準出力)")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix="bench_e2e_")
+    gemini = FakeGeminiServer(args.gemini_latency, args.gemini_error_rate, seed=args.seed).start()
+    voicevox = FakeVoicevoxServer(args.voicevox_latency, args.voicevox_error_rate, seed=args.seed).start()
+    env = prepare_environment(directory, gemini, voicevox)
+    os.environ.update(env)
+    seed_papers(args.papers, args.seed)
+
+    log_path = os.path.join(directory, "server.log")
+    server = start_server(env, log_path)
+    try:
+        results = asyncio.run(run_scenarios(args, server))
+    finally:
+        server.terminate()
+        server.wait()
+        gemini.stop()
+        voicevox.stop()
+
+    report = {
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+        **results,
+        "fake_services": {
+            "gemini": {"requests": gemini.requests, "errors": gemini.errors},
+            "voicevox": {"requests": voicevox.requests, "errors": voicevox.errors},
+        },
+        "server_log": log_path,
+    }
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding='utf-8') as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
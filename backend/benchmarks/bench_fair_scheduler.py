@@ -0,0 +1,171 @@
+"""
+backend/benchmarks/bench_fair_scheduler.py
+
+Simulated multi-user load for the generation slot scheduler (backend/modules/FairScheduler.py).
+This is a discrete-event simulation, so it runs in seconds and needs no services. New users
+arrive over a time window and each asks for a full backfill (30 items by default) with an
+empty feed. At the same time, already active users keep swiping, and each swipe refills one
+item at the end of their feed. Every item that is not an asset hit holds one generation slot
+for a lognormal service time (a Gemini summary plus VOICEVOX synthesis).
+The same workload is replayed under three policies:
+- fifo: one global queue in arrival order (what a plain semaphore or thread pool gives)
+- wfq: per-user weighted fair queuing only
+- fair: FairScheduler's policy (WFQ + empty-feed and head-of-queue priority classes)
+For each policy the report gives the time-to-first-item distribution of the new users, the
+time to finish their whole backfill, and the latency of the active users' refills.
+
+Usage: python -m backend.benchmarks.bench_fair_scheduler [--users 1000] [--slots 128] [--output report.json]
+"""
+
+import argparse
+import heapq
+import json
+import math
+import os
+import random
+import sys
+from collections import deque
+from typing import Any, Dict, List, Tuple
+
+# プロジェクトルートをパスに追加
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from backend.benchmarks.bench_e2e import percentile
+from backend.modules.FairScheduler import FairQueue, PRIORITY_BACKFILL, item_priority
+
+POLICIES = ("fifo", "wfq", "fair")
+
+
+class FifoQueue:
+    """到着順の1本のキュー (比較用)"""
+    def __init__(self):
+        self._items: deque = deque()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def push(self, user_id: Any, item: Any, priority: int = PRIORITY_BACKFILL) -> None:
+        self._items.append((user_id, item))
+
+    def pop(self) -> Tuple[Any, Any]:
+        return self._items.popleft()
+
+
+def build_workload(args) -> List[Tuple[float, str, Any, List[float]]]:
+    """
+    (時刻, 種類, ユーザー, アイテムごとのサービス時間) の列を作る。サービス時間0はアセットのヒット。
+    全ての方式で同じ負荷を再生できるよう、乱数はここでだけ使う
+    """
+    rng = random.Random(args.seed)
+    # 平均が service_mean になる対数正規分布
+    mu = math.log(args.service_mean) - args.service_sigma ** 2 / 2
+
+    def service_times(count: int) -> List[float]:
+        return [0.0 if rng.random() < args.hit_rate else rng.lognormvariate(mu, args.service_sigma) for _ in range(count)]
+
+    events = []
+    for user_id in range(args.users):
+        events.append((rng.uniform(0, args.window), "new", user_id, service_times(args.backfill)))
+    for active_id in range(args.active_users):
+        t = rng.expovariate(args.swipe_rate)
+        while t < args.window:
+            events.append((t, "swipe", args.users + active_id, service_times(1)))
+            t += rng.expovariate(args.swipe_rate)
+    return sorted(events, key=lambda event: event[0])
+
+
+def simulate(policy: str, workload, args) -> Dict[str, Any]:
+    """1つの方式で負荷を再生し、ユーザーごとの最初のアイテム・全件の完了時刻とリフィルの待ち時間を集める"""
+    queue = FifoQueue() if policy == "fifo" else FairQueue()
+    free_slots = args.slots
+    # (時刻, 順番, 種類, データ)
+    events: list = [(t, i, kind, (user_id, times)) for i, (t, kind, user_id, times) in enumerate(workload)]
+    heapq.heapify(events)
+    seq = len(events)
+    arrived: Dict[Any, float] = {}
+    first_item: Dict[Any, float] = {}
+    last_item: Dict[Any, float] = {}
+    remaining: Dict[Any, int] = {}
+    refill_latencies: List[float] = []
+    now = 0.0
+
+    def complete(user_id: Any, position: int, kind: str, started_at: float) -> None:
+        if kind == "swipe":
+            refill_latencies.append(now - started_at)
+            return
+        if position == 0:
+            first_item[user_id] = now - arrived[user_id]
+        remaining[user_id] -= 1
+        if not remaining[user_id]:
+            last_item[user_id] = now - arrived[user_id]
+
+    while events:
+        now, _, kind, data = heapq.heappop(events)
+        if kind == "done":
+            user_id, position, item_kind, started_at = data
+            free_slots += 1
+            complete(user_id, position, item_kind, started_at)
+        else:
+            user_id, times = data
+            if kind == "new":
+                arrived[user_id] = now
+                remaining[user_id] = len(times)
+            # 既存ユーザーのリフィルはフィードの末尾 (ACTIVE_FEED_SIZE件目) に入る
+            offset = 0 if kind == "new" else args.active_feed_size
+            for position, service in enumerate(times):
+                if service == 0.0:
+                    complete(user_id, position, kind, now)
+                    continue
+                priority = PRIORITY_BACKFILL if policy == "wfq" else item_priority(offset + position, empty_feed=kind == "new")
+                queue.push(user_id, (position, kind, now, service), priority)
+        # 空いている枠に次のアイテムを割り当てる
+        while free_slots and len(queue):
+            user_id, (position, item_kind, started_at, service) = queue.pop()
+            free_slots -= 1
+            seq += 1
+            heapq.heappush(events, (now + service, seq, "done", (user_id, position, item_kind, started_at)))
+
+    def summary(values: List[float]) -> Dict[str, float]:
+        return {f"p{q}": round(percentile(values, q), 2) for q in (50, 90, 99)} | {"max": round(max(values, default=0.0), 2)}
+    return {
+        "time_to_first_item": summary(list(first_item.values())),
+        "time_to_full_backfill": summary(list(last_item.values())),
+        "refill_latency": summary(refill_latencies),
+        "makespan": round(now, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="生成枠のスケジューリング方式ごとの最初のアイテムまでの時間をシミュレーションで比べる")
+    parser.add_argument("--users", type=int, default=1000, help="期間中に到着する新規ユーザー数 (フィードが空の状態で全件を要求する)")
+    parser.add_argument("--backfill", type=int, default=30, help="新規ユーザー1人あたりの生成件数")
+    parser.add_argument("--window", type=float, default=600.0, help="新規ユーザーが到着する期間 (秒)")
+    parser.add_argument("--active-users", type=int, default=200, help="スワイプを続ける既存ユーザー数")
+    parser.add_argument("--active-feed-size", type=int, default=20, help="既存ユーザーのフィードに残っている件数")
+    parser.add_argument("--swipe-rate", type=float, default=0.1, help="既存ユーザー1人あたりのスワイプ数 (回/秒)")
+    parser.add_argument("--slots", type=int, default=96, help="同時に生成できるアイテム数 (Gemini・VOICEVOXの容量)")
+    parser.add_argument("--service-mean", type=float, default=2.0, help="1アイテムの生成時間の平均 (秒)")
+    parser.add_argument("--service-sigma", type=float, default=0.5, help="生成時間の対数正規分布のσ")
+    parser.add_argument("--hit-rate", type=float, default=0.2, help="共有アセットがヒットする割合 (生成枠を使わない)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="レポートを書き出すJSONファイル (省略時は標準出力)")
+    args = parser.parse_args()
+
+    workload = build_workload(args)
+    generated = sum(1 for _, _, _, times in workload for service in times if service)
+    offered = sum(service for _, _, _, times in workload for service in times) / (args.slots * args.window)
+    report = {
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+        "workload": {"generated_items": generated, "offered_load": round(offered, 2)},
+        "policies": {policy: simulate(policy, workload, args) for policy in POLICIES},
+    }
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding='utf-8') as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""
+backend/benchmarks/bench_feed_serialization.py
+
+Measures the time and the peak memory allocated to build and encode one feed response.
+"pydantic" is the previous path: a FeedItem model per item, then FastAPI's own response
+handling for /api/feed/next (validation against the route's response_model, serialization and
+JSONResponse rendering). The other rows build FeedCard dataclasses with feed_item_event and
+encode them with each JSON encoder that is installed (msgspec, orjson, json), as
+json_response() does. Rows are synthetic but sized like production data.
+
+Usage: python -m backend.benchmarks.bench_feed_serialization [--repeat 2000] [--output report.json]
+"""
+
+import argparse
+import base64
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List
+
+# プロジェクトルートをパスに追加
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+
+from api.api_fb import FeedItem, app
+from backend.modules.FeedEvents import audio_url, feed_item_event
+from backend.modules.FeedModels import json_encoders
+
+# 30秒・24kHz・16bitモノラルのWAV
+WAV_BYTES = 30 * 24000 * 2
+SUMMARY = "この論文は大規模言語モデルの推論を効率化する新しい手法を提案しています。" * 6
+
+
+def make_rows(count: int) -> List[Dict[str, Any]]:
+    """feedの行と paper_info の行 (PAPER_CARD の列) の組"""
+    return [{
+        "feed_id": 1000 + i, "paper_id": 2400000000 + i, "gemini_abstract": SUMMARY,
+        "paper": {
+            "paper_id": 2400000000 + i, "title": "Efficient Retrieval-Augmented Generation with Hierarchical Memory",
+            "author": ", ".join(f"Author {j}" for j in range(6)), "arxiv_url": f"http://arxiv.org/abs/2401.{i:05d}v1",
+        },
+    } for i in range(count)]
+
+
+def _run_to_end(coroutine) -> Any:
+    # serialize_response は is_coroutine=True なら途中で中断しないので、イベントループなしで最後まで実行できる
+    try:
+        coroutine.send(None)
+    except StopIteration as stop:
+        return stop.value
+    raise RuntimeError("serialize_response suspended")
+
+
+def pydantic_response(rows: List[Dict[str, Any]], audio: Any, batch: bool, response_field: Any) -> bytes:
+    """変更前: FeedItem を作り、FastAPIが response_model で検証し直してから JSONResponse にする"""
+    items = [FeedItem(
+        feed_id=row["feed_id"], paper_id=str(row["paper_id"]), title=row["paper"]["title"],
+        authors=[author.strip() for author in row["paper"].get("author", "").split(',')], summary=row["gemini_abstract"],
+        audio_base64=audio, audio_url=audio_url(row["feed_id"]), paper_url=row["paper"]["arxiv_url"], is_bookmarked=False,
+    ) for row in rows]
+    content = {"items": items} if batch else items[0]
+    return JSONResponse(_run_to_end(serialize_response(field=response_field, response_content=content))).body
+
+
+def card_response(rows: List[Dict[str, Any]], audio: Any, batch: bool, encode: Callable[[Any], bytes]) -> bytes:
+    """変更後: FeedCard を作り、検証せずにエンコードする"""
+    items = [feed_item_event(row["feed_id"], row["paper"], row["gemini_abstract"], False, audio_base64=audio) for row in rows]
+    return encode({"items": items} if batch else items[0])
+
+
+def measure(build: Callable[[], bytes], repeat: int) -> Dict[str, Any]:
+    """1レスポンスあたりの時間 (中央値) と、作る間に確保したメモリのピーク"""
+    body = build()
+    timings = []
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        build()
+        timings.append(time.perf_counter() - started_at)
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+        build()
+        peak = tracemalloc.get_traced_memory()[1] - baseline
+    finally:
+        tracemalloc.stop()
+    return {
+        "median_us": round(statistics.median(timings) * 1e6, 1),
+        "p99_us": round(sorted(timings)[int(len(timings) * 0.99)] * 1e6, 1),
+        "peak_alloc_kib": round(peak / 1024, 1),
+        "body_bytes": len(body),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="フィードのレスポンスを組み立ててエンコードする時間とメモリを比べる")
+    parser.add_argument("--repeat", type=int, default=2000, help="1つの方式を何回測るか (音声を含む場合は1/20)")
+    parser.add_argument("--output", help="レポートを書き出すJSONファイル")
+    args = parser.parse_args()
+
+    route = next(r for r in app.routes if getattr(r, "path", None) == "/api/feed/next/{user_id}")
+    voice = base64.b64encode(b"\0" * WAV_BYTES).decode('ascii')
+    # (名前, 行, 音声, まとめて返すか, 繰り返し回数)
+    scenarios = [
+        ("GET /api/feed/next?n=20&include_audio=false", make_rows(20), None, True, args.repeat),
+        ("GET /api/feed/next (1 item, audio inline)", make_rows(1), voice, False, max(args.repeat // 20, 10)),
+    ]
+    report: Dict[str, Any] = {}
+    for name, rows, audio, batch, repeat in scenarios:
+        results = {"pydantic": measure(lambda: pydantic_response(rows, audio, batch, route.response_field), repeat)}
+        for encoder_name, encode in json_encoders().items():
+            results[f"cards+{encoder_name}"] = measure(lambda: card_response(rows, audio, batch, encode), repeat)
+        # どの方式も同じ内容を返すことを確かめておく
+        bodies = [json.loads(pydantic_response(rows, audio, batch, route.response_field))]
+        bodies += [json.loads(card_response(rows, audio, batch, encode)) for encode in json_encoders().values()]
+        assert all(body == bodies[0] for body in bodies), name
+        base = results["pydantic"]["median_us"]
+        for result in results.values():
+            result["speedup"] = round(base / result["median_us"], 2)
+        report[name] = results
+
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
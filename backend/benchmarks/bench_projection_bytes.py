@@ -0,0 +1,86 @@
+"""
+backend/benchmarks/bench_projection_bytes.py
+
+Estimates the bytes PostgREST sends per endpoint before and after column projection.
+Rows are synthetic but sized like production data (arXiv abstracts, Japanese summaries,
+30 s of 24 kHz mono WAV as base64), and each endpoint's queries are replayed as JSON payloads
+of the selected columns, so the numbers track the response bodies the API receives.
+
+Usage: python -m backend.benchmarks.bench_projection_bytes
+"""
+
+import base64
+import json
+import os
+import sys
+from typing import Any, Dict, List, Sequence
+
+# プロジェクトルートをパスに追加
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from backend.modules.Projections import (
+    TABLE_COLUMNS, PAPER_CARD, PAPER_LATEST, PAPER_ABSTRACT, FEED_ITEM, FEED_PAPER_IDS, PAPER_ASSET,
+)
+
+# 30秒・24kHz・16bitモノラルのWAV
+WAV_BYTES = 30 * 24000 * 2
+# 共有アセットのヒット率 (事前生成が効いている状態)
+ASSET_HIT_RATE = 0.8
+
+
+def make_paper(i: int) -> Dict[str, Any]:
+    return {
+        "paper_id": str(2400000000 + i), "arxiv_id": f"2401.{i:05d}", "arxiv_version": 1,
+        "title": "Efficient Retrieval-Augmented Generation with Hierarchical Memory",
+        "author": ", ".join(f"Author {j}" for j in range(6)), "published_date": "2024-01-15",
+        "arxiv_url": f"http://arxiv.org/abs/2401.{i:05d}v1", "arxiv_category": "cs.CL",
+        "abstract": "We propose a retrieval-augmented method that " * 30, "content_hash": "0" * 64,
+        "created_at": "2024-01-16T00:00:00+00:00",
+    }
+
+
+def make_feed_row(i: int, voice: str) -> Dict[str, Any]:
+    return {
+        "feed_id": i, "user_id": 1, "paper_id": str(2400000000 + i),
+        "gemini_abstract": "この論文は階層的なメモリを用いた検索拡張生成の手法を提案しています。" * 8,
+        "voice": voice, "voice_key": "ab/" + "c" * 64 + ".wav",
+    }
+
+
+def payload_bytes(rows: Sequence[Dict[str, Any]], columns: Sequence[str]) -> int:
+    return len(json.dumps([{c: row.get(c) for c in columns} for row in rows], ensure_ascii=False).encode('utf-8'))
+
+
+def main():
+    voice = base64.b64encode(b"\0" * WAV_BYTES).decode('ascii')
+    papers = [make_paper(i) for i in range(30)]
+    feed_rows = [make_feed_row(i, voice) for i in range(30)]
+    all_paper, all_feed = TABLE_COLUMNS["paper_info"], TABLE_COLUMNS["feed"]
+    misses = papers[:int(len(papers) * (1 - ASSET_HIT_RATE))]
+
+    # 各エンドポイントが発行するクエリ: (行, 変更前の列, 変更後の列)
+    cases: Dict[str, List[tuple]] = {
+        "GET /api/feed/next (1 item)": [
+            (feed_rows[:1], all_feed, FEED_ITEM.columns),
+            (papers[:1], PAPER_CARD.columns, PAPER_CARD.columns),
+        ],
+        "GET /api/feed/initial (10 papers)": [
+            (papers[:10], all_paper, PAPER_LATEST.columns),
+            (feed_rows[:10], ("paper_id", "feed_id", "gemini_abstract"), FEED_ITEM.columns),
+        ],
+        "feed generation (30 papers)": [
+            (feed_rows, FEED_PAPER_IDS.columns, FEED_PAPER_IDS.columns),
+            (papers, all_paper, PAPER_CARD.columns),
+            (feed_rows, ("paper_id", "voice_type", "gemini_abstract", "voice"), PAPER_ASSET.columns),
+            (misses, (), PAPER_ABSTRACT.columns),  # アセットがない論文だけアブストラクトを読む
+        ],
+    }
+    print(f"{'endpoint':<36}{'before':>14}{'after':>14}{'ratio':>10}")
+    for name, queries in cases.items():
+        before = sum(payload_bytes(rows, cols) for rows, cols, _ in queries if cols)
+        after = sum(payload_bytes(rows, cols) for rows, _, cols in queries)
+        print(f"{name:<36}{before:>14,}{after:>14,}{before / after:>9.0f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+"""
+backend/benchmarks/fakes.py
+
+Local stand-ins for the external services used by feed generation, for offline benchmarks.
+FakeGeminiServer answers the Gemini REST generateContent call (PaperSummarizer connects to it
+through GEMINI_API_ENDPOINT) with a fixed-length Japanese summary and usage metadata.
+FakeVoicevoxServer implements /audio_query, /synthesis and the user dictionary API
+(VoicevoxClient connects to it through VOICEVOX_URL) and returns a 24 kHz 16-bit mono WAV
+whose length follows the text.
+Both run on a background thread, with configurable latency and error rate.
+"""
+
+import abc
+import json
+import random
+import struct
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterator, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+SAMPLE_RATE = 24000
+# 読み上げの速さ (1秒あたりの文字数)。合成するWAVの長さの計算に使う
+CHARS_PER_SECOND = 8.0
+SUMMARY_SENTENCE = "この論文は大規模言語モデルの推論を効率化する新しい手法を提案しています。"
+
+
+def _wav_header(data_size: int) -> bytes:
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI", b"RIFF", 36 + data_size, b"WAVE", b"fmt ", 16, 1, 1,
+        SAMPLE_RATE, SAMPLE_RATE * 2, 2, 16, b"data", data_size,
+    )
+
+
+def make_wav(seconds: float) -> bytes:
+    """指定した長さの無音のWAV (24kHz・16bit・モノラル) を作る"""
+    data_size = int(seconds * SAMPLE_RATE) * 2
+    return _wav_header(data_size) + bytes(data_size)
+
+
+def iter_wav(seconds: float, chunk_size: int = 64 * 1024) -> Tuple[int, Iterator[bytes]]:
+    """make_wav と同じWAVを (全体のサイズ, チャンクの列) として返す (偽サーバー側でも全体を持たない)"""
+    data_size = int(seconds * SAMPLE_RATE) * 2
+    silence = bytes(chunk_size)
+
+    def chunks() -> Iterator[bytes]:
+        yield _wav_header(data_size)
+        for start in range(0, data_size, chunk_size):
+            yield silence[:min(chunk_size, data_size - start)]
+    return 44 + data_size, chunks()
+
+
+class _FakeServer(abc.ABC):
+    """偽サーバーの共通部分 (スレッドでの起動・停止と遅延・エラーの注入)"""
+    def __init__(self, latency: float = 0.0, error_rate: float = 0.0, seed: int = 0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.requests = 0
+        self.errors = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "_FakeServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _should_fail(self) -> bool:
+        """遅延を入れ、エラーを返すべきリクエストかどうかを決める"""
+        with self._lock:
+            self.requests += 1
+            fail = self._random.random() < self.error_rate
+            if fail:
+                self.errors += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return fail
+
+    @abc.abstractmethod
+    def handle(self, path: str, query: Dict[str, Any], body: bytes):
+        """(ステータス, Content-Type, 本文) を返す。本文は bytes か (サイズ, チャンクの列)"""
+
+    def is_measured(self, path: str) -> bool:
+        """遅延・エラーを入れ、リクエスト数に数えるパスかどうか (起動時の設定用のAPIは数えない)"""
+        return True
+
+    def _handler_class(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                self.do_POST()
+
+            def do_POST(self):
+                url = urlparse(self.path)
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                if fake.is_measured(url.path) and fake._should_fail():
+                    status, content_type, payload = 500, "application/json", b'{"error": {"code": 500, "message": "injected error"}}'
+                else:
+                    status, content_type, payload = fake.handle(url.path, parse_qs(url.query), body)
+                # 本文は bytes か (サイズ, チャンクの列)
+                size, chunks = (len(payload), [payload]) if isinstance(payload, bytes) else payload
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(size))
+                self.end_headers()
+                for chunk in chunks:
+                    self.wfile.write(chunk)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+class FakeGeminiServer(_FakeServer):
+    """
+    Gemini APIの generateContent の偽物。入力の長さに応じたトークン数と約300字の要約を返す
+    """
+    def __init__(self, latency: float = 0.5, error_rate: float = 0.0, summary_chars: int = 300, seed: int = 0):
+        self.summary_chars = summary_chars
+        super().__init__(latency, error_rate, seed)
+
+    def handle(self, path: str, query: Dict[str, Any], body: bytes):
+        request = json.loads(body or b"{}")
+        prompt = " ".join(part.get("text", "") for content in request.get("contents", []) for part in content.get("parts", []))
+        summary = (SUMMARY_SENTENCE * (self.summary_chars // len(SUMMARY_SENTENCE) + 1))[:self.summary_chars]
+        response = {
+            "candidates": [{"content": {"parts": [{"text": summary}], "role": "model"}, "finishReason": "STOP"}],
+            # 英語はおよそ4文字で1トークン、日本語はおよそ1文字で1トークン
+            "usageMetadata": {
+                "promptTokenCount": len(prompt) // 4, "candidatesTokenCount": len(summary),
+                "totalTokenCount": len(prompt) // 4 + len(summary),
+            },
+        }
+        return 200, "application/json", json.dumps(response, ensure_ascii=False).encode("utf-8")
+
+
+class FakeVoicevoxServer(_FakeServer):
+    """
+    VOICEVOXエンジンの偽物。audio_query はテキストを含むクエリを返し、synthesis はテキストの長さに応じたWAVを返す
+    """
+    def __init__(self, latency: float = 0.2, error_rate: float = 0.0, seed: int = 0):
+        super().__init__(latency, error_rate, seed)
+        # ユーザー辞書 ({uuid: 単語})
+        self.user_dict: Dict[str, Dict[str, Any]] = {}
+
+    def is_measured(self, path: str) -> bool:
+        return not path.startswith("/user_dict")
+
+    def handle(self, path: str, query: Dict[str, Any], body: bytes):
+        if path == "/user_dict":
+            return 200, "application/json", json.dumps(self.user_dict, ensure_ascii=False).encode("utf-8")
+        if path == "/user_dict_word":
+            word_uuid = f"{len(self.user_dict):08d}-0000-0000-0000-000000000000"
+            self.user_dict[word_uuid] = {
+                "surface": query.get("surface", [""])[0], "pronunciation": query.get("pronunciation", [""])[0],
+                "accent_type": int(query.get("accent_type", ["0"])[0]),
+            }
+            return 200, "application/json", json.dumps(word_uuid).encode("utf-8")
+        if path == "/audio_query":
+            text = query.get("text", [""])[0]
+            return 200, "application/json", json.dumps({"kana": text, "speedScale": 1.0}, ensure_ascii=False).encode("utf-8")
+        if path == "/synthesis":
+            text = json.loads(body or b"{}").get("kana", "")
+            return 200, "audio/wav", iter_wav(max(len(text) / CHARS_PER_SECOND, 1.0))
+        return 404, "application/json", b'{"detail": "Not Found"}'
@@ -0,0 +1,80 @@
+"""
+backend/modules/AudioResponse.py
+
+This module builds HTTP responses for audio files on local disk without reading the whole
+file into Python bytes. Full requests return a FileResponse, which the server can send with
+sendfile (zero-copy) when it supports it. Single-range requests (players seeking or fetching
+the header first) are answered with 206 from an mmap of just that range, streamed in small
+slices; pages already sent are released with MADV_DONTNEED so RSS stays flat under many
+concurrent clients.
+"""
+
+import mmap
+import os
+import re
+from typing import Iterator, Optional, Tuple
+
+from fastapi.responses import FileResponse, Response, StreamingResponse
+
+AUDIO_MEDIA_TYPE = "audio/wav"
+# mmapから一度に送る大きさ
+RANGE_CHUNK_SIZE = 64 * 1024
+
+_RANGE_PATTERN = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def parse_range(range_header: Optional[str], file_size: int) -> Optional[Tuple[int, int]]:
+    """
+    Rangeヘッダーを (開始位置, 終了位置(含む)) にする。単一範囲でなければNone (全体を返す)。
+    範囲がファイルの外ならValueError
+    """
+    if not range_header:
+        return None
+    match = _RANGE_PATTERN.match(range_header.strip())
+    if not match or match.group(1) == match.group(2) == "":
+        return None
+    start_text, end_text = match.groups()
+    if start_text == "":
+        # bytes=-N は末尾のNバイト
+        start, end = max(file_size - int(end_text), 0), file_size - 1
+    else:
+        start = int(start_text)
+        end = min(int(end_text), file_size - 1) if end_text else file_size - 1
+    if start >= file_size or start > end:
+        raise ValueError(f"Range not satisfiable: {range_header}")
+    return start, end
+
+
+def _iter_mmap(path: str, start: int, end: int) -> Iterator[bytes]:
+    # 要求された範囲だけをmmapする (オフセットはページ境界に揃える必要がある)
+    map_start = start - start % mmap.ALLOCATIONGRANULARITY
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), end + 1 - map_start, offset=map_start, access=mmap.ACCESS_READ) as mapped:
+        for offset in range(start - map_start, end + 1 - map_start, RANGE_CHUNK_SIZE):
+            chunk_end = min(offset + RANGE_CHUNK_SIZE, end + 1 - map_start)
+            yield mapped[offset:chunk_end]
+            # 送り終えたページはマッピングから外し、同時接続が多くてもRSSが積み上がらないようにする
+            if hasattr(mmap, "MADV_DONTNEED"):
+                page_start = offset - offset % mmap.PAGESIZE
+                length = chunk_end - page_start
+                mapped.madvise(mmap.MADV_DONTNEED, page_start, length - length % mmap.PAGESIZE)
+
+
+def audio_file_response(path: str, range_header: Optional[str] = None, media_type: str = AUDIO_MEDIA_TYPE):
+    """
+    ローカルの音声ファイルを返すレスポンスを作る。Rangeヘッダーがあれば206で該当範囲だけを返す
+    """
+    file_size = os.path.getsize(path)
+    try:
+        byte_range = parse_range(range_header, file_size) if file_size else None
+    except ValueError:
+        return Response(status_code=416, headers={"Content-Range": f"bytes */{file_size}"})
+    if byte_range is None:
+        return FileResponse(path, media_type=media_type, headers={"Accept-Ranges": "bytes"})
+
+    start, end = byte_range
+    headers = {
+        "Accept-Ranges": "bytes",
+        "Content-Range": f"bytes {start}-{end}/{file_size}",
+        "Content-Length": str(end - start + 1),
+    }
+    return StreamingResponse(_iter_mmap(path, start, end), status_code=206, media_type=media_type, headers=headers)
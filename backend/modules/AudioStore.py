@@ -0,0 +1,384 @@
+"""
+backend/modules/AudioStore.py
+
+This module stores synthesized audio (WAV) outside the database.
+The feed and paper_asset rows keep only a short key; the bytes live in a blob store.
+Keys are content-addressed (sha256 of the audio), so the same audio shared by several
+feed rows is stored once and a write can be retried safely.
+Three backends are provided and selected with the AUDIO_STORE environment variable:
+- "local" (default): files under backend/data/audio (or AUDIO_STORE_DIR)
+- "s3": any S3-compatible object storage such as MinIO (AUDIO_STORE_BUCKET, AUDIO_STORE_ENDPOINT)
+- "supabase": a Supabase Storage bucket (AUDIO_STORE_BUCKET)
+Remote backends are wrapped in CachedAudioStore, an LRU disk tier bounded by total bytes, so
+the API can always serve audio from a local file (sendfile / mmap) instead of Python bytes.
+put_stream() takes the audio as an iterable of chunks (e.g. the VOICEVOX response body) and
+spools it to a temporary file while hashing, so storing an item holds O(chunk) memory rather
+than the whole WAV; remote backends upload from that file.
+"""
+
+import abc
+import base64
+import hashlib
+import os
+import re
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Iterable, Iterator, Optional, Tuple
+
+DEFAULT_AUDIO_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'data', 'audio'))
+DEFAULT_CACHE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'data', 'audio_cache'))
+# ディスクキャッシュの上限 (バイト)
+DEFAULT_CACHE_MAX_BYTES = 2 * 1024 ** 3
+DEFAULT_BUCKET = "audio"
+AUDIO_CONTENT_TYPE = "audio/wav"
+# ストリーミングで読み書きする単位 (バイト)。base64で端数が出ないよう3の倍数にする
+AUDIO_CHUNK_SIZE = 3 * 21846  # 約64KB
+
+_AUDIO_KEY_PATTERN = re.compile(r'^[0-9a-f]{2}/[0-9a-f]{64}\.wav$')
+
+
+def _key_from_digest(digest: str) -> str:
+    # 1つのディレクトリにファイルが集中しないよう、先頭2文字で分ける
+    return f"{digest[:2]}/{digest}.wav"
+
+
+def is_audio_key(key: str) -> bool:
+    """_key_from_digest が作る形のキーかどうか (クライアントから受け取ったキーを確かめる)"""
+    return bool(_AUDIO_KEY_PATTERN.match(key)) and key[:2] == key[3:5]
+
+
+def audio_key(data: bytes) -> str:
+    """音声データの内容から保存キーを作る (同じ音声は同じキーになる)"""
+    return _key_from_digest(hashlib.sha256(data).hexdigest())
+
+
+def iter_chunks(data: bytes, chunk_size: int = AUDIO_CHUNK_SIZE) -> Iterator[memoryview]:
+    """bytesをコピーせずにチャンクに分ける (memoryviewのスライス)"""
+    view = memoryview(data)
+    for start in range(0, len(view), chunk_size):
+        yield view[start:start + chunk_size]
+
+
+def _spool(chunks: Iterable[bytes], directory: str) -> Tuple[str, str, int]:
+    """
+    チャンクを一時ファイルに書きながらsha256を計算する。(一時ファイルのパス, キー, サイズ) を返す。
+    途中で例外が起きた場合は一時ファイルを消す
+    """
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for chunk in chunks:
+                digest.update(chunk)
+                f.write(chunk)
+                size += len(chunk)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return tmp_path, _key_from_digest(digest.hexdigest()), size
+
+
+def encode_base64_file(path: str, chunk_size: int = AUDIO_CHUNK_SIZE) -> str:
+    """
+    ファイルを少しずつ読んでbase64文字列にする (ファイル全体のbytesとbase64文字列を同時に持たない)
+    """
+    if chunk_size % 3:
+        raise ValueError("chunk_size must be a multiple of 3")
+    parts = []
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            parts.append(base64.b64encode(chunk).decode('ascii'))
+    return "".join(parts)
+
+
+class AudioStore(abc.ABC):
+    """
+    音声データの保存先の共通インターフェース (put_file / get / delete / local_path を実装する)
+    """
+    def put(self, data: bytes) -> str:
+        """音声を保存してキーを返す"""
+        return self.put_stream(iter_chunks(data))
+
+    def put_stream(self, chunks: Iterable[bytes]) -> str:
+        """チャンクの列として渡された音声を保存してキーを返す。一時ファイルを経由するのでメモリはチャンク分しか使わない"""
+        tmp_path, key, _ = _spool(chunks, tempfile.gettempdir())
+        try:
+            self.put_file(tmp_path, key)
+        finally:
+            os.remove(tmp_path)
+        return key
+
+    @abc.abstractmethod
+    def put_file(self, path: str, key: str) -> None:
+        """ローカルファイルの内容をキーで保存する (キーは内容から計算済み)"""
+
+    @abc.abstractmethod
+    def get(self, key: str) -> Optional[bytes]:
+        """キーに対応する音声を返す。存在しなければNone"""
+
+    @abc.abstractmethod
+    def delete(self, key: str) -> None:
+        """キーに対応する音声を削除する"""
+
+    @abc.abstractmethod
+    def local_path(self, key: str) -> Optional[str]:
+        """キーに対応する音声のローカルファイルのパスを返す (配信用)。存在しなければNone"""
+
+
+def _write_atomically(path: str, data: bytes) -> None:
+    """書きかけのファイルが読まれないよう、一時ファイルに書いてから置き換える"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def _read_chunks(path: str, chunk_size: int = AUDIO_CHUNK_SIZE) -> Iterator[bytes]:
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+
+def _safe_join(directory: str, key: str) -> str:
+    path = os.path.abspath(os.path.join(directory, key))
+    if not path.startswith(directory + os.sep):
+        raise ValueError(f"Invalid audio key: {key}")
+    return path
+
+
+class LocalAudioStore(AudioStore):
+    """
+    ローカルのファイルシステムに保存する実装
+    """
+    def __init__(self, directory: str = DEFAULT_AUDIO_DIR):
+        self.directory = os.path.abspath(directory)
+        os.makedirs(self.directory, exist_ok=True)
+
+    def path(self, key: str) -> str:
+        return _safe_join(self.directory, key)
+
+    def put_stream(self, chunks: Iterable[bytes]) -> str:
+        # 同じファイルシステム上の一時ファイルに書き、完成してから置き換える
+        tmp_path, key, _ = _spool(chunks, self.directory)
+        self._commit(tmp_path, self.path(key))
+        return key
+
+    def put_file(self, path: str, key: str) -> None:
+        tmp_path, _, _ = _spool(_read_chunks(path), self.directory)
+        self._commit(tmp_path, self.path(key))
+
+    @staticmethod
+    def _commit(tmp_path: str, path: str) -> None:
+        if os.path.exists(path):
+            os.remove(tmp_path)
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(tmp_path, path)
+
+    def get(self, key: str) -> Optional[bytes]:
+        try:
+            with open(self.path(key), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def delete(self, key: str) -> None:
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    def local_path(self, key: str) -> Optional[str]:
+        path = self.path(key)
+        return path if os.path.exists(path) else None
+
+
+class CachedAudioStore(AudioStore):
+    """
+    リモートの音声ストアの手前に置くLRUのディスクキャッシュ。
+    配信時はローカルファイルを返し、合計サイズが上限を超えたら最も長く使われていないファイルから削除する
+    """
+    def __init__(self, remote: AudioStore, directory: str = DEFAULT_CACHE_DIR, max_bytes: int = DEFAULT_CACHE_MAX_BYTES):
+        self.remote = remote
+        self.directory = os.path.abspath(directory)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._sizes: "OrderedDict[str, int]" = OrderedDict()
+        self._total_bytes = 0
+        os.makedirs(self.directory, exist_ok=True)
+        # 再起動後も既存のキャッシュを使う (最終アクセスの古い順に並べる)
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith(".wav"):
+                    stat = os.stat(os.path.join(root, name))
+                    entries.append((stat.st_atime, os.path.relpath(os.path.join(root, name), self.directory), stat.st_size))
+        for _, key, size in sorted(entries):
+            self._sizes[key.replace(os.sep, "/")] = size
+            self._total_bytes += size
+        self._evict()
+
+    def _evict(self) -> None:
+        while self._total_bytes > self.max_bytes and len(self._sizes) > 1:
+            key, size = self._sizes.popitem(last=False)
+            self._total_bytes -= size
+            try:
+                os.remove(_safe_join(self.directory, key))
+            except FileNotFoundError:
+                pass
+
+    def _remember(self, key: str, data: bytes) -> str:
+        path = _safe_join(self.directory, key)
+        _write_atomically(path, data)
+        return self._track(key, path, len(data))
+
+    def _track(self, key: str, path: str, size: int) -> str:
+        with self._lock:
+            if key not in self._sizes:
+                self._sizes[key] = size
+                self._total_bytes += size
+            self._evict()
+        return path
+
+    def put_stream(self, chunks: Iterable[bytes]) -> str:
+        # キャッシュのディレクトリに書いてからリモートへアップロードし、そのままキャッシュのファイルにする
+        # (生成直後の音声はすぐに再生されることが多い)
+        tmp_path, key, size = _spool(chunks, self.directory)
+        try:
+            self.remote.put_file(tmp_path, key)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        path = _safe_join(self.directory, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(tmp_path, path)
+        self._track(key, path, size)
+        return key
+
+    def put_file(self, path: str, key: str) -> None:
+        self.put_stream(_read_chunks(path))
+
+    def get(self, key: str) -> Optional[bytes]:
+        path = self.local_path(key)
+        if path is None:
+            return None
+        with open(path, "rb") as f:
+            return f.read()
+
+    def delete(self, key: str) -> None:
+        self.remote.delete(key)
+        with self._lock:
+            size = self._sizes.pop(key, None)
+            if size is not None:
+                self._total_bytes -= size
+        try:
+            os.remove(_safe_join(self.directory, key))
+        except FileNotFoundError:
+            pass
+
+    def local_path(self, key: str) -> Optional[str]:
+        path = _safe_join(self.directory, key)
+        with self._lock:
+            if key in self._sizes and os.path.exists(path):
+                self._sizes.move_to_end(key)
+                return path
+        # キャッシュにない場合だけリモートから取得する
+        data = self.remote.get(key)
+        if data is None:
+            return None
+        return self._remember(key, data)
+
+
+class S3AudioStore(AudioStore):
+    """
+    S3互換のオブジェクトストレージ (MinIOなど) に保存する実装
+    """
+    def __init__(self, bucket: str, endpoint_url: Optional[str] = None):
+        import boto3  # S3互換ストレージを使う場合のみ必要
+        from botocore.exceptions import ClientError
+        self.bucket = bucket
+        self.client = boto3.client("s3", endpoint_url=endpoint_url)
+        self._client_error = ClientError
+
+    def put_file(self, path: str, key: str) -> None:
+        # upload_file はファイルを少しずつ読んで送る (大きければマルチパート)
+        self.client.upload_file(path, self.bucket, key, ExtraArgs={"ContentType": AUDIO_CONTENT_TYPE})
+
+    def get(self, key: str) -> Optional[bytes]:
+        try:
+            return self.client.get_object(Bucket=self.bucket, Key=key)["Body"].read()
+        except self._client_error as e:
+            if e.response.get("Error", {}).get("Code") in ("NoSuchKey", "404"):
+                return None
+            raise
+
+    def delete(self, key: str) -> None:
+        self.client.delete_object(Bucket=self.bucket, Key=key)
+
+    def local_path(self, key: str) -> Optional[str]:
+        # ローカルのファイルはない (配信には CachedAudioStore で包んで使う)
+        return None
+
+
+class SupabaseAudioStore(AudioStore):
+    """
+    Supabase Storageのバケットに保存する実装
+    """
+    def __init__(self, supabase, bucket: str = DEFAULT_BUCKET):
+        self.bucket = supabase.storage.from_(bucket)
+
+    def put_file(self, path: str, key: str) -> None:
+        # パスを渡すとファイルから読みながら送る。同じキーは同じ内容なので、既にあれば上書きしてよい
+        self.bucket.upload(key, path, {"content-type": AUDIO_CONTENT_TYPE, "upsert": "true"})
+
+    def get(self, key: str) -> Optional[bytes]:
+        try:
+            return self.bucket.download(key)
+        except Exception as e:
+            if "not found" in str(e).lower() or "404" in str(e):
+                return None
+            raise
+
+    def delete(self, key: str) -> None:
+        self.bucket.remove([key])
+
+    def local_path(self, key: str) -> Optional[str]:
+        # ローカルのファイルはない (配信には CachedAudioStore で包んで使う)
+        return None
+
+
+_default_store: Optional[AudioStore] = None
+_default_store_lock = threading.Lock()
+
+
+def get_audio_store() -> AudioStore:
+    """プロセス共通の音声ストアを返す (AUDIO_STOREで実装を選ぶ)"""
+    global _default_store
+    with _default_store_lock:
+        if _default_store is None:
+            backend = os.environ.get("AUDIO_STORE", "local")
+            bucket = os.environ.get("AUDIO_STORE_BUCKET", DEFAULT_BUCKET)
+            if backend in ("s3", "supabase"):
+                if backend == "s3":
+                    remote: AudioStore = S3AudioStore(bucket, os.environ.get("AUDIO_STORE_ENDPOINT"))
+                else:
+                    from supabase import create_client
+                    remote = SupabaseAudioStore(create_client(os.environ["SUPABASE_URL"], os.environ["SUPABASE_KEY"]), bucket)
+                _default_store = CachedAudioStore(
+                    remote,
+                    os.environ.get("AUDIO_CACHE_DIR", DEFAULT_CACHE_DIR),
+                    int(os.environ.get("AUDIO_CACHE_MAX_BYTES", DEFAULT_CACHE_MAX_BYTES)),
+                )
+            else:
+                _default_store = LocalAudioStore(os.environ.get("AUDIO_STORE_DIR", DEFAULT_AUDIO_DIR))
+        return _default_store
@@ -0,0 +1,213 @@
+"""
+backend/modules/BookmarkCache.py
+
+This module keeps each user's bookmarked paper ids as a set so feed responses can fill
+is_bookmarked without querying the bookmark table on every swipe.
+A user's set is loaded lazily on first use, then kept current write-through by the bookmark
+endpoints. The default backend is an in-process LRU bounded by user count (entries also
+expire after a TTL, which bounds staleness when several workers each hold their own copy).
+Setting BOOKMARK_CACHE_REDIS_URL switches to a Redis (or Redis-compatible) set per user that
+all workers share, so a write in one worker is immediately visible to the others.
+Both backends guard the lazy load the same way: writes bump a per-user generation, and a set
+loaded from the database is stored only if the generation did not change during the load
+(in Redis the check and the store run as one Lua script, so a toggle from another worker
+cannot be overwritten by stale membership).
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, Optional, Set
+
+# 保持するユーザー数の上限 (1ユーザーあたり数百件程度のpaper_idの集合)
+MAX_CACHED_USERS = 10000
+# 集合を読み込み直すまでの秒数
+CACHE_TTL_SECONDS = 300
+# Redisのキー。空集合も「読み込み済み」と区別できるよう、番兵の要素を1つ入れておく
+REDIS_KEY_PREFIX = "bookmarks:"
+# 読み込み中に書き込みがあったかを判定するための世代番号のキー
+REDIS_GENERATION_PREFIX = "bookmarks_gen:"
+_LOADED_SENTINEL = ""
+
+# 世代番号が読み込み前と同じ場合だけ、読み込んだ集合で置き換える
+# KEYS: [集合, 世代番号]  ARGV: [読み込み前の世代番号, TTL, 番兵, paper_id...]
+_STORE_IF_UNCHANGED = """
+if (redis.call('GET', KEYS[2]) or '0') ~= ARGV[1] then
+    return 0
+end
+redis.call('DEL', KEYS[1])
+for i = 3, #ARGV do
+    redis.call('SADD', KEYS[1], ARGV[i])
+end
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return 1
+"""
+# 世代番号を進め、読み込み済みの集合がある場合だけ追加・削除する (なければ次回の読み込みで反映される)
+# KEYS: [集合, 世代番号]  ARGV: ["add" か "remove", 世代番号のTTL, paper_id]
+_UPDATE_IF_LOADED = """
+redis.call('INCR', KEYS[2])
+redis.call('EXPIRE', KEYS[2], ARGV[2])
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    if ARGV[1] == 'add' then
+        redis.call('SADD', KEYS[1], ARGV[3])
+    else
+        redis.call('SREM', KEYS[1], ARGV[3])
+    end
+end
+return 1
+"""
+
+Loader = Callable[[], Iterable[Any]]
+
+
+class BookmarkCache:
+    """
+    ユーザーごとのブックマーク済みpaper_idの集合をプロセス内に保持するLRUキャッシュ
+    """
+    def __init__(self, max_users: int = MAX_CACHED_USERS, ttl: float = CACHE_TTL_SECONDS):
+        self.max_users = max_users
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._sets: "OrderedDict[int, Set[str]]" = OrderedDict()
+        self._loaded_at: Dict[int, float] = {}
+        # 読み込み中に書き込みがあったかを判定するための世代番号
+        self._generation: Dict[int, int] = {}
+
+    def _get_fresh(self, user_id: int) -> Optional[Set[str]]:
+        bookmarks = self._sets.get(user_id)
+        if bookmarks is None:
+            return None
+        if time.monotonic() - self._loaded_at[user_id] > self.ttl:
+            self._drop(user_id)
+            return None
+        self._sets.move_to_end(user_id)
+        return bookmarks
+
+    def _drop(self, user_id: int) -> None:
+        self._sets.pop(user_id, None)
+        self._loaded_at.pop(user_id, None)
+
+    def _bump(self, user_id: int) -> None:
+        self._generation[user_id] = self._generation.get(user_id, 0) + 1
+
+    def bookmarked_among(self, user_id: int, paper_ids: Iterable[Any], load: Loader) -> Set[str]:
+        """
+        paper_idsのうちブックマーク済みのものを返す。未読み込みのユーザーはload()でDBから読み込む
+        """
+        with self._lock:
+            bookmarks = self._get_fresh(user_id)
+            generation = self._generation.get(user_id, 0)
+        if bookmarks is None:
+            # DBの読み込みはロックの外で行う
+            bookmarks = {str(p) for p in load()}
+            with self._lock:
+                # 読み込み中にadd/removeがあった場合は古い可能性があるので保存しない
+                if self._generation.get(user_id, 0) == generation:
+                    self._sets[user_id] = bookmarks
+                    self._loaded_at[user_id] = time.monotonic()
+                    self._sets.move_to_end(user_id)
+                    while len(self._sets) > self.max_users:
+                        evicted, _ = self._sets.popitem(last=False)
+                        self._loaded_at.pop(evicted, None)
+                        self._generation.pop(evicted, None)
+        with self._lock:
+            return {str(p) for p in paper_ids if str(p) in bookmarks}
+
+    def add(self, user_id: int, paper_id: Any) -> None:
+        """ブックマーク追加後に呼ぶ (読み込み済みのユーザーのみ集合を更新する)"""
+        with self._lock:
+            self._bump(user_id)
+            bookmarks = self._sets.get(user_id)
+            if bookmarks is not None:
+                bookmarks.add(str(paper_id))
+
+    def remove(self, user_id: int, paper_id: Any) -> None:
+        """ブックマーク削除後に呼ぶ"""
+        with self._lock:
+            self._bump(user_id)
+            bookmarks = self._sets.get(user_id)
+            if bookmarks is not None:
+                bookmarks.discard(str(paper_id))
+
+    def invalidate(self, user_id: int) -> None:
+        with self._lock:
+            self._bump(user_id)
+            self._drop(user_id)
+
+
+class RedisBookmarkCache:
+    """
+    ユーザーごとの集合をRedisのSETとして保持するキャッシュ (全ワーカーで共有される)
+    """
+    def __init__(self, client: Any, ttl: float = CACHE_TTL_SECONDS):
+        self.client = client
+        self.ttl = int(ttl)
+        self._store_if_unchanged = client.register_script(_STORE_IF_UNCHANGED)
+        self._update_if_loaded = client.register_script(_UPDATE_IF_LOADED)
+
+    @staticmethod
+    def _key(user_id: int) -> str:
+        return f"{REDIS_KEY_PREFIX}{int(user_id)}"
+
+    @staticmethod
+    def _generation_key(user_id: int) -> str:
+        return f"{REDIS_GENERATION_PREFIX}{int(user_id)}"
+
+    def bookmarked_among(self, user_id: int, paper_ids: Iterable[Any], load: Loader) -> Set[str]:
+        key, generation_key = self._key(user_id), self._generation_key(user_id)
+        paper_ids = [str(p) for p in paper_ids]
+        if not self.client.exists(key):
+            generation = self.client.get(generation_key) or "0"
+            # DBの読み込みはスクリプトの外で行う
+            members = {str(p) for p in load()}
+            stored = self._store_if_unchanged(keys=[key, generation_key], args=[generation, self.ttl, _LOADED_SENTINEL, *members])
+            if not stored:
+                # 読み込み中に他のワーカーが書き込んだので保存しなかった。今回は読み込んだ集合で答える
+                return {p for p in paper_ids if p in members}
+        if not paper_ids:
+            return set()
+        flags = self.client.smismember(key, paper_ids)
+        return {p for p, flag in zip(paper_ids, flags) if flag}
+
+    def _update(self, user_id: int, action: str, paper_id: Any) -> None:
+        # 世代番号は読み込みにかかる時間より十分長く残す
+        self._update_if_loaded(keys=[self._key(user_id), self._generation_key(user_id)], args=[action, self.ttl * 2, str(paper_id)])
+
+    def add(self, user_id: int, paper_id: Any) -> None:
+        self._update(user_id, "add", paper_id)
+
+    def remove(self, user_id: int, paper_id: Any) -> None:
+        self._update(user_id, "remove", paper_id)
+
+    def invalidate(self, user_id: int) -> None:
+        pipe = self.client.pipeline()
+        pipe.incr(self._generation_key(user_id))
+        pipe.expire(self._generation_key(user_id), self.ttl * 2)
+        pipe.delete(self._key(user_id))
+        pipe.execute()
+
+
+def load_bookmark_ids(supabase: Any, user_id: int) -> Iterable[Any]:
+    """bookmarkテーブルからユーザーのブックマーク済みpaper_idを全て読む (キャッシュの読み込み用)"""
+    bookmark_res = supabase.table("bookmark").select("paper_id").eq("user_id", user_id).execute()
+    return [item['paper_id'] for item in bookmark_res.data or []]
+
+
+_default_cache: Optional[Any] = None
+_default_cache_lock = threading.Lock()
+
+
+def get_bookmark_cache():
+    """プロセス共通のブックマークキャッシュを返す。BOOKMARK_CACHE_REDIS_URLが設定されていればRedisを使う"""
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            redis_url = os.environ.get("BOOKMARK_CACHE_REDIS_URL")
+            if redis_url:
+                # redis は任意の依存 (requirements.txt には含めない)。BOOKMARK_CACHE_REDIS_URL を使う場合は pip install redis
+                import redis
+                _default_cache = RedisBookmarkCache(redis.Redis.from_url(redis_url, decode_responses=True))
+            else:
+                _default_cache = BookmarkCache()
+        return _default_cache
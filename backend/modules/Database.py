@@ -0,0 +1,585 @@
+"""
+backend/modules/Database.py
+
+This module selects the storage backend for the API and feed generation.
+get_client() returns either the Supabase client (default) or SQLiteClient, an embedded
+drop-in selected with DATABASE_BACKEND=sqlite. SQLiteClient implements the subset of the
+supabase-py query builder this project uses (select / insert / upsert / update / delete,
+the eq/in_/is_/not_/or_ filters, order / limit / range / single, one-level embedding such
+as paper_info(title)) and the database functions called through rpc(), on a WAL-mode
+database file with the same tables and indexes as db/migrations (db/sqlite_schema.sql).
+Each thread keeps its own connection, and sqlite3's statement cache reuses the prepared
+statements, so single-node deployments and offline benchmarks get sub-millisecond queries.
+"""
+
+import json
+import os
+import re
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from backend.modules.Metrics import InstrumentedClient
+
+DEFAULT_SQLITE_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'data', 'app.sqlite3'))
+SCHEMA_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'db', 'sqlite_schema.sql'))
+# 接続ごとにキャッシュするプリペアドステートメントの数
+STATEMENT_CACHE_SIZE = 512
+
+# 埋め込み select (例: bookmark の paper_info(title)) で使う外部キー: (テーブル, 参照先) -> (列, 参照先の列)
+RELATIONS: Dict[Tuple[str, str], Tuple[str, str]] = {
+    ("bookmark", "paper_info"): ("paper_id", "paper_id"),
+    ("feed", "paper_info"): ("paper_id", "paper_id"),
+    ("paper_asset", "paper_info"): ("paper_id", "paper_id"),
+}
+
+_OPERATORS = {"eq": "=", "neq": "!=", "gt": ">", "gte": ">=", "lt": "<", "lte": "<=", "like": "LIKE", "ilike": "LIKE"}
+_IDENTIFIER = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+
+class DatabaseError(Exception):
+    """
+    PostgRESTのエラーと同じくコード (23503: 外部キー違反, 23505: 一意制約違反, PGRST116: single()で行がない) を含む例外
+    """
+    def __init__(self, code: str, message: str):
+        super().__init__(f"{{'code': '{code}', 'message': '{message}'}}")
+        self.code = code
+        self.message = message
+
+
+def _translate_error(e: sqlite3.IntegrityError) -> DatabaseError:
+    message = str(e)
+    if "FOREIGN KEY" in message:
+        return DatabaseError("23503", message)
+    if "UNIQUE" in message or "PRIMARY KEY" in message:
+        return DatabaseError("23505", message)
+    return DatabaseError("23000", message)
+
+
+def _quote(identifier: str) -> str:
+    if not _IDENTIFIER.match(identifier):
+        raise DatabaseError("42703", f"invalid identifier: {identifier}")
+    return f'"{identifier}"'
+
+
+def _to_param(value: Any) -> Any:
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False)
+    return value
+
+
+def _split_top_level(text: str) -> List[str]:
+    """括弧と二重引用符の外側のカンマで分割する"""
+    parts, depth, quoted, current = [], 0, False, []
+    for char in text:
+        if char == '"':
+            quoted = not quoted
+        elif not quoted and char == '(':
+            depth += 1
+        elif not quoted and char == ')':
+            depth -= 1
+        if char == ',' and depth == 0 and not quoted:
+            parts.append("".join(current).strip())
+            current = []
+        else:
+            current.append(char)
+    if "".join(current).strip():
+        parts.append("".join(current).strip())
+    return parts
+
+
+class SQLiteResponse:
+    """supabase-pyのAPIResponseと同じく data を持つ応答"""
+    def __init__(self, data: Any, count: Optional[int] = None):
+        self.data = data
+        self.count = count
+
+
+class SQLiteQueryBuilder:
+    """
+    supabase.table(name) の代わりになるクエリビルダー
+    """
+    def __init__(self, client: "SQLiteClient", table: str):
+        self.client = client
+        self.table = table
+        self._mode = "select"
+        self._columns: List[str] = []
+        self._embeds: List[Tuple[str, List[str]]] = []
+        self._values: List[Dict[str, Any]] = []
+        self._on_conflict: Optional[str] = None
+        self._ignore_duplicates = False
+        self._where: List[str] = []
+        self._params: List[Any] = []
+        self._order: List[str] = []
+        self._limit: Optional[int] = None
+        self._offset: Optional[int] = None
+        self._single = False
+        self._maybe_single = False
+        self._negate_next = False
+        self._count: Optional[str] = None
+
+    # --- 操作 ---
+    def select(self, columns: str = "*", count: Optional[str] = None) -> "SQLiteQueryBuilder":
+        self._mode = "select"
+        self._count = count
+        for item in _split_top_level(columns):
+            match = re.match(r'^(\w+)\((.*)\)$', item)
+            if match:
+                self._embeds.append((match.group(1), [c.strip() for c in match.group(2).split(',') if c.strip()]))
+            else:
+                self._columns.append(item)
+        return self
+
+    def insert(self, values: Any) -> "SQLiteQueryBuilder":
+        self._mode = "insert"
+        self._values = values if isinstance(values, list) else [values]
+        return self
+
+    def upsert(self, values: Any, on_conflict: str = "", ignore_duplicates: bool = False, **_) -> "SQLiteQueryBuilder":
+        self.insert(values)
+        self._mode = "upsert"
+        self._on_conflict = on_conflict or None
+        self._ignore_duplicates = ignore_duplicates
+        return self
+
+    def update(self, values: Dict[str, Any]) -> "SQLiteQueryBuilder":
+        self._mode = "update"
+        self._values = [values]
+        return self
+
+    def delete(self) -> "SQLiteQueryBuilder":
+        self._mode = "delete"
+        return self
+
+    # --- 絞り込み ---
+    def _add(self, condition: str, params: Sequence[Any] = ()) -> "SQLiteQueryBuilder":
+        if self._negate_next:
+            condition = f"NOT ({condition})"
+            self._negate_next = False
+        self._where.append(condition)
+        self._params.extend(_to_param(p) for p in params)
+        return self
+
+    @property
+    def not_(self) -> "SQLiteQueryBuilder":
+        """次の絞り込みを否定する (postgrest-pyと同じくプロパティ)"""
+        self._negate_next = True
+        return self
+
+    def filter(self, column: str, operator: str, value: Any) -> "SQLiteQueryBuilder":
+        condition, params = _condition(column, operator, value)
+        return self._add(condition, params)
+
+    def eq(self, column: str, value: Any):
+        return self._add(f"{_quote(column)} = ?", [value])
+
+    def neq(self, column: str, value: Any):
+        return self._add(f"{_quote(column)} != ?", [value])
+
+    def gt(self, column: str, value: Any):
+        return self._add(f"{_quote(column)} > ?", [value])
+
+    def gte(self, column: str, value: Any):
+        return self._add(f"{_quote(column)} >= ?", [value])
+
+    def lt(self, column: str, value: Any):
+        return self._add(f"{_quote(column)} < ?", [value])
+
+    def lte(self, column: str, value: Any):
+        return self._add(f"{_quote(column)} <= ?", [value])
+
+    def like(self, column: str, pattern: str):
+        return self._add(f"{_quote(column)} LIKE ?", [pattern.replace("*", "%")])
+
+    def ilike(self, column: str, pattern: str):
+        return self._add(f"{_quote(column)} LIKE ? COLLATE NOCASE", [pattern.replace("*", "%")])
+
+    def in_(self, column: str, values: Iterable[Any]):
+        values = list(values)
+        if not values:
+            return self._add("0")
+        return self._add(f"{_quote(column)} IN ({', '.join('?' * len(values))})", values)
+
+    def is_(self, column: str, value: Any):
+        if value is None or value == "null":
+            return self._add(f"{_quote(column)} IS NULL")
+        return self._add(f"{_quote(column)} IS ?", [1 if value in (True, "true") else 0])
+
+    def or_(self, filters: str):
+        """PostgRESTの or フィルター (例: a.lt.1,and(a.eq.1,b.lt.2))"""
+        condition, params = _parse_logic("or", filters)
+        return self._add(condition, params)
+
+    # --- 並び順・件数 ---
+    def order(self, column: str, desc: bool = False, nullsfirst: bool = False, **_):
+        self._order.append(f"{_quote(column)} {'DESC' if desc else 'ASC'} NULLS {'FIRST' if nullsfirst else 'LAST'}")
+        return self
+
+    def limit(self, size: int):
+        self._limit = int(size)
+        return self
+
+    def range(self, start: int, end: int):
+        self._offset = int(start)
+        self._limit = int(end) - int(start) + 1
+        return self
+
+    def single(self):
+        self._single = True
+        return self
+
+    def maybe_single(self):
+        self._maybe_single = True
+        return self
+
+    # --- 実行 ---
+    def _where_clause(self) -> str:
+        return f" WHERE {' AND '.join(self._where)}" if self._where else ""
+
+    def execute(self) -> SQLiteResponse:
+        try:
+            rows = getattr(self, f"_execute_{self._mode}")()
+        except sqlite3.IntegrityError as e:
+            raise _translate_error(e) from e
+        if self._single or self._maybe_single:
+            if len(rows) != 1:
+                if self._maybe_single and not rows:
+                    return SQLiteResponse(None)
+                raise DatabaseError("PGRST116", f"The result contains {len(rows)} rows")
+            return SQLiteResponse(rows[0])
+        return SQLiteResponse(rows, len(rows) if self._count else None)
+
+    def _execute_select(self) -> List[Dict[str, Any]]:
+        columns = [c for c in self._columns if c != "*"]
+        # 埋め込みの結合に使う列は、指定されていなくても読む
+        join_columns = [RELATIONS[(self.table, embed)][0] for embed, _ in self._embeds]
+        if "*" in self._columns or not (columns or join_columns):
+            select_list = "*"
+        else:
+            select_list = ", ".join(_quote(c) for c in dict.fromkeys(columns + join_columns))
+        sql = f"SELECT {select_list} FROM {_quote(self.table)}{self._where_clause()}"
+        if self._order:
+            sql += f" ORDER BY {', '.join(self._order)}"
+        if self._limit is not None or self._offset is not None:
+            sql += f" LIMIT {self._limit if self._limit is not None else -1} OFFSET {self._offset or 0}"
+        rows = self.client.query(sql, self._params)
+        for embed, embed_columns in self._embeds:
+            column, foreign_column = RELATIONS[(self.table, embed)]
+            keys = list({row[column] for row in rows if row[column] is not None})
+            related: Dict[Any, Dict[str, Any]] = {}
+            if keys:
+                select_embed = ", ".join(_quote(c) for c in dict.fromkeys(embed_columns + [foreign_column]))
+                for item in self.client.query(
+                    f"SELECT {select_embed} FROM {_quote(embed)} WHERE {_quote(foreign_column)} IN ({', '.join('?' * len(keys))})", keys
+                ):
+                    related[item[foreign_column]] = {c: item[c] for c in embed_columns}
+            for row in rows:
+                row[embed] = related.get(row[column])
+        if join_columns and "*" not in self._columns:
+            rows = [{key: value for key, value in row.items() if key in columns or key in dict(self._embeds)} for row in rows]
+        return rows
+
+    def _conflict_columns(self) -> List[str]:
+        if self._on_conflict:
+            return [c.strip() for c in self._on_conflict.split(',')]
+        return self.client.primary_key(self.table)
+
+    def _execute_insert(self) -> List[Dict[str, Any]]:
+        results = []
+        with self.client.transaction() as conn:
+            for values in self._values:
+                columns = list(values)
+                sql = (f"INSERT INTO {_quote(self.table)} ({', '.join(_quote(c) for c in columns)}) "
+                       f"VALUES ({', '.join('?' * len(columns))})")
+                if self._mode == "upsert":
+                    conflict = self._conflict_columns()
+                    updates = [c for c in columns if c not in conflict]
+                    if self._ignore_duplicates or not updates:
+                        sql += f" ON CONFLICT ({', '.join(_quote(c) for c in conflict)}) DO NOTHING"
+                    else:
+                        sql += (f" ON CONFLICT ({', '.join(_quote(c) for c in conflict)}) DO UPDATE SET "
+                                + ", ".join(f"{_quote(c)} = excluded.{_quote(c)}" for c in updates))
+                results += _fetch_dicts(conn.execute(sql + " RETURNING *", [_to_param(values[c]) for c in columns]))
+        return results
+
+    _execute_upsert = _execute_insert
+
+    def _execute_update(self) -> List[Dict[str, Any]]:
+        values = self._values[0]
+        sql = (f"UPDATE {_quote(self.table)} SET {', '.join(f'{_quote(c)} = ?' for c in values)}"
+               f"{self._where_clause()} RETURNING *")
+        with self.client.transaction() as conn:
+            return _fetch_dicts(conn.execute(sql, [_to_param(v) for v in values.values()] + self._params))
+
+    def _execute_delete(self) -> List[Dict[str, Any]]:
+        with self.client.transaction() as conn:
+            return _fetch_dicts(conn.execute(f"DELETE FROM {_quote(self.table)}{self._where_clause()} RETURNING *", self._params))
+
+
+def _condition(column: str, operator: str, value: Any) -> Tuple[str, List[Any]]:
+    """PostgRESTの 列.演算子.値 の1つをSQLの条件にする"""
+    negate = operator.startswith("not.")
+    if negate:
+        operator = operator[4:]
+    if operator == "in":
+        values = value if isinstance(value, (list, tuple, set)) else [
+            v.strip('"') for v in _split_top_level(str(value).strip("()"))
+        ]
+        values = list(values)
+        condition, params = (f"{_quote(column)} IN ({', '.join('?' * len(values))})", values) if values else ("0", [])
+    elif operator == "is":
+        condition, params = (f"{_quote(column)} IS NULL", []) if value in (None, "null") else (f"{_quote(column)} IS ?", [1 if value in (True, "true") else 0])
+    elif operator in _OPERATORS:
+        if isinstance(value, str) and len(value) >= 2 and value[0] == value[-1] == '"':
+            value = value[1:-1]
+        if operator in ("like", "ilike"):
+            value = str(value).replace("*", "%")
+        condition, params = f"{_quote(column)} {_OPERATORS[operator]} ?", [value]
+        if operator == "ilike":
+            condition += " COLLATE NOCASE"
+    else:
+        raise DatabaseError("PGRST100", f"unsupported operator: {operator}")
+    return (f"NOT ({condition})" if negate else condition), params
+
+
+def _parse_logic(kind: str, filters: str) -> Tuple[str, List[Any]]:
+    conditions, params = [], []
+    for part in _split_top_level(filters):
+        match = re.match(r'^(not\.)?(and|or)\((.*)\)$', part)
+        if match:
+            condition, part_params = _parse_logic(match.group(2), match.group(3))
+            if match.group(1):
+                condition = f"NOT {condition}"
+        else:
+            column, rest = part.split(".", 1)
+            prefix = ""
+            if rest.startswith("not."):
+                prefix, rest = "not.", rest[4:]
+            operator, _, value = rest.partition(".")
+            condition, part_params = _condition(column, prefix + operator, value)
+        conditions.append(condition)
+        params += part_params
+    return "(" + f" {kind.upper()} ".join(conditions) + ")", params
+
+
+def _fetch_dicts(cursor: sqlite3.Cursor) -> List[Dict[str, Any]]:
+    names = [d[0] for d in cursor.description or []]
+    return [dict(zip(names, row)) for row in cursor.fetchall()]
+
+
+class _RpcCall:
+    def __init__(self, client: "SQLiteClient", name: str, params: Dict[str, Any]):
+        self.client = client
+        self.name = name
+        self.params = params
+
+    def execute(self) -> SQLiteResponse:
+        function = RPC_FUNCTIONS.get(self.name)
+        if function is None:
+            raise DatabaseError("PGRST202", f"Could not find the function {self.name}")
+        try:
+            with self.client.transaction() as conn:
+                return SQLiteResponse(function(conn, **self.params))
+        except sqlite3.IntegrityError as e:
+            raise _translate_error(e) from e
+
+
+class SQLiteClient:
+    """
+    Supabaseクライアントの代わりに使う組み込みSQLiteのクライアント
+    """
+    def __init__(self, path: str = DEFAULT_SQLITE_PATH):
+        self.path = path
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._local = threading.local()
+        self._primary_keys: Dict[str, List[str]] = {}
+        with open(SCHEMA_PATH, encoding='utf-8') as f:
+            self.connection().executescript(f.read())
+
+    def connection(self) -> sqlite3.Connection:
+        """スレッドごとの接続を返す (FastAPIの同期エンドポイントはスレッドプールで動くため)"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False, cached_statements=STATEMENT_CACHE_SIZE)
+            conn.execute("pragma journal_mode = wal")
+            conn.execute("pragma synchronous = normal")
+            conn.execute("pragma foreign_keys = on")
+            conn.execute("pragma busy_timeout = 5000")
+            self._local.conn = conn
+            self._local.depth = 0
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        """書き込みの途中で他の接続に割り込まれないよう BEGIN IMMEDIATE で囲む (入れ子は外側にまとめる)"""
+        conn = self.connection()
+        if self._local.depth:
+            self._local.depth += 1
+            try:
+                yield conn
+            finally:
+                self._local.depth -= 1
+            return
+        conn.execute("begin immediate")
+        self._local.depth = 1
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("rollback")
+            raise
+        else:
+            conn.execute("commit")
+        finally:
+            self._local.depth = 0
+
+    def query(self, sql: str, params: Sequence[Any] = ()) -> List[Dict[str, Any]]:
+        return _fetch_dicts(self.connection().execute(sql, list(params)))
+
+    def primary_key(self, table: str) -> List[str]:
+        if table not in self._primary_keys:
+            info = self.connection().execute(f"pragma table_info({_quote(table)})").fetchall()
+            self._primary_keys[table] = [row[1] for row in sorted(info, key=lambda r: r[5]) if row[5]]
+        return self._primary_keys[table]
+
+    def table(self, name: str) -> SQLiteQueryBuilder:
+        return SQLiteQueryBuilder(self, name)
+
+    def rpc(self, name: str, params: Optional[Dict[str, Any]] = None) -> _RpcCall:
+        return _RpcCall(self, name, params or {})
+
+
+# --- db/migrations のデータベース関数と同じ動作をするRPC ---
+
+def _rpc_upsert_papers(conn: sqlite3.Connection, papers: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    columns = ("paper_id", "arxiv_id", "arxiv_version", "title", "author", "published_date",
+               "arxiv_url", "arxiv_category", "abstract", "content_hash")
+    results = []
+    for paper in papers:
+        existing = conn.execute(
+            "select paper_id, arxiv_version, content_hash from paper_info where arxiv_id = ?", (paper.get("arxiv_id"),)
+        ).fetchone()
+        if existing is None:
+            conn.execute(
+                f"insert into paper_info ({', '.join(columns)}) values ({', '.join('?' * len(columns))})",
+                [paper.get(c) for c in columns],
+            )
+            results.append({"paper_id": paper.get("paper_id"), "arxiv_id": paper.get("arxiv_id"), "action": "inserted"})
+            continue
+        paper_id, arxiv_version, content_hash = existing
+        if content_hash == paper.get("content_hash") or (arxiv_version or 0) > (paper.get("arxiv_version") or 0):
+            continue
+        updated = [c for c in columns if c not in ("paper_id", "arxiv_id")]
+        conn.execute(
+            f"update paper_info set {', '.join(f'{c} = ?' for c in updated)} where paper_id = ?",
+            [paper.get(c) for c in updated] + [paper_id],
+        )
+        # 内容が変わった論文から作ったフィードと共有アセットは無効化する
+        conn.execute("delete from feed where paper_id = ?", (paper_id,))
+        conn.execute("delete from paper_asset where paper_id = ?", (paper_id,))
+        results.append({"paper_id": paper_id, "arxiv_id": paper.get("arxiv_id"), "action": "updated"})
+    return results
+
+
+def _rpc_dequeue_feed(conn: sqlite3.Connection, p_user_id: int, p_count: int) -> List[Dict[str, Any]]:
+    rows = _fetch_dicts(conn.execute(
+        "delete from feed where feed_id in (select feed_id from feed where user_id = ? order by feed_id limit ?) "
+        "returning feed_id, user_id, paper_id, gemini_abstract, voice_key",
+        (p_user_id, p_count),
+    ))
+    return sorted(rows, key=lambda row: row["feed_id"])
+
+
+def _rpc_toggle_bookmark(conn: sqlite3.Connection, p_user_id: int, p_paper_id: str) -> List[Dict[str, Any]]:
+    removed = conn.execute("delete from bookmark where user_id = ? and paper_id = ? returning 1", (p_user_id, p_paper_id)).fetchall()
+    if removed:
+        return [{"is_bookmarked": False}]
+    conn.execute("insert into bookmark (user_id, paper_id) values (?, ?) on conflict (user_id, paper_id) do nothing", (p_user_id, p_paper_id))
+    return [{"is_bookmarked": True}]
+
+
+def _rpc_claim_generation_jobs(conn: sqlite3.Connection, p_worker: str, p_limit: int, p_lease_seconds: int = 600, p_max_attempts: int = 3) -> List[Dict[str, Any]]:
+    # BEGIN IMMEDIATE の中で実行されるので、他のワーカーが同じジョブを取ることはない
+    rows = _fetch_dicts(conn.execute(
+        "update generation_job set status = 'running', worker = ?, attempts = attempts + 1, "
+        "started_at = strftime('%Y-%m-%dT%H:%M:%f+00:00', 'now') "
+        "where job_id in (select job_id from generation_job where attempts < ? and (status = 'queued' or "
+        "(status = 'running' and started_at < strftime('%Y-%m-%dT%H:%M:%f+00:00', 'now', ?))) "
+        "and (run_after is null or run_after <= strftime('%Y-%m-%dT%H:%M:%f+00:00', 'now')) order by job_id limit ?) "
+        "returning *",
+        (p_worker, p_max_attempts, f"{-int(p_lease_seconds)} seconds", p_limit),
+    ))
+    return sorted(rows, key=lambda row: row["job_id"])
+
+
+def _rpc_switch_feed_voice(conn: sqlite3.Connection, p_user_id: int, p_voice_type: int) -> List[Dict[str, Any]]:
+    user = conn.execute("select voice_type from user_info where user_id = ?", (p_user_id,)).fetchone()
+    if user is None:
+        return []
+    conn.execute("update user_info set voice_type = ? where user_id = ?", (p_voice_type, p_user_id))
+    moved = conn.execute(
+        "update feed set (voice_key, gemini_abstract) = (select a.voice_key, a.gemini_abstract from paper_asset a "
+        "where a.paper_id = feed.paper_id and a.voice_type = ?) "
+        "where user_id = ? and exists (select 1 from paper_asset a where a.paper_id = feed.paper_id and a.voice_type = ?) "
+        "returning (select a.is_variant from paper_asset a where a.paper_id = feed.paper_id and a.voice_type = ?)",
+        (p_voice_type, p_user_id, p_voice_type, p_voice_type),
+    ).fetchall()
+    removed = conn.execute(
+        "delete from feed where user_id = ? and not exists (select 1 from paper_asset a where a.paper_id = feed.paper_id and a.voice_type = ?)",
+        (p_user_id, p_voice_type),
+    ).rowcount
+    result = {"repointed": len(moved), "removed": removed, "variant_hits": sum(1 for (is_variant,) in moved if is_variant)}
+    conn.execute(
+        "insert into voice_switch (user_id, from_voice, to_voice, repointed, removed, variant_hits) values (?, ?, ?, ?, ?, ?)",
+        (p_user_id, user[0], p_voice_type, result["repointed"], result["removed"], result["variant_hits"]),
+    )
+    return [result]
+
+
+def _rpc_acquire_work_lease(conn: sqlite3.Connection, p_key: str, p_owner: str, p_lease_seconds: int = 120) -> bool:
+    acquired = conn.execute(
+        "insert into work_lease (lease_key, owner, expires_at) values (?, ?, strftime('%Y-%m-%dT%H:%M:%f+00:00', 'now', ?)) "
+        "on conflict (lease_key) do update set owner = excluded.owner, expires_at = excluded.expires_at "
+        "where work_lease.expires_at < strftime('%Y-%m-%dT%H:%M:%f+00:00', 'now') or work_lease.owner = excluded.owner "
+        "returning 1",
+        (p_key, p_owner, f"{int(p_lease_seconds)} seconds"),
+    ).fetchall()
+    return bool(acquired)
+
+
+def _rpc_release_work_lease(conn: sqlite3.Connection, p_key: str, p_owner: str) -> None:
+    conn.execute("delete from work_lease where lease_key = ? and owner = ?", (p_key, p_owner))
+
+
+RPC_FUNCTIONS: Dict[str, Callable[..., Any]] = {
+    "upsert_papers": _rpc_upsert_papers,
+    "dequeue_feed": _rpc_dequeue_feed,
+    "toggle_bookmark": _rpc_toggle_bookmark,
+    "claim_generation_jobs": _rpc_claim_generation_jobs,
+    "switch_feed_voice": _rpc_switch_feed_voice,
+    "acquire_work_lease": _rpc_acquire_work_lease,
+    "release_work_lease": _rpc_release_work_lease,
+}
+
+
+_default_client: Optional[Any] = None
+_default_client_lock = threading.Lock()
+
+
+def get_client() -> Any:
+    """
+    プロセス共通のデータベースクライアントを返す。
+    DATABASE_BACKEND=sqlite なら SQLiteClient (SQLITE_PATH)、それ以外は Supabase (SUPABASE_URL / SUPABASE_KEY)
+    """
+    global _default_client
+    with _default_client_lock:
+        if _default_client is None:
+            if os.environ.get("DATABASE_BACKEND", "supabase") == "sqlite":
+                client = SQLiteClient(os.environ.get("SQLITE_PATH", DEFAULT_SQLITE_PATH))
+            else:
+                from supabase import create_client
+                client = create_client(os.environ["SUPABASE_URL"], os.environ["SUPABASE_KEY"])
+            # 全てのクエリの往復時間をテーブル・操作ごとに記録する (/metrics の db_query_seconds)
+            _default_client = InstrumentedClient(client)
+        return _default_client
@@ -0,0 +1,176 @@
+"""
+backend/modules/FairScheduler.py
+
+This module decides which user's item gets the next generation slot (one Gemini summary
+plus VOICEVOX synthesis), so one user's 30-item backfill cannot hold every slot while a
+new user waits for their first item.
+FairQueue implements weighted fair queuing per user (self-clocked: each item gets a
+finish tag of max(virtual time, the user's last tag) + cost / weight, and the smallest tag
+is served first). On top of that, items are split into strict priority classes:
+- PRIORITY_EMPTY_FEED: the next items of a user whose feed is empty (they see nothing yet)
+- PRIORITY_HEAD: the next HEAD_ITEMS items of any user (what they will swipe to next)
+- PRIORITY_BACKFILL: the rest of the backfill
+FairScheduler hands out a fixed number of slots in that order, to threads (slot()) for the
+in-API generation and to coroutines (async_slot()) for GenerationWorker.
+See backend/benchmarks/bench_fair_scheduler.py for a simulated 1000-user comparison with FIFO.
+"""
+
+import asyncio
+import heapq
+import itertools
+import os
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from backend.modules.Metrics import histogram
+
+PRIORITY_EMPTY_FEED = 0
+PRIORITY_HEAD = 1
+PRIORITY_BACKFILL = 2
+PRIORITY_NAMES = {PRIORITY_EMPTY_FEED: "empty_feed", PRIORITY_HEAD: "head", PRIORITY_BACKFILL: "backfill"}
+# ユーザーが次に見る (先頭から数えて) 何件までを優先するか
+HEAD_ITEMS = 3
+# 同時に生成できるアイテム数の既定値 (GENERATION_SLOTSで変更できる)
+DEFAULT_GENERATION_SLOTS = 4
+
+SLOT_WAIT_SECONDS = histogram("generation_slot_wait_seconds", "Time an item waited for a generation slot.", ["priority"])
+
+
+def item_priority(position: int, empty_feed: bool = False) -> int:
+    """フィードの先頭からの位置と、ユーザーのフィードが空かどうかから優先度を決める"""
+    if position >= HEAD_ITEMS:
+        return PRIORITY_BACKFILL
+    return PRIORITY_EMPTY_FEED if empty_feed else PRIORITY_HEAD
+
+
+class FairQueue:
+    """
+    優先度クラスごとに、ユーザー単位の重み付き公平キュー (自己クロック型WFQ) を持つキュー
+    """
+    def __init__(self):
+        # (優先度, 終了タグ, 到着順, ユーザー, アイテム)
+        self._heap: list = []
+        self._seq = itertools.count()
+        # 優先度ごとの仮想時刻と、(優先度, ユーザー) ごとの最後の終了タグ・待っている件数
+        self._virtual_time: Dict[int, float] = {}
+        self._last_finish: Dict[Tuple[int, Any], float] = {}
+        self._pending: Dict[Tuple[int, Any], int] = {}
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def push(self, user_id: Any, item: Any, priority: int = PRIORITY_BACKFILL, weight: float = 1.0, cost: float = 1.0) -> None:
+        key = (priority, user_id)
+        start = max(self._virtual_time.get(priority, 0.0), self._last_finish.get(key, 0.0))
+        finish = start + cost / weight
+        self._last_finish[key] = finish
+        self._pending[key] = self._pending.get(key, 0) + 1
+        heapq.heappush(self._heap, (priority, finish, next(self._seq), user_id, item))
+
+    def pop(self) -> Tuple[Any, Any]:
+        """次に処理する (ユーザー, アイテム) を返す"""
+        priority, finish, _, user_id, item = heapq.heappop(self._heap)
+        self._virtual_time[priority] = max(self._virtual_time.get(priority, 0.0), finish)
+        key = (priority, user_id)
+        self._pending[key] -= 1
+        if not self._pending[key]:
+            # 待っているアイテムがなくなったユーザーの最後のタグは仮想時刻以下なので、次は仮想時刻から始まる。覚えておく必要はない
+            del self._pending[key]
+            del self._last_finish[key]
+        return user_id, item
+
+
+class _Waiter:
+    __slots__ = ("wake", "granted", "cancelled", "priority", "queued_at")
+
+    def __init__(self, wake: Callable[[], None], priority: int):
+        self.wake = wake
+        self.granted = False
+        self.cancelled = False
+        self.priority = priority
+        self.queued_at = time.perf_counter()
+
+
+class FairScheduler:
+    """
+    capacity 個の生成枠を FairQueue の順に割り当てる。スレッドからも、イベントループからも使える
+    """
+    def __init__(self, capacity: int = DEFAULT_GENERATION_SLOTS):
+        self.capacity = capacity
+        self._queue = FairQueue()
+        self._lock = threading.Lock()
+        self._running = 0
+
+    def _request(self, waiter: _Waiter, user_id: Any, weight: float) -> bool:
+        """空きがあればすぐに枠を取ってTrueを返す。なければ待ち行列に入れる"""
+        with self._lock:
+            if self._running < self.capacity and not len(self._queue):
+                self._running += 1
+                waiter.granted = True
+                return True
+            self._queue.push(user_id, waiter, waiter.priority, weight)
+            return False
+
+    def _release(self) -> None:
+        """枠を返す。待っている中で最も優先されるアイテムがあれば、枠をそのまま渡す"""
+        with self._lock:
+            while len(self._queue):
+                _, waiter = self._queue.pop()
+                if waiter.cancelled:
+                    continue
+                waiter.granted = True
+                SLOT_WAIT_SECONDS.observe(time.perf_counter() - waiter.queued_at, priority=PRIORITY_NAMES[waiter.priority])
+                waiter.wake()
+                return
+            self._running -= 1
+
+    @contextmanager
+    def slot(self, user_id: Any, position: int = 0, empty_feed: bool = False, weight: float = 1.0):
+        """生成枠を1つ取る (スレッド用)。取れるまでブロックする"""
+        event = threading.Event()
+        waiter = _Waiter(event.set, item_priority(position, empty_feed))
+        if not self._request(waiter, user_id, weight):
+            event.wait()
+        try:
+            yield
+        finally:
+            self._release()
+
+    @asynccontextmanager
+    async def async_slot(self, user_id: Any, position: int = 0, empty_feed: bool = False, weight: float = 1.0):
+        """生成枠を1つ取る (コルーチン用)。待っている間にキャンセルされた場合は枠を取らない"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def wake() -> None:
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+        waiter = _Waiter(wake, item_priority(position, empty_feed))
+        if not self._request(waiter, user_id, weight):
+            try:
+                await future
+            except asyncio.CancelledError:
+                with self._lock:
+                    granted = waiter.granted
+                    waiter.cancelled = not granted
+                if granted:
+                    self._release()
+                raise
+        try:
+            yield
+        finally:
+            self._release()
+
+
+_default_scheduler: Optional[FairScheduler] = None
+_default_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> FairScheduler:
+    """プロセス共通のスケジューラーを返す (枠の数は GENERATION_SLOTS)"""
+    global _default_scheduler
+    with _default_scheduler_lock:
+        if _default_scheduler is None:
+            _default_scheduler = FairScheduler(int(os.environ.get("GENERATION_SLOTS", DEFAULT_GENERATION_SLOTS)))
+        return _default_scheduler
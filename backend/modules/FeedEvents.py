@@ -0,0 +1,87 @@
+"""
+backend/modules/FeedEvents.py
+
+This module delivers newly stored feed items to streaming clients (SSE / WebSocket).
+FeedGenerator publishes an event right after each feed insert, and the API's streaming
+endpoints subscribe per user. Generation runs in worker threads while the endpoints run
+on the event loop, so events are handed over with call_soon_threadsafe.
+Events from other processes are not seen here; the endpoints cover that by re-reading
+the feed table (feed_id > last sent id) on every heartbeat.
+"""
+
+import asyncio
+import os
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from backend.modules.FeedModels import FeedCard, split_authors
+
+# 音声URLのベース (APIサーバーのアドレス)
+AUDIO_BASE_URL = os.environ.get("AUDIO_BASE_URL", "http://127.0.0.1:8000")
+# 購読者ごとのキューの上限。遅いクライアントのためにメモリが増え続けないようにする
+SUBSCRIBER_QUEUE_SIZE = 100
+
+
+def audio_url(feed_id: int, voice_key: Optional[str] = None) -> str:
+    """
+    音声配信URLを返す。音声キーが分かれば、feedの行が取り出された (削除された) 後も使えるキーのURLにする
+    """
+    if voice_key:
+        return f"{AUDIO_BASE_URL}/api/audio/by-key/{voice_key}"
+    return f"{AUDIO_BASE_URL}/api/audio/{feed_id}"
+
+
+def feed_item_event(feed_id: int, paper: Dict[str, Any], summary: Optional[str], is_bookmarked: bool = False,
+                    audio_base64: Optional[str] = None, voice_key: Optional[str] = None) -> FeedCard:
+    """
+    feedの1件と paper_info の行 (PAPER_CARD の列) を、クライアントへ送る形 (FeedItemと同じキー) に整形する。
+    音声は audio_url から取得する (audio_base64 は本文に音声を含める時だけ渡す)
+    """
+    return FeedCard(
+        feed_id, str(paper["paper_id"]), paper["title"], split_authors(paper.get("author")), summary or "",
+        audio_base64, audio_url(feed_id, voice_key), paper["arxiv_url"], is_bookmarked,
+    )
+
+
+class FeedEventBroker:
+    """
+    ユーザーごとの購読者キューにフィード生成イベントを配るクラス
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers: Dict[int, List[Tuple[asyncio.AbstractEventLoop, asyncio.Queue]]] = {}
+
+    def subscribe(self, user_id: int) -> asyncio.Queue:
+        """イベントループ上から呼び出し、イベントを受け取るキューを返す"""
+        queue: asyncio.Queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        with self._lock:
+            self._subscribers.setdefault(user_id, []).append((asyncio.get_running_loop(), queue))
+        return queue
+
+    def unsubscribe(self, user_id: int, queue: asyncio.Queue) -> None:
+        with self._lock:
+            subscribers = [s for s in self._subscribers.get(user_id, []) if s[1] is not queue]
+            if subscribers:
+                self._subscribers[user_id] = subscribers
+            else:
+                self._subscribers.pop(user_id, None)
+
+    @staticmethod
+    def _put(queue: asyncio.Queue, event: FeedCard) -> None:
+        # キューが一杯のクライアントにはイベントを捨てる (次のハートビートでDBから取り直される)
+        if not queue.full():
+            queue.put_nowait(event)
+
+    def publish(self, user_id: int, event: FeedCard) -> None:
+        """任意のスレッドから呼び出せる。購読者がいなければ何もしない"""
+        with self._lock:
+            subscribers = list(self._subscribers.get(user_id, []))
+        for loop, queue in subscribers:
+            try:
+                loop.call_soon_threadsafe(self._put, queue, event)
+            except RuntimeError:
+                # イベントループが既に閉じている
+                self.unsubscribe(user_id, queue)
+
+
+feed_event_broker = FeedEventBroker()
@@ -1,105 +1,449 @@
 
 
 import os
-import base64
+import time
+import threading
 from dotenv import load_dotenv
-from supabase import create_client, Client
+from typing import TYPE_CHECKING, Optional
 import sys
 
 # プロジェクトルートをパスに追加
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
 
 # 依存するモジュールをインポート (クラスを直接インポート)
-from backend.poc.arxiv.gemini_summarizer import PaperSummarizer
-from backend.poc.voicevox.VoicevoxEngine import VoicevoxClient
+from backend.modules.PaperSearchIndex import get_search_index
+from backend.modules.PaperRanker import get_ranker
+from backend.modules.PaperAnnIndex import get_ann_index
+from backend.modules.FeedEvents import feed_event_broker, feed_item_event
+from backend.modules.BookmarkCache import get_bookmark_cache, load_bookmark_ids
+from backend.modules.AudioStore import get_audio_store
+from backend.modules.Database import get_client
+from backend.modules.FairScheduler import get_scheduler
+from backend.modules.Metrics import GEMINI_TOKENS, STAGE_SECONDS, span
+from backend.modules.Resilience import CircuitOpenError
+from backend.modules.SingleFlight import asset_flight_key, get_single_flight, refill_flight_key, summary_flight_key
+from backend.modules.TextNormalizer import get_normalizer, normalize_for_speech
+from backend.modules.VoiceVariants import schedule_variants
+from backend.modules.Projections import (
+    PAPER_CARD, PAPER_ABSTRACT, PAPER_ASSET, PAPER_ASSET_SUMMARY, FEED_PAPER_IDS, USER_FEED_SETTINGS, fetch_by_ids,
+)
+
+if TYPE_CHECKING:
+    # 型注釈のためだけなので実行時には読み込まない (SQLiteで動かす場合はsupabaseを読み込まずに済む)
+    from supabase import Client
+    from backend.poc.arXiv.gemini_summarizer import PaperSummarizer
+    from backend.poc.voicevox.VoicevoxEngine import VoicevoxClient
 
 load_dotenv()
-SUPABASE_URL = os.environ.get("SUPABASE_URL")
-SUPABASE_KEY = os.environ.get("SUPABASE_KEY")
 
-def generate_and_store_feed_for_user(user_id: int, count: int = 30):
+# キーワード検索で取得する候補数 (要求件数の何倍か)。嗜好ランキングで並べ替えてから上位だけを処理する
+KEYWORD_CANDIDATE_FACTOR = 5
+# ブックマーク起点モードで種にする最新ブックマークの件数
+BOOKMARK_SEED_COUNT = 10
+
+FEED_MODE_DEFAULT = "default"
+FEED_MODE_BOOKMARKS = "bookmarks"
+
+# Gemini・VOICEVOXの回路が開いていた時に、生成できなかった分を再試行するまでの最短の秒数
+MIN_RETRY_SECONDS = 5.0
+# 要約の後、音声合成を終えて paper_asset に保存されるまで、他のプロセスに同じ論文の要約を待たせる秒数
+SUMMARY_HOLD_SECONDS = 30
+
+# 要約・音声合成のクライアント (初めてアセットを生成する時に作り、プロセス内で使い回す)
+_summarizer = None
+_voice_client = None
+_clients_lock = threading.Lock()
+
+def get_summarizer() -> "PaperSummarizer":
+    """プロセス共通の要約クライアントを返す (google.generativeai の読み込みと設定は初回だけ行う)"""
+    global _summarizer
+    with _clients_lock:
+        if _summarizer is None:
+            from backend.poc.arXiv.gemini_summarizer import PaperSummarizer
+            _summarizer = PaperSummarizer()
+        return _summarizer
+
+def get_voice_client() -> "VoicevoxClient":
+    """プロセス共通の音声合成クライアントを返す (requests もここで初めて読み込む)"""
+    global _voice_client
+    with _clients_lock:
+        if _voice_client is None:
+            from backend.poc.voicevox.VoicevoxEngine import VoicevoxClient
+            _voice_client = VoicevoxClient()
+            # 読み上げ辞書の読みをエンジンに登録し、置き換えたカタカナが1語として正しいアクセントで読まれるようにする
+            added = _voice_client.load_user_dictionary(get_normalizer().dictionary_words())
+            if added:
+                print(f"BACKGROUND: Registered {added} words in the VOICEVOX user dictionary")
+        return _voice_client
+
+# 共有アセット (paper_asset) の利用状況。事前生成のヒット率の報告に使う
+ASSET_STATS = {"hits": 0, "misses": 0}
+_asset_stats_lock = threading.Lock()
+
+def fetch_paper_assets(supabase: "Client", paper_ids: list, voice_type: int):
     """
-    ユーザー専用のフィードを生成し、データベースに保存するバックグラウンドタスク。
+    論文の共有アセットをまとめて取得する。
+    戻り値は (指定話者の要約＋音声, 話者を問わない要約) の2つの辞書 (キーはpaper_id)
+    """
+    if not paper_ids:
+        return {}, {}
+    asset_res = PAPER_ASSET.select(supabase).in_("paper_id", paper_ids).execute()
+    assets, summaries = {}, {}
+    for item in asset_res.data or []:
+        summaries[str(item['paper_id'])] = item['gemini_abstract']
+        if item['voice_type'] == voice_type:
+            assets[str(item['paper_id'])] = item
+    return assets, summaries
+
+def fetch_paper_asset(supabase: "Client", paper_id, voice_type: int):
+    """論文・話者の共有アセットを1件読む (なければNone)"""
+    asset_res = PAPER_ASSET.select(supabase).eq("paper_id", paper_id).eq("voice_type", voice_type).limit(1).execute()
+    return asset_res.data[0] if asset_res.data else None
+
+def fetch_summary(supabase: "Client", paper_id):
+    """論文の要約を話者を問わず1件読む (なければNone)"""
+    summary_res = PAPER_ASSET_SUMMARY.select(supabase).eq("paper_id", paper_id).limit(1).execute()
+    return summary_res.data[0]['gemini_abstract'] if summary_res.data else None
+
+def summarize_paper(supabase: "Client", paper: dict, summarizer):
+    """
+    論文を要約する。同じ論文・プロンプトの要約を同時に求める呼び出し (他のプロセスも含む) とはGeminiの呼び出しを1回にまとめる
+    """
+    paper_id = paper['paper_id']
+
+    def summarize():
+        with span("gemini_summarize", paper_id=paper_id):
+            summary = summarizer.summarize(paper['abstract'])
+        record_gemini_usage(getattr(summarizer, "last_usage", None))
+        return summary
+    return get_single_flight().do(
+        summary_flight_key(paper_id, getattr(summarizer, "system_prompt", "")), summarize,
+        lookup=lambda: fetch_summary(supabase, paper_id), hold_seconds=SUMMARY_HOLD_SECONDS,
+    )
+
+def release_summary_lease(paper_id, summarizer) -> None:
+    """要約の後に残したリースを外す (アセットを保存した後か、音声合成に失敗した後に呼ぶ)"""
+    get_single_flight().release(summary_flight_key(paper_id, getattr(summarizer, "system_prompt", "")))
+
+def create_paper_asset(supabase: "Client", paper: dict, voice_type: int, summarizer, voice_client, summary: str = None):
     """
-    print(f"BACKGROUND: Starting feed generation for user_id: {user_id}")
+    論文の要約と音声を生成して共有アセットとして保存する。失敗した場合はNoneを返す。
+    別の話者で要約済みの場合は summary を渡すとGeminiの呼び出しを省略できる
+    """
+    paper_id = paper['paper_id']
+    # 要約を生成
+    if not summary:
+        summary = summarize_paper(supabase, paper, summarizer)
+        if not summary or "要約の生成に失敗しました" in summary:
+            print(f"BACKGROUND: Failed to generate summary for paper_id: {paper_id}. Skipping.")
+            return None
+        try:
+            return _synthesize_and_save(supabase, paper_id, voice_type, summary, voice_client)
+        finally:
+            release_summary_lease(paper_id, summarizer)
+    return _synthesize_and_save(supabase, paper_id, voice_type, summary, voice_client)
+
+def _synthesize_and_save(supabase: "Client", paper_id, voice_type: int, summary: str, voice_client):
+    """要約を音声合成し、共有アセットとして保存する。失敗した場合はNoneを返す"""
+
+    # 音声合成の結果は受信しながら音声ストアへ書き込み、行にはキーだけを持たせる
+    # (WAV全体をメモリに載せないので、同時に生成してもメモリはチャンク分しか増えない)
     try:
-        supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
-
-        # ユーザーの音声設定を取得 (見つからない場合はデフォルト値3を使用)
-        user_info_res = supabase.table("user_info").select("voice_type").eq("user_id", user_id).single().execute()
-        voice_type = user_info_res.data.get('voice_type', 3) if user_info_res.data else 3
-        
-        # 1. このユーザーが既にフィード済みの論文IDリストを取得
-        existing_feed_papers_res = supabase.table("feed").select("paper_id").eq("user_id", user_id).execute()
-        existing_paper_ids = {item['paper_id'] for item in existing_feed_papers_res.data} if existing_feed_papers_res.data else set()
-        
-        # 2. 未読の論文をpaper_infoから取得
-        query = supabase.table("paper_info").select("*")
-        if existing_paper_ids:
-            query = query.not_("paper_id", "in", list(existing_paper_ids))
-        papers_to_process_res = query.limit(count).execute()
-        
-        papers_to_process = papers_to_process_res.data
-        
-        if not papers_to_process:
-            print(f"BACKGROUND: No new papers to process for user_id: {user_id}")
-            return
+        with span("voicevox_synthesize", paper_id=paper_id, voice_type=voice_type):
+            # 英語の用語・略語・数字は読みに直してから渡す (表示する要約はそのまま)
+            voice_key = get_audio_store().put_stream(voice_client.stream_voice(text=normalize_for_speech(summary), speaker=voice_type))
+    except CircuitOpenError:
+        # VOICEVOXが使えない間は呼び出し元で生成を打ち切り、後で再試行する
+        raise
+    except Exception as e:
+        print(f"BACKGROUND: Failed to synthesize voice for paper_id: {paper_id}. Skipping. Error: {e}")
+        return None
+    finally:
+        for stage, seconds in getattr(voice_client, "last_timings", {}).items():
+            STAGE_SECONDS.observe(seconds, stage=f"voicevox_{stage}")
+    asset = save_paper_asset(supabase, paper_id, voice_type, summary, voice_key)
+    # VOICE_VARIANTS=K なら人気の話者の音声も裏で作っておく (話者の切り替えが付け替えだけで済む)
+    schedule_variants(supabase, paper_id, summary, voice_type, voice_client)
+    return asset
+
+def get_or_create_paper_asset(supabase: "Client", user_id: int, position: int, paper: dict, voice_type: int, summary: str = None, empty_feed: bool = False):
+    """
+    論文・話者の共有アセットを作る。同じアセットを同時に作ろうとしている呼び出し (他のユーザー・他のプロセスも含む) があれば、
+    その結果を待って使う。生成枠は実際に作る時だけ取る (待っている間は枠を使わない)
+    """
+    def create():
+        with get_scheduler().slot(user_id, position, empty_feed=empty_feed):
+            return create_paper_asset(supabase, paper, voice_type, get_summarizer(), get_voice_client(), summary=summary)
+    return get_single_flight().do(
+        asset_flight_key(paper['paper_id'], voice_type), create,
+        lookup=lambda: fetch_paper_asset(supabase, paper['paper_id'], voice_type),
+    )
+
+def save_paper_asset(supabase: "Client", paper_id, voice_type: int, summary: str, voice_key: str) -> dict:
+    """生成した要約と音声のキーを共有アセットとして保存し、アセットの辞書を返す"""
+    asset = {
+        "paper_id": paper_id,
+        "voice_type": voice_type,
+        "gemini_abstract": summary,
+        "voice_key": voice_key
+    }
+    response = supabase.table("paper_asset").upsert(asset, on_conflict="paper_id,voice_type").execute()
+    if not response.data:
+        print(f"BACKGROUND: Failed to store asset for paper_id: {paper_id} (voice_type: {voice_type}).")
+    return asset
+
+def record_gemini_usage(usage) -> None:
+    """Geminiの応答のusage_metadataから、入力・出力のトークン数を記録する"""
+    if usage is None:
+        return
+    GEMINI_TOKENS.observe(getattr(usage, "prompt_token_count", 0) or 0, kind="prompt")
+    GEMINI_TOKENS.observe(getattr(usage, "candidates_token_count", 0) or 0, kind="candidates")
+
+def record_asset_usage(hits: int, misses: int) -> float:
+    """アセットのヒット・ミスを記録し、プロセス起動以降のヒット率を返す"""
+    with _asset_stats_lock:
+        ASSET_STATS["hits"] += hits
+        ASSET_STATS["misses"] += misses
+        total = ASSET_STATS["hits"] + ASSET_STATS["misses"]
+        return ASSET_STATS["hits"] / total if total else 0.0
+
+def select_papers_like_bookmarks(supabase: "Client", user_id: int, count: int, exclude_ids: set) -> list:
+    """
+    ユーザーの最新のブックマークを種に、ANNインデックスから似た論文のpaper_idを選ぶ。
+    各ブックマークの近傍を順番に1件ずつ取り出し、特定のブックマークに偏らないようにする
+    """
+    bookmark_res = supabase.table("bookmark").select("paper_id").eq("user_id", user_id).order("references_date", desc=True).limit(BOOKMARK_SEED_COUNT).execute()
+    seed_ids = [str(item['paper_id']) for item in bookmark_res.data or []]
+    if not seed_ids:
+        return []
 
-        # 新しいfeed_idを決定するため、現在の最大値を取得
-        max_feed_id_res = supabase.table("feed").select("feed_id").order("feed_id", desc=True).limit(1).single().execute()
-        next_feed_id = (max_feed_id_res.data['feed_id'] + 1) if max_feed_id_res.data else 1
+    index = get_ann_index()
+    excluded = {str(paper_id) for paper_id in exclude_ids} | set(seed_ids)
+    neighbor_lists = [[paper_id for paper_id, _ in index.similar(seed_id, count, exclude_ids=excluded)] for seed_id in seed_ids]
+    selected = []
+    for rank in range(count):
+        for neighbors in neighbor_lists:
+            if rank < len(neighbors) and neighbors[rank] not in selected:
+                selected.append(neighbors[rank])
+    return selected[:count]
 
-        # 各クラスのインスタンスを生成
-        summarizer = PaperSummarizer()
-        voice_client = VoicevoxClient()
+def plan_feed_generation(supabase: "Client", user_id: int, count: int, mode: str = FEED_MODE_DEFAULT):
+    """
+    フィードに追加する論文を選び、生成に必要なものをまとめて読む。
+    戻り値は {"voice_type", "papers", "assets", "summaries", "bookmarked_ids", "feed_size"} (追加する論文がなければNone)。
+    feed_size はユーザーのフィードに既にあるアイテム数で、生成枠の優先度 (FairScheduler) に使う
+    API内のバックグラウンド生成と GenerationWorker の両方が使う
+    """
+    # ユーザーの音声設定とキーワードを取得 (見つからない場合はデフォルト値3を使用)
+    user_info_res = USER_FEED_SETTINGS.select(supabase).eq("user_id", user_id).single().execute()
+    voice_type = user_info_res.data.get('voice_type', 3) if user_info_res.data else 3
+    keyword = (user_info_res.data.get('keyword') or "") if user_info_res.data else ""
+
+    # 1. このユーザーが既にフィード済みの論文IDリストを取得
+    existing_feed_papers_res = FEED_PAPER_IDS.select(supabase).eq("user_id", user_id).execute()
+    existing_paper_ids = {item['paper_id'] for item in existing_feed_papers_res.data} if existing_feed_papers_res.data else set()
+
+    # 2a. 候補論文を選ぶ。ブックマーク起点モードではブックマークの近傍を優先する。
+    #     キーワードがあればローカルの全文検索索引から候補を取り (arXiv APIは呼ばない)、嗜好ベクトルで並べ替える。足りない分は全論文から嗜好に近い順に選ぶ。
+    #     要約・音声合成という重い処理は、ここで上位になった論文だけに行う
+    with span("select_candidates"):
+        ranker = get_ranker()
+        selected_ids = []
+        if mode == FEED_MODE_BOOKMARKS:
+            selected_ids = select_papers_like_bookmarks(supabase, user_id, count, existing_paper_ids)
+            print(f"BACKGROUND: Found {len(selected_ids)} papers similar to bookmarks for user_id: {user_id}")
+        if keyword.strip() and len(selected_ids) < count:
+            matched_ids = get_search_index().search(keyword, limit=count * KEYWORD_CANDIDATE_FACTOR, exclude_ids=existing_paper_ids)
+            matched_ids = [paper_id for paper_id in ranker.rerank(user_id, matched_ids) if paper_id not in selected_ids]
+            selected_ids += matched_ids[:count - len(selected_ids)]
+            print(f"BACKGROUND: Keyword '{keyword}' matched {len(matched_ids)} papers for user_id: {user_id}")
+        if len(selected_ids) < count:
+            selected_ids += ranker.rank(user_id, count - len(selected_ids), exclude_ids=existing_paper_ids | set(selected_ids))
 
-        # 3. 論文ごとに処理
+        # 論文はカード表示用の列だけを読む。アブストラクトは要約の生成が必要な論文だけ後で読む
+        papers_to_process = []
+        if selected_ids:
+            selected_res = PAPER_CARD.select(supabase).in_("paper_id", selected_ids).execute()
+            order = {paper_id: i for i, paper_id in enumerate(selected_ids)}
+            papers_to_process = sorted(selected_res.data or [], key=lambda p: order.get(str(p['paper_id']), len(order)))
+
+        # 2b. それでも足りない分 (嗜好ベクトルがまだないユーザーなど) は未読の論文をpaper_infoから取得
+        if len(papers_to_process) < count:
+            excluded_ids = existing_paper_ids | {p['paper_id'] for p in papers_to_process}
+            query = PAPER_CARD.select(supabase)
+            if excluded_ids:
+                query = query.not_.in_("paper_id", list(excluded_ids))
+            papers_to_process_res = query.limit(count - len(papers_to_process)).execute()
+            papers_to_process += papers_to_process_res.data or []
+
+    if not papers_to_process:
+        return None
+
+    # 3. 共有アセットをまとめて取得 (事前生成・他ユーザー分の生成済みなら要約・音声合成を省略できる)
+    with span("fetch_assets"):
+        assets, summaries = fetch_paper_assets(supabase, [p['paper_id'] for p in papers_to_process], voice_type)
+        # 要約がどの話者でもまだない論文だけアブストラクトを読む
+        abstracts = fetch_by_ids(supabase, PAPER_ABSTRACT, [
+            p['paper_id'] for p in papers_to_process if str(p['paper_id']) not in assets and str(p['paper_id']) not in summaries
+        ])
         for paper in papers_to_process:
-            paper_id = paper['paper_id']
-            abstract = paper['abstract']
-            print(f"BACKGROUND: Processing paper_id: {paper_id} for user_id: {user_id}")
-            
-            # 3a. 要約を生成
-            summary = summarizer.summarize(abstract)
-            if not summary or "要約の生成に失敗しました" in summary:
-                print(f"BACKGROUND: Failed to generate summary for paper_id: {paper_id}. Skipping.")
-                continue
-            
-            # 3b. 音声合成を実行 (bytesで直接受け取る)
-            audio_data = voice_client.synthesize_voice(text=summary, speaker=voice_type)
-            if not audio_data:
-                print(f"BACKGROUND: Failed to synthesize voice for paper_id: {paper_id}. Skipping.")
-                continue
-
-            # 3c. 音声データをBase64にエンコード
-            encoded_audio = base64.b64encode(audio_data).decode('utf-8')
-            
-            # 3d. feedテーブルに保存
-            feed_data = {
-                "feed_id": next_feed_id,
-                "user_id": user_id,
-                "paper_id": paper_id,
-                "gemini_abstract": summary,
-                "voice": encoded_audio
-            }
-            response = supabase.table("feed").insert(feed_data).execute()
-            if response.data:
-                print(f"BACKGROUND: Successfully stored feed for paper_id: {paper_id} with new feed_id: {next_feed_id}")
-                next_feed_id += 1 # 次のfeed_idをインクリメント
-            else:
-                print(f"BACKGROUND: Failed to store feed for paper_id: {paper_id}. Error: {response.error}")
+            paper['abstract'] = abstracts.get(str(paper['paper_id']), {}).get('abstract')
+
+    # プッシュするアイテムのブックマーク状態 (キャッシュ済みならDBは読まない)
+    bookmarked_ids = get_bookmark_cache().bookmarked_among(
+        user_id, [p['paper_id'] for p in papers_to_process], lambda: load_bookmark_ids(supabase, user_id)
+    )
+    return {
+        "voice_type": voice_type,
+        "papers": papers_to_process,
+        "assets": assets,
+        "summaries": summaries,
+        "bookmarked_ids": bookmarked_ids,
+        "feed_size": len(existing_paper_ids),
+    }
+
+def store_feed_item(supabase: "Client", user_id: int, paper: dict, asset: dict, is_bookmarked: bool):
+    """
+    アセットを参照するfeedの行を保存し、ストリーミング接続中のクライアントへ通知する。保存したfeed_idを返す (失敗時はNone)
+    """
+    paper_id = paper['paper_id']
+    # feed_idはデータベースのシーケンスが払い出す (同時に生成しても衝突しない)
+    feed_data = {
+        "user_id": user_id,
+        "paper_id": paper_id,
+        "gemini_abstract": asset["gemini_abstract"],
+        "voice_key": asset["voice_key"]
+    }
+    # 同じユーザーの補充が同時に走って同じ論文を選んでいても、feedには1行しか入らない (feed(user_id, paper_id) は一意)
+    with span("feed_insert"):
+        response = supabase.table("feed").upsert(feed_data, on_conflict="user_id,paper_id", ignore_duplicates=True).execute()
+    if not response.data:
+        print(f"BACKGROUND: paper_id: {paper_id} is already in the feed of user_id: {user_id}. Skipping.")
+        return None
+    feed_id = response.data[0]['feed_id']
+    print(f"BACKGROUND: Successfully stored feed for paper_id: {paper_id} with new feed_id: {feed_id}")
+    # 同じプロセスのストリーミング接続へはすぐに通知する (別プロセスのAPIはハートビートの時にDBから拾う)
+    feed_event_broker.publish(user_id, feed_item_event(feed_id, paper, asset["gemini_abstract"], is_bookmarked, voice_key=asset["voice_key"]))
+    return feed_id
+
+def generate_and_store_feed_for_user(user_id: int, count: int = 30, mode: str = FEED_MODE_DEFAULT, lease_key: Optional[str] = None):
+    """
+    ユーザー専用のフィードを生成し、データベースに保存するバックグラウンドタスク。
+    mode="bookmarks" の場合は、ブックマークした論文に似た論文を優先して選ぶ。
+    lease_key を渡すと、1件ごとにそのwork_leaseを延ばす (補充が長引いても他のプロセスに同じ補充を始めさせない)
+    """
+    print(f"BACKGROUND: Starting feed generation for user_id: {user_id} (mode: {mode})")
+    started_at = time.perf_counter()
+    with span("feed_generation", user_id=user_id, count=count, mode=mode) as generation_span:
+        try:
+            supabase: Client = get_client()
+
+            # 1〜3. 論文の選択と、共有アセット・アブストラクト・ブックマーク状態の取得
+            plan = plan_feed_generation(supabase, user_id, count, mode)
+            if plan is None:
+                print(f"BACKGROUND: No new papers to process for user_id: {user_id}")
+                return
+            papers_to_process, assets, summaries = plan["papers"], plan["assets"], plan["summaries"]
 
+            # 要約・音声合成のクライアントはアセットが見つからなかった時だけ作る (get_summarizer / get_voice_client)
+            hits, misses = 0, 0
+            first_item_seconds = None
+            # Gemini・VOICEVOXの回路が開いていて生成しなかった件数・生成に失敗した件数と、再試行できるまでの秒数
+            deferred, failed, retry_after = 0, 0, MIN_RETRY_SECONDS
+
+            # 4. 論文ごとに処理
+            for position, paper in enumerate(papers_to_process, start=plan["feed_size"]):
+                paper_id = paper['paper_id']
+                print(f"BACKGROUND: Processing paper_id: {paper_id} for user_id: {user_id}")
+                if lease_key and not get_single_flight().renew(lease_key):
+                    print(f"BACKGROUND: Lost lease {lease_key} for user_id: {user_id}")
+
+                # 4a. 共有アセットを探し、なければ要約・音声合成を行う
+                #     生成枠はユーザー間で公平に、ユーザーが次に見るアイテムを優先して割り当てる (FairScheduler)
+                #     他のユーザーの生成が同じ論文を作っている最中なら、その結果を待って使う (SingleFlight)
+                asset = assets.get(str(paper_id))
+                if asset:
+                    hits += 1
+                else:
+                    misses += 1
+                    try:
+                        asset = get_or_create_paper_asset(
+                            supabase, user_id, position, paper, plan["voice_type"], summaries.get(str(paper_id)), empty_feed=plan["feed_size"] == 0,
+                        )
+                    except CircuitOpenError as e:
+                        # タイムアウトを待たずに次へ進み (共有アセットがある論文は保存できる)、この分は後で生成する
+                        deferred += 1
+                        retry_after = max(retry_after, e.retry_after)
+                        continue
+                    if not asset:
+                        failed += 1
+                        continue
+
+                # 4b. feedテーブルに保存
+                feed_id = store_feed_item(supabase, user_id, paper, asset, str(paper_id) in plan["bookmarked_ids"])
+                if feed_id is not None and first_item_seconds is None:
+                    first_item_seconds = time.perf_counter() - started_at
+
+            hit_rate = record_asset_usage(hits, misses)
+            first_item_text = f"{first_item_seconds:.2f}s" if first_item_seconds is not None else "n/a"
+            print(f"BACKGROUND: Asset hits {hits}/{hits + misses} for user_id: {user_id} (process hit rate {hit_rate:.1%}), time to first item: {first_item_text}")
+            generation_span.set(papers=len(papers_to_process), asset_hits=hits, asset_misses=misses, first_item_seconds=first_item_seconds, deferred=deferred)
+            if deferred:
+                # 回路が開いた場合は、それまでに失敗した分も同じ障害によるものとして生成し直す
+                reschedule_refill(user_id, deferred + failed, retry_after)
+
+        except Exception as e:
+            print(f"BACKGROUND ERROR: An unexpected error occurred during feed generation for user_id: {user_id}. Error: {e}")
+
+# ユーザーごとのまだ始まっていない補充の件数。同じユーザーの補充は1つずつ、まとめて行う
+_pending_refills = {}
+_pending_refills_lock = threading.Lock()
+
+def _drain_refills(user_id: int) -> None:
+    """溜まっている補充の件数をまとめて生成する (前の補充でfeedに入った論文は次の補充で選ばれない)"""
+    while True:
+        with _pending_refills_lock:
+            count = _pending_refills.pop(user_id, 0)
+        if not count:
+            return
+        generate_and_store_feed_for_user(user_id=user_id, count=count, lease_key=refill_flight_key(user_id))
+
+def refill_feed(user_id: int, count: int) -> None:
+    """
+    feedテーブルにcount件を補充する。同じユーザーの補充が実行中なら件数だけ足して、実行中の補充に任せる。
+    プロセスをまたいでも同じユーザーの補充は同時に走らない (work_lease)
+    """
+    with _pending_refills_lock:
+        _pending_refills[user_id] = _pending_refills.get(user_id, 0) + count
+    while True:
+        get_single_flight().do(refill_flight_key(user_id), lambda: _drain_refills(user_id))
+        with _pending_refills_lock:
+            # 実行中の補充が件数を取り出した後に足した分が残っていれば、改めて実行する
+            if not _pending_refills.get(user_id):
+                return
+
+def reschedule_refill(user_id: int, count: int, delay: float) -> None:
+    """依存先の障害で生成できなかった件数を、delay秒後に補充し直す"""
+    print(f"BACKGROUND: Dependency unavailable, rescheduling {count} items for user_id: {user_id} in {delay:.0f}s")
+    timer = threading.Timer(delay, add_papers_to_feed, args=(user_id, count))
+    timer.daemon = True
+    timer.start()
+
+def add_papers_to_feed(user_id: int, count: int):
+    """取り出された件数分の論文をまとめて生成し、feedテーブルに補充する"""
+    print(f"BACKGROUND: Adding {count} papers for user_id: {user_id}")
+    try:
+        refill_feed(user_id, count)
+        print(f"BACKGROUND: Successfully finished adding {count} papers for user_id: {user_id}")
     except Exception as e:
-        print(f"BACKGROUND ERROR: An unexpected error occurred during feed generation for user_id: {user_id}. Error: {e}")
+        print(f"BACKGROUND ERROR: Failed to add {count} papers for user_id: {user_id}. Error: {e}")
 
 def add_one_paper_to_feed(user_id: int):
     """論文を1件だけ生成し、feedテーブルに補充する"""
     print(f"BACKGROUND: Adding one paper for user_id: {user_id}")
     try:
-        # 既存のgenerate_and_store_feed_for_user関数をcount=1で呼び出す
-        generate_and_store_feed_for_user(user_id=user_id, count=1)
+        # 同時に呼ばれた分は1回の生成にまとめる (同じ「未読」の論文を重ねて選ばない)
+        refill_feed(user_id, 1)
         print(f"BACKGROUND: Successfully finished adding one paper for user_id: {user_id}")
     except Exception as e:
         print(f"BACKGROUND ERROR: Failed to add one paper for user_id: {user_id}. Error: {e}")
-
-
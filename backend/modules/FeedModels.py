@@ -0,0 +1,95 @@
+"""
+backend/modules/FeedModels.py
+
+Compact response types for the hot feed endpoints and a fast JSON encoder for them.
+FeedCard (built by FeedEvents.feed_item_event) and SimilarPaperCard are __slots__ dataclasses
+built once from trusted database rows. The endpoints encode them straight to bytes with
+json_response() instead of building Pydantic models and letting FastAPI re-validate them
+against response_model. The Pydantic models in api/api_fb.py are kept only to document the
+OpenAPI schema; returning a Response skips FastAPI's validation and serialization.
+The encoder is chosen on first use: msgspec if it is installed, then orjson, then the
+standard json module (compact, non-ASCII kept as UTF-8). All three produce the same keys.
+
+`python -m backend.benchmarks.bench_feed_serialization` compares them with the Pydantic path.
+"""
+
+import json
+import threading
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional
+
+from fastapi.responses import Response
+
+_encode: Optional[Callable[[Any], bytes]] = None
+_encode_lock = threading.Lock()
+
+
+@dataclass(slots=True)
+class FeedCard:
+    """フィードの1件 (APIの FeedItem と同じキー)。audio_base64 は音声を本文に含める時だけ入れる"""
+    feed_id: int
+    paper_id: str
+    title: str
+    authors: List[str]
+    summary: str
+    audio_base64: Optional[str]
+    audio_url: str
+    paper_url: str
+    is_bookmarked: bool
+
+
+@dataclass(slots=True)
+class SimilarPaperCard:
+    """似た論文の1件 (APIの SimilarPaperItem と同じキー)"""
+    paper_id: str
+    title: str
+    authors: List[str]
+    paper_url: str
+    score: float
+
+
+def split_authors(author: Optional[str]) -> List[str]:
+    """paper_info の author (カンマ区切り) を著者のリストにする"""
+    return [name.strip() for name in (author or "").split(',')]
+
+
+def _to_builtin(value: Any) -> Any:
+    # 標準のjsonモジュール用: __slots__ のデータクラスを辞書にする (asdict と違い中身を複製しない)
+    slots = getattr(type(value), "__slots__", None)
+    if slots is None:
+        raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+    return {name: getattr(value, name) for name in slots}
+
+
+def json_encoders() -> Dict[str, Callable[[Any], bytes]]:
+    """使えるJSONエンコーダー ({名前: 関数}) を速い順に返す (ベンチマークでも使う)"""
+    encoders: Dict[str, Callable[[Any], bytes]] = {}
+    try:
+        import msgspec  # 入っていれば使う (任意の依存)
+        encoders["msgspec"] = msgspec.json.Encoder().encode
+    except ImportError:
+        pass
+    try:
+        import orjson  # 入っていれば使う (任意の依存)
+        encoders["orjson"] = orjson.dumps
+    except ImportError:
+        pass
+    encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'), default=_to_builtin)
+    encoders["json"] = lambda value: encoder.encode(value).encode('utf-8')
+    return encoders
+
+
+def encode_json(value: Any) -> bytes:
+    """辞書・リスト・FeedCard などをJSONのbytesにする (エンコーダーは初めて使う時に選ぶ)"""
+    global _encode
+    if _encode is None:
+        with _encode_lock:
+            if _encode is None:
+                name, _encode = next(iter(json_encoders().items()))
+                print(f"API: Using {name} for JSON responses")
+    return _encode(value)
+
+
+def json_response(value: Any, status_code: int = 200, headers: Optional[Dict[str, str]] = None) -> Response:
+    """エンコード済みの本文を返すレスポンス (FastAPIの response_model の検証を通さない)"""
+    return Response(content=encode_json(value), status_code=status_code, media_type="application/json", headers=headers)
@@ -0,0 +1,440 @@
+"""
+backend/modules/GenerationWorker.py
+
+This module runs feed generation outside the API process.
+With GENERATION_QUEUE=1 the API only inserts a row into the generation_job table, and any
+number of worker processes claim jobs with claim_generation_jobs (for update skip locked),
+so workers can be started, stopped and scaled independently of the API, e.g.
+`python -m backend.modules.GenerationWorker --workers 4 --concurrency 8`.
+Inside a worker the pipeline is split by cost. IO stages (DB, Gemini, VOICEVOX) run as
+coroutines on an asyncio loop, calling the blocking clients in threads. CPU stages (cleaning
+the summary text for speech, concatenating the per-sentence WAVs and hashing them) run in a
+ProcessPoolExecutor, so they do not hold the GIL that the IO loop needs. The summary is
+synthesized one sentence at a time in parallel, and each WAV segment is received straight
+into a multiprocessing.shared_memory block whose name is handed to the CPU stage, so audio
+bytes are never pickled between processes.
+When Gemini or VOICEVOX is unavailable (an open circuit in backend/modules/Resilience.py), the
+job does not wait on timeouts item by item: the items it could not generate are requeued with
+run_after set, without counting as an attempt.
+"""
+
+import argparse
+import asyncio
+import itertools
+import multiprocessing
+import os
+import socket
+import struct
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from multiprocessing import shared_memory
+from typing import Any, Dict, List, Optional, Tuple
+
+# プロジェクトルートをパスに追加
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from backend.modules.AudioStore import get_audio_store, iter_chunks
+from backend.modules.Database import get_client
+from backend.modules.FairScheduler import FairScheduler
+from backend.modules.FeedGenerator import (
+    FEED_MODE_DEFAULT, MIN_RETRY_SECONDS, SUMMARY_HOLD_SECONDS, fetch_paper_asset, fetch_summary, get_summarizer, get_voice_client,
+    plan_feed_generation, record_asset_usage, record_gemini_usage, release_summary_lease, save_paper_asset, store_feed_item,
+)
+from backend.modules.Metrics import STAGE_SECONDS, span
+from backend.modules.Resilience import CircuitOpenError
+from backend.modules.SingleFlight import asset_flight_key, get_single_flight, summary_flight_key
+from backend.modules.TextNormalizer import get_normalizer
+from backend.modules.VoiceVariants import schedule_variants
+
+# 1回の音声合成リクエストにまとめる最大文字数 (短い文は次の文とまとめてリクエスト数を減らす)
+MAX_SEGMENT_CHARS = 120
+# 取り出したジョブが終わらないまま、この秒数が過ぎたら他のワーカーが取り直す
+JOB_LEASE_SECONDS = 600
+MAX_JOB_ATTEMPTS = 3
+# キューが空の時に次の取り出しを試すまでの間隔 (秒)
+DEFAULT_POLL_INTERVAL = 1.0
+
+
+def enqueue_generation(supabase: Any, user_id: int, count: int = 30, mode: str = FEED_MODE_DEFAULT) -> Optional[int]:
+    """フィード生成のジョブを追加し、job_idを返す (生成はGenerationWorkerが行う)"""
+    response = supabase.table("generation_job").insert({"user_id": user_id, "count": count, "mode": mode}).execute()
+    if not response.data:
+        print(f"API: Failed to enqueue feed generation for user_id: {user_id}")
+        return None
+    job_id = response.data[0]['job_id']
+    print(f"API: Enqueued feed generation job {job_id} for user_id: {user_id} (count: {count}, mode: {mode})")
+    return job_id
+
+
+# --- CPU段 (ProcessPoolExecutorの子プロセスで実行する。引数と戻り値は小さいものだけにする) ---
+
+def prepare_speech_text(summary: str, max_chars: int = MAX_SEGMENT_CHARS) -> List[str]:
+    """
+    要約から読み上げに不要な記号やURLを取り除き、用語・略語・数字を読みに直して (TextNormalizer)、
+    並列に合成できるよう文の単位に分ける
+    """
+    return get_normalizer().segments(summary, max_chars)
+
+
+def _wav_parts(wav: memoryview) -> Tuple[bytes, memoryview]:
+    """WAVを (fmtチャンクの中身, dataチャンクの中身) に分ける。dataはコピーせずにmemoryviewで返す"""
+    if bytes(wav[0:4]) != b"RIFF" or bytes(wav[8:12]) != b"WAVE":
+        raise ValueError("segment is not a WAV file")
+    offset, fmt = 12, None
+    while offset + 8 <= len(wav):
+        chunk_id = bytes(wav[offset:offset + 4])
+        (size,) = struct.unpack_from("<I", wav, offset + 4)
+        body = wav[offset + 8:offset + 8 + size]
+        if chunk_id == b"fmt ":
+            fmt = bytes(body)
+        elif chunk_id == b"data":
+            if fmt is None:
+                raise ValueError("WAV data chunk appears before fmt chunk")
+            return fmt, body
+        offset += 8 + size + (size & 1)
+    raise ValueError("WAV has no data chunk")
+
+
+def _store_concatenated(buffers: List[memoryview]) -> str:
+    parts = [_wav_parts(buffer) for buffer in buffers]
+    fmt = parts[0][0]
+    if any(part_fmt != fmt for part_fmt, _ in parts):
+        raise ValueError("WAV segments have different formats")
+    data_size = sum(len(data) for _, data in parts)
+    header = b"".join([
+        b"RIFF", struct.pack("<I", 4 + 8 + len(fmt) + 8 + data_size), b"WAVE",
+        b"fmt ", struct.pack("<I", len(fmt)), fmt,
+        b"data", struct.pack("<I", data_size),
+    ])
+
+    def chunks():
+        yield header
+        for _, data in parts:
+            yield from iter_chunks(data)
+    # ヘッダーを書き直して連結しながら、ハッシュを計算して音声ストアへ書き込む
+    return get_audio_store().put_stream(chunks())
+
+
+def _attach_shared_memory(name: str) -> shared_memory.SharedMemory:
+    """作成済みの共有メモリを開く。後始末は作成した側が行う"""
+    if sys.version_info >= (3, 13):
+        # このプロセスのresource_trackerには登録しない
+        return shared_memory.SharedMemory(name=name, track=False)
+    # 3.12以前は track がない。プールの子プロセスは作成した側とresource_trackerを共有しているので、
+    # 登録は重複するだけで、終了時に削除されることはない (unregister すると作成した側の登録まで消える)
+    return shared_memory.SharedMemory(name=name)
+
+
+def assemble_audio(segments: List[Tuple[str, int]]) -> str:
+    """
+    共有メモリ上のWAVの断片 (名前, サイズ) を1つのWAVに連結して音声ストアに保存し、キーを返す。
+    共有メモリの削除は作成した側 (ワーカーのイベントループ) が行う
+    """
+    blocks = [_attach_shared_memory(name) for name, _ in segments]
+    try:
+        # memoryviewを関数の中だけで使い、closeの前に全て解放されるようにする
+        return _store_concatenated([block.buf[:size] for block, (_, size) in zip(blocks, segments)])
+    finally:
+        for block in blocks:
+            block.close()
+
+
+# --- IO段 (スレッドで実行するブロッキング呼び出し) ---
+
+def _summarize(summarizer: Any, abstract: str) -> str:
+    # usage_metadataは呼び出したスレッドごとに保持されるので、同じスレッドで記録する
+    summary = summarizer.summarize(abstract)
+    record_gemini_usage(getattr(summarizer, "last_usage", None))
+    return summary
+
+
+def _receive_segment(voice_client: Any, text: str, speaker: int) -> Tuple[shared_memory.SharedMemory, int]:
+    """
+    1文を音声合成し、応答を受信しながら共有メモリに書き込む。(共有メモリ, WAVのサイズ) を返す。
+    共有メモリの大きさはWAVのヘッダー (RIFFチャンクのサイズ) から決める
+    """
+    chunks = voice_client.stream_voice(text=text, speaker=speaker)
+    head = b""
+    try:
+        while len(head) < 8:
+            head += next(chunks)
+    except StopIteration:
+        raise ValueError("VOICEVOX returned an empty response")
+    if head[:4] != b"RIFF":
+        raise ValueError("VOICEVOX response is not a WAV file")
+    (riff_size,) = struct.unpack_from("<I", head, 4)
+    block = shared_memory.SharedMemory(create=True, size=riff_size + 8)
+    size = 0
+    try:
+        for part in itertools.chain([head], chunks):
+            if size + len(part) > block.size:
+                raise ValueError("VOICEVOX response is longer than its WAV header")
+            block.buf[size:size + len(part)] = part
+            size += len(part)
+    except BaseException:
+        block.close()
+        block.unlink()
+        raise
+    finally:
+        for stage, seconds in getattr(voice_client, "last_timings", {}).items():
+            STAGE_SECONDS.observe(seconds, stage=f"voicevox_{stage}")
+    return block, size
+
+
+class GenerationWorker:
+    """
+    generation_job からジョブを取り出し、IO段をイベントループで、CPU段をプロセスプールで実行するワーカー
+    """
+    def __init__(self, name: str, cpu_pool: ProcessPoolExecutor, concurrency: int = 8, max_jobs: int = 32,
+                 poll_interval: float = DEFAULT_POLL_INTERVAL):
+        self.name = name
+        self.cpu_pool = cpu_pool
+        self.max_jobs = max_jobs
+        self.poll_interval = poll_interval
+        self.supabase = get_client()
+        # 同時に生成するアセット (要約＋音声合成) の枠。ジョブをまたいで、ユーザー間で公平に割り当てる
+        self.scheduler = FairScheduler(concurrency)
+        self.completed = 0
+
+    def claim_jobs(self, limit: int) -> List[Dict[str, Any]]:
+        response = self.supabase.rpc("claim_generation_jobs", {
+            "p_worker": self.name, "p_limit": limit,
+            "p_lease_seconds": JOB_LEASE_SECONDS, "p_max_attempts": MAX_JOB_ATTEMPTS,
+        }).execute()
+        return response.data or []
+
+    def defer_job(self, job: Dict[str, Any], remaining: int, retry_after: float, reason: str) -> None:
+        """
+        依存先の障害で生成できなかった remaining 件を、retry_after 秒後に再実行するようキューに戻す (試行回数には数えない)
+        """
+        now = datetime.now(timezone.utc)
+        self.supabase.table("generation_job").update({
+            "status": "queued", "count": remaining, "attempts": max(0, job.get("attempts", 1) - 1), "error": reason,
+            "run_after": (now + timedelta(seconds=retry_after)).isoformat(timespec="milliseconds"),
+            "finished_at": now.isoformat(timespec="milliseconds"),
+        }).eq("job_id", job["job_id"]).execute()
+
+    def finish_job(self, job: Dict[str, Any], error: Optional[str] = None) -> None:
+        """ジョブを完了にする。失敗した場合は試行回数が残っていればキューに戻す"""
+        if error is None:
+            update = {"status": "done", "error": None}
+        elif job.get("attempts", 0) < MAX_JOB_ATTEMPTS:
+            update = {"status": "queued", "error": error}
+        else:
+            update = {"status": "failed", "error": error}
+        update["finished_at"] = datetime.now(timezone.utc).isoformat(timespec="milliseconds")
+        self.supabase.table("generation_job").update(update).eq("job_id", job["job_id"]).execute()
+
+    async def run(self, once: bool = False) -> None:
+        """ジョブを取り出して実行し続ける。once=True ならキューが空になった時点で終了する"""
+        active: set = set()
+        print(f"WORKER: {self.name} started (max jobs: {self.max_jobs})")
+        while True:
+            jobs = []
+            if len(active) < self.max_jobs:
+                jobs = await asyncio.to_thread(self.claim_jobs, self.max_jobs - len(active))
+            for job in jobs:
+                task = asyncio.create_task(self.run_job(job))
+                active.add(task)
+                task.add_done_callback(active.discard)
+            if once and not jobs and not active:
+                break
+            if jobs:
+                continue
+            # 実行中のジョブが終われば空きができるので、待つのは次の完了かポーリング間隔まで
+            if active:
+                await asyncio.wait(active, timeout=self.poll_interval, return_when=asyncio.FIRST_COMPLETED)
+            else:
+                await asyncio.sleep(self.poll_interval)
+        print(f"WORKER: {self.name} finished {self.completed} jobs")
+
+    async def run_job(self, job: Dict[str, Any]) -> None:
+        user_id, count, mode = job["user_id"], job["count"], job["mode"]
+        print(f"WORKER: {self.name} running job {job['job_id']} for user_id: {user_id} (count: {count}, mode: {mode}, attempt: {job.get('attempts')})")
+        started_at = time.perf_counter()
+        error, deferral = None, None
+        with span("feed_generation", user_id=user_id, count=count, mode=mode, worker=self.name) as generation_span:
+            try:
+                plan = await asyncio.to_thread(plan_feed_generation, self.supabase, user_id, count, mode)
+                if plan is None:
+                    print(f"WORKER: No new papers to process for user_id: {user_id}")
+                else:
+                    hits, stored, first_item_seconds, deferral = await self.generate_items(user_id, plan, started_at)
+                    misses = len(plan["papers"]) - hits
+                    hit_rate = record_asset_usage(hits, misses)
+                    first_item_text = f"{first_item_seconds:.2f}s" if first_item_seconds is not None else "n/a"
+                    print(f"WORKER: Stored {stored}/{len(plan['papers'])} items for user_id: {user_id}, asset hits {hits} (process hit rate {hit_rate:.1%}), time to first item: {first_item_text}")
+                    generation_span.set(papers=len(plan["papers"]), asset_hits=hits, asset_misses=misses, first_item_seconds=first_item_seconds)
+            except Exception as e:
+                error = str(e) or type(e).__name__
+                print(f"WORKER ERROR: Feed generation failed for user_id: {user_id} (job {job['job_id']}). Error: {error}")
+        if deferral is not None:
+            # Gemini・VOICEVOXの回路が開いていた分は、タイムアウトを待たずに打ち切って後で生成し直す
+            remaining, e = deferral
+            retry_after = max(MIN_RETRY_SECONDS, e.retry_after)
+            print(f"WORKER: {e.name} unavailable, deferring {remaining} items of job {job['job_id']} by {retry_after:.0f}s")
+            await asyncio.to_thread(self.defer_job, job, remaining, retry_after, str(e))
+        else:
+            await asyncio.to_thread(self.finish_job, job, error)
+        self.completed += 1
+
+    async def generate_items(self, user_id: int, plan: Dict[str, Any], started_at: float):
+        """
+        アセットの生成は論文ごとに並行して進め、feedへの保存は選んだ順に行う (先頭が揃い次第すぐに保存する)。
+        戻り値は (アセットのヒット数, 保存した件数, 最初の1件までの秒数, 依存先の障害で生成しなかった分)。
+        最後の値は (件数, CircuitOpenError) か、なければNone
+        """
+        papers = plan["papers"]
+        hits = sum(1 for paper in papers if str(paper['paper_id']) in plan["assets"])
+        tasks = [
+            asyncio.create_task(self.get_or_create_asset(user_id, position, paper, plan))
+            for position, paper in enumerate(papers, start=plan["feed_size"])
+        ]
+        stored, first_item_seconds = 0, None
+        deferred, failed, circuit_error = 0, 0, None
+        try:
+            for paper, task in zip(papers, tasks):
+                try:
+                    asset = await task
+                except CircuitOpenError as e:
+                    deferred += 1
+                    circuit_error = e if circuit_error is None or e.retry_after > circuit_error.retry_after else circuit_error
+                    continue
+                if not asset:
+                    failed += 1
+                    continue
+                is_bookmarked = str(paper['paper_id']) in plan["bookmarked_ids"]
+                feed_id = await asyncio.to_thread(store_feed_item, self.supabase, user_id, paper, asset, is_bookmarked)
+                if feed_id is not None:
+                    stored += 1
+                    if first_item_seconds is None:
+                        first_item_seconds = time.perf_counter() - started_at
+        finally:
+            for task in tasks:
+                task.cancel()
+        # 回路が開いた場合は、それまでに失敗した分も同じ障害によるものとして生成し直す
+        return hits, stored, first_item_seconds, (deferred + failed, circuit_error) if deferred else None
+
+    async def get_or_create_asset(self, user_id: int, position: int, paper: Dict[str, Any], plan: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        asset = plan["assets"].get(str(paper['paper_id']))
+        if asset:
+            return asset
+        paper_id, voice_type = paper['paper_id'], plan["voice_type"]
+
+        # 枠はユーザーが次に見るアイテム (フィードが空のユーザーを最優先) から割り当てられる
+        # 同じアセットを他のジョブ・プロセスが作っている最中なら、枠を取らずにその結果を待つ
+        async def create() -> Optional[Dict[str, Any]]:
+            async with self.scheduler.async_slot(user_id, position, empty_feed=plan["feed_size"] == 0):
+                return await self.create_asset(paper, voice_type, plan["summaries"].get(str(paper_id)))
+        return await get_single_flight().do_async(
+            asset_flight_key(paper_id, voice_type), create, lookup=lambda: fetch_paper_asset(self.supabase, paper_id, voice_type),
+        )
+
+    async def create_asset(self, paper: Dict[str, Any], voice_type: int, summary: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """論文の要約と音声を生成して共有アセットとして保存する。失敗した場合はNoneを返す"""
+        paper_id = paper['paper_id']
+        # 1. 要約 (IO: Gemini)。別の話者で要約済みなら省略し、同じ論文の要約を求める他のジョブとは1回にまとめる
+        if not summary:
+            summarizer = await asyncio.to_thread(get_summarizer)
+
+            async def summarize() -> str:
+                with span("gemini_summarize", paper_id=paper_id):
+                    return await asyncio.to_thread(_summarize, summarizer, paper['abstract'])
+            summary = await get_single_flight().do_async(
+                summary_flight_key(paper_id, getattr(summarizer, "system_prompt", "")), summarize,
+                lookup=lambda: fetch_summary(self.supabase, paper_id), hold_seconds=SUMMARY_HOLD_SECONDS,
+            )
+            try:
+                return await self.synthesize_asset(paper_id, voice_type, summary)
+            finally:
+                await asyncio.to_thread(release_summary_lease, paper_id, summarizer)
+        return await self.synthesize_asset(paper_id, voice_type, summary)
+
+    async def synthesize_asset(self, paper_id: Any, voice_type: int, summary: str) -> Optional[Dict[str, Any]]:
+        """要約を読み上げ用に分割して音声合成し、共有アセットとして保存する。失敗した場合はNoneを返す"""
+        loop = asyncio.get_running_loop()
+        if not summary or "要約の生成に失敗しました" in summary:
+            print(f"WORKER: Failed to generate summary for paper_id: {paper_id}. Skipping.")
+            return None
+
+        # 2. 読み上げ用の整形と文への分割 (CPU)
+        with span("text_cleanup", paper_id=paper_id):
+            sentences = await loop.run_in_executor(self.cpu_pool, prepare_speech_text, summary)
+        if not sentences:
+            print(f"WORKER: Summary for paper_id: {paper_id} has nothing to read aloud. Skipping.")
+            return None
+
+        # 3. 文ごとに並行して音声合成し (IO: VOICEVOX)、共有メモリ上で連結・ハッシュ・保存する (CPU)
+        voice_client = await asyncio.to_thread(get_voice_client)
+        blocks: List[Tuple[shared_memory.SharedMemory, int]] = []
+        try:
+            with span("voicevox_synthesize", paper_id=paper_id, voice_type=voice_type, segments=len(sentences)):
+                results = await asyncio.gather(
+                    *(asyncio.to_thread(_receive_segment, voice_client, sentence, voice_type) for sentence in sentences),
+                    return_exceptions=True,
+                )
+            blocks = [result for result in results if not isinstance(result, BaseException)]
+            errors = [result for result in results if isinstance(result, BaseException)]
+            if errors:
+                raise errors[0]
+            with span("audio_assemble", paper_id=paper_id, segments=len(blocks)):
+                voice_key = await loop.run_in_executor(self.cpu_pool, assemble_audio, [(block.name, size) for block, size in blocks])
+        except CircuitOpenError:
+            raise
+        except Exception as e:
+            print(f"WORKER: Failed to synthesize voice for paper_id: {paper_id}. Skipping. Error: {e}")
+            return None
+        finally:
+            for block, _ in blocks:
+                block.close()
+                block.unlink()
+
+        # 4. 共有アセットとして保存し (IO: DB)、VOICE_VARIANTS=K なら人気の話者の音声も裏で作り始める
+        asset = await asyncio.to_thread(save_paper_asset, self.supabase, paper_id, voice_type, summary, voice_key)
+        schedule_variants(self.supabase, paper_id, summary, voice_type, voice_client, self.scheduler)
+        return asset
+
+
+def run_worker(index: int, concurrency: int, max_jobs: int, cpu_processes: int, once: bool, poll_interval: float) -> None:
+    """1つのワーカープロセスの本体。CPU段のプロセスプールとIO段のスレッドプールを作ってイベントループを回す"""
+    name = f"{socket.gethostname()}:{os.getpid()}:{index}"
+    # IOスレッドが動いている状態でforkしないよう、CPU段の子プロセスはforkserverから作る
+    with ProcessPoolExecutor(max_workers=cpu_processes, mp_context=multiprocessing.get_context("forkserver")) as cpu_pool:
+        async def main() -> None:
+            # ブロッキングなIO呼び出し (DB・Gemini・VOICEVOX) 用のスレッド。1つのアセットで文の数だけ同時に使う
+            asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=concurrency * 4, thread_name_prefix="worker-io"))
+            await GenerationWorker(name, cpu_pool, concurrency, max_jobs, poll_interval).run(once=once)
+        asyncio.run(main())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="generation_job のフィード生成ジョブを処理するワーカーを起動する")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 1) // 2), help="起動するワーカープロセスの数")
+    parser.add_argument("--concurrency", type=int, default=8, help="1ワーカーで同時に生成するアセットの数")
+    parser.add_argument("--jobs", type=int, default=32, help="1ワーカーで同時に実行するジョブの数 (生成の順番はFairSchedulerが決める)")
+    parser.add_argument("--cpu-processes", type=int, default=1, help="1ワーカーあたりのCPU段のプロセス数")
+    parser.add_argument("--poll-interval", type=float, default=DEFAULT_POLL_INTERVAL, help="キューが空の時の取り出し間隔 (秒)")
+    parser.add_argument("--once", action="store_true", help="キューが空になったら終了する")
+    args = parser.parse_args()
+
+    worker_args = (args.concurrency, args.jobs, args.cpu_processes, args.once, args.poll_interval)
+    if args.workers == 1:
+        run_worker(0, *worker_args)
+        return
+    processes = [multiprocessing.Process(target=run_worker, args=(i, *worker_args), daemon=False) for i in range(args.workers)]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        print("WORKER: Stopping workers...")
+        for process in processes:
+            process.terminate()
+            process.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+"""
+backend/modules/Metrics.py
+
+This module records per-stage timings on the feed hot paths and exports them in the
+Prometheus text format (served by the API at /metrics).
+Histograms are kept in-process with fixed buckets, so there is no extra dependency.
+span() times one stage: it observes the stage histogram and, when tracing is on
+(FEED_TRACE=1), also collects a span tree per feed generation that is printed as one JSON
+line when the root span ends. If OpenTelemetry is installed and OTEL_TRACES=1, the same
+spans are also started on the OpenTelemetry tracer.
+InstrumentedClient wraps a database client so every query is timed by table and operation.
+"""
+
+import contextvars
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+# 秒単位のバケット (DBの往復は数ms、Gemini・VOICEVOXは数秒)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+TOKEN_BUCKETS = (50, 100, 200, 400, 800, 1600, 3200, 6400)
+
+TRACE_ENABLED = os.environ.get("FEED_TRACE") == "1"
+
+
+class Histogram:
+    """
+    ラベルごとに累積バケット・合計・件数を持つヒストグラム
+    """
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        # ラベルの値の組 -> [各バケットの件数..., 合計, 件数]
+        self._series: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0.0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def expose(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted(self._series.items())
+        for key, series in items:
+            labels = ",".join(f'{name}="{value}"' for name, value in zip(self.labelnames, key))
+            prefix = f"{labels}," if labels else ""
+            for bound, count in zip(self.buckets, series):
+                lines.append(f'{self.name}_bucket{{{prefix}le="{bound}"}} {count:g}')
+            lines.append(f'{self.name}_bucket{{{prefix}le="+Inf"}} {series[-1]:g}')
+            suffix = f"{{{labels}}}" if labels else ""
+            lines.append(f"{self.name}_sum{suffix} {series[-2]:.6f}")
+            lines.append(f"{self.name}_count{suffix} {series[-1]:g}")
+        return lines
+
+
+_registry: List[Histogram] = []
+
+
+def histogram(name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+    """ヒストグラムを作成して /metrics の出力対象に登録する"""
+    metric = Histogram(name, documentation, labelnames, buckets)
+    _registry.append(metric)
+    return metric
+
+
+def render_metrics() -> str:
+    """登録された全てのヒストグラムをPrometheusのテキスト形式にする"""
+    return "\n".join(line for metric in _registry for line in metric.expose()) + "\n"
+
+
+STAGE_SECONDS = histogram("feed_stage_seconds", "Time spent in each feed pipeline stage.", ["stage"])
+DB_QUERY_SECONDS = histogram("db_query_seconds", "Database round trip time by table and operation.", ["table", "operation"])
+GEMINI_TOKENS = histogram("gemini_tokens", "Gemini tokens per summarization request.", ["kind"], TOKEN_BUCKETS)
+
+
+# --- スパン ---
+
+_current_span: contextvars.ContextVar = contextvars.ContextVar("current_span", default=None)
+_otel_tracer: Optional[Any] = None
+if os.environ.get("OTEL_TRACES") == "1":
+    try:
+        from opentelemetry import trace  # OpenTelemetryを使う場合のみ必要
+        _otel_tracer = trace.get_tracer("feed")
+    except ImportError:
+        print("METRICS: OTEL_TRACES=1 ですが opentelemetry がインストールされていません。")
+
+
+class Span:
+    def __init__(self, name: str, attributes: Dict[str, Any]):
+        self.name = name
+        self.attributes = attributes
+        self.start = time.perf_counter()
+        self.duration: Optional[float] = None
+        self.children: List["Span"] = []
+
+    def set(self, **attributes: Any) -> None:
+        self.attributes.update(attributes)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "ms": round((self.duration or 0.0) * 1000, 2),
+            **({"attributes": self.attributes} if self.attributes else {}),
+            **({"children": [child.to_dict() for child in self.children]} if self.children else {}),
+        }
+
+
+@contextmanager
+def span(stage: str, **attributes: Any) -> Iterator[Span]:
+    """
+    ステージの所要時間を計測する。feed_stage_seconds{stage=...} に記録し、トレースが有効なら親スパンの子として残す
+    """
+    parent = _current_span.get()
+    current = Span(stage, dict(attributes))
+    token = _current_span.set(current)
+    otel_context = _otel_tracer.start_as_current_span(stage, attributes=attributes) if _otel_tracer else None
+    if otel_context:
+        otel_context.__enter__()
+    try:
+        yield current
+    finally:
+        current.duration = time.perf_counter() - current.start
+        if otel_context:
+            otel_context.__exit__(None, None, None)
+        _current_span.reset(token)
+        STAGE_SECONDS.observe(current.duration, stage=stage)
+        if TRACE_ENABLED:
+            if parent is not None:
+                parent.children.append(current)
+            else:
+                print(f"TRACE: {json.dumps(current.to_dict(), ensure_ascii=False, default=str)}")
+
+
+# --- DBクライアントの計測 ---
+
+class _InstrumentedQuery:
+    """クエリビルダーをラップし、execute() の時間を記録する"""
+    def __init__(self, builder: Any, table: str, operation: str = "select"):
+        self._builder = builder
+        self._table = table
+        self._operation = operation
+
+    def __getattr__(self, name: str) -> Any:
+        attribute = getattr(self._builder, name)
+        if name == "not_":
+            return _InstrumentedQuery(attribute, self._table, self._operation)
+        if not callable(attribute):
+            return attribute
+
+        def call(*args: Any, **kwargs: Any) -> Any:
+            result = attribute(*args, **kwargs)
+            operation = name if name in ("select", "insert", "upsert", "update", "delete") else self._operation
+            return _InstrumentedQuery(result, self._table, operation) if result is not None else None
+        return call
+
+    def execute(self) -> Any:
+        start = time.perf_counter()
+        try:
+            return self._builder.execute()
+        finally:
+            DB_QUERY_SECONDS.observe(time.perf_counter() - start, table=self._table, operation=self._operation)
+
+
+class InstrumentedClient:
+    """
+    データベースクライアント (Supabase / SQLiteClient) をラップし、table() と rpc() のクエリを計測する
+    """
+    def __init__(self, client: Any):
+        self._client = client
+
+    def table(self, name: str) -> _InstrumentedQuery:
+        return _InstrumentedQuery(self._client.table(name), name)
+
+    def rpc(self, name: str, params: Optional[Dict[str, Any]] = None) -> _InstrumentedQuery:
+        return _InstrumentedQuery(self._client.rpc(name, params or {}), name, "rpc")
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._client, name)
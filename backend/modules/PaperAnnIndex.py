@@ -0,0 +1,216 @@
+"""
+backend/modules/PaperAnnIndex.py
+
+This module provides an approximate nearest-neighbor (IVF) index over the paper vectors
+stored by PaperRanker.EmbeddingStore, used for "more like this" lookups from bookmarks.
+Centroids are trained offline with spherical k-means and saved next to the vectors; each
+paper's list assignment is an int32 file that is memory-mapped at startup and appended to
+as new papers are ingested, so the index never needs a full rebuild to stay current.
+Several processes (API workers, GenerationWorker, the ingest job) open the same files, so
+appends to the assignment file are made under an exclusive flock, and each process re-reads
+the vector store and the assignment file before answering a lookup to see papers that were
+ingested elsewhere.
+"""
+
+import fcntl
+import os
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from backend.modules.PaperRanker import EmbeddingStore, get_ranker
+
+DEFAULT_NPROBE = 8
+KMEANS_ITERATIONS = 10
+KMEANS_SAMPLE_SIZE = 50000
+# 割り当て計算時に一度に扱う行数 (メモリ使用量を抑えるため)
+ASSIGN_CHUNK_SIZE = 20000
+
+
+def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """スコアの大きい順に上位k件の位置を返す"""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.zeros(0, dtype=np.int64)
+    top = np.argpartition(scores, len(scores) - k)[-k:]
+    return top[np.argsort(-scores[top])]
+
+
+class PaperAnnIndex:
+    """
+    転置ファイル (IVF) 方式の近似最近傍探索インデックス
+    """
+    def __init__(self, store: EmbeddingStore, directory: Optional[str] = None, nprobe: int = DEFAULT_NPROBE):
+        self.store = store
+        self.nprobe = nprobe
+        directory = directory or os.path.dirname(store.vectors_path)
+        self.centroids_path = os.path.join(directory, "ivf_centroids.npy")
+        self.assignments_path = os.path.join(directory, "ivf_assignments.i32")
+        self.lock_path = os.path.join(directory, "ivf_assignments.lock")
+        self._lock = threading.Lock()
+        self.centroids: Optional[np.ndarray] = None
+        self.assignments = np.zeros(0, dtype=np.int32)
+        self._order = np.zeros(0, dtype=np.int64)
+        self._offsets = np.zeros(1, dtype=np.int64)
+        if os.path.exists(self.centroids_path):
+            self.centroids = np.load(self.centroids_path, mmap_mode='r')
+            # 前回の起動後に追加された論文があれば割り当てを追記する
+            with self._lock, self._file_lock():
+                self._catch_up()
+
+    @property
+    def is_built(self) -> bool:
+        return self.centroids is not None
+
+    def _assign(self, vectors: np.ndarray) -> np.ndarray:
+        assignments = np.empty(len(vectors), dtype=np.int32)
+        for start in range(0, len(vectors), ASSIGN_CHUNK_SIZE):
+            chunk = np.asarray(vectors[start:start + ASSIGN_CHUNK_SIZE])
+            assignments[start:start + len(chunk)] = np.argmax(chunk @ self.centroids.T, axis=1)
+        return assignments
+
+    @contextmanager
+    def _file_lock(self):
+        """割り当てファイルを書き換える間、他のプロセスを待たせる"""
+        with open(self.lock_path, "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _assignment_count(self) -> int:
+        return os.path.getsize(self.assignments_path) // 4 if os.path.exists(self.assignments_path) else 0
+
+    def _catch_up(self) -> None:
+        """
+        割り当てファイルを読み直し、まだ割り当てのない論文の分だけ計算して追記する
+        (self._lock と _file_lock() を持った状態で呼ぶ)
+        """
+        self.store.refresh()
+        count = self._assignment_count()
+        if len(self.store) > count:
+            with open(self.assignments_path, "ab") as f:
+                f.write(self._assign(self.store.matrix[count:len(self.store)]).tobytes())
+            count = len(self.store)
+        # 他のプロセスが論文ベクトルより先に割り当てを書くことはないが、念のため読めている論文の分だけ使う
+        count = min(count, len(self.store))
+        if count != len(self.assignments):
+            self.assignments = np.memmap(self.assignments_path, dtype=np.int32, mode='r+', shape=(count,)) if count else np.zeros(0, dtype=np.int32)
+        self._rebuild_lists()
+
+    def refresh(self) -> None:
+        """他のプロセスが追加した論文・割り当てを読み込む (変わっていなければファイルの大きさを見るだけ)"""
+        self.store.refresh()
+        if not self.is_built:
+            return
+        if len(self.store) == len(self.assignments) and self._assignment_count() == len(self.assignments):
+            return
+        with self._lock, self._file_lock():
+            self._catch_up()
+
+    def _rebuild_lists(self) -> None:
+        """割り当てをリストごとに並べ替え、各リストの開始位置を求める"""
+        nlist = len(self.centroids)
+        self._order = np.argsort(self.assignments, kind='stable')
+        self._offsets = np.concatenate(([0], np.cumsum(np.bincount(self.assignments, minlength=nlist))))
+
+    def build(self, nlist: Optional[int] = None, seed: int = 0) -> None:
+        """
+        全論文ベクトルから球面k-meansで重心を学習し、割り当てを保存する (オフライン処理)
+        """
+        matrix = self.store.matrix
+        n = len(matrix)
+        if n == 0:
+            print("ANN: 論文ベクトルがないため、インデックスを構築できません。")
+            return
+        nlist = nlist or max(1, min(n, int(4 * np.sqrt(n))))
+        rng = np.random.default_rng(seed)
+        sample = np.asarray(matrix[np.sort(rng.choice(n, size=min(n, KMEANS_SAMPLE_SIZE), replace=False))])
+        centroids = sample[rng.choice(len(sample), size=nlist, replace=False)].copy()
+        for _ in range(KMEANS_ITERATIONS):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, sample)
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            # 空になったクラスタは前回の重心を使い続ける
+            centroids = np.where(norms > 0, sums / np.maximum(norms, 1e-12), centroids).astype(np.float32)
+
+        with self._lock, self._file_lock():
+            self.centroids = centroids
+            assignments = self._assign(matrix)
+            np.save(self.centroids_path, centroids)
+            assignments.tofile(self.assignments_path)
+            self.assignments = np.memmap(self.assignments_path, dtype=np.int32, mode='r+', shape=(n,))
+            self._rebuild_lists()
+        print(f"ANN: {n}件の論文から{nlist}個のリストを持つインデックスを構築しました。")
+
+    def add_papers(self, papers: Iterable[Dict[str, Any]]) -> int:
+        """
+        EmbeddingStoreに追加・更新された論文をインデックスに反映する (PaperIngestorから呼ばれる)
+        """
+        if not self.is_built:
+            return 0
+        with self._lock, self._file_lock():
+            # 新しく追加された行だけ割り当てを計算してファイルに追記する (他のプロセスが追記した分は読み直す)
+            start = self._assignment_count()
+            self._catch_up()
+            # 内容が更新された論文は割り当てをやり直す
+            updated_rows = [row for row in (self.store.row_of.get(str(p["paper_id"])) for p in papers) if row is not None and row < start]
+            if updated_rows:
+                self.assignments[updated_rows] = self._assign(self.store.matrix[updated_rows])
+                self.assignments.flush()
+                self._rebuild_lists()
+        return len(self.store) - start + len(updated_rows)
+
+    def search(self, vector: np.ndarray, k: int = 10, exclude_rows: Iterable[int] = (), nprobe: Optional[int] = None) -> List[Tuple[int, float]]:
+        """
+        ベクトルに近い論文の (行番号, スコア) を上位k件返す。インデックス未構築の場合は総当たりで計算する
+        """
+        excluded = set(exclude_rows)
+        matrix = self.store.matrix
+        if not self.is_built:
+            candidates = np.arange(len(matrix))
+        else:
+            probe = _top_k(self.centroids @ vector, nprobe or self.nprobe)
+            candidates = np.concatenate([self._order[self._offsets[c]:self._offsets[c + 1]] for c in probe] or [np.zeros(0, dtype=np.int64)])
+        if len(candidates) == 0:
+            return []
+        scores = matrix[candidates] @ vector
+        results = []
+        for position in _top_k(scores, k + len(excluded)):
+            row = int(candidates[position])
+            if row not in excluded:
+                results.append((row, float(scores[position])))
+        return results[:k]
+
+    def similar(self, paper_id: Any, k: int = 10, exclude_ids: Iterable[Any] = ()) -> List[Tuple[str, float]]:
+        """
+        指定した論文に似た論文の (paper_id, スコア) を返す (自分自身は除く)
+        """
+        self.refresh()
+        row = self.store.row_of.get(str(paper_id))
+        if row is None:
+            return []
+        exclude_rows = {row} | {r for r in (self.store.row_of.get(str(p)) for p in exclude_ids) if r is not None}
+        return [(self.store.paper_ids[r], score) for r, score in self.search(np.asarray(self.store.matrix[row]), k, exclude_rows)]
+
+
+_default_index: Optional[PaperAnnIndex] = None
+_default_index_lock = threading.Lock()
+
+
+def get_ann_index() -> PaperAnnIndex:
+    """プロセス共通のANNインデックスを返す (保存済みの重心と割り当てをmemmapで読み込む)"""
+    global _default_index
+    with _default_index_lock:
+        if _default_index is None:
+            _default_index = PaperAnnIndex(get_ranker().store)
+        return _default_index
+
+
+if __name__ == "__main__":
+    # 保存済みの論文ベクトルからインデックスを構築する (オフライン処理: python -m backend.modules.PaperAnnIndex)
+    get_ann_index().build()
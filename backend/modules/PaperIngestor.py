@@ -0,0 +1,111 @@
+"""
+backend/modules/PaperIngestor.py
+
+This module stores harvested arXiv papers into the paper_info table.
+Papers are keyed by their arXiv ID (without version) and upserted in batches through
+the upsert_papers database function (db/migrations/001_paper_info_upsert.sql).
+A content hash of title and abstract makes unchanged re-harvests no-ops, while revised
+versions update the existing row in place and invalidate the feed rows derived from it.
+"""
+
+import hashlib
+import re
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# 1回のRPCで送る論文数の上限
+UPSERT_BATCH_SIZE = 500
+
+_ARXIV_ID_PATTERN = re.compile(r'(?:abs/)?([^/]+/\d+|\d{4}\.\d{4,5})(?:v(\d+))?$')
+
+
+def split_arxiv_id(value: str) -> Tuple[str, int]:
+    """
+    arXivのURLまたはshort id (例: 2401.01234v2, cs/0112017v1) を (バージョンなしID, バージョン) に分解する
+    """
+    match = _ARXIV_ID_PATTERN.search(value.strip())
+    if not match:
+        return value.strip(), 1
+    return match.group(1), int(match.group(2) or 1)
+
+
+def compute_content_hash(title: str, abstract: str) -> str:
+    """
+    タイトルとアブストラクトから内容ハッシュを計算する (空白の揺れは無視する)
+    """
+    normalized = re.sub(r'\s+', ' ', title or '').strip() + "\n" + re.sub(r'\s+', ' ', abstract or '').strip()
+    return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+
+
+class PaperIngestor:
+    """
+    取得した論文をpaper_infoテーブルへupsertするクラス
+    """
+    def __init__(self, supabase: Any, batch_size: int = UPSERT_BATCH_SIZE, indexes: Optional[Iterable[Any]] = None):
+        self.supabase = supabase
+        self.batch_size = batch_size
+        # 挿入・更新された論文を反映する索引 (PaperSearchIndex, EmbeddingStore など add_papers を持つもの)
+        self.indexes = list(indexes or [])
+
+    def _prepare(self, paper: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        PaperFetcherの出力をupsert用のレコードに整形する
+        """
+        arxiv_id, arxiv_version = split_arxiv_id(paper.get("arxiv_url") or paper["paper_id"])
+        return {
+            "paper_id": str(paper.get("paper_id") or f"{arxiv_id}v{arxiv_version}"),
+            "arxiv_id": arxiv_id,
+            "arxiv_version": arxiv_version,
+            "title": paper["title"],
+            "author": paper.get("author", ""),
+            "published_date": paper.get("published_date"),
+            "arxiv_url": paper.get("arxiv_url"),
+            "arxiv_category": paper.get("arxiv_category"),
+            "abstract": paper.get("abstract", ""),
+            "content_hash": compute_content_hash(paper["title"], paper.get("abstract", "")),
+        }
+
+    def _dedupe(self, papers: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        同一バッチ内の同じarXiv IDは最新バージョンだけを残す (ON CONFLICTは同じ行を2回更新できないため)
+        """
+        latest: Dict[str, Dict[str, Any]] = {}
+        for paper in papers:
+            record = self._prepare(paper)
+            current = latest.get(record["arxiv_id"])
+            if current is None or record["arxiv_version"] >= current["arxiv_version"]:
+                latest[record["arxiv_id"]] = record
+        return list(latest.values())
+
+    def ingest(self, papers: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        論文リストをupsertし、挿入・更新・変化なしの件数と、変更があった行を返す
+        """
+        records = self._dedupe(papers)
+        stats: Dict[str, Any] = {"inserted": 0, "updated": 0, "unchanged": 0, "changed_rows": []}
+        records_by_arxiv_id = {record["arxiv_id"]: record for record in records}
+
+        for start in range(0, len(records), self.batch_size):
+            batch = records[start:start + self.batch_size]
+            try:
+                response = self.supabase.rpc("upsert_papers", {"papers": batch}).execute()
+            except Exception as e:
+                print(f"INGEST ERROR: paper_infoへのupsertに失敗しました ({start}〜{start + len(batch)}件目): {e}")
+                continue
+
+            changed = response.data or []
+            changed_rows = []
+            for row in changed:
+                stats[row["action"]] += 1
+                record = dict(records_by_arxiv_id.get(row["arxiv_id"], {}))
+                record["paper_id"] = row["paper_id"]
+                changed_rows.append(record)
+            stats["changed_rows"].extend(changed_rows)
+            stats["unchanged"] += len(batch) - len(changed)
+
+            for index in self.indexes:
+                if changed_rows:
+                    index.add_papers(changed_rows)
+
+        print(f"INGEST: 挿入 {stats['inserted']}件 / 更新 {stats['updated']}件 / 変化なし {stats['unchanged']}件")
+        return stats
+
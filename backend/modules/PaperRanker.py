@@ -0,0 +1,289 @@
+"""
+backend/modules/PaperRanker.py
+
+This module ranks feed candidates by relevance to each user.
+Abstracts are embedded once at ingest time with a signed hashing vectorizer (no model download,
+CPU only) and stored as a contiguous float32 matrix that is memory-mapped at startup.
+Each user has a profile vector updated from bookmarks and swipe history, and candidates are
+scored with a single NumPy matrix-vector product followed by an argpartition top-k.
+"""
+
+import os
+import re
+import threading
+import zlib
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+
+DEFAULT_RANKER_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'data', 'ranker'))
+# 10万件 x 128次元 (約50MB) なら1コアでも行列ベクトル積が10ms未満に収まる
+EMBEDDING_DIM = 128
+
+# フィードバックの重み (ブックマークは強い正のシグナル、スワイプで見ただけの論文は弱い正のシグナル)
+BOOKMARK_WEIGHT = 1.0
+UNBOOKMARK_WEIGHT = -0.5
+SWIPE_WEIGHT = 0.1
+# 古い嗜好を徐々に忘れるための減衰率
+PROFILE_DECAY = 0.98
+
+_TOKEN_PATTERN = re.compile(r'[a-z0-9]{2,}')
+_STOPWORDS = frozenset(
+    "the of and to in for on with we is are this that by as an be from at or our it its can which these using based".split()
+)
+
+
+class HashingVectorizer:
+    """
+    単語をハッシュで固定次元に写像してL2正規化したベクトルを作るクラス (語彙の学習が不要なので増分追加できる)
+    """
+    def __init__(self, dim: int = EMBEDDING_DIM):
+        self.dim = dim
+
+    def _tokens(self, text: str) -> List[str]:
+        words = [w for w in _TOKEN_PATTERN.findall(text.lower()) if w not in _STOPWORDS]
+        # 単語に加えて隣接2語も特徴にする ("large language" など)
+        return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+    def transform_one(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        counts: Dict[int, float] = {}
+        for token in self._tokens(text):
+            h = zlib.crc32(token.encode('utf-8'))
+            # 最上位ビットで符号を決め、ハッシュ衝突による偏りを打ち消す
+            index = h % self.dim
+            counts[index] = counts.get(index, 0.0) + (1.0 if h & 0x80000000 else -1.0)
+        for index, count in counts.items():
+            vector[index] = np.sign(count) * (1.0 + np.log(abs(count))) if count else 0.0
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def transform(self, texts: Iterable[str]) -> np.ndarray:
+        rows = [self.transform_one(text) for text in texts]
+        if not rows:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        return np.vstack(rows)
+
+
+class EmbeddingStore:
+    """
+    論文ベクトルをfloat32の連続行列としてファイルに保存し、memmapで読み込むクラス
+    """
+    def __init__(self, directory: str = DEFAULT_RANKER_DIR, dim: int = EMBEDDING_DIM):
+        os.makedirs(directory, exist_ok=True)
+        self.dim = dim
+        self.vectors_path = os.path.join(directory, "vectors.f32")
+        self.ids_path = os.path.join(directory, "paper_ids.txt")
+        self.vectorizer = HashingVectorizer(dim)
+        self._lock = threading.Lock()
+        self.paper_ids: List[str] = []
+        self.row_of: Dict[str, int] = {}
+        # paper_ids.txt のうち読み込み済みのバイト数
+        self._ids_size = 0
+        self._read_new_ids()
+        self.matrix = self._map()
+
+    def _map(self) -> np.ndarray:
+        if not self.paper_ids:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        return np.memmap(self.vectors_path, dtype=np.float32, mode='r+', shape=(len(self.paper_ids), self.dim))
+
+    def __len__(self) -> int:
+        return len(self.paper_ids)
+
+    def _read_new_ids(self) -> bool:
+        """paper_ids.txt の読み込み済みの位置より後ろの行を読む (書きかけの最後の行は次回に回す)"""
+        if not os.path.exists(self.ids_path) or os.path.getsize(self.ids_path) == self._ids_size:
+            return False
+        with open(self.ids_path, "rb") as f:
+            f.seek(self._ids_size)
+            data = f.read()
+        data = data[:data.rfind(b"\n") + 1]
+        if not data:
+            return False
+        for paper_id in data.decode('utf-8').splitlines():
+            if paper_id.strip():
+                self.row_of[paper_id] = len(self.paper_ids)
+                self.paper_ids.append(paper_id)
+        self._ids_size += len(data)
+        return True
+
+    def refresh(self) -> bool:
+        """
+        他のプロセス (PaperIngestor) が追記した論文を読み込む。ベクトルはIDより先に追記されるので、
+        IDが見えた行のベクトルは必ずファイルにある。増えた場合はTrue
+        """
+        with self._lock:
+            if not self._read_new_ids():
+                return False
+            self.matrix = self._map()
+            return True
+
+    def get(self, paper_id: Any) -> Optional[np.ndarray]:
+        row = self.row_of.get(str(paper_id))
+        return None if row is None else np.asarray(self.matrix[row])
+
+    def add_papers(self, papers: Iterable[Dict[str, Any]]) -> int:
+        """
+        論文のタイトル＋アブストラクトを埋め込んで保存する。既存のpaper_idは行を上書きする
+        """
+        papers = list(papers)
+        if not papers:
+            return 0
+        vectors = self.vectorizer.transform(f"{p.get('title') or ''} {p.get('abstract') or ''}" for p in papers)
+        with self._lock:
+            new_ids: List[str] = []
+            new_rows: List[np.ndarray] = []
+            for paper, vector in zip(papers, vectors):
+                paper_id = str(paper["paper_id"])
+                row = self.row_of.get(paper_id)
+                if row is not None:
+                    self.matrix[row] = vector
+                else:
+                    self.row_of[paper_id] = len(self.paper_ids) + len(new_ids)
+                    new_ids.append(paper_id)
+                    new_rows.append(vector)
+            if isinstance(self.matrix, np.memmap):
+                self.matrix.flush()
+            if new_ids:
+                # 追記のみなので既存の行は書き換えない
+                with open(self.vectors_path, "ab") as f:
+                    f.write(np.vstack(new_rows).astype(np.float32, copy=False).tobytes())
+                with open(self.ids_path, "ab") as f:
+                    f.write("".join(f"{paper_id}\n" for paper_id in new_ids).encode('utf-8'))
+                    self._ids_size = f.tell()
+                self.paper_ids.extend(new_ids)
+                self.matrix = self._map()
+        return len(papers)
+
+
+class UserProfileStore:
+    """
+    ユーザーごとの嗜好ベクトルをファイルに保存するクラス
+    """
+    def __init__(self, directory: str = os.path.join(DEFAULT_RANKER_DIR, "profiles"), dim: int = EMBEDDING_DIM):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.dim = dim
+        self._cache: Dict[int, np.ndarray] = {}
+        self._lock = threading.Lock()
+
+    def _path(self, user_id: int) -> str:
+        return os.path.join(self.directory, f"{int(user_id)}.npy")
+
+    def _load(self, user_id: int) -> Optional[np.ndarray]:
+        # self._lock を持った状態で呼ぶ
+        if user_id not in self._cache:
+            path = self._path(user_id)
+            if not os.path.exists(path):
+                return None
+            self._cache[user_id] = np.load(path)
+        return self._cache[user_id]
+
+    def get(self, user_id: int) -> Optional[np.ndarray]:
+        with self._lock:
+            return self._load(user_id)
+
+    def update(self, user_id: int, vector: np.ndarray, weight: float) -> None:
+        # 読み出し・混ぜ合わせ・保存を1つのロックの中で行う (同じユーザーへの同時の更新を失わない)
+        with self._lock:
+            current = self._load(user_id)
+            profile = np.zeros(self.dim, dtype=np.float32) if current is None else current * PROFILE_DECAY
+            profile = (profile + weight * vector).astype(np.float32)
+            self._cache[user_id] = profile
+            np.save(self._path(user_id), profile)
+
+
+class PaperRanker:
+    """
+    ユーザーの嗜好ベクトルと論文ベクトルの内積で候補論文を並べ替えるクラス
+    """
+    def __init__(self, store: EmbeddingStore, profiles: UserProfileStore):
+        self.store = store
+        self.profiles = profiles
+
+    def _profile(self, user_id: int) -> Optional[np.ndarray]:
+        profile = self.profiles.get(user_id)
+        if profile is None:
+            return None
+        norm = np.linalg.norm(profile)
+        return profile / norm if norm > 0 else None
+
+    def record_feedback(self, user_id: int, paper_id: Any, weight: float) -> None:
+        """
+        ブックマーク・スワイプ履歴をユーザーの嗜好ベクトルに反映する
+        """
+        # 起動後に他のプロセスが取り込んだ論文へのフィードバックも捨てない (変化がなければファイルサイズを見るだけ)
+        self.store.refresh()
+        vector = self.store.get(paper_id)
+        if vector is not None:
+            self.profiles.update(user_id, vector, weight)
+
+    def rank(self, user_id: int, k: int, exclude_ids: Optional[Iterable[Any]] = None) -> List[str]:
+        """
+        全論文から嗜好に近い上位k件のpaper_idを返す。嗜好ベクトルがまだないユーザーには空リストを返す
+        """
+        self.store.refresh()
+        profile = self._profile(user_id)
+        matrix = self.store.matrix
+        if profile is None or k <= 0 or len(matrix) == 0:
+            return []
+        scores = matrix @ profile
+        excluded_rows = [row for row in (self.store.row_of.get(str(p)) for p in (exclude_ids or [])) if row is not None]
+        if excluded_rows:
+            scores[excluded_rows] = -np.inf
+        k = min(k, len(scores) - len(excluded_rows))
+        if k <= 0:
+            return []
+        top = np.argpartition(scores, len(scores) - k)[-k:]
+        top = top[np.argsort(-scores[top])]
+        return [self.store.paper_ids[row] for row in top]
+
+    def rerank(self, user_id: int, paper_ids: List[Any]) -> List[str]:
+        """
+        与えられた候補 (キーワード検索の結果など) を嗜好順に並べ替える。嗜好ベクトルがなければ元の順序のまま返す
+        """
+        self.store.refresh()
+        paper_ids = [str(p) for p in paper_ids]
+        profile = self._profile(user_id)
+        if profile is None or not paper_ids:
+            return paper_ids
+        rows = [self.store.row_of.get(p) for p in paper_ids]
+        known = [(p, row) for p, row in zip(paper_ids, rows) if row is not None]
+        if not known:
+            return paper_ids
+        scores = self.store.matrix[[row for _, row in known]] @ profile
+        ordered = [known[i][0] for i in np.argsort(-scores, kind='stable')]
+        return ordered + [p for p, row in zip(paper_ids, rows) if row is None]
+
+
+_default_ranker: Optional[PaperRanker] = None
+_default_ranker_lock = threading.Lock()
+
+
+def get_ranker() -> PaperRanker:
+    """プロセス共通のランカーを返す (初回呼び出し時にベクトルをmemmapする)"""
+    global _default_ranker
+    with _default_ranker_lock:
+        if _default_ranker is None:
+            directory = os.environ.get("PAPER_RANKER_DIR", DEFAULT_RANKER_DIR)
+            _default_ranker = PaperRanker(EmbeddingStore(directory), UserProfileStore(os.path.join(directory, "profiles")))
+        return _default_ranker
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    from backend.modules.Database import get_client
+
+    # paper_infoの全論文を埋め込み直す (初回構築・復旧用)
+    load_dotenv()
+    supabase = get_client()
+    store = get_ranker().store
+    start, page_size = 0, 1000
+    while True:
+        rows = supabase.table("paper_info").select("paper_id, title, abstract").order("paper_id").range(start, start + page_size - 1).execute().data or []
+        store.add_papers(rows)
+        if len(rows) < page_size:
+            break
+        start += page_size
+    print(f"RANKER: {len(store)}件の論文ベクトルを保存しました。")
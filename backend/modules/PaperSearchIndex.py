@@ -0,0 +1,144 @@
+"""
+backend/modules/PaperSearchIndex.py
+
+This module provides a local full-text index over ingested papers (title and abstract).
+It is backed by SQLite FTS5 with BM25 ranking, so keyword feeds can be answered in
+milliseconds without calling the arXiv API. The index is updated incrementally by
+PaperIngestor and can be rebuilt from the paper_info table by running this file.
+"""
+
+import os
+import re
+import sqlite3
+import threading
+from typing import Any, Dict, Iterable, List, Optional
+
+DEFAULT_INDEX_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'data', 'index', 'papers_fts.sqlite3'))
+
+# タイトルの一致をアブストラクトより重く評価する (bm25の列ごとの重み)
+TITLE_WEIGHT = 2.0
+ABSTRACT_WEIGHT = 1.0
+
+_TOKEN_PATTERN = re.compile(r'[\w\-\.]+', re.UNICODE)
+
+
+class PaperSearchIndex:
+    """
+    SQLite FTS5を使って論文のタイトル・アブストラクトを全文検索するクラス
+    """
+    def __init__(self, db_path: str = DEFAULT_INDEX_PATH):
+        if db_path != ":memory:":
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        # paper_id -> FTSのrowid の対応表。更新時に該当行だけを差し替えるために使う
+        self.conn.execute("CREATE TABLE IF NOT EXISTS paper_doc (doc_id INTEGER PRIMARY KEY, paper_id TEXT NOT NULL UNIQUE)")
+        self.conn.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS paper_fts USING fts5(title, abstract, tokenize='porter unicode61')"
+        )
+        self.conn.commit()
+
+    def add_papers(self, papers: Iterable[Dict[str, Any]]) -> int:
+        """
+        論文を索引に追加する。既に索引済みのpaper_idは内容を差し替える
+        """
+        count = 0
+        with self._lock, self.conn:
+            for paper in papers:
+                paper_id = str(paper["paper_id"])
+                self.conn.execute("INSERT INTO paper_doc (paper_id) VALUES (?) ON CONFLICT (paper_id) DO NOTHING", (paper_id,))
+                doc_id = self.conn.execute("SELECT doc_id FROM paper_doc WHERE paper_id = ?", (paper_id,)).fetchone()[0]
+                self.conn.execute("DELETE FROM paper_fts WHERE rowid = ?", (doc_id,))
+                self.conn.execute(
+                    "INSERT INTO paper_fts (rowid, title, abstract) VALUES (?, ?, ?)",
+                    (doc_id, paper.get("title") or "", paper.get("abstract") or ""),
+                )
+                count += 1
+        return count
+
+    def remove_papers(self, paper_ids: Iterable[Any]) -> None:
+        """
+        指定したpaper_idを索引から削除する
+        """
+        with self._lock, self.conn:
+            for paper_id in paper_ids:
+                row = self.conn.execute("SELECT doc_id FROM paper_doc WHERE paper_id = ?", (str(paper_id),)).fetchone()
+                if row:
+                    self.conn.execute("DELETE FROM paper_fts WHERE rowid = ?", (row[0],))
+                    self.conn.execute("DELETE FROM paper_doc WHERE doc_id = ?", (row[0],))
+
+    def __len__(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM paper_doc").fetchone()[0]
+
+    @staticmethod
+    def _build_match_query(keyword: str, operator: str) -> str:
+        """
+        user_info.keyword (カンマ・空白区切り) をFTS5のMATCH式に変換する。各語は引用符で囲んで演算子として解釈させない
+        """
+        terms = _TOKEN_PATTERN.findall(keyword.replace(",", " "))
+        return f" {operator} ".join('"' + term.replace('"', '""') + '"' for term in terms)
+
+    def search(self, keyword: str, limit: int = 30, exclude_ids: Optional[Iterable[Any]] = None) -> List[str]:
+        """
+        キーワードに一致する論文のpaper_idを関連度順に返す。
+        全語を含む論文 (AND) が足りない場合は、いずれかの語を含む論文 (OR) で補う
+        """
+        excluded = {str(paper_id) for paper_id in (exclude_ids or [])}
+        results: List[str] = []
+        for operator in ("AND", "OR"):
+            match_query = self._build_match_query(keyword, operator)
+            if not match_query:
+                return []
+            with self._lock:
+                rows = self.conn.execute(
+                    "SELECT d.paper_id FROM paper_fts JOIN paper_doc d ON d.doc_id = paper_fts.rowid "
+                    "WHERE paper_fts MATCH ? ORDER BY bm25(paper_fts, ?, ?) LIMIT ?",
+                    (match_query, TITLE_WEIGHT, ABSTRACT_WEIGHT, limit + len(excluded) + len(results)),
+                ).fetchall()
+            for (paper_id,) in rows:
+                if paper_id not in excluded and paper_id not in results:
+                    results.append(paper_id)
+            if len(results) >= limit:
+                break
+        return results[:limit]
+
+    def rebuild_from_supabase(self, supabase: Any, page_size: int = 1000) -> int:
+        """
+        paper_infoテーブルの全論文から索引を作り直す (初回構築・復旧用)
+        """
+        total = 0
+        start = 0
+        while True:
+            res = supabase.table("paper_info").select("paper_id, title, abstract").order("paper_id").range(start, start + page_size - 1).execute()
+            rows = res.data or []
+            total += self.add_papers(rows)
+            if len(rows) < page_size:
+                break
+            start += page_size
+        print(f"INDEX: {total}件の論文を索引に登録しました。")
+        return total
+
+
+_default_index: Optional[PaperSearchIndex] = None
+_default_index_lock = threading.Lock()
+
+
+def get_search_index() -> PaperSearchIndex:
+    """プロセス共通の索引を返す (初回呼び出し時に開く)"""
+    global _default_index
+    with _default_index_lock:
+        if _default_index is None:
+            _default_index = PaperSearchIndex(os.environ.get("PAPER_INDEX_PATH", DEFAULT_INDEX_PATH))
+        return _default_index
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    from backend.modules.Database import get_client
+
+    load_dotenv()
+    index = get_search_index()
+    index.rebuild_from_supabase(get_client())
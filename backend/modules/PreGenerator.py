@@ -0,0 +1,139 @@
+"""
+backend/modules/PreGenerator.py
+
+This module speculatively precomputes shared summary and audio assets (paper_asset table)
+for the (paper, voice_type) pairs most likely to be requested next.
+Demand is estimated across users from which papers were recently selected into feeds,
+which papers were recently ingested, and how common each voice_type is. It is meant to run
+during idle time, e.g. `python -m backend.modules.PreGenerator --budget 50 --interval 600`,
+so that per-user feed generation mostly becomes asset lookups.
+"""
+
+import argparse
+import os
+import sys
+import time
+from collections import Counter
+from typing import Any, Dict, List, Tuple
+
+# プロジェクトルートをパスに追加
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from backend.modules.FeedGenerator import (
+    get_summarizer, get_voice_client, create_paper_asset,
+)
+from backend.modules.Database import get_client
+from backend.modules.Projections import PAPER_ABSTRACT, fetch_by_ids
+from backend.modules.Resilience import CircuitOpenError
+
+# 直近でフィードに選ばれた件数を数える範囲 (feed_idの新しい順)
+FEED_DEMAND_WINDOW = 2000
+# 新着論文として扱う件数と、その事前スコア (まだ誰にも選ばれていない論文にも機会を与える)
+RECENT_PAPER_LIMIT = 200
+RECENT_PAPER_PRIOR = 1.0
+# この割合未満の利用しかない話者は事前生成しない
+MIN_VOICE_SHARE = 0.05
+# 1分間の平均負荷がCPU数 x この値未満ならアイドルとみなす
+IDLE_LOAD_FACTOR = 0.5
+
+
+def collect_demand(supabase: Any) -> Tuple[Counter, Dict[int, float]]:
+    """
+    ユーザー横断の需要を集計する。戻り値は (論文ごとのスコア, 話者ごとの利用割合)
+    """
+    paper_scores: Counter = Counter()
+    feed_res = supabase.table("feed").select("paper_id").order("feed_id", desc=True).limit(FEED_DEMAND_WINDOW).execute()
+    for item in feed_res.data or []:
+        paper_scores[str(item['paper_id'])] += 1
+
+    recent_res = supabase.table("paper_info").select("paper_id").order("created_at", desc=True).limit(RECENT_PAPER_LIMIT).execute()
+    for item in recent_res.data or []:
+        paper_scores[str(item['paper_id'])] += RECENT_PAPER_PRIOR
+
+    voice_counts = Counter(item['voice_type'] for item in (supabase.table("user_info").select("voice_type").execute().data or []))
+    total_users = sum(voice_counts.values())
+    voice_shares = {voice: count / total_users for voice, count in voice_counts.items() if count / total_users >= MIN_VOICE_SHARE} if total_users else {3: 1.0}
+    return paper_scores, voice_shares
+
+
+def plan_pregeneration(supabase: Any, budget: int) -> List[Tuple[str, int, float]]:
+    """
+    需要の見込みが高く、まだアセットがない (paper_id, voice_type) の組を最大budget件返す
+    """
+    paper_scores, voice_shares = collect_demand(supabase)
+    candidates = sorted(
+        ((paper_id, voice, score * share) for paper_id, score in paper_scores.items() for voice, share in voice_shares.items()),
+        key=lambda c: c[2], reverse=True,
+    )[:budget * 4]
+    if not candidates:
+        return []
+
+    existing_res = supabase.table("paper_asset").select("paper_id, voice_type").in_("paper_id", list({c[0] for c in candidates})).execute()
+    existing = {(str(item['paper_id']), item['voice_type']) for item in existing_res.data or []}
+    return [c for c in candidates if (c[0], c[1]) not in existing][:budget]
+
+
+def is_idle() -> bool:
+    """マシンの負荷が低いかどうか (getloadavgがない環境では常にアイドル扱い)"""
+    try:
+        return os.getloadavg()[0] < (os.cpu_count() or 1) * IDLE_LOAD_FACTOR
+    except (AttributeError, OSError):
+        return True
+
+
+def run_pregeneration(budget: int = 50) -> Dict[str, int]:
+    """
+    事前生成を1サイクル実行する。負荷が上がったら途中で打ち切る
+    """
+    supabase = get_client()
+    plan = plan_pregeneration(supabase, budget)
+    print(f"PREGEN: {len(plan)}件の (論文, 話者) を事前生成します。")
+
+    stats = {"generated": 0, "failed": 0, "skipped": 0}
+    if not plan:
+        return stats
+    summarizer = get_summarizer()
+    voice_client = get_voice_client()
+    papers = fetch_by_ids(supabase, PAPER_ABSTRACT, [c[0] for c in plan])
+    summaries: Dict[str, str] = {}
+
+    for paper_id, voice_type, score in plan:
+        if not is_idle():
+            stats["skipped"] = len(plan) - stats["generated"] - stats["failed"]
+            print("PREGEN: 負荷が高いため事前生成を中断します。")
+            break
+        paper = papers.get(paper_id)
+        try:
+            asset = create_paper_asset(supabase, paper, voice_type, summarizer, voice_client, summary=summaries.get(paper_id)) if paper else None
+        except CircuitOpenError as e:
+            stats["skipped"] = len(plan) - stats["generated"] - stats["failed"]
+            print(f"PREGEN: {e.name} が使えないため事前生成を中断します。")
+            break
+        if asset:
+            # 同じ論文の別話者では要約を使い回す
+            summaries[paper_id] = asset["gemini_abstract"]
+            stats["generated"] += 1
+            print(f"PREGEN: paper_id: {paper_id} (voice_type: {voice_type}, score: {score:.2f}) を生成しました。")
+        else:
+            stats["failed"] += 1
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="人気の論文の要約・音声を事前生成する")
+    parser.add_argument("--budget", type=int, default=50, help="1サイクルで生成する (論文, 話者) の最大数")
+    parser.add_argument("--interval", type=int, default=0, help="繰り返し実行する間隔 (秒)。0なら1回だけ実行")
+    args = parser.parse_args()
+
+    while True:
+        if is_idle():
+            print(f"PREGEN: {run_pregeneration(args.budget)}")
+        else:
+            print("PREGEN: 負荷が高いためこのサイクルはスキップします。")
+        if args.interval <= 0:
+            break
+        time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+backend/modules/Projections.py
+
+This module declares which columns each code path reads, instead of select("*").
+Every projection is checked against TABLE_COLUMNS (see test_Projections.py), and heavy
+columns (abstract, gemini_abstract, voice) are only fetched by projections that need them.
+Code that may not need a heavy column selects the light projection first and loads the
+heavy one later with fetch_by_ids for just the rows that turn out to need it.
+"""
+
+from typing import Any, Dict, Iterable, List, NamedTuple, Tuple
+
+# テーブルごとの列 (db/migrations適用後のスキーマ)
+TABLE_COLUMNS: Dict[str, Tuple[str, ...]] = {
+    "paper_info": (
+        "paper_id", "arxiv_id", "arxiv_version", "title", "author", "published_date",
+        "arxiv_url", "arxiv_category", "abstract", "content_hash", "created_at",
+    ),
+    "feed": ("feed_id", "user_id", "paper_id", "gemini_abstract", "voice", "voice_key"),
+    "paper_asset": ("paper_id", "voice_type", "gemini_abstract", "voice", "voice_key", "is_variant", "created_at"),
+    "bookmark": ("bookmark_id", "user_id", "paper_id", "references_date"),
+    "user_info": ("user_id", "uuid", "voice_type", "keyword"),
+}
+
+# 1行あたりのサイズが大きい列。これらを含むプロジェクションは heavy=True で宣言する
+HEAVY_COLUMNS: Dict[str, Tuple[str, ...]] = {
+    "paper_info": ("abstract",),
+    "feed": ("gemini_abstract", "voice"),
+    "paper_asset": ("gemini_abstract", "voice"),
+}
+
+
+class Projection(NamedTuple):
+    """テーブルと、そこから読む列の組"""
+    table: str
+    columns: Tuple[str, ...]
+    heavy: bool = False
+
+    @property
+    def select_clause(self) -> str:
+        return ", ".join(self.columns)
+
+    def select(self, supabase: Any):
+        """supabase.table(...).select(...) を返す (続けて .eq() などを呼ぶ)"""
+        return supabase.table(self.table).select(self.select_clause)
+
+
+# 論文カード (タイトル・著者・URL) の表示に必要な列
+PAPER_CARD = Projection("paper_info", ("paper_id", "title", "author", "arxiv_url"))
+# 新着順に並べるための列
+PAPER_LATEST = Projection("paper_info", PAPER_CARD.columns + ("published_date",))
+# 要約の生成に必要な列 (共有アセットがない論文だけ読む)
+PAPER_ABSTRACT = Projection("paper_info", ("paper_id", "abstract"), heavy=True)
+# フィードアイテムの応答に必要な列 (音声は voice_key から音声ストアを読む)
+FEED_ITEM = Projection("feed", ("feed_id", "paper_id", "gemini_abstract", "voice_key"), heavy=True)
+FEED_PAPER_IDS = Projection("feed", ("paper_id",))
+FEED_VOICE_KEY = Projection("feed", ("voice_key",))
+PAPER_ASSET = Projection("paper_asset", ("paper_id", "voice_type", "gemini_abstract", "voice_key"), heavy=True)
+# 話者を問わず要約だけを使い回すための列
+PAPER_ASSET_SUMMARY = Projection("paper_asset", ("gemini_abstract",), heavy=True)
+USER_FEED_SETTINGS = Projection("user_info", ("voice_type", "keyword"))
+
+ALL_PROJECTIONS: Tuple[Projection, ...] = (
+    PAPER_CARD, PAPER_LATEST, PAPER_ABSTRACT, FEED_ITEM, FEED_PAPER_IDS, FEED_VOICE_KEY, PAPER_ASSET, PAPER_ASSET_SUMMARY,
+    USER_FEED_SETTINGS,
+)
+
+
+def fetch_by_ids(supabase: Any, projection: Projection, ids: Iterable[Any], key: str = "paper_id") -> Dict[str, Dict[str, Any]]:
+    """
+    指定したIDの行だけをプロジェクションの列で読み、{str(ID): 行} で返す (重い列の遅延読み込み用)
+    """
+    ids = list(dict.fromkeys(ids))
+    if not ids:
+        return {}
+    res = projection.select(supabase).in_(key, ids).execute()
+    return {str(row[key]): row for row in res.data or []}
+
+
+def check_projection(projection: Projection) -> List[str]:
+    """プロジェクションの問題点を返す (テスト用)。問題がなければ空リスト"""
+    problems = []
+    known = TABLE_COLUMNS.get(projection.table)
+    if known is None:
+        return [f"unknown table: {projection.table}"]
+    problems += [f"{projection.table}.{c} does not exist" for c in projection.columns if c not in known]
+    heavy = [c for c in projection.columns if c in HEAVY_COLUMNS.get(projection.table, ())]
+    if heavy and not projection.heavy:
+        problems.append(f"{projection.table} projection reads heavy columns {heavy} without heavy=True")
+    if "voice" in projection.columns:
+        problems.append(f"{projection.table}.voice is inline audio; read voice_key instead")
+    return problems
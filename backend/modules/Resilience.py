@@ -0,0 +1,233 @@
+"""
+backend/modules/Resilience.py
+
+This module keeps feed generation from burning its time on a dependency that is down or slow.
+- CircuitBreaker: per dependency (gemini, voicevox:<url>). It opens when the error rate over
+  the last calls passes a threshold, rejects calls with CircuitOpenError while open, and
+  after open_seconds lets a few half-open probes through; a successful probe closes it.
+- AdaptiveTimeout: the request timeout follows the observed p99 latency (times a factor,
+  within a floor and a ceiling) instead of a fixed 10s + 30s.
+- hedged_call(): starts the first attempt, and if it has not answered after a delay (the
+  observed p95) or fails, starts the next one (another VOICEVOX engine). The first success
+  wins and late results are discarded. Only idempotent, cheap-to-duplicate calls are hedged
+  (VOICEVOX), not Gemini.
+Callers let CircuitOpenError propagate so that a generation stops early and is rescheduled
+after retry_after seconds instead of waiting on timeouts item by item.
+"""
+
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Optional, Sequence
+
+from backend.modules.Metrics import histogram
+
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half_open"
+
+# 開いた回路を半開にするまでの秒数
+DEFAULT_OPEN_SECONDS = 30.0
+# 直近何回の呼び出しでエラー率を見るか
+DEFAULT_WINDOW = 20
+# エラー率を判定するのに必要な最小の呼び出し回数
+DEFAULT_MIN_CALLS = 5
+# 回路を開くエラー率
+DEFAULT_FAILURE_RATE = 0.5
+# 半開の時に同時に通す試しの呼び出し数
+DEFAULT_PROBE_CALLS = 1
+# ヘッジ用のスレッド数 (プロセス共通)
+HEDGE_THREADS = 32
+
+DEPENDENCY_SECONDS = histogram("dependency_call_seconds", "Latency of calls to external dependencies.", ["dependency", "outcome"])
+
+
+class CircuitOpenError(Exception):
+    """依存先の回路が開いているため呼び出さなかった。retry_after 秒後に再試行できる"""
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"{name} is unavailable (circuit open, retry after {retry_after:.0f}s)")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    直近 window 回の呼び出しのエラー率で開閉する回路ブレーカー
+    """
+    def __init__(self, name: str, failure_rate: float = DEFAULT_FAILURE_RATE, window: int = DEFAULT_WINDOW,
+                 min_calls: int = DEFAULT_MIN_CALLS, open_seconds: float = DEFAULT_OPEN_SECONDS, probe_calls: int = DEFAULT_PROBE_CALLS):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.open_seconds = open_seconds
+        self.probe_calls = probe_calls
+        self._lock = threading.Lock()
+        # 直近の呼び出しの結果 (Trueが失敗)
+        self._outcomes: deque = deque(maxlen=window)
+        self._state = STATE_CLOSED
+        self._opened_at = 0.0
+        self._probes = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            self._refresh()
+            return self._state
+
+    def retry_after(self) -> float:
+        """回路が開いている場合、半開になるまでの秒数"""
+        with self._lock:
+            self._refresh()
+            return max(0.0, self._opened_at + self.open_seconds - time.monotonic()) if self._state == STATE_OPEN else 0.0
+
+    def _refresh(self) -> None:
+        if self._state == STATE_OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+            self._state = STATE_HALF_OPEN
+            self._probes = 0
+
+    def _open(self) -> None:
+        if self._state != STATE_OPEN:
+            print(f"RESILIENCE: Circuit {self.name} opened for {self.open_seconds:.0f}s")
+        self._state = STATE_OPEN
+        self._opened_at = time.monotonic()
+        self._outcomes.clear()
+
+    def before_call(self) -> None:
+        """呼び出してよければ何もしない。回路が開いている (半開で試しの枠がない) 場合は CircuitOpenError"""
+        with self._lock:
+            self._refresh()
+            if self._state == STATE_CLOSED:
+                return
+            if self._state == STATE_HALF_OPEN and self._probes < self.probe_calls:
+                self._probes += 1
+                return
+            retry_after = max(0.0, self._opened_at + self.open_seconds - time.monotonic())
+        raise CircuitOpenError(self.name, retry_after)
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self._state == STATE_HALF_OPEN:
+                print(f"RESILIENCE: Circuit {self.name} closed")
+                self._state = STATE_CLOSED
+                self._outcomes.clear()
+            self._outcomes.append(False)
+
+    def record_failure(self) -> None:
+        with self._lock:
+            if self._state == STATE_HALF_OPEN:
+                # 試しの呼び出しが失敗したら、また開く
+                self._open()
+                return
+            self._outcomes.append(True)
+            if len(self._outcomes) >= self.min_calls and sum(self._outcomes) / len(self._outcomes) >= self.failure_rate:
+                self._open()
+
+    @contextmanager
+    def guard(self):
+        """with の中の呼び出しを回路に通し、例外が出れば失敗として数える"""
+        self.before_call()
+        started_at = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.record_failure()
+            DEPENDENCY_SECONDS.observe(time.perf_counter() - started_at, dependency=self.name, outcome="error")
+            raise
+        self.record_success()
+        DEPENDENCY_SECONDS.observe(time.perf_counter() - started_at, dependency=self.name, outcome="ok")
+
+
+class AdaptiveTimeout:
+    """
+    直近のレイテンシのp99に合わせて伸び縮みするタイムアウト (秒)。観測が少ないうちは initial を使う
+    """
+    def __init__(self, initial: float, minimum: float, maximum: float, factor: float = 3.0, window: int = 200, min_samples: int = 20):
+        self.initial = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.factor = factor
+        self.min_samples = min_samples
+        self._lock = threading.Lock()
+        self._samples: deque = deque(maxlen=window)
+
+    def observe(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, q: float) -> Optional[float]:
+        """観測したレイテンシのq パーセンタイル (観測が少なければNone)"""
+        with self._lock:
+            if len(self._samples) < self.min_samples:
+                return None
+            ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * q / 100))]
+
+    @property
+    def current(self) -> float:
+        p99 = self.percentile(99)
+        if p99 is None:
+            return self.initial
+        return min(self.maximum, max(self.minimum, p99 * self.factor))
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+_hedge_executor: Optional[ThreadPoolExecutor] = None
+
+
+def get_breaker(name: str, **options: Any) -> CircuitBreaker:
+    """依存先ごとのプロセス共通の回路ブレーカーを返す (options は初めて作る時だけ使う)"""
+    with _breakers_lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            breaker = _breakers[name] = CircuitBreaker(name, **options)
+        return breaker
+
+
+def breaker_states() -> Dict[str, str]:
+    """全ての回路の状態 ({名前: closed/open/half_open})"""
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return {breaker.name: breaker.state for breaker in breakers}
+
+
+def hedged_call(attempts: Sequence[Callable[[], Any]], delay: float, discard: Optional[Callable[[Any], None]] = None) -> Any:
+    """
+    attempts を1つずつ始め、前の試行が delay 秒以内に応答しないか失敗したら次を始める。最初に成功した結果を返す。
+    間に合わなかった試行の結果は discard に渡す (応答を閉じるなど)。全て失敗した場合は、回路が開いていたことによる
+    失敗でない例外があればそれを、全て CircuitOpenError なら最も早く再試行できるものを送出する
+    """
+    global _hedge_executor
+    if len(attempts) == 1:
+        return attempts[0]()
+    with _breakers_lock:
+        if _hedge_executor is None:
+            _hedge_executor = ThreadPoolExecutor(max_workers=HEDGE_THREADS, thread_name_prefix="hedge")
+    pending: set = set()
+    errors = []
+    remaining = list(attempts)
+    winner: Optional[Future] = None
+    while winner is None and (pending or remaining):
+        if remaining:
+            pending.add(_hedge_executor.submit(remaining.pop(0)))
+        # まだ始めていない試行があれば delay 秒だけ待ち、なければどれかが終わるまで待つ
+        done, pending = wait(pending, timeout=delay if remaining else None, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None and winner is None:
+                winner = future
+            elif future.exception() is not None:
+                errors.append(future.exception())
+            elif discard:
+                discard(future.result())
+    if winner is None:
+        failures = [e for e in errors if not isinstance(e, CircuitOpenError)]
+        if failures:
+            raise failures[-1]
+        raise min(errors, key=lambda e: e.retry_after)
+    for future in pending:
+        # 負けた試行は終わった時点で結果を捨てる
+        if discard:
+            future.add_done_callback(lambda f: f.exception() is None and discard(f.result()))
+    return winner.result()
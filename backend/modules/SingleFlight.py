@@ -0,0 +1,234 @@
+"""
+backend/modules/SingleFlight.py
+
+This module makes concurrent callers of the same expensive work share one execution.
+Work is identified by a key such as asset:<paper_id>:<voice_type> (VOICEVOX text+speaker),
+summary:<paper_id>:<prompt digest> (Gemini paper+prompt) or refill:<user_id>.
+Within a process, the first caller of a key runs the function and the others wait for its
+result (or exception) through a shared Future, from threads with do() or from coroutines
+with do_async(). Across API processes and GenerationWorker processes, the leader also takes
+a row in the work_lease table (acquire_work_lease / release_work_lease). A process that
+finds the lease held by someone else polls an optional lookup function (e.g. "is the
+paper_asset row there yet?") until the other process finishes, and only runs the work
+itself if nothing shows up before the lease is released or expires. PostgREST calls do
+not keep a session, so a lease row is used rather than a Postgres advisory lock.
+"""
+
+import asyncio
+import hashlib
+import os
+import socket
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from backend.modules.Database import get_client
+from backend.modules.Metrics import histogram
+
+# リースの有効期限 (秒)。持ち主のプロセスが落ちても、この時間が過ぎれば他のプロセスが処理する
+DEFAULT_LEASE_SECONDS = 120
+# 他のプロセスがリースを持っている時に、結果が現れたかを確かめる間隔 (秒)
+LEASE_POLL_INTERVAL = 0.5
+
+# 実行していたコルーチンがキャンセルされたことを待っている側へ伝える印
+_CANCELLED = object()
+
+FLIGHT_WAIT_SECONDS = histogram("singleflight_wait_seconds", "Time a caller waited for identical work running elsewhere.", ["kind", "scope"])
+
+
+def flight_kind(key: str) -> str:
+    return key.split(":", 1)[0]
+
+
+def asset_flight_key(paper_id: Any, voice_type: int) -> str:
+    return f"asset:{paper_id}:{voice_type}"
+
+
+def summary_flight_key(paper_id: Any, prompt: str) -> str:
+    # プロンプトが変われば別の仕事として扱う
+    return f"summary:{paper_id}:{hashlib.sha256(prompt.encode('utf-8')).hexdigest()[:12]}"
+
+
+def refill_flight_key(user_id: int) -> str:
+    return f"refill:{user_id}"
+
+
+class SingleFlight:
+    """
+    キーごとに実行中の仕事を1つにまとめる登録簿。supabase を渡すと work_lease でプロセスをまたいでもまとめる
+    """
+    def __init__(self, supabase: Any = None, lease_seconds: int = DEFAULT_LEASE_SECONDS, poll_interval: float = LEASE_POLL_INTERVAL):
+        self.supabase = supabase
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self._lock = threading.Lock()
+        self._flights: Dict[str, Future] = {}
+
+    # --- プロセス内 ---
+
+    def _join(self, key: str) -> Tuple[Future, bool]:
+        """キーの実行中の仕事に加わる。(共有のFuture, 自分が実行するかどうか) を返す"""
+        with self._lock:
+            future = self._flights.get(key)
+            if future is not None:
+                return future, False
+            future = self._flights[key] = Future()
+            return future, True
+
+    def _finish(self, key: str, future: Future, result: Any = None, error: Optional[BaseException] = None) -> None:
+        with self._lock:
+            del self._flights[key]
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    # --- プロセス間 (work_lease) ---
+
+    def _try_lease(self, key: str) -> bool:
+        if self.supabase is None:
+            return True
+        response = self.supabase.rpc("acquire_work_lease", {"p_key": key, "p_owner": self.owner, "p_lease_seconds": self.lease_seconds}).execute()
+        return bool(response.data)
+
+    def _release_lease(self, key: str, hold_seconds: int = 0) -> None:
+        """リースを解放する。hold_seconds を指定した場合は解放せず、その秒数だけ残す"""
+        if self.supabase is None:
+            return
+        try:
+            if hold_seconds:
+                self.supabase.rpc("acquire_work_lease", {"p_key": key, "p_owner": self.owner, "p_lease_seconds": hold_seconds}).execute()
+            else:
+                self.supabase.rpc("release_work_lease", {"p_key": key, "p_owner": self.owner}).execute()
+        except Exception as e:
+            # 解放に失敗してもリースは期限切れで外れる
+            print(f"SINGLEFLIGHT: Failed to release lease {key}. Error: {e}")
+
+    def renew(self, key: str, lease_seconds: Optional[int] = None) -> bool:
+        """
+        実行中の仕事のリースを今から lease_seconds 秒 (省略時は self.lease_seconds) に延ばす。
+        長く続く仕事は途中で呼び、期限切れで他のプロセスに同じ仕事を始めさせない。
+        延ばせなかった (既に他のプロセスに取られていた) 場合は False を返す
+        """
+        if self.supabase is None:
+            return True
+        try:
+            response = self.supabase.rpc(
+                "acquire_work_lease", {"p_key": key, "p_owner": self.owner, "p_lease_seconds": lease_seconds or self.lease_seconds},
+            ).execute()
+            return bool(response.data)
+        except Exception as e:
+            # 延長に失敗しても仕事は続ける (次の延長で取り戻す)
+            print(f"SINGLEFLIGHT: Failed to renew lease {key}. Error: {e}")
+            return False
+
+    def release(self, key: str) -> None:
+        """hold_seconds で残したリースを、結果がDBに現れた (または諦めた) 時点で外す"""
+        self._release_lease(key)
+
+    def _wait_turn(self, key: str, lookup: Optional[Callable[[], Any]]) -> Tuple[bool, Any]:
+        """
+        リースが取れるまで待つ。待っている間に他のプロセスの結果が lookup で見つかれば (False, 結果) を、
+        リースが取れたら (True, None) を返す
+        """
+        started_at = time.perf_counter()
+        while not self._try_lease(key):
+            found = lookup() if lookup else None
+            if found is not None:
+                FLIGHT_WAIT_SECONDS.observe(time.perf_counter() - started_at, kind=flight_kind(key), scope="cluster")
+                return False, found
+            time.sleep(self.poll_interval)
+        if time.perf_counter() - started_at > self.poll_interval:
+            FLIGHT_WAIT_SECONDS.observe(time.perf_counter() - started_at, kind=flight_kind(key), scope="cluster")
+        # リースを取る直前に他が終えていたかもしれないので、もう一度だけ確かめる
+        found = lookup() if lookup else None
+        if found is not None:
+            self._release_lease(key)
+            return False, found
+        return True, None
+
+    # --- 呼び出し ---
+
+    def do(self, key: str, fn: Callable[[], Any], lookup: Optional[Callable[[], Any]] = None, hold_seconds: int = 0) -> Any:
+        """
+        keyの仕事を実行して結果を返す。同じkeyの仕事が実行中ならそれを待って同じ結果を返す (スレッド用)。
+        lookup は既に終わった結果 (他のプロセスの分も) を探す関数 (見つからなければNone)。
+        結果がDBに現れるのが fn の後になる仕事は、hold_seconds で終了後もその秒数だけ他のプロセスを待たせる
+        """
+        future, leader = self._join(key)
+        if not leader:
+            started_at = time.perf_counter()
+            try:
+                return future.result()
+            finally:
+                FLIGHT_WAIT_SECONDS.observe(time.perf_counter() - started_at, kind=flight_kind(key), scope="process")
+        try:
+            acquired, result = self._wait_turn(key, lookup)
+            if acquired:
+                try:
+                    result = fn()
+                except BaseException:
+                    self._release_lease(key)
+                    raise
+                self._release_lease(key, hold_seconds)
+        except BaseException as e:
+            self._finish(key, future, error=e)
+            raise
+        self._finish(key, future, result)
+        return result
+
+    async def do_async(self, key: str, fn: Callable[[], Awaitable[Any]], lookup: Optional[Callable[[], Any]] = None, hold_seconds: int = 0) -> Any:
+        """do() のコルーチン版。fn はコルーチン関数、lookup はスレッドで実行する同期関数"""
+        future, leader = self._join(key)
+        if not leader:
+            started_at = time.perf_counter()
+            try:
+                result = await asyncio.wrap_future(future)
+            finally:
+                FLIGHT_WAIT_SECONDS.observe(time.perf_counter() - started_at, kind=flight_kind(key), scope="process")
+            # 実行していた側がキャンセルされた場合は、待っていた側が改めて実行する
+            return await self.do_async(key, fn, lookup, hold_seconds) if result is _CANCELLED else result
+        started_at = time.perf_counter()
+        try:
+            while True:
+                acquired = await asyncio.to_thread(self._try_lease, key)
+                result = await asyncio.to_thread(lookup) if lookup else None
+                if acquired and result is None:
+                    try:
+                        result = await fn()
+                    except BaseException:
+                        await asyncio.to_thread(self._release_lease, key)
+                        raise
+                    await asyncio.to_thread(self._release_lease, key, hold_seconds)
+                    break
+                if acquired:
+                    # リースを取る直前に他が終えていた
+                    await asyncio.to_thread(self._release_lease, key)
+                    break
+                if result is not None:
+                    FLIGHT_WAIT_SECONDS.observe(time.perf_counter() - started_at, kind=flight_kind(key), scope="cluster")
+                    break
+                await asyncio.sleep(self.poll_interval)
+        except asyncio.CancelledError:
+            self._finish(key, future, _CANCELLED)
+            raise
+        except BaseException as e:
+            self._finish(key, future, error=e)
+            raise
+        self._finish(key, future, result)
+        return result
+
+
+_default_flight: Optional[SingleFlight] = None
+_default_flight_lock = threading.Lock()
+
+
+def get_single_flight() -> SingleFlight:
+    """プロセス共通の登録簿を返す (データベースの work_lease でプロセス間もまとめる)"""
+    global _default_flight
+    with _default_flight_lock:
+        if _default_flight is None:
+            _default_flight = SingleFlight(get_client())
+        return _default_flight
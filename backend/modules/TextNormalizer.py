@@ -0,0 +1,271 @@
+"""
+backend/modules/TextNormalizer.py
+
+This module rewrites a summary into text that VOICEVOX reads correctly and quickly, before
+synthesis. Gemini summaries mix Japanese with English technical terms, acronyms and numbers
+("HippoRAG2", "GPT-3.5", "28.4 BLEU", "1,000件"), which the engine analyzes slowly and often
+misreads, forcing a re-generation.
+- Terms from the reading dictionary (backend/data/reading_dictionary.tsv, plus the file in
+  READING_DICTIONARY_PATH if set) are replaced by their katakana reading in one pass with a
+  compiled Aho-Corasick automaton (leftmost-longest, case-insensitive, whole words only).
+- Remaining upper-case acronyms are spelled out letter by letter (CNN -> シーエヌエヌ).
+- Numbers are expanded: standalone numbers become kanji numerals (1,000 -> 千, 28.4 -> 二十八点四,
+  % -> パーセント), and version numbers glued to a term are read in English (GPT-4 -> ジーピーティーフォー).
+- Markdown, URLs and extra spaces are removed, and the text is split into sentences.
+Normalized sentences are cached (LRU), since the same sentence is synthesized for every voice
+and every variant. dictionary_words() gives the readings with accent types, which
+VoicevoxClient.load_user_dictionary() registers in each engine so the replaced katakana is read
+as one word with the right accent.
+"""
+
+import os
+import re
+import threading
+import unicodedata
+from collections import deque
+from functools import lru_cache
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+DEFAULT_DICTIONARY_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'data', 'reading_dictionary.tsv'))
+# 正規化した文を覚えておく件数
+NORMALIZE_CACHE_SIZE = 8192
+# 1回の音声合成リクエストにまとめる最大文字数の既定値 (短い文は次の文とまとめてリクエスト数を減らす)
+MAX_SEGMENT_CHARS = 120
+
+_SENTENCE_END = re.compile(r"(?<=[。！？!?])")
+_MARKDOWN = re.compile(r"\*\*|__|`+|^#+\s*|^\s*[-*]\s+", re.MULTILINE)
+_URL = re.compile(r"https?://\S+")
+_SPACES = re.compile(r"\s+")
+_ACRONYM = re.compile(r"(?<![A-Za-z])[A-Z]{1,6}(?![A-Za-z])")
+# 英字の直後 (GPT-4, HippoRAG2) の数字はバージョンとして英語で読む
+_VERSION = re.compile(r"(?<=[A-Za-z])-?(\d+(?:\.\d+)*)")
+_NUMBER = re.compile(r"\d{1,3}(?:,\d{3})+(?:\.\d+)?|\d+(?:\.\d+)?")
+
+LETTER_READINGS = {
+    "A": "エー", "B": "ビー", "C": "シー", "D": "ディー", "E": "イー", "F": "エフ", "G": "ジー", "H": "エイチ",
+    "I": "アイ", "J": "ジェー", "K": "ケー", "L": "エル", "M": "エム", "N": "エヌ", "O": "オー", "P": "ピー",
+    "Q": "キュー", "R": "アール", "S": "エス", "T": "ティー", "U": "ユー", "V": "ブイ", "W": "ダブリュー",
+    "X": "エックス", "Y": "ワイ", "Z": "ゼット",
+}
+ENGLISH_DIGITS = ("ゼロ", "ワン", "ツー", "スリー", "フォー", "ファイブ", "シックス", "セブン", "エイト", "ナイン")
+KANJI_DIGITS = "〇一二三四五六七八九"
+# 4桁ごとの単位
+KANJI_LARGE_UNITS = ("", "万", "億", "兆", "京")
+# アクセント核を置けない特殊拍 (自動で決める時に1つ前へずらす)
+_SPECIAL_MORAE = set("ーッン")
+_SMALL_KANA = set("ャュョァィゥェォヮ")
+_ASCII_LOWER = str.maketrans("ABCDEFGHIJKLMNOPQRSTUVWXYZ", "abcdefghijklmnopqrstuvwxyz")
+
+
+class AhoCorasick:
+    """
+    複数の語を1回の走査で探すオートマトン。語は構築時に全て登録し、以後は読み取り専用 (スレッド間で共有できる)
+    """
+    def __init__(self, words: Dict[str, str]):
+        # ノードごとの遷移・失敗リンク・そのノードで終わる語 (長さ, 値) の一覧 (失敗リンク先の分も含む)
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._outputs: List[List[Tuple[int, str]]] = [[]]
+        for word, value in words.items():
+            self._add(word, value)
+        self._build()
+
+    def _add(self, word: str, value: str) -> None:
+        node = 0
+        for char in word:
+            next_node = self._goto[node].get(char)
+            if next_node is None:
+                next_node = len(self._goto)
+                self._goto[node][char] = next_node
+                self._goto.append({})
+                self._fail.append(0)
+                self._outputs.append([])
+            node = next_node
+        self._outputs[node] = [(len(word), value)]
+
+    def _build(self) -> None:
+        # 幅優先で失敗リンクを張る (根からの深さが浅いノードのリンクが先に決まる)
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(char, 0)
+                self._outputs[child] = self._outputs[child] + self._outputs[self._fail[child]]
+
+    def finditer(self, text: str) -> Iterator[Tuple[int, int, str]]:
+        """text に現れる全ての語を (開始位置, 終了位置, 値) で返す (重なりを含む)"""
+        node = 0
+        for i, char in enumerate(text):
+            while node and char not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(char, 0)
+            for length, value in self._outputs[node]:
+                yield i + 1 - length, i + 1, value
+
+
+def default_accent(reading: str) -> int:
+    """
+    外来語の規則 (後ろから3拍目にアクセント核、特殊拍なら1つ前) でアクセント型を決める
+    """
+    morae = [char for char in reading if char not in _SMALL_KANA]
+    if len(morae) <= 2:
+        return 1
+    position = len(morae) - 2
+    while position > 1 and morae[position - 1] in _SPECIAL_MORAE:
+        position -= 1
+    return position
+
+
+def load_dictionary(paths: Iterable[str]) -> Dict[str, Tuple[str, Optional[int]]]:
+    """辞書ファイルを読み、{表記: (読み, アクセント型)} を返す (後のファイルの表記が優先)"""
+    entries: Dict[str, Tuple[str, Optional[int]]] = {}
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                line = line.rstrip("\n")
+                if not line.strip() or line.startswith("#"):
+                    continue
+                columns = line.split("\t")
+                surface, reading = columns[0].strip(), columns[1].strip()
+                accent = columns[2].strip() if len(columns) > 2 else ""
+                entries[surface] = (reading, int(accent) if accent else None)
+    return entries
+
+
+def kanji_number(number: int) -> str:
+    """整数を漢数字の読みにする (1,234 -> 千二百三十四)"""
+    if number == 0:
+        return "ゼロ"
+    groups = []
+    unit = 0
+    while number:
+        number, group = divmod(number, 10000)
+        if group:
+            text = ""
+            for digit_unit, name in ((1000, "千"), (100, "百"), (10, "十")):
+                digit, group = divmod(group, digit_unit)
+                if digit:
+                    # 千・百・十の前の「一」は読まない (一万・一億は読む)
+                    text += ("" if digit == 1 else KANJI_DIGITS[digit]) + name
+            if group:
+                text += KANJI_DIGITS[group]
+            groups.append(text + KANJI_LARGE_UNITS[unit])
+        unit += 1
+    return "".join(reversed(groups))
+
+
+def read_number(text: str) -> str:
+    """数字の表記 (1,000 / 28.4) を読みにする。小数部は1桁ずつ読む"""
+    integer, _, fraction = text.replace(",", "").partition(".")
+    reading = kanji_number(int(integer))
+    if fraction:
+        reading = ("レー" if integer == "0" else reading) + "点" + "".join(KANJI_DIGITS[int(digit)] for digit in fraction)
+    return reading
+
+
+def read_version(match: re.Match) -> str:
+    """英字に続くバージョン番号 (4 / 3.5) を英語で読む"""
+    return "ポイント".join("".join(ENGLISH_DIGITS[int(digit)] for digit in part) for part in match.group(1).split("."))
+
+
+def split_sentences(text: str, max_chars: int = MAX_SEGMENT_CHARS) -> List[str]:
+    """文の単位に分け、短い文は max_chars まで次の文とまとめる"""
+    segments: List[str] = []
+    for sentence in (s.strip() for s in _SENTENCE_END.split(text)):
+        if not sentence:
+            continue
+        if segments and len(segments[-1]) + len(sentence) <= max_chars:
+            segments[-1] += sentence
+        else:
+            segments.append(sentence)
+    return segments
+
+
+def clean_text(text: str) -> str:
+    """読み上げに不要な記号・URL・余分な空白を取り除く"""
+    return _SPACES.sub(" ", _URL.sub("", _MARKDOWN.sub("", text))).strip()
+
+
+class TextNormalizer:
+    """
+    読み上げ辞書で表記を読みに置き換え、略語・数字を読みに展開する。正規化した文はLRUで覚えておく
+    """
+    def __init__(self, entries: Dict[str, Tuple[str, Optional[int]]], cache_size: int = NORMALIZE_CACHE_SIZE):
+        self.entries = entries
+        # 英字は小文字にして照合する (同じ長さのまま変換できるのはASCIIだけなので、ASCIIだけ小文字にする)
+        self._matcher = AhoCorasick({surface.translate(_ASCII_LOWER): reading for surface, (reading, _) in entries.items()})
+        self._normalize_sentence = lru_cache(maxsize=cache_size)(self._normalize_uncached)
+
+    def replace_terms(self, text: str) -> str:
+        """辞書の表記を読みに置き換える (左から、最も長い語を優先し、英単語の途中では置き換えない)"""
+        lowered = text.translate(_ASCII_LOWER)
+        matches = sorted(self._matcher.finditer(lowered), key=lambda match: (match[0], match[0] - match[1]))
+        parts, position = [], 0
+        for start, end, reading in matches:
+            if start < position:
+                continue
+            # 英単語の一部 (attention の中の tent など) は置き換えない
+            if (start > 0 and lowered[start - 1].isascii() and lowered[start - 1].isalpha()
+                    and lowered[start].isascii() and lowered[start].isalpha()):
+                continue
+            if (end < len(lowered) and lowered[end].isascii() and lowered[end].isalpha()
+                    and lowered[end - 1].isascii() and lowered[end - 1].isalpha()):
+                continue
+            parts += [text[position:start], reading]
+            position = end
+        parts.append(text[position:])
+        return "".join(parts)
+
+    def _normalize_uncached(self, sentence: str) -> str:
+        # バージョン番号は英字と切り離してから辞書を引く (HippoRAG2 -> HippoRAGツー -> ヒッポラグツー)
+        text = _VERSION.sub(read_version, sentence)
+        text = self.replace_terms(text)
+        text = _ACRONYM.sub(lambda match: "".join(LETTER_READINGS[char] for char in match.group(0)), text)
+        text = _NUMBER.sub(lambda match: read_number(match.group(0)), text)
+        return text.replace("%", "パーセント")
+
+    def normalize(self, text: str) -> str:
+        """要約全体を読み上げ用の文字列にする"""
+        return "".join(self.segments(text, max_chars=0))
+
+    def segments(self, text: str, max_chars: int = MAX_SEGMENT_CHARS) -> List[str]:
+        """要約を読み上げ用に正規化し、並列に合成できるよう文の単位に分ける (max_chars=0 なら文ごと)"""
+        # 全角英数字は半角に、半角カナは全角にそろえてから照合する
+        text = clean_text(unicodedata.normalize("NFKC", text))
+        sentences = [self._normalize_sentence(sentence) for sentence in split_sentences(text, 0)]
+        return split_sentences("".join(sentences), max_chars) if max_chars else sentences
+
+    def cache_info(self):
+        return self._normalize_sentence.cache_info()
+
+    def dictionary_words(self) -> List[Tuple[str, int]]:
+        """エンジンのユーザー辞書に登録する (読み, アクセント型) の一覧"""
+        words = {}
+        for reading, accent in self.entries.values():
+            words[reading] = accent if accent is not None else default_accent(reading)
+        return sorted(words.items())
+
+
+_default_normalizer: Optional[TextNormalizer] = None
+_default_normalizer_lock = threading.Lock()
+
+
+def get_normalizer() -> TextNormalizer:
+    """プロセス共通の正規化器を返す (辞書は初めて使う時に読み込む)"""
+    global _default_normalizer
+    with _default_normalizer_lock:
+        if _default_normalizer is None:
+            paths = [DEFAULT_DICTIONARY_PATH]
+            if os.environ.get("READING_DICTIONARY_PATH"):
+                paths.append(os.environ["READING_DICTIONARY_PATH"])
+            _default_normalizer = TextNormalizer(load_dictionary(paths))
+        return _default_normalizer
+
+
+def normalize_for_speech(summary: str) -> str:
+    """要約を読み上げ用の文字列にする (音声合成に渡す直前に使う。表示用の要約はそのまま)"""
+    return get_normalizer().normalize(summary)
@@ -0,0 +1,175 @@
+"""
+backend/modules/VoiceVariants.py
+
+This module keeps audio for several voices of the same summary, so that switching the
+voice in the settings screen is a pointer change instead of a feed regeneration.
+With VOICE_VARIANTS=K (opt-in, 0 = off), every time a summary is synthesized for a feed,
+the top K most used voice_types are also synthesized in the background and stored as
+paper_asset rows with is_variant = true. The variant work runs at backfill priority under
+its own tenant in FairScheduler, so it never delays a user's next item.
+switch_voice() calls the switch_feed_voice database function, which repoints every feed
+row that has an asset for the new voice, removes the rest (the caller generates only that
+many new items) and logs the outcome to voice_switch.
+`python -m backend.modules.VoiceVariants --days 7` prints a cost/benefit report from that
+log: extra syntheses spent on variants versus syntheses avoided when users switched.
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional
+
+# プロジェクトルートをパスに追加
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from backend.modules.AudioStore import get_audio_store
+from backend.modules.Database import get_client
+from backend.modules.FairScheduler import HEAD_ITEMS, get_scheduler
+from backend.modules.Metrics import span
+from backend.modules.TextNormalizer import normalize_for_speech
+
+# 生成時に合わせて音声を作る人気の話者の数 (0なら作らない)
+VOICE_VARIANTS = int(os.environ.get("VOICE_VARIANTS", 0))
+# 話者の人気の集計を使い回す秒数
+POPULAR_VOICES_TTL = 600
+# 変種の音声合成を同時に何件まで行うか (実際の同時数は FairScheduler の枠で決まる)
+VARIANT_THREADS = 4
+# 変種の生成は1人のユーザーとして扱い、バックフィルの優先度で枠を取る
+VARIANT_TENANT = "voice_variants"
+# 1件の音声合成にかかる秒数の目安 (レポートの既定値。VOICEVOXのCPU時間)
+DEFAULT_SYNTHESIS_SECONDS = 2.0
+
+_popular_voices: List[int] = []
+_popular_voices_at = 0.0
+_popular_voices_lock = threading.Lock()
+_variant_executor: Optional[ThreadPoolExecutor] = None
+
+
+def popular_voice_types(supabase: Any, k: int = VOICE_VARIANTS) -> List[int]:
+    """利用者の多い話者を多い順にk件返す (集計は POPULAR_VOICES_TTL 秒ごとに取り直す)"""
+    global _popular_voices, _popular_voices_at
+    with _popular_voices_lock:
+        if time.monotonic() - _popular_voices_at > POPULAR_VOICES_TTL:
+            counts = Counter(item['voice_type'] for item in (supabase.table("user_info").select("voice_type").execute().data or []))
+            _popular_voices = [voice for voice, _ in counts.most_common()]
+            _popular_voices_at = time.monotonic()
+        return _popular_voices[:k]
+
+
+def missing_variant_voices(supabase: Any, paper_id: Any, voice_type: int) -> List[int]:
+    """この論文でまだ音声がない人気の話者を返す (要求された話者は除く)"""
+    if VOICE_VARIANTS <= 0:
+        return []
+    candidates = [voice for voice in popular_voice_types(supabase) if voice != voice_type]
+    if not candidates:
+        return []
+    existing_res = supabase.table("paper_asset").select("voice_type").eq("paper_id", paper_id).in_("voice_type", candidates).execute()
+    existing = {item['voice_type'] for item in existing_res.data or []}
+    return [voice for voice in candidates if voice not in existing]
+
+
+def synthesize_variants(supabase: Any, paper_id: Any, summary: str, voice_types: Iterable[int], voice_client: Any, scheduler=None) -> int:
+    """
+    同じ要約を複数の話者で並列に音声合成し、is_variant=true のアセットとしてまとめて保存する。保存した件数を返す
+    """
+    scheduler = scheduler or get_scheduler()
+    speech_text = normalize_for_speech(summary)
+
+    def synthesize(voice_type: int) -> Optional[Dict[str, Any]]:
+        try:
+            with scheduler.slot(VARIANT_TENANT, position=HEAD_ITEMS):
+                with span("voicevox_variant", paper_id=paper_id, voice_type=voice_type):
+                    voice_key = get_audio_store().put_stream(voice_client.stream_voice(text=speech_text, speaker=voice_type))
+        except Exception as e:
+            print(f"BACKGROUND: Failed to synthesize voice variant {voice_type} for paper_id: {paper_id}. Error: {e}")
+            return None
+        return {"paper_id": paper_id, "voice_type": voice_type, "gemini_abstract": summary, "voice_key": voice_key, "is_variant": True}
+
+    voice_types = list(voice_types)
+    if not voice_types:
+        return 0
+    with ThreadPoolExecutor(max_workers=min(VARIANT_THREADS, len(voice_types)), thread_name_prefix="voice-variant") as pool:
+        assets = [asset for asset in pool.map(synthesize, voice_types) if asset]
+    if assets:
+        # 同時に他のユーザーが同じ話者で生成していた場合は、そちらを残す
+        supabase.table("paper_asset").upsert(assets, on_conflict="paper_id,voice_type", ignore_duplicates=True).execute()
+        print(f"BACKGROUND: Stored {len(assets)} voice variants {[a['voice_type'] for a in assets]} for paper_id: {paper_id}")
+    return len(assets)
+
+
+def schedule_variants(supabase: Any, paper_id: Any, summary: str, voice_type: int, voice_client: Any, scheduler=None) -> None:
+    """人気の話者の音声をバックグラウンドで作り始める (呼び出し元のフィード生成は待たない)"""
+    global _variant_executor
+    if VOICE_VARIANTS <= 0:
+        return
+
+    def run() -> None:
+        try:
+            synthesize_variants(supabase, paper_id, summary, missing_variant_voices(supabase, paper_id, voice_type), voice_client, scheduler)
+        except Exception as e:
+            print(f"BACKGROUND ERROR: Voice variants failed for paper_id: {paper_id}. Error: {e}")
+    with _popular_voices_lock:
+        if _variant_executor is None:
+            _variant_executor = ThreadPoolExecutor(max_workers=VARIANT_THREADS, thread_name_prefix="voice-variants")
+    _variant_executor.submit(run)
+
+
+def switch_voice(supabase: Any, user_id: int, voice_type: int) -> Optional[Dict[str, int]]:
+    """
+    ユーザーの話者を変更し、フィードの音声を新しい話者のアセットへ付け替える。
+    戻り値は {"repointed", "removed", "variant_hits"} (ユーザーが存在しなければNone)
+    """
+    response = supabase.rpc("switch_feed_voice", {"p_user_id": user_id, "p_voice_type": voice_type}).execute()
+    return response.data[0] if response.data else None
+
+
+def build_report(supabase: Any, days: float = 7.0, synthesis_seconds: float = DEFAULT_SYNTHESIS_SECONDS) -> Dict[str, Any]:
+    """
+    直近days日の利用状況から、変種の音声合成に使った時間と、話者の切り替えで省けた音声合成の時間を比べる
+    """
+    since = (datetime.now(timezone.utc) - timedelta(days=days)).isoformat()
+    switches = supabase.table("voice_switch").select("to_voice, repointed, removed, variant_hits").gte("created_at", since).execute().data or []
+    variants = supabase.table("paper_asset").select("voice_type").eq("is_variant", True).gte("created_at", since).execute().data or []
+
+    repointed = sum(item['repointed'] for item in switches)
+    removed = sum(item['removed'] for item in switches)
+    variant_hits = sum(item['variant_hits'] for item in switches)
+    # 変種がなければ、付け替えられた行のうち変種だった分は再生成 (音声合成) が必要だった
+    extra_seconds = len(variants) * synthesis_seconds
+    avoided_seconds = variant_hits * synthesis_seconds
+    return {
+        "window_days": days,
+        "voice_variants_k": VOICE_VARIANTS,
+        "popular_voices": popular_voice_types(supabase, max(VOICE_VARIANTS, 5)),
+        "voice_switches": len(switches),
+        "switch_targets": dict(Counter(item['to_voice'] for item in switches).most_common()),
+        "items_repointed": repointed,
+        "items_regenerated": removed,
+        "repoint_rate": round(repointed / (repointed + removed), 3) if repointed + removed else None,
+        "variant_syntheses": len(variants),
+        "variant_hits": variant_hits,
+        "variant_use_rate": round(variant_hits / len(variants), 4) if variants else None,
+        "extra_synthesis_seconds": round(extra_seconds, 1),
+        "avoided_synthesis_seconds": round(avoided_seconds, 1),
+        "net_synthesis_seconds": round(avoided_seconds - extra_seconds, 1),
+        # 変種1件の合成は、切り替えで1回使われれば元が取れる (切り替え時の待ち時間の短縮は含めていない)
+        "pays_off": avoided_seconds >= extra_seconds,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="話者の変種の音声合成の費用対効果をレポートする")
+    parser.add_argument("--days", type=float, default=7.0, help="集計する期間 (日)")
+    parser.add_argument("--synthesis-seconds", type=float, default=DEFAULT_SYNTHESIS_SECONDS, help="音声合成1件あたりの時間 (秒)")
+    args = parser.parse_args()
+    print(json.dumps(build_report(get_client(), args.days, args.synthesis_seconds), indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
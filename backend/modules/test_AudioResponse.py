@@ -0,0 +1,68 @@
+import os
+import sys
+import tempfile
+
+# プロジェクトルートをパスに追加
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from fastapi.responses import FileResponse
+
+from backend.modules.AudioResponse import RANGE_CHUNK_SIZE, _iter_mmap, audio_file_response, parse_range
+
+FILE_SIZE = 1000
+
+
+def expect_unsatisfiable(range_header, file_size=FILE_SIZE):
+    try:
+        parse_range(range_header, file_size)
+    except ValueError:
+        return
+    raise AssertionError(f"{range_header} でValueErrorになりませんでした")
+
+
+def run_test():
+    """Rangeヘッダーの解釈と、206・416・全体のレスポンスが正しく作られるかを検証する"""
+    print("--- テスト開始: AudioResponse ---")
+
+    # 1. 単一範囲: 通常・末尾からNバイト・終わりの省略・ファイルより長い終了位置
+    assert parse_range("bytes=0-99", FILE_SIZE) == (0, 99)
+    assert parse_range(" bytes=100-199 ", FILE_SIZE) == (100, 199)
+    assert parse_range("bytes=-100", FILE_SIZE) == (900, 999)
+    assert parse_range("bytes=-5000", FILE_SIZE) == (0, 999)
+    assert parse_range("bytes=500-", FILE_SIZE) == (500, 999)
+    assert parse_range("bytes=990-5000", FILE_SIZE) == (990, 999)
+    print("[成功] 単一範囲・末尾指定・終わりの省略を解釈する")
+
+    # 2. 単一範囲でないもの (なし・複数範囲・単位違い・空) は全体を返す
+    for header in (None, "", "bytes=0-1,5-6", "items=0-1", "bytes=-", "bytes=a-b"):
+        assert parse_range(header, FILE_SIZE) is None, header
+    print("[成功] 複数範囲や解釈できないRangeは全体を返す")
+
+    # 3. ファイルの外・逆順・長さ0の末尾指定は416
+    for header in ("bytes=1000-", "bytes=1000-1001", "bytes=500-100", "bytes=-0"):
+        expect_unsatisfiable(header)
+    print("[成功] 満たせない範囲はValueError")
+
+    # 4. レスポンス: 206は要求した範囲だけを返し、416と全体はそれぞれの形で返す
+    data = bytes(i % 251 for i in range(3 * RANGE_CHUNK_SIZE + 123))
+    path = os.path.join(tempfile.mkdtemp(prefix="test_audio_response_"), "audio.wav")
+    with open(path, "wb") as f:
+        f.write(data)
+    start, end = RANGE_CHUNK_SIZE - 10, 2 * RANGE_CHUNK_SIZE + 50
+    assert b"".join(_iter_mmap(path, start, end)) == data[start:end + 1]
+    assert b"".join(_iter_mmap(path, len(data) - 7, len(data) - 1)) == data[-7:]
+    response = audio_file_response(path, f"bytes={start}-{end}")
+    assert response.status_code == 206
+    assert response.headers["content-range"] == f"bytes {start}-{end}/{len(data)}"
+    assert response.headers["content-length"] == str(end - start + 1)
+    response = audio_file_response(path, f"bytes={len(data)}-")
+    assert response.status_code == 416 and response.headers["content-range"] == f"bytes */{len(data)}"
+    response = audio_file_response(path, "bytes=0-1,5-6")
+    assert isinstance(response, FileResponse) and response.headers["accept-ranges"] == "bytes"
+    print("[成功] 206・416・全体のレスポンスを返す")
+
+    print("\n--- テスト終了 ---")
+
+
+if __name__ == "__main__":
+    run_test()
@@ -0,0 +1,104 @@
+import base64
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import tracemalloc
+
+# プロジェクトルートをパスに追加
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from backend.modules.AudioStore import AUDIO_CHUNK_SIZE, CachedAudioStore, LocalAudioStore, audio_key, encode_base64_file, is_audio_key
+from backend.benchmarks.fakes import FakeVoicevoxServer
+
+# テストする音声のサイズ (約16MB) と、1件あたりに許すピークメモリ
+AUDIO_BYTES = 256 * AUDIO_CHUNK_SIZE
+STREAM_PEAK_LIMIT = 1024 * 1024
+
+
+def generate_chunks(total: int = AUDIO_BYTES):
+    """音声全体をメモリに持たずにチャンクを作る"""
+    for start in range(0, total, AUDIO_CHUNK_SIZE):
+        yield bytes([start // AUDIO_CHUNK_SIZE % 256]) * min(AUDIO_CHUNK_SIZE, total - start)
+
+
+def measure_peak(func):
+    """funcの実行中に増えたメモリのピーク (バイト) と戻り値を返す"""
+    tracemalloc.start()
+    try:
+        result = func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak, result
+
+
+def run_test():
+    """音声の保存・base64変換がファイル全体ではなくチャンク分のメモリで済むかを検証する"""
+    print("--- テスト開始: AudioStore (ストリーミング) ---")
+    directory = tempfile.mkdtemp(prefix="test_audio_")
+    store = LocalAudioStore(os.path.join(directory, "audio"))
+    expected_digest = hashlib.sha256()
+    for chunk in generate_chunks():
+        expected_digest.update(chunk)
+
+    # 1. 以前の方式 (bytes全体 + base64文字列 + JSONの本文) のピークを基準として測る
+    def buffered():
+        data = b"".join(generate_chunks())
+        voice = base64.b64encode(data).decode('ascii')
+        return len(json.dumps({"voice": voice}))
+    buffered_peak, _ = measure_peak(buffered)
+    print(f"[情報] 全体をメモリに載せる場合のピーク: {buffered_peak / 1024 ** 2:.1f}MB ({buffered_peak / AUDIO_BYTES:.2f}倍)")
+
+    # 2. put_stream: チャンクを書きながらハッシュを計算し、ピークはチャンク数個分に収まる
+    stream_peak, key = measure_peak(lambda: store.put_stream(generate_chunks()))
+    assert key == f"{expected_digest.hexdigest()[:2]}/{expected_digest.hexdigest()}.wav"
+    assert os.path.getsize(store.local_path(key)) == AUDIO_BYTES
+    assert stream_peak < STREAM_PEAK_LIMIT, f"put_stream のピークが大きすぎます: {stream_peak}"
+    assert store.put(b"abc") == audio_key(b"abc") and store.get(audio_key(b"abc")) == b"abc"
+    # クライアントから受け取ったキーは、内容から作った形のものだけを受け付ける
+    assert is_audio_key(key) and not is_audio_key("../" + key) and not is_audio_key(key.replace(".wav", "/../x.wav"))
+    print(f"[成功] put_stream のピーク: {stream_peak / 1024:.0f}KB")
+
+    # 3. リモートの手前のディスクキャッシュも、一時ファイルからアップロードするのでピークは変わらない
+    cached = CachedAudioStore(LocalAudioStore(os.path.join(directory, "remote")), os.path.join(directory, "cache"))
+    cached_peak, cached_key = measure_peak(lambda: cached.put_stream(generate_chunks()))
+    assert cached_key == key and cached.remote.local_path(key) is not None
+    assert cached_peak < STREAM_PEAK_LIMIT, f"CachedAudioStore.put_stream のピークが大きすぎます: {cached_peak}"
+    print(f"[成功] CachedAudioStore.put_stream のピーク: {cached_peak / 1024:.0f}KB")
+
+    # 4. encode_base64_file: 一括変換と同じ結果で、元のbytes全体と変換途中のbytesを持たない
+    #    (返す文字列自体がファイルの1.33倍あり、チャンクの文字列を連結する間はその2倍になる)
+    path = store.local_path(key)
+
+    def read_and_encode():
+        with open(path, "rb") as f:
+            return base64.b64encode(f.read()).decode('ascii')
+    whole_peak, expected = measure_peak(read_and_encode)
+    encode_peak, encoded = measure_peak(lambda: encode_base64_file(path))
+    assert encoded == expected
+    assert encode_peak < whole_peak, f"encode_base64_file のピークが大きすぎます: {encode_peak} (一括: {whole_peak})"
+    print(f"[成功] encode_base64_file のピーク: {encode_peak / AUDIO_BYTES:.2f}倍 (一括変換: {whole_peak / AUDIO_BYTES:.2f}倍)")
+
+    # 5. VOICEVOXの応答を受信しながら保存する (偽のVOICEVOXサーバーを使う)
+    voicevox = FakeVoicevoxServer(latency=0).start()
+    os.environ["VOICEVOX_URL"] = voicevox.url
+    from backend.poc.voicevox.VoicevoxEngine import VoicevoxClient
+    try:
+        client = VoicevoxClient()
+        text = "この論文は新しい手法を提案しています。" * 60  # 約2分半・約7MBのWAV
+        voice_peak, voice_key = measure_peak(lambda: store.put_stream(client.stream_voice(text=text, speaker=3)))
+        size = os.path.getsize(store.local_path(voice_key))
+        assert size > 5 * 1024 ** 2
+        assert voice_peak < STREAM_PEAK_LIMIT * 2, f"VOICEVOXからの保存のピークが大きすぎます: {voice_peak}"
+        assert set(client.last_timings) == {"audio_query", "synthesis"}
+        print(f"[成功] VOICEVOXの応答 {size / 1024 ** 2:.1f}MB を保存した時のピーク: {voice_peak / 1024:.0f}KB")
+    finally:
+        voicevox.stop()
+
+    print("\n--- テスト終了 ---")
+
+
+if __name__ == "__main__":
+    run_test()
@@ -0,0 +1,74 @@
+import base64
+import json
+import os
+import sys
+import tempfile
+
+# プロジェクトルートをパスに追加
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+# APIを読み込む前に、テスト用のSQLiteデータベースを使うようにする
+os.environ["DATABASE_BACKEND"] = "sqlite"
+os.environ["SQLITE_PATH"] = os.path.join(tempfile.mkdtemp(prefix="test_bookmarks_"), "bookmarks.db")
+
+from fastapi.testclient import TestClient
+
+from api.api_fb import _canonical_references_date, app
+from backend.modules.Database import get_client
+
+USER_ID = 1
+# 同じ references_date のブックマークを含める (bookmark_id で順序が決まる)
+DATES = ["2024-05-01T10:00:00.123+00:00"] * 3 + ["2024-04-30T09:00:00.5+00:00", "2024-04-29T08:00:00+00:00"]
+
+
+def make_cursor(value):
+    return base64.urlsafe_b64encode(json.dumps(value).encode('utf-8')).decode('ascii')
+
+
+def run_test():
+    """ブックマークのキーセットページングが全件を重複なく返し、不正なカーソルを400で拒むかを検証する"""
+    print("--- テスト開始: BookmarkPagination ---")
+    supabase = get_client()
+    for i, references_date in enumerate(DATES):
+        supabase.table("paper_info").insert({"paper_id": f"p{i}", "title": f"論文{i}", "author": "Alice", "arxiv_url": f"http://arxiv.org/abs/2405.0000{i}v1"}).execute()
+        supabase.table("bookmark").insert({"user_id": USER_ID, "paper_id": f"p{i}", "references_date": references_date}).execute()
+    client = TestClient(app)
+
+    # 1. 1ページ2件ずつたどると、新しい順 (同じ日時は bookmark_id の大きい順) に全件を1回ずつ返す
+    paper_ids, cursor, pages = [], None, 0
+    while True:
+        params = {"limit": 2, **({"cursor": cursor} if cursor else {})}
+        response = client.get(f"/api/bookmarks/{USER_ID}", params=params)
+        assert response.status_code == 200, response.text
+        body = response.json()
+        paper_ids += [item["paper_id"] for item in body["items"]]
+        assert all(item["title"] and item["url"] for item in body["items"]), body
+        pages += 1
+        cursor = body["next_cursor"]
+        if not cursor:
+            break
+    assert paper_ids == ["p2", "p1", "p0", "p3", "p4"] and pages == 3, (paper_ids, pages)
+    print("[成功] ページをたどると全件を重複なく返す")
+
+    # 2. 同じ内容ならETagで304、fields で列を絞れる
+    first = client.get(f"/api/bookmarks/{USER_ID}", params={"limit": 2})
+    assert client.get(f"/api/bookmarks/{USER_ID}", params={"limit": 2}, headers={"If-None-Match": first.headers["etag"]}).status_code == 304
+    assert set(client.get(f"/api/bookmarks/{USER_ID}", params={"fields": "paper_id,title"}).json()["items"][0]) == {"paper_id", "title"}
+    assert client.get(f"/api/bookmarks/{USER_ID}", params={"fields": "voice"}).status_code == 400
+    print("[成功] ETagと列の指定")
+
+    # 3. カーソルの日時は桁数を保って読み直し、日時でないもの (フィルタへの埋め込みを含む) は400
+    assert _canonical_references_date("2024-05-01T10:00:00.123+00:00") == "2024-05-01T10:00:00.123+00:00"
+    assert _canonical_references_date("2024-04-29T08:00:00+00:00") == "2024-04-29T08:00:00+00:00"
+    assert _canonical_references_date("2024-04-29") == "2024-04-29"
+    for cursor in ("not-base64!", make_cursor(["2024-05-01T10:00:00\",bookmark_id.gt.0", 1]),
+                   make_cursor(["yesterday", 1]), make_cursor(["2024-05-01", "x"]), make_cursor(["2024-05-01"])):
+        response = client.get(f"/api/bookmarks/{USER_ID}", params={"cursor": cursor})
+        assert response.status_code == 400, (cursor, response.status_code)
+    print("[成功] 不正なカーソルは400")
+
+    print("\n--- テスト終了 ---")
+
+
+if __name__ == "__main__":
+    run_test()
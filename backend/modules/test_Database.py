@@ -0,0 +1,73 @@
+import os
+import sys
+import tempfile
+
+# プロジェクトルートをパスに追加
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from backend.modules.Database import SQLiteClient
+
+
+def run_test():
+    """SQLiteClientがこのプロジェクトで使うSupabaseのクエリと同じ結果を返すかを検証する"""
+    print("--- テスト開始: Database (SQLite) ---")
+    client = SQLiteClient(os.path.join(tempfile.mkdtemp(prefix="test_db_"), "app.sqlite3"))
+
+    # 1. upsert_papers: 新規は inserted、内容が変わった新しい版は updated、同じ内容は返らない
+    paper = {"paper_id": "2401.00001v1", "arxiv_id": "2401.00001", "arxiv_version": 1, "title": "T", "author": "A, B",
+             "arxiv_url": "http://arxiv.org/abs/2401.00001v1", "abstract": "x", "content_hash": "h1"}
+    assert [r["action"] for r in client.rpc("upsert_papers", {"papers": [paper]}).execute().data] == ["inserted"]
+    assert client.rpc("upsert_papers", {"papers": [paper]}).execute().data == []
+    revised = dict(paper, arxiv_version=2, title="T2", content_hash="h2")
+    assert client.rpc("upsert_papers", {"papers": [revised]}).execute().data[0]["action"] == "updated"
+    print("[成功] upsert_papers")
+
+    # 2. dequeue_feed: 古い順に取り出され、2回目には返らない
+    client.table("feed").insert([{"feed_id": i, "user_id": 1, "paper_id": f"p{i}", "gemini_abstract": "g"} for i in (1, 2, 3)]).execute()
+    # 同じユーザー・論文の2行目は入らない (feed(user_id, paper_id) は一意)
+    assert client.table("feed").upsert({"user_id": 1, "paper_id": "p3"}, on_conflict="user_id,paper_id", ignore_duplicates=True).execute().data == []
+    assert [r["feed_id"] for r in client.rpc("dequeue_feed", {"p_user_id": 1, "p_count": 2}).execute().data] == [1, 2]
+    assert [r["feed_id"] for r in client.table("feed").select("feed_id").eq("user_id", 1).execute().data] == [3]
+    print("[成功] dequeue_feed")
+
+    # 2b. work_lease: 他の持ち主のリースは期限まで取れず、解放すれば取れる
+    lease = {"p_key": "asset:p1:3", "p_lease_seconds": 60}
+    assert client.rpc("acquire_work_lease", dict(lease, p_owner="a")).execute().data is True
+    assert client.rpc("acquire_work_lease", dict(lease, p_owner="b")).execute().data is False
+    client.rpc("release_work_lease", {"p_key": "asset:p1:3", "p_owner": "a"}).execute()
+    assert client.rpc("acquire_work_lease", dict(lease, p_owner="b")).execute().data is True
+    # 期限が切れたリースは他の持ち主が取り直せる
+    client.rpc("acquire_work_lease", dict(lease, p_owner="b", p_lease_seconds=-1)).execute()
+    assert client.rpc("acquire_work_lease", dict(lease, p_owner="c")).execute().data is True
+    print("[成功] work_lease")
+
+    # 3. bookmark: 冪等なupsert、外部キー違反は23503、トグル、joinした一覧
+    for _ in range(2):
+        client.table("bookmark").upsert({"user_id": 1, "paper_id": paper["paper_id"]}, on_conflict="user_id,paper_id", ignore_duplicates=True).execute()
+    try:
+        client.table("bookmark").insert({"user_id": 1, "paper_id": "missing"}).execute()
+        raise AssertionError("外部キー違反が検出されませんでした")
+    except Exception as e:
+        assert "23503" in str(e)
+    rows = client.table("bookmark").select("bookmark_id, paper_info(title)").eq("user_id", 1).execute().data
+    assert rows == [{"bookmark_id": 1, "paper_info": {"title": "T2"}}]
+    assert client.rpc("toggle_bookmark", {"p_user_id": 1, "p_paper_id": paper["paper_id"]}).execute().data == [{"is_bookmarked": False}]
+    print("[成功] bookmark")
+
+    # 4. フィルター: not_.in_、or_ (キーセットページング)、single() で行がない場合は PGRST116
+    assert client.table("paper_info").select("paper_id").not_.in_("paper_id", [paper["paper_id"]]).execute().data == []
+    client.table("bookmark").insert([{"user_id": 2, "paper_id": paper["paper_id"], "references_date": "2024-01-01"}]).execute()
+    page = client.table("bookmark").select("bookmark_id").eq("user_id", 2).or_('references_date.lt."2024-01-02",and(references_date.eq."2024-01-02",bookmark_id.lt.9)').execute().data
+    assert len(page) == 1
+    try:
+        client.table("user_info").select("voice_type").eq("user_id", 404).single().execute()
+        raise AssertionError("single() が空の結果で失敗しませんでした")
+    except Exception as e:
+        assert "PGRST116" in str(e)
+    print("[成功] フィルター")
+
+    print("\n--- テスト終了 ---")
+
+
+if __name__ == "__main__":
+    run_test()
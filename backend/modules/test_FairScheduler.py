@@ -0,0 +1,88 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+
+# プロジェクトルートをパスに追加
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from backend.modules.FairScheduler import FairQueue, FairScheduler, PRIORITY_BACKFILL, item_priority
+
+
+def run_test():
+    """生成枠が優先度クラスの順、同じクラスではユーザー間で公平に割り当てられるかを検証する"""
+    print("--- テスト開始: FairScheduler ---")
+
+    # 1. FairQueue: 先に大量に積んだユーザーがいても、後から来たユーザーと交互に取り出される
+    queue = FairQueue()
+    for i in range(5):
+        queue.push("heavy", i)
+    queue.push("light", 0)
+    queue.push("light", 1)
+    order = [queue.pop()[0] for _ in range(len(queue))]
+    assert order == ["heavy", "light", "heavy", "light", "heavy", "heavy", "heavy"], order
+    print(f"[成功] ユーザー間の公平な順番: {order}")
+
+    # 2. 優先度: フィードが空のユーザーの先頭 > 先頭 > バックフィル (到着順に関係なく)
+    queue = FairQueue()
+    queue.push("a", "backfill", item_priority(10))
+    queue.push("b", "head", item_priority(0))
+    queue.push("c", "empty_feed", item_priority(0, empty_feed=True))
+    assert [queue.pop()[1] for _ in range(3)] == ["empty_feed", "head", "backfill"]
+    # 重みが2倍のユーザーは2倍の頻度で取り出される
+    queue = FairQueue()
+    for i in range(4):
+        queue.push("x", i, PRIORITY_BACKFILL, weight=2.0)
+        queue.push("y", i, PRIORITY_BACKFILL)
+    first = [queue.pop()[0] for _ in range(6)]
+    assert first.count("x") == 4 and first.count("y") == 2, first
+    print("[成功] 優先度クラスと重み")
+
+    # 3. FairScheduler: 枠の数を超えて同時に実行されず、空いた枠は待っている中で最も優先されるものに渡る
+    scheduler = FairScheduler(capacity=1)
+    started = []
+    running, peak = 0, 0
+    lock = threading.Lock()
+
+    def generate(user_id, position, empty_feed=False):
+        nonlocal running, peak
+        with scheduler.slot(user_id, position, empty_feed=empty_feed):
+            with lock:
+                started.append(user_id)
+                running += 1
+                peak = max(peak, running)
+            time.sleep(0.02)
+            with lock:
+                running -= 1
+
+    threads = [threading.Thread(target=generate, args=("old", 10))]
+    threads[0].start()
+    time.sleep(0.005)
+    threads += [threading.Thread(target=generate, args=("old", 11)), threading.Thread(target=generate, args=("new", 0, True))]
+    for thread in threads[1:]:
+        thread.start()
+        time.sleep(0.002)
+    for thread in threads:
+        thread.join()
+    assert peak == 1 and started == ["old", "new", "old"], started
+    print(f"[成功] スレッドからの枠の取得: {started}")
+
+    # 4. async_slot: 待っている間にキャンセルされたコルーチンの分は枠を消費しない
+    async def cancelled_waiter():
+        scheduler = FairScheduler(capacity=1)
+        async with scheduler.async_slot("a", 0):
+            waiter = asyncio.create_task(scheduler.async_slot("b", 0).__aenter__())
+            await asyncio.sleep(0.01)
+            waiter.cancel()
+            await asyncio.gather(waiter, return_exceptions=True)
+        async with scheduler.async_slot("c", 0):
+            return scheduler._running
+    assert asyncio.run(asyncio.wait_for(cancelled_waiter(), 1.0)) == 1
+    print("[成功] キャンセルされた待ちは枠を消費しない")
+
+    print("\n--- テスト終了 ---")
+
+
+if __name__ == "__main__":
+    run_test()
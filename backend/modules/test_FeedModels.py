@@ -0,0 +1,51 @@
+import json
+import os
+import sys
+
+# プロジェクトルートをパスに追加
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from api.api_fb import FeedResponse, SimilarPapersResponse
+from backend.modules.FeedEvents import feed_item_event
+from backend.modules.FeedModels import SimilarPaperCard, json_encoders, json_response
+
+PAPER = {"paper_id": 2401001, "title": "検索拡張生成の効率化", "author": "Alice, Bob ,Carol", "arxiv_url": "http://arxiv.org/abs/2401.00001v1"}
+
+
+def as_dict(card):
+    return {name: getattr(card, name) for name in card.__slots__}
+
+
+def run_test():
+    """FeedModels のレスポンスが、OpenAPIに載せているPydanticモデルと同じJSONになるかを検証する"""
+    print("--- テスト開始: FeedModels ---")
+
+    # 1. 使える全てのエンコーダーで、Pydanticモデル経由のJSONと同じ内容になる
+    cards = [feed_item_event(1, PAPER, "この論文は…", True), feed_item_event(2, PAPER, None, audio_base64="UklGRg==")]
+    similar = [SimilarPaperCard("2401002", "似た論文", ["Dave"], "http://arxiv.org/abs/2401.00002v1", 0.875)]
+    expected_feed = FeedResponse.model_validate({"items": [as_dict(card) for card in cards]}).model_dump(mode="json")
+    expected_similar = SimilarPapersResponse.model_validate({"items": [as_dict(card) for card in similar]}).model_dump(mode="json")
+    assert expected_feed["items"][0]["authors"] == ["Alice", "Bob", "Carol"] and expected_feed["items"][1]["summary"] == ""
+    for name, encode in json_encoders().items():
+        assert json.loads(encode({"items": cards})) == expected_feed, name
+        assert json.loads(encode({"items": similar})) == expected_similar, name
+        # 日本語はエスケープせずUTF-8のまま送る
+        assert "検索拡張生成".encode("utf-8") in encode(cards[0]), name
+    print(f"[成功] Pydanticモデルと同じJSONになる ({', '.join(json_encoders())})")
+
+    # 2. json_response はエンコード済みの本文を返す
+    response = json_response({"items": cards}, headers={"ETag": '"x"'})
+    assert response.media_type == "application/json" and response.headers["etag"] == '"x"'
+    assert json.loads(response.body) == expected_feed
+    try:
+        json_encoders()["json"](object())
+        raise AssertionError("エンコードできない値でTypeErrorになりませんでした")
+    except TypeError:
+        pass
+    print("[成功] エンコード済みの本文をそのまま返す")
+
+    print("\n--- テスト終了 ---")
+
+
+if __name__ == "__main__":
+    run_test()
@@ -0,0 +1,66 @@
+import os
+import sys
+import tempfile
+import wave
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context, shared_memory
+
+# プロジェクトルートをパスに追加
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+# 子プロセスも同じ音声ストアを使うよう、モジュールを読み込む前に保存先を決める
+# (CPU段の子プロセスはこのファイルを読み込み直すので、環境変数に設定済みならそれを使う)
+os.environ.setdefault("AUDIO_STORE_DIR", os.path.join(tempfile.mkdtemp(prefix="test_worker_"), "audio"))
+AUDIO_DIR = os.environ["AUDIO_STORE_DIR"]
+
+from backend.modules.AudioStore import LocalAudioStore
+from backend.modules.Database import SQLiteClient
+from backend.modules.GenerationWorker import assemble_audio, enqueue_generation, prepare_speech_text
+from backend.benchmarks.fakes import SAMPLE_RATE, make_wav
+
+
+def to_shared_memory(data: bytes) -> shared_memory.SharedMemory:
+    block = shared_memory.SharedMemory(create=True, size=len(data))
+    block.buf[:len(data)] = data
+    return block
+
+
+def run_test():
+    """ワーカーのCPU段 (文の分割・共有メモリ上のWAVの連結) とジョブの取り出しを検証する"""
+    print("--- テスト開始: GenerationWorker ---")
+
+    # 1. 読み上げ用の整形: 記号とURLを除き、短い文はまとめ、長い文は分ける
+    segments = prepare_speech_text("**提案手法**は高速です。詳細は https://example.com を参照。" + "あ" * 130 + "。", max_chars=40)
+    assert segments == ["提案手法は高速です。詳細は を参照。", "あ" * 130 + "。"], segments
+    assert prepare_speech_text("  ") == []
+    print("[成功] prepare_speech_text")
+
+    # 2. 別プロセスで共有メモリ上のWAVを連結する: 長さは断片の合計で、ヘッダーも正しい
+    blocks = [to_shared_memory(make_wav(seconds)) for seconds in (1.0, 0.5, 2.0)]
+    try:
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context("forkserver")) as pool:
+            key = pool.submit(assemble_audio, [(block.name, block.size) for block in blocks]).result()
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+    with wave.open(LocalAudioStore(AUDIO_DIR).local_path(key)) as wav:
+        assert wav.getframerate() == SAMPLE_RATE and wav.getnframes() == int(3.5 * SAMPLE_RATE)
+    print(f"[成功] assemble_audio: 3つの断片を {key} に連結")
+
+    # 3. claim_generation_jobs: 同じジョブは1つのワーカーにしか渡らず、リースが切れたら取り直せる
+    client = SQLiteClient(os.path.join(tempfile.mkdtemp(prefix="test_worker_db_"), "app.sqlite3"))
+    job_ids = [enqueue_generation(client, user_id, 5) for user_id in (1, 2, 3)]
+    claim = lambda worker, lease=600: client.rpc("claim_generation_jobs", {"p_worker": worker, "p_limit": 2, "p_lease_seconds": lease}).execute().data
+    first, second = claim("a"), claim("b")
+    assert [job["job_id"] for job in first] == job_ids[:2] and [job["job_id"] for job in second] == job_ids[2:]
+    assert claim("c") == []
+    reclaimed = claim("c", lease=-1)
+    assert len(reclaimed) == 2 and {job["worker"] for job in reclaimed} == {"c"} and {job["attempts"] for job in reclaimed} == {2}
+    print("[成功] claim_generation_jobs")
+
+    print("\n--- テスト終了 ---")
+
+
+if __name__ == "__main__":
+    run_test()
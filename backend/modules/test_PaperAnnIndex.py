@@ -0,0 +1,90 @@
+import os
+import sys
+import tempfile
+from multiprocessing import get_context
+
+import numpy as np
+
+# プロジェクトルートをパスに追加
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from backend.modules.PaperAnnIndex import PaperAnnIndex
+from backend.modules.PaperRanker import EmbeddingStore
+
+TOPICS = {
+    "quantum": "quantum error correction surface code qubit decoder fault tolerant",
+    "retrieval": "retrieval augmented generation dense passage retriever language model",
+    "vision": "image segmentation convolutional vision transformer pixel mask",
+}
+
+
+def make_papers(prefix, count, topic=None):
+    """topic を指定しなければ、番号順にトピックを割り振った論文を作る"""
+    names = list(TOPICS)
+    return [{
+        "paper_id": f"{prefix}{i}",
+        "title": f"{topic or names[i % len(names)]} study {prefix}{i}",
+        "abstract": TOPICS[topic or names[i % len(names)]] + f" variant {i}",
+    } for i in range(count)]
+
+
+def ingest(directory, prefix, count, topic=None):
+    """別のプロセスで論文を取り込む (PaperIngestor と同じく、ベクトルを保存してから索引に反映する)"""
+    store = EmbeddingStore(directory)
+    index = PaperAnnIndex(store)
+    papers = make_papers(prefix, count, topic)
+    store.add_papers(papers)
+    index.add_papers(papers)
+
+
+def run_in_processes(targets):
+    context = get_context("spawn")
+    processes = [context.Process(target=ingest, args=args) for args in targets]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+        assert process.exitcode == 0, process.exitcode
+
+
+def run_test():
+    """IVFインデックスが総当たりと同じ結果を返し、他のプロセスが追加した論文も検索できるかを検証する"""
+    print("--- テスト開始: PaperAnnIndex ---")
+    directory = tempfile.mkdtemp(prefix="test_ann_")
+
+    # 1. 全リストを探せば総当たりと同じ上位k件になる
+    store = EmbeddingStore(directory)
+    store.add_papers(make_papers("p", 60))
+    index = PaperAnnIndex(store)
+    index.build(nlist=4)
+    query = np.asarray(store.matrix[0])
+    brute = np.argsort(-(np.asarray(store.matrix) @ query), kind='stable')[1:6]
+    found = [row for row, _ in index.search(query, k=5, exclude_rows={0}, nprobe=4)]
+    assert sorted(found) == sorted(int(row) for row in brute), (found, brute)
+    assert all(paper_id.startswith("p") and int(paper_id[1:]) % 3 == 0 for paper_id, _ in index.similar("p0", k=5))
+    print("[成功] 全リストを探すと総当たりと一致する")
+
+    # 2. 他のプロセスが取り込んだ論文も、この索引を開き直さずに検索できる
+    run_in_processes([(directory, "q", 5, "quantum")])
+    results = index.similar("q0", k=4)
+    assert len(store) == 65 and len(index.assignments) == 65, (len(store), len(index.assignments))
+    # 新しい論文は同じトピック (quantum) の既存論文・新しい論文と似ている
+    assert any(paper_id.startswith("q") for paper_id, _ in results), results
+    assert all(paper_id.startswith("q") or int(paper_id[1:]) % 3 == 0 for paper_id, _ in results), results
+    assert "q2" not in dict(index.similar("q0", k=10, exclude_ids=["q2"]))
+    print("[成功] 他のプロセスが追加した論文を検索できる")
+
+    # 3. 複数のプロセスが同時に取り込んでも、割り当ては論文1件につき1つだけ追記される
+    run_in_processes([(directory, f"c{n}_", 20) for n in range(4)])
+    reopened = PaperAnnIndex(EmbeddingStore(directory))
+    assert len(reopened.store) == 145 and len(reopened.assignments) == 145, (len(reopened.store), len(reopened.assignments))
+    assert os.path.getsize(index.assignments_path) == 145 * 4
+    index.refresh()
+    assert len(index.assignments) == 145 and index._offsets[-1] == 145
+    print("[成功] 同時に取り込んでも割り当てが重複しない")
+
+    print("\n--- テスト終了 ---")
+
+
+if __name__ == "__main__":
+    run_test()
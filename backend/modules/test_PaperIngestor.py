@@ -0,0 +1,76 @@
+import os
+import sys
+import tempfile
+
+# プロジェクトルートをパスに追加
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from backend.modules.Database import SQLiteClient
+from backend.modules.PaperIngestor import PaperIngestor, compute_content_hash, split_arxiv_id
+
+TITLE = "Efficient Retrieval-Augmented Generation"
+ABSTRACT = "We propose a hierarchical memory for retrieval-augmented generation."
+
+
+class RecordingIndex:
+    """add_papers に渡された論文を記録するだけの索引"""
+    def __init__(self):
+        self.added = []
+
+    def add_papers(self, papers):
+        self.added.extend(paper["paper_id"] for paper in papers)
+        return len(papers)
+
+
+def paper(version=1, title=TITLE, abstract=ABSTRACT, arxiv_id="2401.01234"):
+    return {"title": title, "abstract": abstract, "author": "Alice, Bob", "arxiv_url": f"http://arxiv.org/abs/{arxiv_id}v{version}"}
+
+
+def run_test():
+    """paper_info への取り込みが、変化のない再取得では何もせず、改訂版だけを更新して依存する行を無効化するかを検証する"""
+    print("--- テスト開始: PaperIngestor ---")
+
+    # 1. arXiv ID の分解と内容ハッシュ (空白の揺れは同じ内容として扱う)
+    assert split_arxiv_id("https://arxiv.org/abs/2401.01234v3") == ("2401.01234", 3)
+    assert split_arxiv_id("cs/0112017v1") == ("cs/0112017", 1)
+    assert split_arxiv_id("2401.01234") == ("2401.01234", 1)
+    assert compute_content_hash(TITLE, ABSTRACT) == compute_content_hash(f"  {TITLE}\n", ABSTRACT.replace(" ", "\t "))
+    assert compute_content_hash(TITLE, ABSTRACT) != compute_content_hash(TITLE, ABSTRACT + " Updated.")
+    print("[成功] arXiv ID の分解と内容ハッシュ")
+
+    # 2. 新規は挿入、同じ内容の再取得 (空白だけの違いを含む) は変化なし
+    client = SQLiteClient(os.path.join(tempfile.mkdtemp(), "ingest.db"))
+    index = RecordingIndex()
+    ingestor = PaperIngestor(client, batch_size=2, indexes=[index])
+    stats = ingestor.ingest([paper(), paper(arxiv_id="2401.05678"), paper(arxiv_id="2401.09999")])
+    assert (stats["inserted"], stats["updated"], stats["unchanged"]) == (3, 0, 0), stats
+    paper_id = next(row["paper_id"] for row in stats["changed_rows"] if row["arxiv_id"] == "2401.01234")
+    stats = ingestor.ingest([paper(), paper(title=f" {TITLE} ", arxiv_id="2401.05678")])
+    assert (stats["inserted"], stats["updated"], stats["unchanged"]) == (0, 0, 2), stats
+    assert len(index.added) == 3
+    print("[成功] 変化のない再取得は何もしない")
+
+    # 3. 改訂版は同じ行 (同じpaper_id) を上書きし、その論文のfeed行と共有アセットを無効化する
+    client.table("feed").insert({"user_id": 1, "paper_id": paper_id, "gemini_abstract": "要約"}).execute()
+    client.table("paper_asset").insert({"paper_id": paper_id, "voice_type": 3, "gemini_abstract": "要約", "voice_key": "k"}).execute()
+    # 同じバッチに同じ論文の複数の版があれば最新版だけを使う
+    stats = ingestor.ingest([paper(version=2, abstract=ABSTRACT + " v2."), paper(version=3, abstract=ABSTRACT + " v3.")])
+    assert stats["updated"] == 1 and stats["changed_rows"][0]["paper_id"] == paper_id, stats
+    row = client.table("paper_info").select("arxiv_version, abstract").eq("paper_id", paper_id).execute().data[0]
+    assert row == {"arxiv_version": 3, "abstract": ABSTRACT + " v3."}, row
+    assert client.table("feed").select("feed_id").eq("paper_id", paper_id).execute().data == []
+    assert client.table("paper_asset").select("paper_id").eq("paper_id", paper_id).execute().data == []
+    assert index.added[-1] == paper_id
+    print("[成功] 改訂版は同じ行を更新し、依存する行を無効化する")
+
+    # 4. 古い版を取り直しても新しい版を上書きしない
+    stats = ingestor.ingest([paper(version=2, abstract=ABSTRACT + " v2.")])
+    assert stats["unchanged"] == 1, stats
+    assert client.table("paper_info").select("arxiv_version").eq("paper_id", paper_id).execute().data[0]["arxiv_version"] == 3
+    print("[成功] 古い版で上書きしない")
+
+    print("\n--- テスト終了 ---")
+
+
+if __name__ == "__main__":
+    run_test()
@@ -0,0 +1,54 @@
+import os
+import re
+import sys
+
+# プロジェクトルートをパスに追加
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.append(PROJECT_ROOT)
+
+from backend.modules.Projections import ALL_PROJECTIONS, check_projection
+
+# select("*") を禁止するファイル (APIとフィード生成の経路。check_db.py などの確認用スクリプトは対象外)
+CHECKED_FILES = [
+    "api/api_fb.py",
+    "backend/modules/FeedGenerator.py",
+    "backend/modules/PreGenerator.py",
+    "backend/modules/BookmarkCache.py",
+    "backend/modules/PaperSearchIndex.py",
+    "backend/modules/PaperRanker.py",
+]
+SELECT_STAR = re.compile(r'''\.select\(\s*["']\s*\*\s*["']''')
+# 文字列で列を指定したselectのうち、重い列を含むもの
+INLINE_HEAVY = re.compile(r'''\.select\(\s*["'][^"']*\b(voice|gemini_abstract)\b[^"']*["']''')
+
+
+def run_test():
+    """プロジェクションの定義と、各経路でのselectの使い方を検証する"""
+    print("--- テスト開始: Projections ---")
+    failures = []
+
+    # 1. 全てのプロジェクションがスキーマに存在する列だけを読み、重い列の宣言が正しいこと
+    for projection in ALL_PROJECTIONS:
+        failures += check_projection(projection)
+
+    # 2. 対象のファイルに select("*") がなく、重い列は Projections の宣言を通して読んでいること
+    for path in CHECKED_FILES:
+        with open(os.path.join(PROJECT_ROOT, path), encoding='utf-8') as f:
+            for line_number, line in enumerate(f, 1):
+                if SELECT_STAR.search(line):
+                    failures.append(f"{path}:{line_number}: select(\"*\")")
+                if INLINE_HEAVY.search(line):
+                    failures.append(f"{path}:{line_number}: heavy column selected without a Projection")
+
+    if failures:
+        print("\n[失敗] 以下の問題が見つかりました:")
+        for failure in failures:
+            print(f"- {failure}")
+        print("\n--- テスト終了 ---")
+        sys.exit(1)
+    print(f"\n[成功] {len(ALL_PROJECTIONS)}個のプロジェクションと{len(CHECKED_FILES)}ファイルを検証しました。")
+    print("\n--- テスト終了 ---")
+
+
+if __name__ == "__main__":
+    run_test()
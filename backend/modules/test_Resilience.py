@@ -0,0 +1,108 @@
+import os
+import socket
+import sys
+import time
+
+# プロジェクトルートをパスに追加
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from backend.benchmarks.fakes import FakeVoicevoxServer
+from backend.modules.Resilience import (
+    STATE_CLOSED, STATE_HALF_OPEN, STATE_OPEN, AdaptiveTimeout, CircuitBreaker, CircuitOpenError, hedged_call,
+)
+from backend.poc.voicevox.VoicevoxEngine import VoicevoxClient
+
+
+def unused_url() -> str:
+    """接続を拒否するURL (落ちているエンジンの代わり)"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return f"http://127.0.0.1:{sock.getsockname()[1]}"
+
+
+def run_test():
+    """回路ブレーカー・適応タイムアウト・ヘッジと、VOICEVOXの複数エンジンでの動作を検証する"""
+    print("--- テスト開始: Resilience ---")
+
+    # 1. 回路ブレーカー: エラー率が閾値を超えると開き、半開の試しが成功すると閉じる
+    breaker = CircuitBreaker("test", failure_rate=0.5, window=10, min_calls=4, open_seconds=0.05)
+    for failed in (False, True, True, True):
+        breaker.record_failure() if failed else breaker.record_success()
+    assert breaker.state == STATE_OPEN
+    try:
+        breaker.before_call()
+        raise AssertionError("開いた回路で呼び出しが通りました")
+    except CircuitOpenError as e:
+        assert 0 < e.retry_after <= 0.05
+    time.sleep(0.06)
+    assert breaker.state == STATE_HALF_OPEN
+    breaker.before_call()
+    # 試しの呼び出しは1件まで
+    try:
+        breaker.before_call()
+        raise AssertionError("半開の回路で2件目の呼び出しが通りました")
+    except CircuitOpenError:
+        pass
+    breaker.record_success()
+    assert breaker.state == STATE_CLOSED
+    print("[成功] 回路ブレーカーの開閉")
+
+    # 2. 適応タイムアウト: 観測が揃うまでは初期値、その後はp99×係数 (上限・下限の範囲)
+    timeout = AdaptiveTimeout(30.0, 1.0, 30.0, factor=3.0, min_samples=20)
+    assert timeout.current == 30.0
+    for i in range(100):
+        timeout.observe(0.5 + i / 100)
+    assert abs(timeout.current - 1.49 * 3.0) < 1e-9, timeout.current
+    print(f"[成功] 適応タイムアウト: {timeout.current:.2f}s")
+
+    # 3. ヘッジ: 遅い試行を待たずに次を始め、先に成功した結果を使う。失敗した試行の次はすぐに始める
+    discarded = []
+
+    def slow():
+        time.sleep(0.3)
+        return "slow"
+
+    def fail():
+        raise ValueError("down")
+    started_at = time.perf_counter()
+    assert hedged_call([slow, lambda: "fast"], delay=0.02, discard=discarded.append) == "fast"
+    assert time.perf_counter() - started_at < 0.2
+    assert hedged_call([fail, lambda: "fast"], delay=10.0) == "fast"
+    time.sleep(0.35)
+    assert discarded == ["slow"], discarded
+    print("[成功] ヘッジ")
+
+    # 4. VOICEVOX: 落ちているエンジンは回路が開いて飛ばされ、全て落ちていればタイムアウトを待たずに失敗する
+    voicevox = FakeVoicevoxServer(latency=0.0).start()
+    try:
+        dead = unused_url()
+        client = VoicevoxClient([dead, voicevox.url])
+        for _ in range(6):
+            assert b"".join(client.stream_voice(text="テストです。", speaker=3))[:4] == b"RIFF"
+        assert client.engines[0].breaker.state == STATE_OPEN
+        assert client.engines[1].breaker.state == STATE_CLOSED
+
+        client = VoicevoxClient([unused_url()])
+        for _ in range(10):
+            try:
+                b"".join(client.stream_voice(text="テストです。", speaker=3))
+            except CircuitOpenError:
+                break
+            except Exception:
+                pass
+        started_at = time.perf_counter()
+        try:
+            b"".join(client.stream_voice(text="テストです。", speaker=3))
+            raise AssertionError("落ちているエンジンで音声合成が成功しました")
+        except CircuitOpenError:
+            pass
+        assert time.perf_counter() - started_at < 0.05
+        print("[成功] VOICEVOXのフェイルオーバーと早い失敗")
+    finally:
+        voicevox.stop()
+
+    print("\n--- テスト終了 ---")
+
+
+if __name__ == "__main__":
+    run_test()
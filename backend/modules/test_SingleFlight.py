@@ -0,0 +1,108 @@
+import asyncio
+import os
+import sys
+import tempfile
+import threading
+import time
+
+# プロジェクトルートをパスに追加
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from backend.modules.Database import SQLiteClient
+from backend.modules.SingleFlight import SingleFlight
+
+
+def run_test():
+    """同じキーの仕事が、同時に呼んだスレッド・コルーチン・プロセスの間で1回にまとめられるかを検証する"""
+    print("--- テスト開始: SingleFlight ---")
+
+    # 1. スレッド: 同時に呼んだ全員が1回の実行の結果を受け取る。例外も共有される
+    flight = SingleFlight()
+    calls = []
+
+    def work():
+        calls.append(1)
+        time.sleep(0.05)
+        return "summary"
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(flight.do("summary:p1:x", work))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1 and results == ["summary"] * 8, (calls, results)
+
+    def fail():
+        time.sleep(0.05)
+        raise RuntimeError("gemini")
+    errors = []
+
+    def call_failing():
+        try:
+            flight.do("summary:p2:x", fail)
+        except RuntimeError as e:
+            errors.append(str(e))
+    threads = [threading.Thread(target=call_failing) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == ["gemini"] * 3 and not flight._flights
+    print("[成功] スレッド間で1回の実行と例外を共有")
+
+    # 2. コルーチン: 実行していた側がキャンセルされても、待っていた側が改めて実行する
+    async def coroutines():
+        count = 0
+
+        async def synthesize():
+            nonlocal count
+            count += 1
+            await asyncio.sleep(0.05)
+            return count
+        leader = asyncio.create_task(flight.do_async("asset:p1:3", synthesize))
+        await asyncio.sleep(0.01)
+        followers = [asyncio.create_task(flight.do_async("asset:p1:3", synthesize)) for _ in range(3)]
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        return await asyncio.gather(*followers), count
+    shared, count = asyncio.run(asyncio.wait_for(coroutines(), 2.0))
+    assert shared == [2, 2, 2] and count == 2, (shared, count)
+    print("[成功] キャンセルされた実行は待っていた側が引き継ぐ")
+
+    # 3. プロセス間 (work_lease): 他の持ち主がリースを持っている間は実行せず、lookup で結果を見つけて使う
+    client = SQLiteClient(os.path.join(tempfile.mkdtemp(), "flight.db"))
+    worker_a = SingleFlight(client, poll_interval=0.01)
+    worker_b = SingleFlight(client, poll_interval=0.01)
+    worker_b.owner = "other-process"
+    stored = {}
+    runs = []
+
+    def create_asset():
+        runs.append(1)
+        time.sleep(0.1)
+        stored["asset"] = {"voice_key": "k"}
+        return stored["asset"]
+    thread = threading.Thread(target=lambda: worker_a.do("asset:p3:3", create_asset, lookup=lambda: stored.get("asset")))
+    thread.start()
+    time.sleep(0.02)
+    found = worker_b.do("asset:p3:3", create_asset, lookup=lambda: stored.get("asset"))
+    thread.join()
+    assert runs == [1] and found == {"voice_key": "k"}
+    assert client.table("work_lease").select("lease_key").execute().data == []
+    # hold_seconds を指定すると、終わった後もリースが残る
+    worker_a.do("summary:p3:x", lambda: "s", hold_seconds=30)
+    assert not worker_b._try_lease("summary:p3:x")
+    # 長く続く仕事は renew でリースを延ばし、期限切れで他のプロセスに取られない
+    short_a = SingleFlight(client, lease_seconds=1, poll_interval=0.01)
+    assert short_a._try_lease("refill:7")
+    time.sleep(0.6)
+    assert short_a.renew("refill:7")
+    time.sleep(0.6)
+    assert not worker_b._try_lease("refill:7") and short_a.renew("refill:7")
+    print("[成功] work_lease でプロセスをまたいでまとめる")
+
+    print("\n--- テスト終了 ---")
+
+
+if __name__ == "__main__":
+    run_test()
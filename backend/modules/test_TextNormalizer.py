@@ -0,0 +1,54 @@
+import os
+import sys
+
+# プロジェクトルートをパスに追加
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from backend.benchmarks.fakes import FakeVoicevoxServer
+from backend.modules.TextNormalizer import AhoCorasick, TextNormalizer, get_normalizer
+from backend.poc.voicevox.VoicevoxEngine import VoicevoxClient
+
+
+def run_test():
+    """要約の専門用語・略語・数字が読み上げ用の表記に直され、読みがVOICEVOXのユーザー辞書に登録されるかを検証する"""
+    print("--- テスト開始: TextNormalizer ---")
+
+    # 1. 辞書の照合: 最も左で最も長い語を選び、英単語の途中では置き換えない
+    matcher = AhoCorasick({"rag": "ラグ", "hipporag": "ヒッポラグ"})
+    assert sorted((start, end) for start, end, _ in matcher.finditer("hipporagとrag")) == [(0, 8), (5, 8), (9, 12)]
+    normalizer = get_normalizer()
+    assert normalizer.normalize("HippoRAG2はRAGの一種。") == "ヒッポラグツーはラグの一種。", normalizer.normalize("HippoRAG2はRAGの一種。")
+    assert normalizer.normalize("DRAGONを使う。") != normalizer.normalize("ラグを使う。")
+    print("[成功] 辞書の語を最長一致で読みに置き換える")
+
+    # 2. 略語と数字
+    assert normalizer.normalize("LLMは1,000件で28.4%改善した。") == "エルエルエムは千件で二十八点四パーセント改善した。"
+    assert normalizer.normalize("GPT-4を使う。") == "ジーピーティーフォーを使う。"
+    print("[成功] 略語を1文字ずつ、数字を漢数字で読む")
+
+    # 3. 文ごとのキャッシュと分割
+    custom = TextNormalizer({"transformer": ("トランスフォーマー", None)}, cache_size=16)
+    segments = custom.segments("**Transformer**の論文。Transformerの論文。", max_chars=0)
+    assert segments == ["トランスフォーマーの論文。", "トランスフォーマーの論文。"], segments
+    assert custom.cache_info().hits == 1, custom.cache_info()
+    # 短い文は max_chars までまとめて1回の合成にする
+    assert custom.segments("あい。うえ。おかきくけ。", max_chars=6) == ["あい。うえ。", "おかきくけ。"]
+    print("[成功] 同じ文は正規化をやり直さない")
+
+    # 4. VOICEVOXのユーザー辞書への登録 (2回目は登録済みの語を飛ばす)
+    voicevox = FakeVoicevoxServer(latency=0).start()
+    try:
+        client = VoicevoxClient([voicevox.url])
+        words = normalizer.dictionary_words()
+        assert client.load_user_dictionary(words) == len(words) and len(voicevox.user_dict) == len(words)
+        assert client.load_user_dictionary(words) == 0
+        assert voicevox.requests == 0
+    finally:
+        voicevox.stop()
+    print("[成功] 読みをユーザー辞書に登録する")
+
+    print("\n--- テスト終了 ---")
+
+
+if __name__ == "__main__":
+    run_test()
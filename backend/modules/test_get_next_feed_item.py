@@ -1,5 +1,6 @@
 
 
+import json
 import os
 import sys
 import time
@@ -73,12 +74,14 @@ def run_test():
         print("\n--- 2. 同期処理テストフェーズ ---")
         tasks = TestableBackgroundTasks()
         print("get_next_feed_item を呼び出します...")
-        returned_item = get_next_feed_item(user_id=TEST_USER_ID, background_tasks=tasks)
-        print("get_next_feed_item からレスポンス相当のオブジェクトを受け取りました。")
+        response = get_next_feed_item(user_id=TEST_USER_ID, background_tasks=tasks)
+        print("get_next_feed_item からレスポンスを受け取りました。")
 
+        # 本文はエンコード済みのJSON (FeedItemと同じキー)
+        returned_item = json.loads(response.body)
         assert returned_item is not None, "返却アイテムがNoneです。"
-        assert isinstance(returned_item.audio_base64, str) and len(returned_item.audio_base64) > 100, "Base64音声データが不正です。"
-        print("[成功] 返却されたFeedItemオブジェクトは正常です。")
+        assert isinstance(returned_item["audio_base64"], str) and len(returned_item["audio_base64"]) > 100, "Base64音声データが不正です。"
+        print("[成功] 返却されたFeedItemは正常です。")
 
         count_after_call_res = supabase.table("feed").select("feed_id", count='exact').eq("user_id", TEST_USER_ID).execute()
         count_after_call = count_after_call_res.count
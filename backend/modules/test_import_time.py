@@ -0,0 +1,55 @@
+import os
+import subprocess
+import sys
+
+# プロジェクトルートをパスに追加
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.append(ROOT_DIR)
+
+# APIワーカーの起動 (api.api_fb の import) にかけてよい時間 (ミリ秒)。遅いマシンでは IMPORT_BUDGET_MS で調整する
+IMPORT_BUDGET_MS = float(os.environ.get("IMPORT_BUDGET_MS", 800))
+# 起動時には読み込まず、最初に使う時に読み込むべきモジュール
+LAZY_MODULES = ("google.generativeai", "requests", "supabase", "postgrest", "boto3", "redis", "opentelemetry")
+
+
+def profile_import(module: str):
+    """新しいプロセスで python -X importtime を実行し、(モジュールごとの累積時間 [us], 読み込まれたモジュール) を返す"""
+    env = dict(os.environ, DATABASE_BACKEND="sqlite")
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT_DIR, env=env, capture_output=True, text=True, check=True,
+    )
+    cumulative = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative_us, name = (part.strip() for part in line[len("import time:"):].split("|"))
+        if cumulative_us.isdigit():
+            cumulative[name] = int(cumulative_us)
+    return cumulative, set(cumulative)
+
+
+def run_test():
+    """APIワーカーの起動が予算内に収まり、重いクライアントを起動時に読み込んでいないかを検証する"""
+    print("--- テスト開始: APIの起動時間 ---")
+    # 1回目はバイトコードのキャッシュがない場合があるので、2回測って速い方を使う
+    timings = [profile_import("api.api_fb") for _ in range(2)]
+    cumulative, loaded = min(timings, key=lambda t: t[0]["api.api_fb"])
+    total_ms = cumulative["api.api_fb"] / 1000
+
+    # 1. 遅延読み込みのはずのモジュールが読み込まれていない
+    eager = sorted(name for name in LAZY_MODULES if name in loaded)
+    assert not eager, f"起動時に読み込まれています: {eager}"
+    print(f"[成功] 起動時に読み込まれないモジュール: {', '.join(LAZY_MODULES)}")
+
+    # 2. 起動時間の予算
+    slowest = sorted(((us, name) for name, us in cumulative.items() if "." not in name), reverse=True)[:5]
+    print("[情報] 時間のかかるトップレベルのモジュール: " + ", ".join(f"{name} {us / 1000:.0f}ms" for us, name in slowest))
+    assert total_ms < IMPORT_BUDGET_MS, f"api.api_fb の import に {total_ms:.0f}ms かかりました (予算 {IMPORT_BUDGET_MS:.0f}ms)"
+    print(f"[成功] api.api_fb の import: {total_ms:.0f}ms (予算 {IMPORT_BUDGET_MS:.0f}ms)")
+
+    print("\n--- テスト終了 ---")
+
+
+if __name__ == "__main__":
+    run_test()
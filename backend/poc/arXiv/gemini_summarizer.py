@@ -1,8 +1,19 @@
 import os
+import sys
 import re
-import google.generativeai as genai
+import threading
+import time
 from dotenv import load_dotenv
 
+# プロジェクトルートをパスに追加 (このファイルを単体で実行する場合)
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..')))
+
+from backend.modules.Resilience import AdaptiveTimeout, CircuitOpenError, get_breaker
+
+# タイムアウトの初期値と上限・下限 (秒)。観測したp99に合わせてこの範囲で縮める
+GEMINI_TIMEOUT = 60.0
+GEMINI_MIN_TIMEOUT = 5.0
+
 # ダミーデータの設定
 dummy_abstract = "The dominant sequence transduction models are based on complex recurrent or convolutional neural networks in an encoder-decoder configuration. The best performing models also connect the encoder and decoder through an attention mechanism. We propose a new simple network architecture, the Transformer, based solely on attention mechanisms, dispensing with recurrence and convolutions entirely. Experiments on two machine translation tasks show these models to be superior in quality while being more parallelizable and requiring significantly less time to train. Our model achieves 28.4 BLEU on the WMT 2014 English-to-German translation task, improving over the existing best results, including ensembles by over 2 BLEU. On the WMT 2014 English-to-French translation task, our model establishes a new single-model state-of-the-art BLEU score of 41.8 after training for 3.5 days on eight GPUs, a small fraction of the training costs of the best models from the literature. We show that the Transformer generalizes well to other tasks by applying it successfully to English constituency parsing both with large and limited training data."
 
@@ -12,6 +23,9 @@ class PaperSummarizer:
     Gemini APIを使用して論文のアブストラクトを要約するクラス
     """
     def __init__(self):
+        # google.generativeai は読み込みが重いので、要約が必要になって初めて読み込む
+        import google.generativeai as genai
+
         # プロジェクトルートの.envファイルを読み込む
         dotenv_path = os.path.join(os.path.dirname(__file__), '..', '..', '.env')
         load_dotenv(dotenv_path=dotenv_path)
@@ -19,7 +33,12 @@ class PaperSummarizer:
         api_key = os.getenv('GOOGLE_API_KEY')
         if not api_key:
             raise ValueError("Gemini APIキーが設定されていません。.envファイルを確認してください。")
-        genai.configure(api_key=api_key)
+        # GEMINI_API_ENDPOINT を指定するとそのURLにRESTで接続する (ベンチマーク用の偽サーバーなど)
+        endpoint = os.getenv('GEMINI_API_ENDPOINT')
+        if endpoint:
+            genai.configure(api_key=api_key, transport="rest", client_options={"api_endpoint": endpoint})
+        else:
+            genai.configure(api_key=api_key)
         
         self.system_prompt = """
 あなたは、洞察力に富んだ女の子です。
@@ -39,6 +58,16 @@ ex.「はい、お任せください。これから要約を開始します。
             model_name='gemini-2.0-flash-lite',
             system_instruction=self.system_prompt
         )
+        # 直前の呼び出しのトークン使用量 (usage_metadata)。計測に使う
+        # (プロセス内で共有されるので、呼び出したスレッドごとに持つ)
+        self._local = threading.local()
+        # 障害時は呼び出さずにすぐ失敗させる (CircuitOpenError)。要約は高価なのでヘッジはしない
+        self.breaker = get_breaker("gemini")
+        self.timeout = AdaptiveTimeout(GEMINI_TIMEOUT, GEMINI_MIN_TIMEOUT, GEMINI_TIMEOUT)
+
+    @property
+    def last_usage(self):
+        return getattr(self._local, "usage", None)
 
     def summarize(self, abstract: str) -> str:
         """
@@ -48,10 +77,18 @@ ex.「はい、お任せください。これから要約を開始します。
             return ""
         
         try:
-            response = self.model.generate_content(abstract)
+            started_at = time.perf_counter()
+            with self.breaker.guard():
+                response = self.model.generate_content(abstract, request_options={"timeout": self.timeout.current})
+                text = response.text
+            self.timeout.observe(time.perf_counter() - started_at)
+            self._local.usage = getattr(response, "usage_metadata", None)
             # 応答から不要な改行や空白を削除して整形
-            cleaned_summary = re.sub(r'\s+', ' ', response.text).strip()
+            cleaned_summary = re.sub(r'\s+', ' ', text).strip()
             return cleaned_summary
+        except CircuitOpenError:
+            # 回路が開いている場合はそのまま呼び出し元に返す (生成を打ち切って後で再試行する)
+            raise
         except Exception as e:
             print(f"  [エラー] Gemini APIによる要約中にエラー: {e}")
             return "要約の生成に失敗しました。"
@@ -1,7 +1,12 @@
 import json
+import os
+import sys
 import time
 from getting_paper import PaperFetcher
 
+# プロジェクトルートをパスに追加
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..')))
+
 def main():
     """
     論文を取得し、結果をJSONファイルとして保存するメイン関数
@@ -9,6 +14,7 @@ def main():
     # --- 設定項目 ---
     paper_cases = 8000  # 取得したい論文の総数
     output_filename = "papers_data.json" # 出力ファイル名
+    ingest_to_db = False # Trueの場合、取得結果をpaper_infoへupsertする
     # ----------------
 
     start_time = time.time()
@@ -31,6 +37,19 @@ def main():
     except Exception as e:
         print(f"ファイルの保存中にエラーが発生しました: {e}")
 
+    # 3. paper_infoテーブルへupsert (変化のない論文はno-op、改訂版は上書き)
+    if ingest_to_db:
+        from dotenv import load_dotenv
+        from backend.modules.Database import get_client
+        from backend.modules.PaperIngestor import PaperIngestor
+        from backend.modules.PaperSearchIndex import get_search_index
+        from backend.modules.PaperRanker import get_ranker
+        from backend.modules.PaperAnnIndex import get_ann_index
+
+        load_dotenv()
+        supabase = get_client()
+        PaperIngestor(supabase, indexes=[get_search_index(), get_ranker().store, get_ann_index()]).ingest(papers_list)
+
     end_time = time.time()
     print(f"\n処理時間: {end_time - start_time:.2f} 秒")
 
@@ -1,12 +1,124 @@
+import itertools
+import os
+import sys
+import threading
+import time
 import requests
-from typing import Optional
+from dataclasses import dataclass, field
+from functools import partial
+from typing import Iterator, List, Optional, Tuple
 
-AUDIO_QUERY_API = 'http://localhost:50021/audio_query'
-SYNTHESIS_API = 'http://localhost:50021/synthesis'
+# プロジェクトルートをパスに追加 (このファイルを単体で実行する場合)
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..')))
+
+from backend.modules.Resilience import AdaptiveTimeout, CircuitBreaker, get_breaker, hedged_call
+
+# VOICEVOXエンジンのURL (ベンチマークではローカルの偽サーバーを指す)
+VOICEVOX_URL = os.environ.get('VOICEVOX_URL', 'http://localhost:50021')
+# stream_voice で1回に読み出すバイト数
+STREAM_CHUNK_SIZE = 64 * 1024
+# タイムアウトの初期値と上限 (秒)。観測したp99に合わせてこの範囲で縮める
+AUDIO_QUERY_TIMEOUT = 10.0
+SYNTHESIS_TIMEOUT = 30.0
+# 観測が少ないうちに、次のエンジンへヘッジするまでの秒数
+DEFAULT_HEDGE_DELAY = 2.0
+
+
+def engine_urls() -> List[str]:
+    """VOICEVOX_URLS (カンマ区切り) があれば複数のエンジンを、なければ VOICEVOX_URL の1台を使う"""
+    urls = [url.strip().rstrip('/') for url in os.environ.get('VOICEVOX_URLS', '').split(',') if url.strip()]
+    return urls or [os.environ.get('VOICEVOX_URL', VOICEVOX_URL).rstrip('/')]
+
+
+@dataclass
+class VoicevoxEngine:
+    """1台のVOICEVOXエンジンと、その回路ブレーカー・適応タイムアウト"""
+    url: str
+    breaker: Optional[CircuitBreaker] = None
+    query_timeout: AdaptiveTimeout = field(default_factory=lambda: AdaptiveTimeout(AUDIO_QUERY_TIMEOUT, 1.0, AUDIO_QUERY_TIMEOUT))
+    synthesis_timeout: AdaptiveTimeout = field(default_factory=lambda: AdaptiveTimeout(SYNTHESIS_TIMEOUT, 3.0, SYNTHESIS_TIMEOUT))
+
+    def __post_init__(self):
+        if self.breaker is None:
+            self.breaker = get_breaker(f"voicevox:{self.url}")
 
 class VoicevoxClient:
     """VoicevoxClient. convert text to voice by voicevoxapi"""
 
+    def __init__(self, urls: Optional[List[str]] = None):
+        # 直前の呼び出しの各APIの所要時間 (秒)。計測に使う
+        # (プロセス内で共有されるので、呼び出したスレッドごとに持つ)
+        self._local = threading.local()
+        self.engines = [VoicevoxEngine(url) for url in (urls or engine_urls())]
+        # 最初に試すエンジンを順番に回して負荷を分ける
+        self._next_engine = itertools.count()
+
+    @property
+    def last_timings(self) -> dict[str, float]:
+        return getattr(self._local, "timings", {})
+
+    def _engines_in_order(self) -> List[VoicevoxEngine]:
+        start = next(self._next_engine) % len(self.engines)
+        return self.engines[start:] + self.engines[:start]
+
+    @staticmethod
+    def _hedge_delay(timeouts: List[AdaptiveTimeout]) -> float:
+        # 次のエンジンへヘッジするのは、最初のエンジンが普段 (p95) より遅い時
+        p95 = timeouts[0].percentile(95)
+        return p95 if p95 is not None else DEFAULT_HEDGE_DELAY
+
+    def _audio_query(self, engine: VoicevoxEngine, text: str, speaker: int) -> dict:
+        with engine.breaker.guard():
+            response = requests.post(
+                f'{engine.url}/audio_query',
+                params={'text': text, 'speaker': speaker},
+                timeout=engine.query_timeout.current
+            )
+            response.raise_for_status()
+        engine.query_timeout.observe(response.elapsed.total_seconds())
+        return response.json()
+
+    def _open_synthesis(self, engine: VoicevoxEngine, speaker: int, query: dict) -> requests.Response:
+        """音声合成を要求し、本文を読む前の応答を返す (VOICEVOXは合成を終えてから応答するので、ここまでが待ち時間)"""
+        started_at = time.perf_counter()
+        with engine.breaker.guard():
+            response = requests.post(
+                f'{engine.url}/synthesis',
+                params={'speaker': speaker},
+                json=query,
+                timeout=engine.synthesis_timeout.current,
+                stream=True
+            )
+            try:
+                response.raise_for_status()
+            except requests.exceptions.RequestException:
+                response.close()
+                raise
+        engine.synthesis_timeout.observe(time.perf_counter() - started_at)
+        return response
+
+    def load_user_dictionary(self, words: List[Tuple[str, int]]) -> int:
+        """(表記, アクセント型) の語を各エンジンのユーザー辞書に登録する (登録済みの表記は飛ばす)。登録した件数を返す"""
+        added = 0
+        for engine in self.engines:
+            try:
+                response = requests.get(f'{engine.url}/user_dict', timeout=engine.query_timeout.current)
+                response.raise_for_status()
+                # エンジンは表記を全角にして保存するので、読み (カタカナ) で比べる
+                registered = {word.get('pronunciation') for word in response.json().values()}
+                for surface, accent_type in words:
+                    if surface in registered:
+                        continue
+                    requests.post(
+                        f'{engine.url}/user_dict_word',
+                        params={'surface': surface, 'pronunciation': surface, 'accent_type': accent_type, 'word_type': 'PROPER_NOUN'},
+                        timeout=engine.query_timeout.current
+                    ).raise_for_status()
+                    added += 1
+            except requests.exceptions.RequestException as e:
+                print(f"Failed to load the user dictionary into VOICEVOX engine {engine.url}: {e}")
+        return added
+
     def synthesize_voice(
         self,
         text: str,
@@ -20,33 +132,10 @@ class VoicevoxClient:
         Returns:
             Optional[bytes]: The synthesized voice data as bytes, or None if failed.
         """
-        # 1. テキストから音声合成のためのクエリを作成
-        query_payload: dict[str, str | int] = {
-            'text': text,
-            'speaker': speaker
-        }
-
         try:
-            query_response = requests.post(
-                AUDIO_QUERY_API,
-                params=query_payload,
-                timeout=10
-            )
-            query_response.raise_for_status() # ステータスコードが200番台でない場合に例外を発生
-            query = query_response.json()
-
-            # 2. クエリを元に音声データを生成
-            synthesis_payload = {'speaker': speaker}
-            synthesis_response = requests.post(
-                SYNTHESIS_API,
-                params=synthesis_payload, 
-                json=query,
-                timeout=30
-            )
-            synthesis_response.raise_for_status()
-
+            content = b''.join(self.stream_voice(text=text, speaker=speaker))
             print(f"Successfully synthesized voice for text: '{text[:20]}...'")
-            return synthesis_response.content
+            return content
 
         except requests.exceptions.RequestException as e:
             print(f"Error communicating with VOICEVOX engine: {e}")
@@ -54,3 +143,47 @@ class VoicevoxClient:
         except Exception as e:
             print(f"An unexpected error occurred in synthesize_voice: {e}")
             return None
+
+    def stream_voice(
+        self,
+        text: str,
+        speaker: int,
+        chunk_size: int = STREAM_CHUNK_SIZE,
+    ) -> Iterator[bytes]:
+        """Create voice and yield the WAV data in chunks as it is received.
+
+        Unlike synthesize_voice, the whole body is never held in memory, so the caller
+        can write it to storage with a bounded buffer. With several engines (VOICEVOX_URLS),
+        a request that is slower than usual is hedged to the next engine, and engines whose
+        circuit is open are skipped.
+
+        Args:
+            text (str): The text of speak on voicevox engine.
+            speaker (int): ID of speaker in voicevox engine.
+            chunk_size (int): Maximum size of each yielded chunk in bytes.
+        Yields:
+            bytes: The next part of the synthesized WAV data.
+        Raises:
+            requests.exceptions.RequestException: If the engine cannot be reached or returns an error.
+            CircuitOpenError: If every engine's circuit is open (the caller should retry later).
+        """
+        self._local.timings = {}
+        engines = self._engines_in_order()
+        # 1. テキストから音声合成のためのクエリを作成 (小さいJSONなのでそのまま読む)
+        started_at = time.perf_counter()
+        query = hedged_call(
+            [partial(self._audio_query, engine, text, speaker) for engine in engines],
+            self._hedge_delay([engine.query_timeout for engine in engines]),
+        )
+        self._local.timings['audio_query'] = time.perf_counter() - started_at
+
+        # 2. 音声データは受信した分ずつ呼び出し元に渡す
+        started_at = time.perf_counter()
+        synthesis_response = hedged_call(
+            [partial(self._open_synthesis, engine, speaker, query) for engine in engines],
+            self._hedge_delay([engine.synthesis_timeout for engine in engines]),
+            discard=lambda response: response.close(),
+        )
+        with synthesis_response:
+            yield from synthesis_response.iter_content(chunk_size=chunk_size)
+        self._local.timings['synthesis'] = time.perf_counter() - started_at
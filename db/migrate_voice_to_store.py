@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+# feed / paper_asset の voice 列 (base64) に入っている音声を音声ストアへ移し、voice_key だけを残す。
+# 006_audio_voice_key.sql の適用後に実行する。途中で止めても、再実行すれば残りから続きを処理する。
+# 使い方: python db/migrate_voice_to_store.py [--batch-size 50]
+import argparse
+import base64
+import os
+import sys
+
+from dotenv import load_dotenv
+
+# プロジェクトルートをパスに追加
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from backend.modules.AudioStore import get_audio_store
+from backend.modules.Database import get_client
+
+load_dotenv()
+
+# テーブルごとの主キー列
+TABLE_KEYS = {"feed": ("feed_id",), "paper_asset": ("paper_id", "voice_type")}
+
+
+def migrate_table(supabase, store, table: str, batch_size: int) -> int:
+    """voice_keyが未設定の行を少しずつ読み、音声をストアに保存してvoiceを空にする"""
+    key_columns = TABLE_KEYS[table]
+    migrated = 0
+    while True:
+        # 処理した行は条件から外れるので、毎回先頭から読めばよい
+        rows = supabase.table(table).select(", ".join(key_columns + ("voice",))).is_("voice_key", "null").not_.is_("voice", "null").limit(batch_size).execute().data or []
+        if not rows:
+            return migrated
+        for row in rows:
+            key = store.put(base64.b64decode(row["voice"]))
+            query = supabase.table(table).update({"voice_key": key, "voice": None})
+            for column in key_columns:
+                query = query.eq(column, row[column])
+            query.execute()
+            migrated += 1
+        print(f"{table}: {migrated}件の音声を移しました。")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="base64の音声データを音声ストアへ移す")
+    parser.add_argument("--batch-size", type=int, default=50, help="1回に読み込む行数 (1行あたり数MBになり得るので小さめにする)")
+    args = parser.parse_args()
+
+    supabase = get_client()
+    store = get_audio_store()
+    for table in TABLE_KEYS:
+        print(f"{table}: 完了 ({migrate_table(supabase, store, table, args.batch_size)}件)")
+    print("全ての音声を移しました。db/migrations/007_drop_inline_voice.sql を適用してください。")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+-- paper_info を arXiv ID で一意にし、取り込みを ON CONFLICT の upsert にする。
+-- content_hash はタイトル＋アブストラクトのハッシュ。変化のない再取得は no-op、
+-- 改訂版 (v2, v3 ...) は同じ行を上書きし、その論文に依存する feed 行を無効化する。
+
+alter table paper_info
+    add column if not exists arxiv_id text,
+    add column if not exists arxiv_version integer not null default 1,
+    add column if not exists content_hash text;
+
+-- 既存行の arxiv_id を arxiv_url から埋める (例: http://arxiv.org/abs/2401.01234v2 -> 2401.01234)
+update paper_info
+set arxiv_id = regexp_replace(regexp_replace(arxiv_url, '^.*/abs/', ''), 'v[0-9]+$', '')
+where arxiv_id is null and arxiv_url is not null;
+
+-- 既存行の arxiv_version と content_hash も埋める。埋めないと最初の再取得で全ての既存論文が
+-- 「内容が変わった」と判定され、feed 行と共有アセットがまとめて無効化される。
+-- content_hash は PaperIngestor.compute_content_hash と同じ正規化 (空白の連続を1つにして両端を削る)
+update paper_info
+set arxiv_version = (regexp_match(arxiv_url, 'v([0-9]+)$'))[1]::integer
+where arxiv_url ~ 'v[0-9]+$';
+
+update paper_info
+set content_hash = encode(sha256(convert_to(
+    btrim(regexp_replace(coalesce(title, ''), '\s+', ' ', 'g')) || E'\n' ||
+    btrim(regexp_replace(coalesce(abstract, ''), '\s+', ' ', 'g')),
+    'UTF8')), 'hex')
+where content_hash is null;
+
+create unique index if not exists paper_info_arxiv_id_key on paper_info (arxiv_id);
+
+-- バッチ単位の upsert。挿入・更新された行だけを返す (変化なしの行は返らない)。
+-- paper_id は初回挿入時のものを維持し、feed からの参照を壊さない。
+create or replace function upsert_papers(papers jsonb)
+returns table (paper_id text, arxiv_id text, action text)
+language sql
+as $$
+    with incoming as (
+        select *
+        from jsonb_to_recordset(papers) as p(
+            paper_id text,
+            arxiv_id text,
+            arxiv_version integer,
+            title text,
+            author text,
+            published_date date,
+            arxiv_url text,
+            arxiv_category text,
+            abstract text,
+            content_hash text
+        )
+    ),
+    upserted as (
+        insert into paper_info as t (
+            paper_id, arxiv_id, arxiv_version, title, author, published_date,
+            arxiv_url, arxiv_category, abstract, content_hash
+        )
+        select
+            paper_id, arxiv_id, arxiv_version, title, author, published_date,
+            arxiv_url, arxiv_category, abstract, content_hash
+        from incoming
+        on conflict (arxiv_id) do update set
+            arxiv_version = excluded.arxiv_version,
+            title = excluded.title,
+            author = excluded.author,
+            published_date = excluded.published_date,
+            arxiv_url = excluded.arxiv_url,
+            arxiv_category = excluded.arxiv_category,
+            abstract = excluded.abstract,
+            content_hash = excluded.content_hash
+        where t.content_hash is distinct from excluded.content_hash
+          and t.arxiv_version <= excluded.arxiv_version
+        returning t.paper_id, t.arxiv_id, (xmax = 0) as inserted
+    ),
+    -- 内容が変わった論文の要約・音声 (feed 行) を無効化する
+    invalidated as (
+        delete from feed f
+        using upserted u
+        where f.paper_id = u.paper_id and not u.inserted
+        returning f.paper_id
+    )
+    select u.paper_id, u.arxiv_id, case when u.inserted then 'inserted' else 'updated' end
+    from upserted u;
+$$;
@@ -0,0 +1,71 @@
+-- 論文ごと・話者ごとに生成済みの要約と音声を共有するテーブル。
+-- 同じ論文を複数ユーザーが選んでも、要約 (Gemini) と音声合成 (VOICEVOX) は1回で済む。
+create table if not exists paper_asset (
+    paper_id text not null,
+    voice_type integer not null,
+    gemini_abstract text not null,
+    voice text not null,
+    created_at timestamptz not null default now(),
+    primary key (paper_id, voice_type)
+);
+
+-- 要約だけを話者をまたいで探すための索引
+create index if not exists paper_asset_paper_id_idx on paper_asset (paper_id);
+
+-- upsert_papers: 内容が変わった論文は feed 行に加えて共有アセットも無効化する
+create or replace function upsert_papers(papers jsonb)
+returns table (paper_id text, arxiv_id text, action text)
+language sql
+as $$
+    with incoming as (
+        select *
+        from jsonb_to_recordset(papers) as p(
+            paper_id text,
+            arxiv_id text,
+            arxiv_version integer,
+            title text,
+            author text,
+            published_date date,
+            arxiv_url text,
+            arxiv_category text,
+            abstract text,
+            content_hash text
+        )
+    ),
+    upserted as (
+        insert into paper_info as t (
+            paper_id, arxiv_id, arxiv_version, title, author, published_date,
+            arxiv_url, arxiv_category, abstract, content_hash
+        )
+        select
+            paper_id, arxiv_id, arxiv_version, title, author, published_date,
+            arxiv_url, arxiv_category, abstract, content_hash
+        from incoming
+        on conflict (arxiv_id) do update set
+            arxiv_version = excluded.arxiv_version,
+            title = excluded.title,
+            author = excluded.author,
+            published_date = excluded.published_date,
+            arxiv_url = excluded.arxiv_url,
+            arxiv_category = excluded.arxiv_category,
+            abstract = excluded.abstract,
+            content_hash = excluded.content_hash
+        where t.content_hash is distinct from excluded.content_hash
+          and t.arxiv_version <= excluded.arxiv_version
+        returning t.paper_id, t.arxiv_id, (xmax = 0) as inserted
+    ),
+    invalidated_feed as (
+        delete from feed f
+        using upserted u
+        where f.paper_id = u.paper_id and not u.inserted
+        returning f.paper_id
+    ),
+    invalidated_asset as (
+        delete from paper_asset a
+        using upserted u
+        where a.paper_id = u.paper_id and not u.inserted
+        returning a.paper_id
+    )
+    select u.paper_id, u.arxiv_id, case when u.inserted then 'inserted' else 'updated' end
+    from upserted u;
+$$;
@@ -0,0 +1,19 @@
+-- ユーザーのフィードキューから古い順にN件を1文で取り出す (取得と削除を同時に行う)。
+-- for update skip locked により、同時に呼ばれても同じアイテムが2回返ることはない。
+create index if not exists feed_user_id_feed_id_idx on feed (user_id, feed_id);
+
+create or replace function dequeue_feed(p_user_id bigint, p_count integer)
+returns setof feed
+language sql
+as $$
+    delete from feed
+    where feed_id in (
+        select feed_id
+        from feed
+        where user_id = p_user_id
+        order by feed_id
+        limit p_count
+        for update skip locked
+    )
+    returning *;
+$$;
@@ -0,0 +1,3 @@
+-- ブックマーク一覧のキーセットページング (references_date, bookmark_id の降順) 用の複合索引
+create index if not exists bookmark_user_id_references_date_idx
+    on bookmark (user_id, references_date desc, bookmark_id desc);
@@ -0,0 +1,74 @@
+-- bookmark を (user_id, paper_id) で一意にし、論文情報は paper_info から join で取得する。
+-- 追加・削除・トグルはいずれも (user_id, paper_id) の索引を使う1回のアクセスで済む。
+
+alter table bookmark add column if not exists paper_id text;
+
+-- 既存行は url から paper_id を埋める。url の表記揺れ (http/https, abs/pdf, v1/v2, 末尾の / や .pdf) があっても
+-- 同じ論文に紐づくよう、PaperIngestor.split_arxiv_id と同じくバージョンなしの arXiv ID で照合する
+update bookmark b
+set paper_id = p.paper_id
+from paper_info p
+where b.paper_id is null
+  and p.arxiv_id = regexp_replace(regexp_replace(regexp_replace(regexp_replace(
+        regexp_replace(b.url, '[?#].*$', ''), '/+$', ''), '^.*/(abs|pdf)/', ''), '\.pdf$', ''), 'v[0-9]+$', '');
+
+-- arXiv ID で照合できない url (arXiv 以外など) は、url の完全一致で紐づける
+update bookmark b
+set paper_id = p.paper_id
+from paper_info p
+where b.paper_id is null and p.arxiv_url = b.url;
+
+-- 紐づかない行が残っていれば、ユーザーのブックマークを消さずにここで止める
+do $$
+declare
+    unmatched bigint;
+begin
+    select count(*) into unmatched from bookmark where paper_id is null;
+    if unmatched > 0 then
+        raise exception '005_bookmark_paper_id: % bookmark rows do not match any paper_info row', unmatched
+            using hint = 'Inspect them with: select bookmark_id, user_id, url from bookmark where paper_id is null';
+    end if;
+end
+$$;
+
+-- 同じ論文への重複したブックマークは新しい方を残す
+delete from bookmark a
+using bookmark b
+where a.user_id = b.user_id and a.paper_id = b.paper_id and a.bookmark_id < b.bookmark_id;
+
+alter table bookmark alter column paper_id set not null;
+alter table bookmark
+    add constraint bookmark_paper_id_fkey foreign key (paper_id) references paper_info (paper_id) on delete cascade;
+create unique index if not exists bookmark_user_id_paper_id_key on bookmark (user_id, paper_id);
+
+-- bookmark_id は max+1 の採番をやめてシーケンスで払い出す
+create sequence if not exists bookmark_bookmark_id_seq owned by bookmark.bookmark_id;
+select setval('bookmark_bookmark_id_seq', coalesce((select max(bookmark_id) from bookmark), 0) + 1, false);
+alter table bookmark alter column bookmark_id set default nextval('bookmark_bookmark_id_seq');
+alter table bookmark alter column references_date set default now();
+
+-- title / author / url は paper_info と重複するので削除する
+alter table bookmark
+    drop column if exists title,
+    drop column if exists author,
+    drop column if exists url;
+
+-- ブックマークの付け外しを1文で行う。戻り値は操作後にブックマークされているかどうか
+create or replace function toggle_bookmark(p_user_id bigint, p_paper_id text)
+returns table (is_bookmarked boolean)
+language sql
+as $$
+    with removed as (
+        delete from bookmark
+        where user_id = p_user_id and paper_id = p_paper_id
+        returning 1
+    ),
+    added as (
+        insert into bookmark (user_id, paper_id)
+        select p_user_id, p_paper_id
+        where not exists (select 1 from removed)
+        on conflict (user_id, paper_id) do nothing
+        returning 1
+    )
+    select exists (select 1 from added);
+$$;
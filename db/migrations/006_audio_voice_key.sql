@@ -0,0 +1,7 @@
+-- 音声データ (base64のWAV) を行に持たず、音声ストア (backend/modules/AudioStore.py) のキーだけを持つ。
+-- 手順: 1. このファイルを適用 2. python db/migrate_voice_to_store.py で既存の音声を移す 3. 007_drop_inline_voice.sql を適用
+alter table feed add column if not exists voice_key text;
+alter table feed alter column voice drop not null;
+
+alter table paper_asset add column if not exists voice_key text;
+alter table paper_asset alter column voice drop not null;
@@ -0,0 +1,13 @@
+-- db/migrate_voice_to_store.py で全ての音声を音声ストアへ移した後に適用する。
+-- 移し忘れた行があれば失敗するように、先に確認する
+do $$
+begin
+    if exists (select 1 from feed where voice is not null and voice_key is null)
+       or exists (select 1 from paper_asset where voice is not null and voice_key is null) then
+        raise exception 'inline voice data remains; run db/migrate_voice_to_store.py first';
+    end if;
+end $$;
+
+alter table feed drop column if exists voice;
+alter table paper_asset drop column if exists voice;
+alter table paper_asset alter column voice_key set not null;
@@ -0,0 +1,19 @@
+-- dequeue_feed: feed の全列 (setof feed) ではなく、応答に必要な列だけを返す。
+-- 戻り値の型が変わるので作り直す
+drop function if exists dequeue_feed(bigint, integer);
+
+create function dequeue_feed(p_user_id bigint, p_count integer)
+returns table (feed_id bigint, user_id bigint, paper_id text, gemini_abstract text, voice_key text)
+language sql
+as $$
+    delete from feed f
+    where f.feed_id in (
+        select q.feed_id
+        from feed q
+        where q.user_id = p_user_id
+        order by q.feed_id
+        limit p_count
+        for update skip locked
+    )
+    returning f.feed_id, f.user_id, f.paper_id, f.gemini_abstract, f.voice_key;
+$$;
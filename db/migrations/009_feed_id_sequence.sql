@@ -0,0 +1,6 @@
+-- feed_id は max+1 の採番をやめてシーケンスで払い出す。
+-- 複数のフィード生成が同時に走ると同じ max を読んで主キーが衝突し、生成が途中で止まっていた。
+
+create sequence if not exists feed_feed_id_seq owned by feed.feed_id;
+select setval('feed_feed_id_seq', coalesce((select max(feed_id) from feed), 0) + 1, false);
+alter table feed alter column feed_id set default nextval('feed_feed_id_seq');
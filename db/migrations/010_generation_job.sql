@@ -0,0 +1,37 @@
+-- フィード生成をAPIプロセスのBackgroundTasksから切り離すためのジョブキュー。
+-- APIは generation_job に行を追加するだけで、GenerationWorker (python -m backend.modules.GenerationWorker) が取り出して生成する。
+-- 取り出しは for update skip locked なので、複数のワーカープロセス・マシンで同時に動かしても同じジョブを2回処理しない。
+-- ワーカーが落ちて running のまま残ったジョブは、リース時間を過ぎると他のワーカーが取り直す (最大 p_max_attempts 回)。
+
+create table if not exists generation_job (
+    job_id bigserial primary key,
+    user_id bigint not null,
+    count integer not null default 30,
+    mode text not null default 'default',
+    status text not null default 'queued',
+    worker text,
+    attempts integer not null default 0,
+    error text,
+    created_at timestamptz not null default now(),
+    started_at timestamptz,
+    finished_at timestamptz
+);
+create index if not exists generation_job_pending_idx on generation_job (job_id) where status in ('queued', 'running');
+
+create or replace function claim_generation_jobs(p_worker text, p_limit integer, p_lease_seconds integer default 600, p_max_attempts integer default 3)
+returns setof generation_job
+language sql
+as $$
+    update generation_job
+    set status = 'running', worker = p_worker, attempts = attempts + 1, started_at = now()
+    where job_id in (
+        select job_id
+        from generation_job
+        where attempts < p_max_attempts
+          and (status = 'queued' or (status = 'running' and started_at < now() - make_interval(secs => p_lease_seconds)))
+        order by job_id
+        limit p_limit
+        for update skip locked
+    )
+    returning *;
+$$;
@@ -0,0 +1,55 @@
+-- 話者の切り替えを、フィードの再生成ではなく参照先の付け替えにする。
+-- 生成時に人気の話者の音声も作っておき (VOICE_VARIANTS=K)、paper_asset に is_variant = true で保存する。
+-- switch_feed_voice は voice_type の更新と、フィードの各行の音声を新しい話者のアセットへ付け替える処理を1つのトランザクションで行う。
+-- 新しい話者のアセットがない行だけを削除し (呼び出し側が不足分を生成する)、結果を voice_switch に記録する (費用対効果のレポート用)。
+
+alter table paper_asset add column if not exists is_variant boolean not null default false;
+create index if not exists paper_asset_variant_created_at_idx on paper_asset (created_at) where is_variant;
+
+create table if not exists voice_switch (
+    switch_id bigserial primary key,
+    user_id bigint not null,
+    from_voice integer,
+    to_voice integer not null,
+    repointed integer not null default 0,
+    removed integer not null default 0,
+    variant_hits integer not null default 0,
+    created_at timestamptz not null default now()
+);
+create index if not exists voice_switch_created_at_idx on voice_switch (created_at);
+
+create or replace function switch_feed_voice(p_user_id bigint, p_voice_type integer)
+returns table (repointed integer, removed integer, variant_hits integer)
+language plpgsql
+as $$
+declare
+    v_from integer;
+    v_repointed integer;
+    v_variant_hits integer;
+    v_removed integer;
+begin
+    select voice_type into v_from from user_info where user_id = p_user_id for update;
+    if not found then
+        return;
+    end if;
+    update user_info set voice_type = p_voice_type where user_id = p_user_id;
+
+    with moved as (
+        update feed f
+        set voice_key = a.voice_key, gemini_abstract = a.gemini_abstract
+        from paper_asset a
+        where f.user_id = p_user_id and a.paper_id = f.paper_id and a.voice_type = p_voice_type
+        returning a.is_variant
+    )
+    select count(*), count(*) filter (where moved.is_variant) into v_repointed, v_variant_hits from moved;
+
+    delete from feed f
+    where f.user_id = p_user_id
+      and not exists (select 1 from paper_asset a where a.paper_id = f.paper_id and a.voice_type = p_voice_type);
+    get diagnostics v_removed = row_count;
+
+    insert into voice_switch (user_id, from_voice, to_voice, repointed, removed, variant_hits)
+    values (p_user_id, v_from, p_voice_type, v_repointed, v_removed, v_variant_hits);
+    return query select v_repointed, v_removed, v_variant_hits;
+end;
+$$;
@@ -0,0 +1,37 @@
+-- 同じ仕事 (同じ論文の要約、同じ論文・話者の音声合成、同じユーザーの補充) を複数のプロセスが同時に行わないためのリース。
+-- backend/modules/SingleFlight.py が仕事の前に acquire_work_lease でキーの行を取り、終わったら release_work_lease で消す。
+-- 持ち主が落ちた場合は expires_at を過ぎれば他のプロセスが取り直せる。
+-- あわせて、同じユーザーのフィードに同じ論文が2回入らないよう feed (user_id, paper_id) を一意にする。
+
+create table if not exists work_lease (
+    lease_key text primary key,
+    owner text not null,
+    expires_at timestamptz not null
+);
+
+create or replace function acquire_work_lease(p_key text, p_owner text, p_lease_seconds integer default 120)
+returns boolean
+language sql
+as $$
+    with acquired as (
+        insert into work_lease (lease_key, owner, expires_at)
+        values (p_key, p_owner, now() + make_interval(secs => p_lease_seconds))
+        on conflict (lease_key) do update
+        set owner = excluded.owner, expires_at = excluded.expires_at
+        where work_lease.expires_at < now() or work_lease.owner = excluded.owner
+        returning 1
+    )
+    select exists (select 1 from acquired);
+$$;
+
+create or replace function release_work_lease(p_key text, p_owner text)
+returns void
+language sql
+as $$
+    delete from work_lease where lease_key = p_key and owner = p_owner;
+$$;
+
+-- 既に重複している行は古い方 (feed_id が小さい方) を残す
+delete from feed a using feed b
+where a.user_id = b.user_id and a.paper_id = b.paper_id and a.feed_id > b.feed_id;
+create unique index if not exists feed_user_id_paper_id_key on feed (user_id, paper_id);
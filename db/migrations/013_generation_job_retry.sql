@@ -0,0 +1,24 @@
+-- Gemini・VOICEVOXの回路ブレーカーが開いている間に取り出したジョブは、タイムアウトを待たずに打ち切り、
+-- 生成できなかった件数だけを run_after 以降に再実行する (backend/modules/Resilience.py, GenerationWorker.py)。
+-- 依存先の障害による打ち切りは試行回数に数えない。
+
+alter table generation_job add column if not exists run_after timestamptz;
+
+create or replace function claim_generation_jobs(p_worker text, p_limit integer, p_lease_seconds integer default 600, p_max_attempts integer default 3)
+returns setof generation_job
+language sql
+as $$
+    update generation_job
+    set status = 'running', worker = p_worker, attempts = attempts + 1, started_at = now()
+    where job_id in (
+        select job_id
+        from generation_job
+        where attempts < p_max_attempts
+          and (status = 'queued' or (status = 'running' and started_at < now() - make_interval(secs => p_lease_seconds)))
+          and (run_after is null or run_after <= now())
+        order by job_id
+        limit p_limit
+        for update skip locked
+    )
+    returning *;
+$$;
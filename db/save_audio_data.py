@@ -5,7 +5,6 @@
 import os
 import datetime
 import uuid
-import base64
 
 from dotenv import load_dotenv
 from typing import Any, Dict
@@ -14,7 +13,12 @@ from supabase import create_client, Client  # type: ignore  # pylint: disable=im
 
 
 import inspect
+import sys
 
+# プロジェクトルートをパスに追加
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from backend.modules.AudioStore import get_audio_store
 
 load_dotenv()
 SUPABASE_URL = os.environ["SUPABASE_URL"]
@@ -33,7 +37,8 @@ def save_audio_data():
         with open(file_path, "rb") as f:
             audio_data_bytes = f.read()
             print(type(audio_data_bytes))
-        audio_data_base64_string = base64.b64encode(audio_data_bytes).decode('utf-8')
+        # 音声データは音声ストアに保存し、feedにはキーだけを入れる (feed.voice は 007_drop_inline_voice で削除済み)
+        voice_key = get_audio_store().put(audio_data_bytes)
     except Exception as e:
         print("ファイルの読み込みに失敗しました:", e)
         return
@@ -69,23 +74,6 @@ def save_audio_data():
             print("データ挿入失敗:", insert_response.error)
 
 
-        # ブックマークデータの挿入
-        book_mark_data = {
-            "bookmark_id": 1,
-            "user_id": 1,
-            "title": "Attention Is All You Need",
-            "author": "Ashish Vaswani et al.",
-            "url": "https://arxiv.org/abs/1706.03762", # 'email' を 'url' に修正し、値を追加
-            "references_date": "2025-07-04", # 'reference_date' のスペルを修正
-        }
-        insert_response = supabase.table("bookmark").insert(book_mark_data).execute()
-        if insert_response.data:
-            print("データ挿入成功:", insert_response.data)
-        else:
-            print("データ挿入失敗:", insert_response.error)
-
-
-
         # 音声ファイルのpoc
         paper_info_data = {
             "paper_id": 1,
@@ -105,12 +93,25 @@ def save_audio_data():
             print("データ挿入失敗:", insert_response.error)
 
 
+        # ブックマークデータの挿入 (paper_infoの論文を参照するので論文の後に入れる)
+        # 論文の情報は paper_info から join するので、bookmark には (user_id, paper_id) だけを入れる。APIの add_bookmark と同じupsert
+        book_mark_data = {
+            "user_id": 1,
+            "paper_id": paper_info_data["paper_id"],
+        }
+        insert_response = supabase.table("bookmark").upsert(book_mark_data, on_conflict="user_id,paper_id", ignore_duplicates=True).execute()
+        if insert_response.data:
+            print("データ挿入成功:", insert_response.data)
+        else:
+            print("bookmarkテーブルに既に同じブックマークが存在します。")
+
+
         # 音声ファイルのpoc
         feed_data = {
             "feed_id": 1,
             "user_id": 1,
             "paper_id": 1,
-            "voice": audio_data_base64_string,
+            "voice_key": voice_key,
         }
         insert_response = supabase.table("feed").insert(feed_data).execute()
         if insert_response.data:
@@ -129,11 +130,13 @@ def save_audio_data():
         # print(response.data)
 
 
-        # voiceデータをデータベースから取得して，デコードしてmp3に変換．
+        # voice_keyをデータベースから取得して，音声ストアから読み出してmp3に戻す．
         response = supabase.table('feed').select('*').execute()
         data = response.data
-        encoded_voice = data[0]['voice']
-        decoded_audio_data_bytes = base64.b64decode(audio_data_base64_string)
+        decoded_audio_data_bytes = get_audio_store().get(data[0]['voice_key'])
+        if decoded_audio_data_bytes is None:
+            print(f"音声ストアに voice_key: {data[0]['voice_key']} の音声がありません。")
+            return
         output_file_path = "../backend/data/voices/reconverted_audio.mp3"
         try:
             with open(output_file_path, "wb") as f:
@@ -0,0 +1,95 @@
+-- ローカル組み込みモード (DATABASE_BACKEND=sqlite) のスキーマ。
+-- db/migrations を全て適用した後の Supabase のスキーマと同じ列・索引を持つ。
+-- backend/modules/Database.py が起動時に適用する (何度実行しても安全)。
+
+create table if not exists user_info (
+    user_id integer primary key,
+    uuid text,
+    voice_type integer not null default 3,
+    keyword text
+);
+
+create table if not exists paper_info (
+    paper_id text primary key,
+    arxiv_id text,
+    arxiv_version integer not null default 1,
+    title text,
+    author text,
+    published_date text,
+    arxiv_url text,
+    arxiv_category text,
+    abstract text,
+    content_hash text,
+    created_at text not null default (strftime('%Y-%m-%dT%H:%M:%f+00:00', 'now'))
+);
+create unique index if not exists paper_info_arxiv_id_key on paper_info (arxiv_id);
+create index if not exists paper_info_published_date_idx on paper_info (published_date desc);
+create index if not exists paper_info_created_at_idx on paper_info (created_at desc);
+
+create table if not exists feed (
+    feed_id integer primary key,
+    user_id integer not null,
+    paper_id text not null,
+    gemini_abstract text,
+    voice text,
+    voice_key text
+);
+create index if not exists feed_user_id_feed_id_idx on feed (user_id, feed_id);
+create index if not exists feed_paper_id_idx on feed (paper_id);
+create unique index if not exists feed_user_id_paper_id_key on feed (user_id, paper_id);
+
+create table if not exists bookmark (
+    bookmark_id integer primary key autoincrement,
+    user_id integer not null,
+    paper_id text not null references paper_info (paper_id) on delete cascade,
+    references_date text not null default (strftime('%Y-%m-%dT%H:%M:%f+00:00', 'now'))
+);
+create unique index if not exists bookmark_user_id_paper_id_key on bookmark (user_id, paper_id);
+create index if not exists bookmark_user_id_references_date_idx on bookmark (user_id, references_date desc, bookmark_id desc);
+
+create table if not exists paper_asset (
+    paper_id text not null,
+    voice_type integer not null,
+    gemini_abstract text not null,
+    voice text,
+    voice_key text,
+    is_variant integer not null default 0,
+    created_at text not null default (strftime('%Y-%m-%dT%H:%M:%f+00:00', 'now')),
+    primary key (paper_id, voice_type)
+);
+create index if not exists paper_asset_paper_id_idx on paper_asset (paper_id);
+create index if not exists paper_asset_variant_created_at_idx on paper_asset (created_at) where is_variant;
+
+create table if not exists generation_job (
+    job_id integer primary key autoincrement,
+    user_id integer not null,
+    count integer not null default 30,
+    mode text not null default 'default',
+    status text not null default 'queued',
+    worker text,
+    attempts integer not null default 0,
+    error text,
+    created_at text not null default (strftime('%Y-%m-%dT%H:%M:%f+00:00', 'now')),
+    started_at text,
+    finished_at text,
+    run_after text
+);
+create index if not exists generation_job_pending_idx on generation_job (job_id) where status in ('queued', 'running');
+
+create table if not exists voice_switch (
+    switch_id integer primary key autoincrement,
+    user_id integer not null,
+    from_voice integer,
+    to_voice integer not null,
+    repointed integer not null default 0,
+    removed integer not null default 0,
+    variant_hits integer not null default 0,
+    created_at text not null default (strftime('%Y-%m-%dT%H:%M:%f+00:00', 'now'))
+);
+create index if not exists voice_switch_created_at_idx on voice_switch (created_at);
+
+create table if not exists work_lease (
+    lease_key text primary key,
+    owner text not null,
+    expires_at text not null
+);
@@ -1,4 +1,4 @@
-import { FeedResponse, FeedItem, UserSettings, UserSettingsUpdateRequest } from '../types';
+import { FeedResponse, FeedItem, UserSettings, UserSettingsUpdateRequest, SimilarPapersResponse, BookmarkResponse } from '../types';
 
 // --- IP直書き部分（必要に応じて切り替え） ---
 const LOCAL_IP = "192.168.40.31"; // ← ご自身のIPに変更
@@ -14,8 +14,8 @@ export const getInitialFeed = async (userId: number = 1): Promise<FeedResponse>
   return await response.json();
 };
 
-export const generateFeed = async (userId: number = 1): Promise<any> => {
-  const response = await fetch(`${API_BASE_URL}/feed/generate/${userId}`, { method: 'POST' });
+export const generateFeed = async (userId: number = 1, mode: 'default' | 'bookmarks' = 'default'): Promise<any> => {
+  const response = await fetch(`${API_BASE_URL}/feed/generate/${userId}?mode=${mode}`, { method: 'POST' });
   if (!response.ok) throw new Error('Failed to start feed generation');
   return await response.json();
 };
@@ -26,8 +26,64 @@ export const getNextFeedItem = async (userId: number = 1): Promise<FeedItem> =>
   return await response.json();
 };
 
-export const getBookmarks = async (userId: number = 1): Promise<FeedResponse> => {
-  const response = await fetch(`${API_BASE_URL}/bookmarks/${userId}`);
+export const getSimilarPapers = async (paperId: string, k: number = 10): Promise<SimilarPapersResponse> => {
+  const response = await fetch(`${API_BASE_URL}/papers/${encodeURIComponent(paperId)}/similar?k=${k}`);
+  if (!response.ok) throw new Error('Failed to fetch similar papers');
+  return await response.json();
+};
+
+// 先頭からn件をまとめて取り出す。先読み済みで音声が不要な場合は includeAudio=false。
+export const getNextFeedItems = async (n: number, userId: number = 1, includeAudio: boolean = true): Promise<FeedResponse> => {
+  const response = await fetch(`${API_BASE_URL}/feed/next/${userId}?n=${n}&include_audio=${includeAudio}`);
+  if (!response.ok) throw new Error('Failed to fetch next feed items');
+  return await response.json();
+};
+
+// 取り出さずに先頭n件を覗き見る (audio_urlで音声を先読みするため)。
+export const peekFeedItems = async (n: number, userId: number = 1): Promise<FeedResponse> => {
+  const response = await fetch(`${API_BASE_URL}/feed/next/${userId}?n=${n}&peek=true`);
+  if (!response.ok) throw new Error('Failed to peek feed items');
+  return await response.json();
+};
+
+// 生成されたフィードアイテムをWebSocketで受け取る。lastIdを渡すとその続きから再開する。
+// 戻り値の関数を呼ぶと購読を終了する。
+export const subscribeFeed = (
+  onItem: (item: FeedItem) => void,
+  userId: number = 1,
+  lastId: number = 0,
+): (() => void) => {
+  let closed = false;
+  let socket: WebSocket | null = null;
+  let latestId = lastId;
+
+  const connect = () => {
+    socket = new WebSocket(`${API_BASE_URL.replace(/^http/, 'ws')}/feed/ws/${userId}?last_id=${latestId}`);
+    socket.onmessage = (event) => {
+      const message = JSON.parse(event.data);
+      if (message.type === 'feed_item') {
+        latestId = Math.max(latestId, Number(message.item.feed_id));
+        onItem(message.item);
+      }
+    };
+    // 切断されたら受信済みの最後のIDから再接続する
+    socket.onclose = () => {
+      if (!closed) setTimeout(connect, 3000);
+    };
+  };
+  connect();
+
+  return () => {
+    closed = true;
+    socket?.close();
+  };
+};
+
+// 次のページは前回のレスポンスの next_cursor を渡して取得する。
+export const getBookmarks = async (userId: number = 1, cursor?: string | null, limit: number = 20): Promise<BookmarkResponse> => {
+  const params = new URLSearchParams({ limit: String(limit) });
+  if (cursor) params.append('cursor', cursor);
+  const response = await fetch(`${API_BASE_URL}/bookmarks/${userId}?${params.toString()}`);
   if (!response.ok) throw new Error('Failed to fetch bookmarks');
   return await response.json();
 };
@@ -51,6 +107,17 @@ export const deleteBookmark = async (paperId: string, uuid: string, userId: numb
   if (!response.ok) throw new Error('Failed to delete bookmark');
 };
 
+// 付け外しを1回の呼び出しで行い、操作後の状態を返す。
+export const toggleBookmark = async (paperId: string, userId: number = 1): Promise<{ paper_id: string; is_bookmarked: boolean }> => {
+  const response = await fetch(`${API_BASE_URL}/bookmarks/${userId}/toggle`, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({ paper_id: paperId }),
+  });
+  if (!response.ok) throw new Error('Failed to toggle bookmark');
+  return await response.json();
+};
+
 export const getSettings = async (userId: number = 1): Promise<UserSettings> => {
   const response = await fetch(`${API_BASE_URL}/settings/${userId}`);
   if (!response.ok) throw new Error('Failed to get settings');
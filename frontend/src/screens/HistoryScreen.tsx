@@ -1,4 +1,4 @@
-import React, { useEffect, useState } from 'react';
+import React, { useCallback, useEffect, useRef, useState } from 'react';
 import {
   View,
   Text,
@@ -11,37 +11,43 @@ import {
 import { useIsFocused } from '@react-navigation/native';
 import * as Linking from 'expo-linking';
 import { getBookmarks } from '../api';
-import { FeedItem } from '../types';
+import { BookmarkItem } from '../types';
 
 // ブックマークアイテムを1つ表示するコンポーネント
-const BookmarkItem = ({ item }: { item: FeedItem }) => {
+const BookmarkRow = ({ item }: { item: BookmarkItem }) => {
   const handlePress = () => {
-    if (item.paper_url) {
-      Linking.openURL(item.paper_url);
+    if (item.url) {
+      Linking.openURL(item.url);
     }
   };
 
   return (
     <TouchableOpacity onPress={handlePress} style={styles.itemContainer}>
       <Text style={styles.itemTitle} numberOfLines={2}>{item.title}</Text>
-      <Text style={styles.itemAuthors} numberOfLines={1}>{item.authors.join(', ')}</Text>
+      <Text style={styles.itemAuthors} numberOfLines={1}>{item.author}</Text>
     </TouchableOpacity>
   );
 };
 
 const HistoryScreen = () => {
-  const [bookmarks, setBookmarks] = useState<FeedItem[]>([]);
+  const [bookmarks, setBookmarks] = useState<BookmarkItem[]>([]);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
   const [loading, setLoading] = useState(false);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [error, setError] = useState<string | null>(null);
-  
+  // 同じページを二重に読み込まないための印 (onEndReached は続けて呼ばれることがある)
+  const loadingMoreRef = useRef(false);
+
   const isFocused = useIsFocused();
 
   useEffect(() => {
+    // 画面を開くたびに1ページ目から読み直す
     const fetchBookmarks = async () => {
       try {
         setLoading(true);
         const response = await getBookmarks();
         setBookmarks(response.items);
+        setNextCursor(response.next_cursor);
         setError(null);
       } catch (e) {
         setError('ブックマークの取得に失敗しました。');
@@ -55,6 +61,23 @@ const HistoryScreen = () => {
     }
   }, [isFocused]);
 
+  // 一覧の末尾に近づいたら next_cursor で次のページを読み込んで後ろに足す
+  const fetchMoreBookmarks = useCallback(async () => {
+    if (!nextCursor || loadingMoreRef.current) return;
+    loadingMoreRef.current = true;
+    setLoadingMore(true);
+    try {
+      const response = await getBookmarks(undefined, nextCursor);
+      setBookmarks(prev => [...prev, ...response.items]);
+      setNextCursor(response.next_cursor);
+    } catch (e) {
+      console.error('Failed to fetch more bookmarks:', e);
+    } finally {
+      loadingMoreRef.current = false;
+      setLoadingMore(false);
+    }
+  }, [nextCursor]);
+
   if (loading) {
     return <ActivityIndicator style={styles.centered} size="large" color="#3FE0B5" />;
   }
@@ -75,9 +98,12 @@ const HistoryScreen = () => {
       {bookmarks.length > 0 ? (
         <FlatList
           data={bookmarks}
-          renderItem={({ item }) => <BookmarkItem item={item} />}
-          keyExtractor={(item) => item.paper_id}
+          renderItem={({ item }) => <BookmarkRow item={item} />}
+          keyExtractor={(item) => String(item.bookmark_id ?? item.paper_id)}
           contentContainerStyle={{ paddingBottom: 20 }}
+          onEndReached={fetchMoreBookmarks}
+          onEndReachedThreshold={0.5}
+          ListFooterComponent={loadingMore ? <ActivityIndicator style={styles.footer} color="#3FE0B5" /> : null}
         />
       ) : (
         <View style={styles.centered}>
@@ -132,6 +158,9 @@ const styles = StyleSheet.create({
     color: '#ccc',
     marginTop: 6,
   },
+  footer: {
+    marginVertical: 16,
+  },
   noItemText: {
     color: '#999',
     fontSize: 16,
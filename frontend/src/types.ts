@@ -5,16 +5,41 @@ export interface FeedItem {
   authors: string[];
   summary: string;
   audio_url: string;
+  audio_base64?: string;
   paper_url: string;
   is_bookmarked: boolean;
 }
 export interface FeedResponse {
   items: FeedItem[];
 }
+// fields で列を絞った場合は指定外の列は含まれない
+export interface BookmarkItem {
+  bookmark_id?: number;
+  user_id?: number;
+  paper_id?: string;
+  title?: string;
+  author?: string;
+  url?: string;
+  references_date?: string;
+}
+export interface BookmarkResponse {
+  items: BookmarkItem[];
+  next_cursor: string | null;
+}
 export interface UserSettings {
   user_id: number;
   character_voice: number;
 }
 export interface UserSettingsUpdateRequest {
   character_voice?: number;
-}
\ No newline at end of file
+}
+export interface SimilarPaperItem {
+  paper_id: string;
+  title: string;
+  authors: string[];
+  paper_url: string;
+  score: number;
+}
+export interface SimilarPapersResponse {
+  items: SimilarPaperItem[];
+}